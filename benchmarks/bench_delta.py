@@ -0,0 +1,72 @@
+"""Measure the throughput of the delta encoding of MARIADB.DELTA on a dump sized base.
+
+Writes a base of SIZE bytes of text like a mariadb dump, prints MB/s of
+write_signature() on it and of encode_delta() for a dump where --changed percent
+of the rows changed, for an unchanged dump and for unrelated random data that
+matches no chunk of the base, with the size of every delta.
+
+    python benchmarks/bench_delta.py --size 512 --changed 0.1
+"""
+import argparse
+import os
+import random
+import tempfile
+import time
+from ddmail_backup_taker.delta import encode_delta, write_signature
+
+def dump_rows(count, seed):
+    """Make count rows of an extended INSERT of a mariadb dump, the same rows for the same seed."""
+    rng = random.Random(seed)
+    return [b"(%d,'user%d@example.com','%032x',%d)," % (key, key, rng.getrandbits(128), rng.randrange(1000000)) for key in range(count)]
+
+def write_dump(path, rows):
+    """Write rows as INSERT statements of about 1mb."""
+    with open(path, "wb") as f:
+        for start in range(0, len(rows), 10000):
+            f.write(b"INSERT INTO `users` VALUES " + b"".join(rows[start:start + 10000])[:-1] + b";\n")
+
+def main():
+    parser = argparse.ArgumentParser(description="Throughput of the delta encoding.")
+    parser.add_argument("--size", type=int, help="Size of the synthetic dump in MB.", default=512)
+    parser.add_argument("--changed", type=float, help="Percent of the rows changed between the base and the new dump.", default=0.1)
+    args = parser.parse_args()
+
+    size = args.size * 1048576
+    rows = dump_rows(size // 72, 1)
+
+    with tempfile.TemporaryDirectory() as folder:
+        base_path = os.path.join(folder, "base.sql")
+        signature_path = os.path.join(folder, "base.sig")
+        delta_path = os.path.join(folder, "dump.sql.delta")
+        write_dump(base_path, rows)
+        base_size = os.path.getsize(base_path)
+
+        start = time.perf_counter()
+        write_signature(base_path, signature_path)
+        seconds = time.perf_counter() - start
+        print(f"{'signature':40} {base_size / seconds / 1e6:8.1f} MB/s {os.path.getsize(signature_path):12} bytes")
+
+        # Change a spread of rows like updates of a live database.
+        changed = list(rows)
+        rng = random.Random(2)
+        for key in rng.sample(range(len(rows)), int(len(rows) * args.changed / 100)):
+            changed[key] = b"(%d,'user%d@example.com','%032x',%d)," % (key, key, rng.getrandbits(128), rng.randrange(1000000))
+
+        runs = [("delta " + str(args.changed) + "% changed rows", changed), ("delta unchanged", rows), ("delta unrelated data", None)]
+        for name, run_rows in runs:
+            data_path = os.path.join(folder, "dump.sql")
+            if run_rows is None:
+                with open(data_path, "wb") as f:
+                    for _ in range(base_size // 1048576):
+                        f.write(os.urandom(1048576))
+            else:
+                write_dump(data_path, run_rows)
+            data_size = os.path.getsize(data_path)
+
+            start = time.perf_counter()
+            delta_size = encode_delta(signature_path, data_path, delta_path)
+            seconds = time.perf_counter() - start
+            print(f"{name:40} {data_size / seconds / 1e6:8.1f} MB/s {delta_size:12} bytes")
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,50 @@
+"""Measure the throughput of the encryption engines on a large synthetic input.
+
+Every run encrypts SIZE bytes of random data to /dev/null and prints GB/s for the
+gpg engine, piping the stream through one gpg process, and for the chunked engine
+with 1 up to --threads threads. The config file gives GPG_BIN and PUBKEY_FINGERPRINT.
+
+    python benchmarks/bench_encryption.py --config-file config.toml --size 1024 --threads 8
+"""
+import argparse
+import os
+import time
+import toml
+from ddmail_backup_taker.encryption import encrypt_stage
+from ddmail_backup_taker.stages import write_stage
+
+def iter_input(block, size):
+    """Yield size bytes by repeating block."""
+    while size > 0:
+        yield block[:size]
+        size = size - len(block)
+
+def main():
+    parser = argparse.ArgumentParser(description="Throughput of the encryption engines.")
+    parser.add_argument("--config-file", type=str, help="Full path to config file.", required=True)
+    parser.add_argument("--size", type=int, help="Size of the synthetic input in MB.", default=1024)
+    parser.add_argument("--threads", type=int, help="Largest number of threads of the chunked engine.", default=os.cpu_count() or 1)
+    args = parser.parse_args()
+
+    with open(args.config_file, "r") as f:
+        toml_config = toml.load(f)
+
+    size = args.size * 1048576
+    # Random data so gpg can not shrink it with its own compression.
+    block = os.urandom(4194304)
+
+    runs = [("gpg pipe", {"ENGINE": "gpg"})]
+    threads = 1
+    while threads <= args.threads:
+        runs.append(("chunked " + str(threads) + " threads", {"ENGINE": "chunked", "THREADS": threads}))
+        threads = threads * 2
+
+    for name, settings in runs:
+        config = dict(toml_config, GPG_ENCRYPTION=dict(toml_config["GPG_ENCRYPTION"], **settings))
+        start = time.perf_counter()
+        write_stage(encrypt_stage(iter_input(block, size), config), os.devnull)
+        seconds = time.perf_counter() - start
+        print(f"{name:40} {size / seconds / 1e9:6.2f} GB/s")
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,49 @@
+"""Measure the throughput of the stage pipelines on a large synthetic input.
+
+Every run pipes SIZE bytes from head through cat to /dev/null and prints GB/s for
+run_pipeline() with os.splice() and tee(2), run_pipeline() copying through a
+buffer and the generator stages of ddmail_backup_taker.stages.
+
+    python benchmarks/bench_pipeline.py --size 4096
+"""
+import argparse
+import hashlib
+import os
+import time
+from ddmail_backup_taker.pipeline import run_pipeline
+from ddmail_backup_taker.stages import hash_stage, process_source, process_stage, write_stage
+
+def bench_stages(cmds, dst_path, hasher):
+    chunks = process_source(cmds[0])
+    for cmd in cmds[1:]:
+        chunks = process_stage(chunks, cmd)
+    if hasher is not None:
+        chunks = hash_stage(chunks, hasher)
+    write_stage(chunks, dst_path)
+
+def main():
+    parser = argparse.ArgumentParser(description="Throughput of the stage pipelines.")
+    parser.add_argument("--size", type=int, help="Size of the synthetic input in MB.", default=4096)
+    parser.add_argument("--source", type=str, help="File the input is read from.", default="/dev/zero")
+    args = parser.parse_args()
+
+    size = args.size * 1048576
+    cmds = [["head", "-c", str(size), args.source], ["cat"]]
+
+    runs = [
+            ("run_pipeline splice", lambda: run_pipeline(cmds, os.devnull)),
+            ("run_pipeline splice + tee sha256", lambda: run_pipeline(cmds, os.devnull, hashlib.sha256())),
+            ("run_pipeline readinto", lambda: run_pipeline(cmds, os.devnull, zero_copy=False)),
+            ("run_pipeline readinto + sha256", lambda: run_pipeline(cmds, os.devnull, hashlib.sha256(), zero_copy=False)),
+            ("generator stages", lambda: bench_stages(cmds, os.devnull, None)),
+            ("generator stages + sha256", lambda: bench_stages(cmds, os.devnull, hashlib.sha256())),
+            ]
+
+    for name, run in runs:
+        start = time.perf_counter()
+        run()
+        seconds = time.perf_counter() - start
+        print(f"{name:40} {size / seconds / 1e9:6.2f} GB/s")
+
+if __name__ == "__main__":
+    main()
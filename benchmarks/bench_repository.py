@@ -0,0 +1,74 @@
+"""Measure the throughput of the content-defined chunking of the chunk repository.
+
+Prints MB/s of iter_chunks() on SIZE bytes of random data and of dump like text,
+then backs up --files files of random data to a repository in a temporary folder
+twice and prints the time of the first run, which reads every file, and of the
+second run, which finds the files unchanged and does not read them.
+
+    python benchmarks/bench_repository.py --size 256 --files 64
+"""
+import argparse
+import io
+import logging
+import os
+import tempfile
+import time
+from ddmail_backup_taker.repository import AVG_CHUNK_SIZE, backup_to_repository, iter_chunks
+
+def dump_like(size):
+    """Make size bytes of text like an extended INSERT of a mariadb dump."""
+    rows = []
+    length = 0
+    key = 0
+    while length < size:
+        row = b"(%d,'user%d@example.com','%s')," % (key, key, os.urandom(16).hex().encode())
+        rows.append(row)
+        length = length + len(row)
+        key = key + 1
+    return b"".join(rows)[:size]
+
+def main():
+    parser = argparse.ArgumentParser(description="Throughput of the chunk repository.")
+    parser.add_argument("--size", type=int, help="Size of the synthetic data in MB.", default=256)
+    parser.add_argument("--files", type=int, help="Number of files the data is split into for the backup runs.", default=64)
+    parser.add_argument("--avg-chunk-size", type=int, help="Average chunk size in bytes.", default=AVG_CHUNK_SIZE)
+    args = parser.parse_args()
+
+    logger = logging.getLogger("bench_repository")
+    size = args.size * 1048576
+    sizes = (args.avg_chunk_size // 4, args.avg_chunk_size, args.avg_chunk_size * 4)
+
+    for name, data in [("random", os.urandom(size)), ("dump", dump_like(size))]:
+        start = time.perf_counter()
+        count = sum(1 for _ in iter_chunks(io.BytesIO(data), *sizes))
+        seconds = time.perf_counter() - start
+        print(f"{'chunking ' + name:40} {size / seconds / 1e6:8.1f} MB/s {size // count:10} bytes per chunk")
+
+    with tempfile.TemporaryDirectory() as folder:
+        data_folder = os.path.join(folder, "data")
+        os.makedirs(data_folder)
+        for i in range(args.files):
+            path = os.path.join(data_folder, "file" + str(i))
+            with open(path, "wb") as f:
+                f.write(os.urandom(size // args.files))
+            # Files changed within the last second are always read.
+            os.utime(path, (time.time() - 60, time.time() - 60))
+
+        toml_config = {
+                "GPG_ENCRYPTION": {"USE": False},
+                "REPOSITORY": {"USE": True, "PATH": os.path.join(folder, "repository"), "AVG_CHUNK_SIZE": args.avg_chunk_size},
+                }
+
+        for name in ["first backup", "unchanged backup"]:
+            start = time.perf_counter()
+            result = backup_to_repository(logger, toml_config, [data_folder])
+            seconds = time.perf_counter() - start
+
+            assert result["is_working"], result["msg"]
+            print(f"{name:40} {size / seconds / 1e6:8.1f} MB/s {seconds:8.2f} s")
+
+            # Snapshot names have a resolution of one second.
+            time.sleep(1.1)
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,56 @@
+"""Measure the throughput of the upload modes against the local stand-in receiver.
+
+Every run sends a backup of SIZE random bytes to LocalReceiver on localhost and
+prints MB/s for the single request upload and the chunked upload on 1 up to
+--concurrency streams, --latency adds a delay to every request like a link to an
+offsite receiver.
+
+    python benchmarks/bench_upload.py --size 256 --latency 0.05 --concurrency 8
+"""
+import argparse
+import logging
+import os
+import tempfile
+import time
+from ddmail_backup_taker.backup import send_to_backup_receiver
+from ddmail_backup_taker.local_receiver import LocalReceiver
+
+def main():
+    parser = argparse.ArgumentParser(description="Throughput of the upload modes.")
+    parser.add_argument("--size", type=int, help="Size of the synthetic backup in MB.", default=256)
+    parser.add_argument("--chunk-size", type=int, help="Size of a chunk in MB.", default=16)
+    parser.add_argument("--latency", type=float, help="Seconds every request to the receiver is delayed.", default=0.0)
+    parser.add_argument("--concurrency", type=int, help="Largest number of streams of the chunked upload.", default=8)
+    args = parser.parse_args()
+
+    logger = logging.getLogger("bench_upload")
+    size = args.size * 1048576
+
+    with tempfile.TemporaryDirectory() as folder:
+        backup_file = os.path.join(folder, "backup_1.tar.gz")
+        with open(backup_file, "wb") as f:
+            for _ in range(args.size):
+                f.write(os.urandom(1048576))
+        os.makedirs(os.path.join(folder, "received"))
+
+        runs = [("single", {"MODE": "single"})]
+        concurrency = 1
+        while concurrency <= args.concurrency:
+            runs.append(("chunked " + str(concurrency) + " streams", {"MODE": "chunked", "CHUNK_SIZE": args.chunk_size * 1048576, "CONCURRENCY": concurrency}))
+            concurrency = concurrency * 2
+
+        for name, settings in runs:
+            with LocalReceiver(os.path.join(folder, "received"), "secret", latency=args.latency) as receiver:
+                toml_config = {
+                        "SAVE_BACKUPS_TO": folder,
+                        "BACKUP_RECEIVER": dict({"USE": True, "URL": receiver.url, "PASSWORD": "secret"}, **settings)
+                        }
+                start = time.perf_counter()
+                result = send_to_backup_receiver(logger, toml_config, backup_file, "backup_1.tar.gz")
+                seconds = time.perf_counter() - start
+
+            assert result["is_working"], result["msg"]
+            print(f"{name:40} {size / seconds / 1e6:8.1f} MB/s")
+
+if __name__ == "__main__":
+    main()
@@ -6,23 +6,13 @@ import toml
 import sys
 from ddmail_backup_taker.validate_config import check_config
 from ddmail_backup_taker.backup import create_backup, send_to_backup_receiver, clear_backups
+from ddmail_backup_taker.table_layout import restore_table_layout
+from ddmail_backup_taker.delta import apply_delta
+from ddmail_backup_taker.encryption import decrypt_file
+from ddmail_backup_taker.catalog import restore_members
 
-def main():
-    # Get arguments from args.
-    parser = argparse.ArgumentParser(description="Backup files and mariadb databases")
-    parser.add_argument('--config-file', type=str, help='Full path to config file.', required=True)
-    args = parser.parse_args()
-
-    # Check that config file exists and is a file.
-    if not os.path.isfile(args.config_file):
-        print("ERROR: config file does not exist or is not a file.")
-        sys.exit(1)
-
-    # Parse toml config file.
-    with open(args.config_file, 'r') as f:
-        toml_config = toml.load(f)
-
-    # Setup logging.
+def setup_logger(toml_config:dict) -> logging.Logger:
+    """Setup logging to console, file and syslog as configured in the LOGGING section."""
     logger = logging.getLogger(__name__)
 
     formatter = logging.Formatter(
@@ -56,6 +46,26 @@ def main():
     elif toml_config["LOGGING"]["LOGLEVEL"] == "ERROR":
         logger.setLevel(logging.ERROR)
 
+    return logger
+
+def main():
+    # Get arguments from args.
+    parser = argparse.ArgumentParser(description="Backup files and mariadb databases")
+    parser.add_argument('--config-file', type=str, help='Full path to config file.', required=True)
+    args = parser.parse_args()
+
+    # Check that config file exists and is a file.
+    if not os.path.isfile(args.config_file):
+        print("ERROR: config file does not exist or is not a file.")
+        sys.exit(1)
+
+    # Parse toml config file.
+    with open(args.config_file, 'r') as f:
+        toml_config = toml.load(f)
+
+    # Setup logging.
+    logger = setup_logger(toml_config)
+
     logger.info("starting backup job")
 
     # Validate config.
@@ -74,12 +84,13 @@ def main():
 
     # Send backup file to ddmail_backup_receiver.
     if toml_config["BACKUP_RECEIVER"]["USE"]:
-        # Send backup to ddmail_backup_receiver
-        logger.debug("running send_to_backup_receiver")
-        result_send_to_backup_receiver = send_to_backup_receiver(logger, toml_config, result_create_backup["backup_file"], result_create_backup["backup_filename"])
-        if not result_send_to_backup_receiver["is_working"]:
-            logger.error("send_to_backup_receiver failed")
-            sys.exit(1)
+        # Send backup to ddmail_backup_receiver, every volume and the index of a backup split into volumes.
+        for backup_file in result_create_backup["backup_files"]:
+            logger.debug("running send_to_backup_receiver")
+            result_send_to_backup_receiver = send_to_backup_receiver(logger, toml_config, backup_file, os.path.basename(backup_file))
+            if not result_send_to_backup_receiver["is_working"]:
+                logger.error("send_to_backup_receiver failed")
+                sys.exit(1)
 
     # Clear/remove backup files if there is to many.
     logger.debug("running clear_backups")
@@ -90,5 +101,181 @@ def main():
 
     logger.info("backup job finished succesfully")
 
+def restore_db():
+    # Get arguments from args.
+    parser = argparse.ArgumentParser(description="Restore mariadb databases dumped with MARIADB.LAYOUT tables")
+    parser.add_argument('--config-file', type=str, help='Full path to config file.', required=True)
+    parser.add_argument('--dump-folder', type=str, help='Full path to the extracted mariadb folder of a backup.', required=True)
+    parser.add_argument('--workers', type=int, help='Number of tables restored at the same time.', default=4)
+    args = parser.parse_args()
+
+    # Check that config file exists and is a file.
+    if not os.path.isfile(args.config_file):
+        print("ERROR: config file does not exist or is not a file.")
+        sys.exit(1)
+
+    # Check that the number of workers is positive.
+    if args.workers <= 0:
+        print("ERROR: workers must be a positive integer.")
+        sys.exit(1)
+
+    # Parse toml config file.
+    with open(args.config_file, 'r') as f:
+        toml_config = toml.load(f)
+
+    # Setup logging.
+    logger = setup_logger(toml_config)
+
+    logger.info("starting database restore")
+
+    # Restore the databases.
+    result_restore_table_layout = restore_table_layout(logger, toml_config, args.dump_folder, args.workers)
+    if not result_restore_table_layout["is_working"]:
+        logger.error("restore_table_layout failed: " + result_restore_table_layout["msg"])
+        sys.exit(1)
+
+    logger.info("database restore finished succesfully")
+
+def apply_delta_dump():
+    # Get arguments from args.
+    parser = argparse.ArgumentParser(description="Restore a mariadb dump stored as a delta with MARIADB.DELTA")
+    parser.add_argument('--config-file', type=str, help='Full path to config file.', required=True)
+    parser.add_argument('--base', type=str, help='Full path to the extracted full_db_dump.sql of the base backup.', required=True)
+    parser.add_argument('--delta', type=str, help='Full path to the extracted full_db_dump.sql.delta of a backup.', required=True)
+    parser.add_argument('--output', type=str, help='Full path where the restored dump is written.', required=True)
+    args = parser.parse_args()
+
+    # Check that config file exists and is a file.
+    if not os.path.isfile(args.config_file):
+        print("ERROR: config file does not exist or is not a file.")
+        sys.exit(1)
+
+    # Check that the base and the delta exist.
+    if not os.path.isfile(args.base) or not os.path.isfile(args.delta):
+        print("ERROR: base or delta does not exist or is not a file.")
+        sys.exit(1)
+
+    # Parse toml config file.
+    with open(args.config_file, 'r') as f:
+        toml_config = toml.load(f)
+
+    # Setup logging.
+    logger = setup_logger(toml_config)
+
+    logger.info("starting delta restore")
+
+    # Restore the dump.
+    result_apply_delta = apply_delta(logger, args.base, args.delta, args.output)
+    if not result_apply_delta["is_working"]:
+        logger.error("apply_delta failed: " + result_apply_delta["msg"])
+        sys.exit(1)
+
+    logger.info("delta restore finished succesfully")
+
+def decrypt_backup():
+    # Get arguments from args.
+    parser = argparse.ArgumentParser(description="Decrypt a backup file encrypted with the gpg or chunked GPG_ENCRYPTION.ENGINE")
+    parser.add_argument('--config-file', type=str, help='Full path to config file.', required=True)
+    parser.add_argument('--backup-file', type=str, help='Full path to the encrypted .gpg or .ddenc backup file.', required=True)
+    parser.add_argument('--output', type=str, help='Full path where the decrypted backup file is written.', required=True)
+    args = parser.parse_args()
+
+    # Check that config file exists and is a file.
+    if not os.path.isfile(args.config_file):
+        print("ERROR: config file does not exist or is not a file.")
+        sys.exit(1)
+
+    # Check that the backup file exists.
+    if not os.path.isfile(args.backup_file):
+        print("ERROR: backup file does not exist or is not a file.")
+        sys.exit(1)
+
+    # Parse toml config file.
+    with open(args.config_file, 'r') as f:
+        toml_config = toml.load(f)
+
+    # Setup logging.
+    logger = setup_logger(toml_config)
+
+    logger.info("starting decrypt of " + args.backup_file)
+
+    # Decrypt the backup file.
+    result_decrypt_file = decrypt_file(logger, toml_config, args.backup_file, args.output)
+    if not result_decrypt_file["is_working"]:
+        logger.error("decrypt_file failed: " + result_decrypt_file["msg"])
+        sys.exit(1)
+
+    logger.info("decrypt finished succesfully")
+
+def restore_files():
+    # Get arguments from args.
+    parser = argparse.ArgumentParser(description="Restore single folders and files from a backup written with ARCHIVE.INDEX")
+    parser.add_argument('--config-file', type=str, help='Full path to config file.', required=True)
+    parser.add_argument('--backup-file', type=str, help='Full path to the backup file, for a backup split into volumes the path without volume number.', required=True)
+    parser.add_argument('--path', type=str, action='append', help='Folder or file to restore as it was backed up, can be given more than once.', required=True)
+    parser.add_argument('--dst-folder', type=str, help='Full path to the folder to restore into.', required=True)
+    args = parser.parse_args()
+
+    # Check that config file exists and is a file.
+    if not os.path.isfile(args.config_file):
+        print("ERROR: config file does not exist or is not a file.")
+        sys.exit(1)
+
+    # Check that the destination folder exists.
+    if not os.path.isdir(args.dst_folder):
+        print("ERROR: destination folder does not exist or is not a folder.")
+        sys.exit(1)
+
+    # Parse toml config file.
+    with open(args.config_file, 'r') as f:
+        toml_config = toml.load(f)
+
+    # Setup logging.
+    logger = setup_logger(toml_config)
+
+    logger.info("starting restore of " + ", ".join(args.path) + " from " + args.backup_file)
+
+    # Restore the folders and files.
+    result_restore_members = restore_members(logger, toml_config, args.backup_file, args.path, args.dst_folder)
+    if not result_restore_members["is_working"]:
+        logger.error("restore_members failed: " + result_restore_members["msg"])
+        sys.exit(1)
+
+    logger.info("restore finished succesfully")
+
+def send_backup():
+    # Get arguments from args.
+    parser = argparse.ArgumentParser(description="Send a backup file to ddmail_backup_receiver, a chunked upload resumes from the chunks the receiver has")
+    parser.add_argument('--config-file', type=str, help='Full path to config file.', required=True)
+    parser.add_argument('--backup-file', type=str, help='Full path to the backup file to send.', required=True)
+    args = parser.parse_args()
+
+    # Check that config file exists and is a file.
+    if not os.path.isfile(args.config_file):
+        print("ERROR: config file does not exist or is not a file.")
+        sys.exit(1)
+
+    # Check that the backup file exists.
+    if not os.path.isfile(args.backup_file):
+        print("ERROR: backup file does not exist or is not a file.")
+        sys.exit(1)
+
+    # Parse toml config file.
+    with open(args.config_file, 'r') as f:
+        toml_config = toml.load(f)
+
+    # Setup logging.
+    logger = setup_logger(toml_config)
+
+    logger.info("starting send of " + args.backup_file)
+
+    # Send the backup file.
+    result_send_to_backup_receiver = send_to_backup_receiver(logger, toml_config, args.backup_file, os.path.basename(args.backup_file))
+    if not result_send_to_backup_receiver["is_working"]:
+        logger.error("send_to_backup_receiver failed: " + result_send_to_backup_receiver["msg"])
+        sys.exit(1)
+
+    logger.info("send finished succesfully")
+
 if __name__ == "__main__":
     main()
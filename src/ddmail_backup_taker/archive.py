@@ -0,0 +1,506 @@
+import os
+import stat
+import subprocess
+import logging
+import hashlib
+import tarfile
+import pwd
+import grp
+import functools
+import glob
+import json
+import time
+import zlib
+from typing import BinaryIO, Callable, Iterable, Iterator, Optional
+from ddmail_backup_taker.compression import BINARY_CODECS, compress_stage, compression_settings, compressor_cmd, framed_compress_stage
+from ddmail_backup_taker.encryption import encrypt_stage, encryption_settings, gpg_encrypt_cmd
+from ddmail_backup_taker.pipeline import run_pipeline
+from ddmail_backup_taker.stages import BUF_SIZE, count_stage, hash_stage, process_source, write_stage, write_volumes_stage
+
+def stream_archive(logger:logging.Logger, toml_config:dict, data_to_backup:list[str], backup_file:str, recursive:bool = True, members:Optional[Iterable[tuple[str, bytes]]] = None) -> dict:
+    """Create a backup archive in-process as one streaming pass.
+
+    The tar stream is built inside the process as a generator of buffers and is
+    passed through the stages of write_pipeline(). With ARCHIVE.INDEX true a
+    catalog of the members is written next to the backup file. The (name, data)
+    members are archived after the paths, they are read one at a time.
+
+    Args:
+        logger (logging.Logger): Logger object for recording operations.
+        toml_config (dict): Configuration dictionary with backup settings.
+        data_to_backup (list[str]): List of files and folders to include in the backup.
+        backup_file (str): Full path of the backup file to create.
+        recursive (bool): False to only archive the listed paths and not the content of folders.
+        members (Iterable[tuple[str, bytes]]): Extra members without a file on disk, or None.
+
+    Returns:
+        dict: Result containing status information, checksum and sizes:
+            {"is_working": bool, "msg": str, "sha256": str, "archive_size": int, "backup_size": int}
+
+    Error Responses:
+        {"is_working": False, "msg": "<binary> command failed with return code <code>"}: If a stage subprocess fails
+        {"is_working": False, "msg": "Error during backup process: <error>"}: For other errors
+
+    Success Response:
+        {"is_working": True, "msg": "finished successfully", "sha256": "<checksum>", "archive_size": <bytes>, "backup_size": <bytes>}
+    """
+    index = [] if toml_config.get("ARCHIVE", {}).get("INDEX", False) else None
+    trailer = (lambda: members) if members is not None else None
+    return write_pipeline(logger, toml_config, iter_tar(logger, data_to_backup, trailer=trailer, recursive=recursive, index=index), backup_file, index)
+
+def stream_tar_process(logger:logging.Logger, toml_config:dict, tar_cmd:list[str], backup_file:str) -> dict:
+    """Create a backup archive from the uncompressed output of the tar binary.
+
+    The tar subprocess writes the archive to stdout and it is passed through the
+    stages of write_pipeline(), used when the compression is done in-process.
+    When every stage is a subprocess, a zstd or lz4 compressor or none and gpg,
+    and the backup is not split into volumes the stages are connected by
+    write_process_pipeline() instead.
+
+    Args:
+        logger (logging.Logger): Logger object for recording operations.
+        toml_config (dict): Configuration dictionary with backup settings.
+        tar_cmd (list[str]): The tar command line writing an uncompressed archive to stdout.
+        backup_file (str): Full path of the backup file to create.
+
+    Returns:
+        dict: Result containing status information, checksum and sizes:
+            {"is_working": bool, "msg": str, "sha256": str, "archive_size": int, "backup_size": int}
+
+    Error Responses:
+        {"is_working": False, "msg": "<binary> command failed with return code <code>"}: If tar or a stage subprocess fails
+        {"is_working": False, "msg": "Error during backup process: <error>"}: For other errors
+
+    Success Response:
+        {"is_working": True, "msg": "finished successfully", "sha256": "<checksum>", "archive_size": <bytes>, "backup_size": <bytes>}
+    """
+    codec = compression_settings(toml_config)["codec"]
+
+    # Check if every stage is a subprocess, the chunked encryption engine runs in Python.
+    chunked = toml_config["GPG_ENCRYPTION"]["USE"] and encryption_settings(toml_config)["engine"] == "chunked"
+    if (codec in BINARY_CODECS or codec == "none") and not toml_config.get("ARCHIVE", {}).get("VOLUME_SIZE", 0) and not chunked:
+        return write_process_pipeline(logger, toml_config, tar_cmd, backup_file)
+
+    return write_pipeline(logger, toml_config, process_source(tar_cmd), backup_file)
+
+def write_process_pipeline(logger:logging.Logger, toml_config:dict, tar_cmd:list[str], backup_file:str) -> dict:
+    """Run tar, the compressor binary and gpg as one pipeline writing the backup file.
+
+    The subprocesses are connected by enlarged pipes with run_pipeline(), the
+    archive is counted and the backup file is hashed without copying the stream
+    through Python buffers where the kernel supports os.splice() and tee(2).
+
+    Args:
+        logger (logging.Logger): Logger object for recording operations.
+        toml_config (dict): Configuration dictionary with backup settings.
+        tar_cmd (list[str]): The tar command line writing an uncompressed archive to stdout.
+        backup_file (str): Full path of the backup file to create.
+
+    Returns:
+        dict: Result containing status information, checksum and sizes:
+            {"is_working": bool, "msg": str, "sha256": str, "archive_size": int, "backup_size": int, "backup_files": list[str]}
+
+    Error Responses:
+        {"is_working": False, "msg": "<binary> command failed with return code <code>"}: If a subprocess fails
+        {"is_working": False, "msg": "Error during backup process: <error>"}: For other errors
+
+    Success Response:
+        {"is_working": True, "msg": "finished successfully", "sha256": "<checksum>", "archive_size": <bytes>, "backup_size": <bytes>, "backup_files": ["<path>"]}
+    """
+    settings = compression_settings(toml_config)
+    sha256 = hashlib.sha256()
+
+    cmds = [tar_cmd]
+    if settings["codec"] in BINARY_CODECS:
+        cmds.append(compressor_cmd(settings))
+    if toml_config["GPG_ENCRYPTION"]["USE"]:
+        cmds.append(gpg_encrypt_cmd(toml_config))
+
+    try:
+        counts = run_pipeline(cmds, backup_file, sha256)
+    except subprocess.CalledProcessError as e:
+        remove_partial_backup(backup_file)
+        msg = f"{os.path.basename(e.cmd[0])} command failed with return code {e.returncode}"
+        logger.error(msg)
+        return {"is_working": False, "msg": msg}
+    except Exception as e:
+        remove_partial_backup(backup_file)
+        msg = f"Error during backup process: {str(e)}"
+        logger.error(msg)
+        return {"is_working": False, "msg": msg}
+
+    logger.debug("archived " + str(counts[0]) + " bytes into " + str(counts[-1]) + " bytes")
+    return {
+            "is_working": True,
+            "msg": "finished successfully",
+            "sha256": sha256.hexdigest(),
+            "archive_size": counts[0],
+            "backup_size": counts[-1],
+            "backup_files": [backup_file]
+            }
+
+def write_pipeline(logger:logging.Logger, toml_config:dict, chunks:Iterable[bytes], backup_file:str, index:Optional[list] = None) -> dict:
+    """Compress, encrypt, hash and write an archive stream to the backup file in one pass.
+
+    The GPG encryption stage runs the gpg binary as a subprocess that is fed through
+    stdin and read from stdout so every byte written to disk is seen by the hashing
+    stage. When ARCHIVE.VOLUME_SIZE is set the stream is split into the volumes
+    backup_file.001, backup_file.002 and so on, described by the json index file
+    backup_file.index. When index is given the archive is compressed as
+    independently decompressible frames and the members in index and the frames
+    are written to the catalog file backup_file.catalog, see write_catalog().
+
+    Args:
+        logger (logging.Logger): Logger object for recording operations.
+        toml_config (dict): Configuration dictionary with backup settings.
+        chunks (Iterable[bytes]): The uncompressed tar archive as buffers.
+        backup_file (str): Full path of the backup file to create.
+        index (list): Members filled in by iter_tar() while chunks is read, or None for no catalog.
+
+    Returns:
+        dict: Result containing status information, checksum and sizes:
+            {"is_working": bool, "msg": str, "sha256": str, "archive_size": int, "backup_size": int, "backup_files": list[str]}
+
+    Error Responses:
+        {"is_working": False, "msg": "<binary> command failed with return code <code>"}: If a subprocess fails
+        {"is_working": False, "msg": "Error during backup process: <error>"}: For other errors
+
+    Success Response:
+        {"is_working": True, "msg": "finished successfully", "sha256": "<checksum>", "archive_size": <bytes>, "backup_size": <bytes>, "backup_files": ["<path>"]}
+        With volumes also {"index_file": "<path>"}, backup_files holds the volumes followed by the index file.
+        With index also {"catalog_file": "<path>"}, the catalog file is last in backup_files.
+    """
+    volume_size = toml_config.get("ARCHIVE", {}).get("VOLUME_SIZE", 0)
+    sha256 = hashlib.sha256()
+    archive_stats = {"bytes": 0}
+    backup_stats = {"bytes": 0}
+
+    try:
+        # Build the stages, each stage consumes the output of the previous one.
+        chunks = count_stage(chunks, archive_stats)
+        if index is not None:
+            frames = []
+            chunks = framed_compress_stage(chunks, toml_config, frames)
+        else:
+            chunks = compress_stage(chunks, toml_config)
+
+        if toml_config["GPG_ENCRYPTION"]["USE"]:
+            chunks = encrypt_stage(chunks, toml_config)
+
+        chunks = hash_stage(chunks, sha256)
+        chunks = count_stage(chunks, backup_stats)
+
+        # Pull the buffers through all stages and write them to the backup file or volumes.
+        if volume_size:
+            volumes = write_volumes_stage(chunks, backup_file, volume_size)
+            index_file = write_volume_index(backup_file, volume_size, volumes, sha256.hexdigest(), backup_stats["bytes"])
+        else:
+            write_stage(chunks, backup_file)
+
+        if index is not None:
+            catalog_file = write_catalog(toml_config, backup_file, index, frames)
+    except subprocess.CalledProcessError as e:
+        remove_partial_backup(backup_file)
+        msg = f"{os.path.basename(e.cmd[0])} command failed with return code {e.returncode}"
+        logger.error(msg)
+        return {"is_working": False, "msg": msg}
+    except Exception as e:
+        remove_partial_backup(backup_file)
+        msg = f"Error during backup process: {str(e)}"
+        logger.error(msg)
+        return {"is_working": False, "msg": msg}
+
+    msg = "finished successfully"
+    logger.debug("archived " + str(archive_stats["bytes"]) + " bytes into " + str(backup_stats["bytes"]) + " bytes")
+    result = {
+            "is_working": True,
+            "msg": msg,
+            "sha256": sha256.hexdigest(),
+            "archive_size": archive_stats["bytes"],
+            "backup_size": backup_stats["bytes"],
+            "backup_files": [backup_file]
+            }
+
+    if volume_size:
+        logger.info("wrote backup as " + str(len(volumes)) + " volumes of at most " + str(volume_size) + " bytes")
+        result["backup_files"] = [volume["file"] for volume in volumes] + [index_file]
+        result["index_file"] = index_file
+
+    if index is not None:
+        result["backup_files"].append(catalog_file)
+        result["catalog_file"] = catalog_file
+
+    return result
+
+def write_catalog(toml_config:dict, backup_file:str, index:list, frames:list) -> str:
+    """Write the catalog of the members and frames of a backup and return its path.
+
+    The catalog is gzip compressed json with the codec, the frames as [offset, size,
+    compressed offset, compressed size] and the members from iter_tar(). Offsets are
+    in the compressed stream before encryption, with volumes in the joined volumes.
+    The catalog holds every file name so it is encrypted the same way as the backup.
+    """
+    catalog_file = backup_file + ".catalog"
+    catalog = {
+            "backup_filename": os.path.basename(backup_file),
+            "codec": compression_settings(toml_config)["codec"],
+            "frames": frames,
+            "members": index
+            }
+
+    chunks = gzip_json(catalog)
+    if toml_config["GPG_ENCRYPTION"]["USE"]:
+        chunks = encrypt_stage(chunks, toml_config)
+    write_stage(chunks, catalog_file)
+
+    return catalog_file
+
+def gzip_json(data) -> Iterator[bytes]:
+    """Encode data as gzip compressed json."""
+    compressor = zlib.compressobj(6, zlib.DEFLATED, 31)
+    yield compressor.compress(json.dumps(data).encode("utf-8"))
+    yield compressor.flush()
+
+def write_volume_index(backup_file:str, volume_size:int, volumes:list[dict], sha256:str, size:int) -> str:
+    """Write the json index describing the volumes of a backup and return its path.
+
+    The backup is restored by joining the volumes in the listed order, the checksum
+    and size of the joined stream and of every volume are included for verifying.
+    """
+    index_file = backup_file + ".index"
+    index = {
+            "backup_filename": os.path.basename(backup_file),
+            "volume_size": volume_size,
+            "size": size,
+            "sha256": sha256,
+            "volumes": [
+                {"filename": os.path.basename(volume["file"]), "size": volume["size"], "sha256": volume["sha256"]}
+                for volume in volumes
+                ]
+            }
+
+    with open(index_file, "w") as f:
+        json.dump(index, f, indent=4)
+
+    return index_file
+
+
+def remove_partial_file(path:str) -> None:
+    """Remove a partially written output file after a failed run."""
+    if os.path.isfile(path):
+        os.remove(path)
+
+def remove_partial_backup(backup_file:str) -> None:
+    """Remove a partially written backup file, its volumes, index and catalog after a failed run."""
+    remove_partial_file(backup_file)
+    remove_partial_file(backup_file + ".index")
+    remove_partial_file(backup_file + ".catalog")
+    for path in glob.glob(glob.escape(backup_file) + ".[0-9][0-9][0-9]*"):
+        remove_partial_file(path)
+
+def iter_paths(logger:logging.Logger, data_to_backup:list[str], recursive:bool = True) -> Iterator[str]:
+    """Yield every folder and file under the paths to backup, parents first.
+
+    Symlinks are not followed, the same way as tar does. With recursive false only
+    the paths themselves are yielded, the same way as tar --no-recursion does.
+    """
+    for data in data_to_backup:
+        if not os.path.lexists(data):
+            logger.warning("path " + data + " does not exist, skipping it")
+            continue
+
+        yield data
+
+        if recursive and os.path.isdir(data) and not os.path.islink(data):
+            for root, dirs, files in os.walk(data, onerror=lambda e: logger.warning(str(e))):
+                dirs.sort()
+                for name in dirs:
+                    path = os.path.join(root, name)
+                    # Symlinks to folders are archived as symlinks and not walked.
+                    yield path
+                for name in sorted(files):
+                    yield os.path.join(root, name)
+
+@functools.lru_cache(maxsize=None)
+def user_name(uid:int) -> str:
+    """Get the user name of an uid, empty string if there is none."""
+    try:
+        return pwd.getpwuid(uid).pw_name
+    except KeyError:
+        return ""
+
+@functools.lru_cache(maxsize=None)
+def group_name(gid:int) -> str:
+    """Get the group name of a gid, empty string if there is none."""
+    try:
+        return grp.getgrgid(gid).gr_name
+    except KeyError:
+        return ""
+
+def make_tarinfo(path:str, st:os.stat_result, arcname:str) -> Optional[tarfile.TarInfo]:
+    """Create the tar header information of a path from its stat result.
+
+    Returns None for file types that can not be archived, for example sockets.
+    """
+    tarinfo = tarfile.TarInfo(arcname)
+    tarinfo.mode = stat.S_IMODE(st.st_mode)
+    tarinfo.uid = st.st_uid
+    tarinfo.gid = st.st_gid
+    tarinfo.uname = user_name(st.st_uid)
+    tarinfo.gname = group_name(st.st_gid)
+    tarinfo.mtime = int(st.st_mtime)
+
+    if stat.S_ISREG(st.st_mode):
+        tarinfo.type = tarfile.REGTYPE
+        tarinfo.size = st.st_size
+    elif stat.S_ISDIR(st.st_mode):
+        tarinfo.type = tarfile.DIRTYPE
+    elif stat.S_ISLNK(st.st_mode):
+        tarinfo.type = tarfile.SYMTYPE
+        tarinfo.linkname = os.readlink(path)
+    elif stat.S_ISFIFO(st.st_mode):
+        tarinfo.type = tarfile.FIFOTYPE
+    elif stat.S_ISCHR(st.st_mode) or stat.S_ISBLK(st.st_mode):
+        tarinfo.type = tarfile.CHRTYPE if stat.S_ISCHR(st.st_mode) else tarfile.BLKTYPE
+        tarinfo.devmajor = os.major(st.st_rdev)
+        tarinfo.devminor = os.minor(st.st_rdev)
+    else:
+        return None
+
+    return tarinfo
+
+def arcname_of(path:str) -> str:
+    """Get the member name of a path, leading slashes are removed like tar does."""
+    return os.path.normpath(path).lstrip("/")
+
+def tar_header(tarinfo:tarfile.TarInfo) -> bytes:
+    """Encode a tar header block using the pax format."""
+    return tarinfo.tobuf(tarfile.PAX_FORMAT, "utf-8", "surrogateescape")
+
+def iter_file_data(logger:logging.Logger, f:BinaryIO, path:str, size:int, hasher = None) -> Iterator[bytes]:
+    """Yield exactly size bytes of file data followed by the tar block padding.
+
+    Files that grow while they are read are cut at the size in the header and files
+    that shrink are padded with zeros, the same way as tar does. The archived data,
+    without the block padding, is added to hasher when it is given.
+    """
+    remaining = size
+    while remaining > 0:
+        data = f.read(min(BUF_SIZE, remaining))
+        if not data:
+            logger.warning("file " + path + " shrank while it was read, padding with zeros")
+            data = bytes(remaining)
+        remaining = remaining - len(data)
+        if hasher is not None:
+            hasher.update(data)
+        yield data
+
+    padding = (tarfile.BLOCKSIZE - size % tarfile.BLOCKSIZE) % tarfile.BLOCKSIZE
+    if padding:
+        yield bytes(padding)
+
+def iter_tar(logger:logging.Logger, data_to_backup:list[str], select:Optional[Callable[[str, os.stat_result], bool]] = None, trailer:Optional[Callable[[], Iterable[tuple[str, bytes]]]] = None, recursive:bool = True, index:Optional[list] = None) -> Iterator[bytes]:
+    """Build a tar archive of the paths to backup as a generator of buffers.
+
+    Small headers and files are joined into buffers of about BUF_SIZE bytes so the
+    following stages get reasonably sized buffers to work on. Only paths where
+    select(path, stat) is true are archived when select is given. The members
+    returned by trailer() are added last, after all paths have been walked, one
+    at a time so trailer() can return a generator. With recursive false the
+    content of folders is not archived.
+
+    When index is given every member is appended to it as a dict with path, type,
+    size, mtime, the SHA256 checksum of regular files and the offset and length of
+    the member, headers and padding included, in the uncompressed archive.
+    """
+    buf = bytearray()
+    archive_size = 0
+
+    def add_to_index(tarinfo):
+        offset = archive_size + len(buf)
+        if index:
+            index[-1]["length"] = offset - index[-1]["offset"]
+        index.append({
+            "path": tarinfo.name,
+            "type": tarinfo.type.decode("ascii"),
+            "size": tarinfo.size,
+            "mtime": tarinfo.mtime,
+            "sha256": None,
+            "offset": offset,
+            "length": 0
+            })
+
+    for path in iter_paths(logger, data_to_backup, recursive):
+        f = None
+        try:
+            st = os.lstat(path)
+            tarinfo = make_tarinfo(path, st, arcname_of(path))
+            # Open regular files before the header is written so a vanished file is skipped.
+            if tarinfo is not None and tarinfo.isreg():
+                f = open(path, "rb")
+        except FileNotFoundError:
+            logger.warning("file " + path + " vanished before it was archived")
+            continue
+
+        if tarinfo is None:
+            logger.warning("file " + path + " has a type that can not be archived, skipping it")
+            continue
+
+        if select is not None and not select(path, st):
+            if f is not None:
+                f.close()
+            continue
+
+        hasher = None
+        if index is not None:
+            add_to_index(tarinfo)
+            if f is not None:
+                hasher = hashlib.sha256()
+
+        buf += tar_header(tarinfo)
+
+        if f is not None:
+            with f:
+                for data in iter_file_data(logger, f, path, tarinfo.size, hasher):
+                    buf += data
+                    if len(buf) >= BUF_SIZE:
+                        archive_size = archive_size + len(buf)
+                        yield bytes(buf)
+                        buf.clear()
+
+            if hasher is not None:
+                index[-1]["sha256"] = hasher.hexdigest()
+
+        if len(buf) >= BUF_SIZE:
+            archive_size = archive_size + len(buf)
+            yield bytes(buf)
+            buf.clear()
+
+    # Members that are only known after all paths are walked or are streamed from a subprocess.
+    if trailer is not None:
+        for name, data in trailer():
+            tarinfo = tarfile.TarInfo(name)
+            tarinfo.size = len(data)
+            tarinfo.mode = 0o600
+            tarinfo.mtime = int(time.time())
+            if index is not None:
+                add_to_index(tarinfo)
+                index[-1]["sha256"] = hashlib.sha256(data).hexdigest()
+            buf += tar_header(tarinfo)
+            buf += data
+            buf += bytes((tarfile.BLOCKSIZE - len(data) % tarfile.BLOCKSIZE) % tarfile.BLOCKSIZE)
+
+            if len(buf) >= BUF_SIZE:
+                archive_size = archive_size + len(buf)
+                yield bytes(buf)
+                buf.clear()
+
+    # The last member ends where the end of archive marker starts.
+    if index:
+        index[-1]["length"] = archive_size + len(buf) - index[-1]["offset"]
+
+    # End of archive marker, two zero blocks padded to a full tar record.
+    buf += bytes(2 * tarfile.BLOCKSIZE)
+    archive_size = archive_size + len(buf)
+    buf += bytes((tarfile.RECORDSIZE - archive_size % tarfile.RECORDSIZE) % tarfile.RECORDSIZE)
+    yield bytes(buf)
@@ -4,14 +4,47 @@ import logging
 import datetime
 import glob
 import hashlib
+import json
+import re
+import shutil
 import requests
+from ddmail_backup_taker.archive import stream_archive, stream_tar_process
+from ddmail_backup_taker.compression import CODEC_EXTENSIONS, archive_extension, is_tar_compression
+from ddmail_backup_taker.encryption import ENCRYPTION_EXTENSIONS, encryption_extension, encryption_settings
+from ddmail_backup_taker.incremental import stream_incremental_archive
+from ddmail_backup_taker.shards import archive_shards
+from ddmail_backup_taker.repository import backup_to_repository, prune_repository
+from ddmail_backup_taker.mariadb import backup_mariadb_databases, dump_database, list_databases, iter_dump_members
+from ddmail_backup_taker.chunked_dump import backup_mariadb_chunked
+from ddmail_backup_taker.table_layout import backup_mariadb_table_layout
+from ddmail_backup_taker.table_changes import TABLE_STATE, backup_changed_tables, save_table_state, table_backups
+from ddmail_backup_taker.binlog import BINLOG_STATE, full_dump, copy_binlogs, save_binlog_state
+from ddmail_backup_taker.pipeline import enlarge_pipe
+from ddmail_backup_taker.delta import DELTA_STATE, backup_mariadb_delta, delta_bases, save_delta_state
+from ddmail_backup_taker.upload import MultipartFileBody, send_chunked, upload_settings
+from ddmail_backup_taker.stages import SNAPSHOT_FOLDER
 
 def create_backup(logger:logging.Logger, toml_config:dict) -> dict:
     """Create a complete backup according to the provided configuration.
 
-    This function orchestrates the backup process, creating necessary directories,
-    backing up MariaDB databases if configured, and compressing specified folders
-    into a backup archive with optional encryption.
+    Creates the working folders, backs up the MariaDB databases when MARIADB.USE
+    is true and archives the folders and files to backup with optional encryption.
+    backup_files lists every file to send to the backup receiver, the volumes and
+    index file when ARCHIVE.VOLUME_SIZE is set and the catalog when ARCHIVE.INDEX
+    is true.
+
+    Modes:
+        REPOSITORY.USE: The data is stored in the deduplicating chunk repository, the backup file is the pack with the new chunks of the run.
+        MARIADB.PER_DATABASE: Every database is dumped to its own file by backup_mariadb_databases().
+        MARIADB.STREAM: The dump is archived by tar_data() instead of written to disk.
+        MARIADB.COMPRESSION: The dump is compressed while it is written.
+        MARIADB.MODE consistent: The dump reads one snapshot without locking tables.
+        MARIADB.MODE chunked: The tables are dumped as key range chunks by backup_mariadb_chunked().
+        MARIADB.MODE physical: mariabackup streams a physical backup instead of a dump.
+        MARIADB.LAYOUT tables: Every table is dumped to its own schema and data file by backup_mariadb_table_layout().
+        MARIADB.SKIP_UNCHANGED: Only the tables changed since they were last dumped are dumped by backup_changed_tables(), the others are referenced from an earlier backup.
+        MARIADB.DELTA: The dump is stored as a delta against the last full dump by backup_mariadb_delta().
+        MARIADB.INCREMENTAL: A full backup dumps the databases with full_dump(), an incremental backup only copies the binary logs since the last run with copy_binlogs(), the coordinates to continue from are saved in SNAPSHOT_FOLDER.
 
     Args:
         logger (logging.Logger): Logger object for recording operations.
@@ -19,7 +52,7 @@ def create_backup(logger:logging.Logger, toml_config:dict) -> dict:
 
     Returns:
         dict: Result containing status information:
-            {"is_working": bool, "msg": str, "backup_file": str, "backup_filename": str}
+            {"is_working": bool, "msg": str, "backup_file": str, "backup_filename": str, "backup_files": list[str], "backup_type": str, "backup_level": int}
 
     Error Responses:
         {"is_working": False, "msg": "Failed to backup MariaDB: <error message>"}: If MariaDB backup fails
@@ -27,7 +60,7 @@ def create_backup(logger:logging.Logger, toml_config:dict) -> dict:
         {"is_working": False, "msg": "Failed to secure delete temp folder"}: If temp folder deletion fails
 
     Success Response:
-        {"is_working": True, "msg": "finished successfully", "backup_file": "<path>", "backup_filename": "<filename>"}
+        {"is_working": True, "msg": "finished successfully", "backup_file": "<path>", "backup_filename": "<filename>", "backup_files": ["<path>"], "backup_type": "full|incremental|snapshot", "backup_level": <level>}
     """
     # Working folder.
     tmp_folder = toml_config["TMP_FOLDER"]
@@ -52,7 +85,118 @@ def create_backup(logger:logging.Logger, toml_config:dict) -> dict:
     if not os.path.exists(tmp_folder_date):
         os.makedirs(tmp_folder_date)
 
-    if toml_config["MARIADB"]["USE"]:
+    # Binary log coordinates to continue the next incremental database backup from.
+    binlog_coordinates = None
+    binlog_state_file = os.path.join(save_backups_to, SNAPSHOT_FOLDER, BINLOG_STATE)
+
+    # Tables dumped or referenced by this run, saved with their fingerprints after the archive is written.
+    changed_tables = None
+    table_state_file = os.path.join(save_backups_to, SNAPSHOT_FOLDER, TABLE_STATE)
+
+    # Full dump or delta of this run, saved as the base of the next deltas after the archive is written.
+    delta_run = None
+    delta_state_file = os.path.join(save_backups_to, SNAPSHOT_FOLDER, DELTA_STATE)
+
+    # Check if this run only needs the binary logs since the last run.
+    copy_only_binlogs = False
+    if toml_config["MARIADB"]["USE"] and toml_config["MARIADB"].get("INCREMENTAL", False) and os.path.isfile(binlog_state_file):
+        result_planned_level = planned_backup_level(logger, toml_config, snapshot_name_of(toml_config))
+        if not result_planned_level["is_working"]:
+            msg = "Failed to backup MariaDB: " + result_planned_level["msg"]
+            logger.error(msg)
+            return {"is_working": False, "msg": msg}
+        copy_only_binlogs = result_planned_level["backup_level"] > 0
+
+    if copy_only_binlogs:
+        # Incremental database backup, the binary logs written since the last run.
+        result = copy_binlogs(logger, toml_config, binlog_state_file, tmp_folder_date)
+
+        if not result["is_working"]:
+            msg = "Failed to backup MariaDB: " + result["msg"]
+            logger.error(msg)
+            return {"is_working": False, "msg": msg}
+
+        data_to_backup.extend(result["binlog_files"])
+        binlog_coordinates = {"binlog_file": result["binlog_file"], "binlog_position": result["binlog_position"]}
+    elif toml_config["MARIADB"]["USE"] and toml_config["MARIADB"].get("INCREMENTAL", False):
+        # Full dump that records the binary log coordinates of the dump.
+        result = full_dump(logger, toml_config, tmp_folder_date)
+
+        if not result["is_working"]:
+            msg = "Failed to backup MariaDB: " + result["msg"]
+            logger.error(msg)
+            return {"is_working": False, "msg": msg}
+
+        data_to_backup.append(result["db_dump_file"])
+        binlog_coordinates = {"binlog_file": result["binlog_file"], "binlog_position": result["binlog_position"]}
+    elif toml_config["MARIADB"]["USE"] and toml_config["MARIADB"].get("MODE", "lock") == "chunked":
+        # Tables are dumped as key range chunks by concurrent sessions sharing one snapshot.
+        result = backup_mariadb_chunked(logger, toml_config, tmp_folder_date)
+
+        if not result["is_working"]:
+            msg = "Failed to backup MariaDB: " + result["msg"]
+            logger.error(msg)
+            return {"is_working": False, "msg": msg}
+
+        data_to_backup.extend(result["db_dump_files"])
+    elif toml_config["MARIADB"]["USE"] and toml_config["MARIADB"].get("SKIP_UNCHANGED", False):
+        # Only tables that changed since they were last dumped are dumped.
+        result = backup_changed_tables(logger, toml_config, table_state_file, tmp_folder_date)
+
+        if not result["is_working"]:
+            msg = "Failed to backup MariaDB: " + result["msg"]
+            logger.error(msg)
+            return {"is_working": False, "msg": msg}
+
+        data_to_backup.extend(result["db_dump_files"])
+        changed_tables = result["tables"]
+    elif toml_config["MARIADB"]["USE"] and toml_config["MARIADB"].get("LAYOUT", "file") == "tables":
+        # A folder with a schema and a data file for every table that can be restored concurrently.
+        result = backup_mariadb_table_layout(logger, toml_config, tmp_folder_date)
+
+        if not result["is_working"]:
+            msg = "Failed to backup MariaDB: " + result["msg"]
+            logger.error(msg)
+            return {"is_working": False, "msg": msg}
+
+        data_to_backup.append(result["db_dump_folder"])
+    elif toml_config["MARIADB"]["USE"] and toml_config["MARIADB"].get("DELTA", False):
+        # The dump is stored as a delta against the last full dump.
+        result = backup_mariadb_delta(logger, toml_config, delta_state_file, tmp_folder_date)
+
+        if not result["is_working"]:
+            msg = "Failed to backup MariaDB: " + result["msg"]
+            logger.error(msg)
+            return {"is_working": False, "msg": msg}
+
+        data_to_backup.append(result["db_dump_file"])
+        delta_run = result["delta_run"]
+    elif toml_config["MARIADB"]["USE"] and toml_config["MARIADB"].get("STREAM", False):
+        # The dump is streamed into the archive by tar_data() without a temporary file.
+        logger.debug("mariadb dump is streamed into the archive")
+    elif toml_config["MARIADB"]["USE"] and toml_config["MARIADB"].get("PER_DATABASE", False):
+        # Every database is dumped to its own file by concurrent workers.
+        result = backup_mariadb_databases(logger, toml_config, tmp_folder_date)
+
+        if not result["is_working"]:
+            msg = "Failed to backup MariaDB: " + result["msg"]
+            logger.error(msg)
+            return {"is_working": False, "msg": msg}
+
+        data_to_backup.extend(result["db_dump_files"])
+    elif toml_config["MARIADB"]["USE"] and (toml_config["MARIADB"].get("COMPRESSION", "none") != "none" or toml_config["MARIADB"].get("MODE", "lock") in ["consistent", "physical"]):
+        # All databases are dumped to one file, from one snapshot with MODE consistent,
+        # as the mariabackup xbstream with MODE physical and compressed while it is
+        # written with COMPRESSION.
+        result = dump_database(logger, toml_config, None, tmp_folder_date)
+
+        if not result["is_working"]:
+            msg = "Failed to backup MariaDB: " + result["msg"]
+            logger.error(msg)
+            return {"is_working": False, "msg": msg}
+
+        data_to_backup.append(result["db_dump_file"])
+    elif toml_config["MARIADB"]["USE"]:
         # Mariadb-dump binary location.
         mariadbdump_bin = toml_config["MARIADB"]["MARIADBDUMP_BIN"]
 
@@ -73,7 +217,14 @@ def create_backup(logger:logging.Logger, toml_config:dict) -> dict:
         data_to_backup.extend(str.split(toml_config["DATA"]["DATA_TO_BACKUP"]))
 
     result_tar_data = {}
-    if toml_config["DATA"]["USE"] or toml_config["MARIADB"]["USE"]:
+    if (toml_config["DATA"]["USE"] or toml_config["MARIADB"]["USE"]) and toml_config.get("REPOSITORY", {}).get("USE", False):
+        logger.debug("running backup_to_repository")
+        result_tar_data = backup_to_repository(logger, toml_config, data_to_backup)
+        if not result_tar_data["is_working"]:
+            msg = "Failed to backup folders: " + result_tar_data["msg"]
+            logger.error(msg)
+            return {"is_working": False, "msg": msg}
+    elif toml_config["DATA"]["USE"] or toml_config["MARIADB"]["USE"]:
         logger.debug("running tar_data")
         result_tar_data = tar_data(logger, toml_config, data_to_backup)
         if not result_tar_data["is_working"]:
@@ -81,6 +232,18 @@ def create_backup(logger:logging.Logger, toml_config:dict) -> dict:
             logger.error(msg)
             return {"is_working": False, "msg": msg}
 
+    # Save where the next incremental database backup continues from.
+    if binlog_coordinates is not None:
+        save_binlog_state(logger, binlog_state_file, binlog_coordinates)
+
+    # Save which backup holds every table.
+    if changed_tables is not None:
+        save_table_state(logger, toml_config, table_state_file, changed_tables, os.path.basename(backup_stem(result_tar_data["backup_file"])))
+
+    # Save the signature of the base dump of the next deltas and which backup every delta needs.
+    if delta_run is not None:
+        save_delta_state(logger, toml_config, delta_state_file, delta_run, os.path.basename(backup_stem(result_tar_data["backup_file"])))
+
     # Remove temp folder
     result_secure_delete = secure_delete(logger,toml_config,tmp_folder_date)
     if not result_secure_delete["is_working"]:
@@ -96,13 +259,34 @@ def create_backup(logger:logging.Logger, toml_config:dict) -> dict:
     # All worked as expected.
     msg = "finished successfully"
     logger.debug(msg)
-    return {"is_working": True, "msg": msg, "backup_file": result_tar_data["backup_file"], "backup_filename": result_tar_data["backup_filename"]}
+    result_create_backup = {
+            "is_working": True,
+            "msg": msg,
+            "backup_file": result_tar_data["backup_file"],
+            "backup_filename": result_tar_data["backup_filename"],
+            "backup_files": result_tar_data.get("backup_files", [result_tar_data["backup_file"]]),
+            "backup_type": result_tar_data.get("backup_type", "full"),
+            "backup_level": result_tar_data.get("backup_level", 0)
+            }
+
+    if binlog_coordinates is not None:
+        result_create_backup.update(binlog_coordinates)
+
+    return result_create_backup
 
 def tar_data(logger:logging.Logger, toml_config:dict, data_to_backup:list[str])->dict:
     """Create a compressed archive of backup data.
 
-    This function compresses the specified folders and files into a tar.gz archive,
-    with optional GPG encryption if configured in the settings.
+    The folders and files are archived with tar and encrypted with gpg when
+    configured. The file extension follows COMPRESSION.CODEC.
+
+    Modes:
+        ARCHIVE.ENGINE tar: TAR_BIN and gpg run as subprocesses. When the COMPRESSION section asks for anything else than single threaded gzip with the default level compressing every block, tar writes an uncompressed archive that is compressed in-process by stream_tar_process().
+        ARCHIVE.ENGINE python: The archive is built in-process by stream_archive(), the SHA256 checksum and size of the backup file are also returned.
+        DATA.INCREMENTAL: The archive only holds the files changed since the previous run, using a tar snapshot file in SNAPSHOT_FOLDER under SAVE_BACKUPS_TO. The python engine uses stream_incremental_archive(), with Maildir support when DATA.MAILDIR is true.
+        ARCHIVE.VOLUME_SIZE: The backup is written in-process as numbered volumes, backup_file is the index file of the volumes.
+        ARCHIVE.SHARDED: The paths are archived as shards by concurrent workers with archive_shards(), backup_file is the manifest of the shards.
+        MARIADB.STREAM: With MARIADB.USE true the output of mariadb-dump is archived straight from the process as parts under DUMP_MEMBER_FOLDER, see iter_dump_members(), so no dump is written to disk.
 
     Args:
         logger (logging.Logger): Logger object for recording operations.
@@ -111,7 +295,7 @@ def tar_data(logger:logging.Logger, toml_config:dict, data_to_backup:list[str])-
 
     Returns:
         dict: Result containing status information and file path:
-            {"is_working": bool, "msg": str, "backup_file": str, "backup_filename": str}
+            {"is_working": bool, "msg": str, "backup_file": str, "backup_filename": str, "backup_type": str, "backup_level": int}
 
     Error Responses:
         {"is_working": False, "msg": "tar binary location is wrong"}: If tar binary doesn't exist
@@ -119,16 +303,24 @@ def tar_data(logger:logging.Logger, toml_config:dict, data_to_backup:list[str])-
         {"is_working": False, "msg": "tar command failed with return code <code>"}: If tar command fails
         {"is_working": False, "msg": "gpg command failed with return code <code>"}: If GPG encryption fails
         {"is_working": False, "msg": "Error during backup process: <error>"}: For other errors
+        {"is_working": False, "msg": "Failed to prepare incremental snapshot: <error message>"}: If snapshot state can not be read
+        {"is_working": False, "msg": "Failed to save incremental snapshot: <error message>"}: If snapshot state can not be saved
+        {"is_working": False, "msg": "mariadb-dump command failed with return code <code>"}: If a streamed dump fails
 
     Success Response:
-        {"is_working": True, "msg": "finished successfully", "backup_file": "<path>", "backup_filename": "<filename>"}
+        {"is_working": True, "msg": "finished successfully", "backup_file": "<path>", "backup_filename": "<filename>", "backup_type": "full|incremental", "backup_level": <level>}
+        The python engine and in-process compression also adds {"sha256": "<checksum>", "backup_size": <bytes>, "backup_files": ["<path>"]}
     """
 
     tar_bin = toml_config["TAR_BIN"]
     save_backups_to = toml_config["SAVE_BACKUPS_TO"]
+    archive_engine = toml_config.get("ARCHIVE", {}).get("ENGINE", "tar")
+    volume_size = toml_config.get("ARCHIVE", {}).get("VOLUME_SIZE", 0)
+    sharded = toml_config.get("ARCHIVE", {}).get("SHARDED", False)
+    extension = archive_extension(toml_config)
 
     # Check if tar binary exist.
-    if not os.path.exists(tar_bin):
+    if archive_engine == "tar" and not os.path.exists(tar_bin):
         msg = "tar binary location is wrong"
         logger.error(msg)
         return {"is_working": False, "msg": msg}
@@ -139,12 +331,88 @@ def tar_data(logger:logging.Logger, toml_config:dict, data_to_backup:list[str])-
         logger.error(msg)
         return {"is_working": False, "msg": msg}
 
+    # Full backup unless an incremental snapshot says otherwise.
+    backup_type = "full"
+    backup_level = 0
+    tar_options = []
+    snapshot_file = None
+    snapshot_name = None
+
+    # Should only changes since the last run be archived.
+    if toml_config["DATA"].get("INCREMENTAL", False):
+        snapshot_name = snapshot_name_of(toml_config)
+
+        result_prepare_snapshot = prepare_snapshot(logger, toml_config, snapshot_name)
+        if not result_prepare_snapshot["is_working"]:
+            msg = "Failed to prepare incremental snapshot: " + result_prepare_snapshot["msg"]
+            logger.error(msg)
+            return {"is_working": False, "msg": msg}
+
+        backup_level = result_prepare_snapshot["backup_level"]
+        snapshot_file = result_prepare_snapshot["snapshot_file"]
+        tar_options = ["--listed-incremental=" + snapshot_file]
+        if backup_level > 0:
+            backup_type = "incremental"
+
     # Create backup file name.
-    backup_filename = f"backup_{datetime.datetime.now().strftime('%Y%m%d%H%M%S')}.tar.gz"
+    timestamp = datetime.datetime.now().strftime('%Y%m%d%H%M%S')
+    if backup_type == "incremental":
+        backup_filename = f"backup_{timestamp}.incr{backup_level}{extension}"
+    else:
+        backup_filename = f"backup_{timestamp}{extension}"
     backup_file = os.path.join(save_backups_to, backup_filename)
 
+    # Extra information about the backup file from the archive engine.
+    backup_info = {}
+
+    # Database dumps streamed into the archive.
+    members = None
+    if toml_config["MARIADB"]["USE"] and toml_config["MARIADB"].get("STREAM", False):
+        databases = None
+        if toml_config["MARIADB"].get("PER_DATABASE", False):
+            result_list_databases = list_databases(logger, toml_config)
+            if not result_list_databases["is_working"]:
+                return {"is_working": False, "msg": result_list_databases["msg"]}
+            databases = result_list_databases["databases"]
+        members = iter_dump_members(toml_config, databases)
+
+    # The chunked encryption engine runs in-process so it needs a streaming archive engine.
+    chunked = toml_config["GPG_ENCRYPTION"]["USE"] and encryption_settings(toml_config)["engine"] == "chunked"
+
+    if archive_engine == "python" or not is_tar_compression(toml_config) or volume_size or sharded or chunked:
+        if toml_config["GPG_ENCRYPTION"]["USE"]:
+            backup_file = backup_file + encryption_extension(toml_config)
+            backup_filename = backup_filename + encryption_extension(toml_config)
+            extension = extension + encryption_extension(toml_config)
+
+        if sharded:
+            # Archive every shard with its own worker.
+            result_stream = archive_shards(logger, toml_config, data_to_backup, backup_file, extension)
+        elif archive_engine == "python" and snapshot_file:
+            # Build an archive with only the changes since the last run in-process.
+            result_stream = stream_incremental_archive(logger, toml_config, data_to_backup, backup_file, snapshot_file, backup_level, members)
+        elif archive_engine == "python":
+            # Build the archive in-process.
+            result_stream = stream_archive(logger, toml_config, data_to_backup, backup_file, members=members)
+        else:
+            # Let tar write an uncompressed archive that is compressed in-process.
+            result_stream = stream_tar_process(logger, toml_config, [tar_bin, "-cf", "-"] + tar_options + data_to_backup, backup_file)
+
+        if not result_stream["is_working"]:
+            return {"is_working": False, "msg": result_stream["msg"]}
+
+        backup_info = {"sha256": result_stream["sha256"], "backup_size": result_stream["backup_size"], "backup_files": result_stream["backup_files"]}
+
+        # A backup split into volumes is named by its index file and a sharded backup by its manifest.
+        if "index_file" in result_stream:
+            backup_file = result_stream["index_file"]
+            backup_filename = os.path.basename(backup_file)
+        elif "manifest_file" in result_stream:
+            backup_file = result_stream["manifest_file"]
+            backup_filename = os.path.basename(backup_file)
+
     # Should the tar archive be encrypted.
-    if toml_config["GPG_ENCRYPTION"]["USE"]:
+    elif toml_config["GPG_ENCRYPTION"]["USE"]:
         gpg_bin = toml_config["GPG_ENCRYPTION"]["GPG_BIN"]
         gpg_pubkey_fingerprint = toml_config["GPG_ENCRYPTION"]["PUBKEY_FINGERPRINT"]
         backup_file = backup_file + ".gpg"
@@ -153,7 +421,7 @@ def tar_data(logger:logging.Logger, toml_config:dict, data_to_backup:list[str])-
         try:
             # Create tar process
             tar_process = subprocess.Popen(
-                [tar_bin, "-czf", "-"] + data_to_backup,
+                [tar_bin, "-czf", "-"] + tar_options + data_to_backup,
                 stdout=subprocess.PIPE,
                 stderr=subprocess.PIPE
             )
@@ -168,6 +436,8 @@ def tar_data(logger:logging.Logger, toml_config:dict, data_to_backup:list[str])-
 
             # Allow tar_process to receive a SIGPIPE if gpg_process exits
             if tar_process.stdout:
+                # A larger pipe lets tar and gpg run with fewer context switches.
+                enlarge_pipe(tar_process.stdout.fileno())
                 tar_process.stdout.close()
 
             # Wait for completion and check return codes
@@ -193,7 +463,7 @@ def tar_data(logger:logging.Logger, toml_config:dict, data_to_backup:list[str])-
         try:
             # Create standard tar command
             tar_process = subprocess.run(
-                [tar_bin, "-czf", backup_file] + data_to_backup,
+                [tar_bin, "-czf", backup_file] + tar_options + data_to_backup,
                 check=True,
                 stdout=subprocess.PIPE,
                 stderr=subprocess.PIPE
@@ -213,10 +483,168 @@ def tar_data(logger:logging.Logger, toml_config:dict, data_to_backup:list[str])-
             logger.error(msg)
             return {"is_working": False, "msg": msg}
 
+    # Keep the snapshot so the next run only archives new changes.
+    if snapshot_file:
+        result_commit_snapshot = commit_snapshot(logger, toml_config, snapshot_file, backup_level, backup_filename, snapshot_name)
+        if not result_commit_snapshot["is_working"]:
+            msg = "Failed to save incremental snapshot: " + result_commit_snapshot["msg"]
+            logger.error(msg)
+            return {"is_working": False, "msg": msg}
+
     # All worked as expected.
     msg = "finished successfully"
     logger.debug(msg)
-    return {"is_working": True, "msg": msg,"backup_file": backup_file, "backup_filename": backup_filename}
+    return {
+            "is_working": True,
+            "msg": msg,
+            "backup_file": backup_file,
+            "backup_filename": backup_filename,
+            "backup_type": backup_type,
+            "backup_level": backup_level,
+            **backup_info
+            }
+
+def snapshot_name_of(toml_config:dict) -> str:
+    """Get the filename of the snapshot file, the python engine keeps its own state instead of a tar snapshot file."""
+    if toml_config.get("ARCHIVE", {}).get("ENGINE", "tar") == "python":
+        return "data.json"
+    return "data.snar"
+
+def planned_backup_level(logger:logging.Logger, toml_config:dict, snapshot_name:str = "data.snar") -> dict:
+    """Get the level of the next incremental backup run from the saved snapshot state.
+
+    The level is 0 when there is no saved state or the last run reached
+    DATA.INCREMENTAL_MAX_LEVEL, else one more than the last run. Nothing is changed.
+
+    Args:
+        logger (logging.Logger): Logger object for recording operations.
+        toml_config (dict): Configuration dictionary with backup settings.
+        snapshot_name (str): Filename of the snapshot file, data.snar for tar and data.json for the python engine.
+
+    Returns:
+        dict: Result containing status information and backup level:
+            {"is_working": bool, "msg": str, "backup_level": int}
+
+    Error Responses:
+        {"is_working": False, "msg": "snapshot state file <path> is not valid"}: If the saved state can not be parsed
+
+    Success Response:
+        {"is_working": True, "msg": "done", "backup_level": <level>}
+    """
+    snapshot_folder = os.path.join(toml_config["SAVE_BACKUPS_TO"], SNAPSHOT_FOLDER)
+    state_file = os.path.join(snapshot_folder, "state.json")
+    saved_snapshot_file = os.path.join(snapshot_folder, snapshot_name)
+    max_level = toml_config["DATA"].get("INCREMENTAL_MAX_LEVEL", 6)
+
+    # No saved state, take a full backup.
+    if not os.path.isfile(state_file) or not os.path.isfile(saved_snapshot_file):
+        logger.info("no saved snapshot found, taking full backup")
+        return {"is_working": True, "msg": "done", "backup_level": 0}
+
+    try:
+        with open(state_file, "r") as f:
+            last_level = int(json.load(f)["level"])
+    except (ValueError, KeyError, TypeError):
+        msg = "snapshot state file " + state_file + " is not valid"
+        logger.error(msg)
+        return {"is_working": False, "msg": msg}
+
+    # Start a new chain with a full backup when the max level is reached.
+    if last_level >= max_level:
+        logger.info("incremental max level " + str(max_level) + " reached, taking full backup")
+        return {"is_working": True, "msg": "done", "backup_level": 0}
+
+    return {"is_working": True, "msg": "done", "backup_level": last_level + 1}
+
+def prepare_snapshot(logger:logging.Logger, toml_config:dict, snapshot_name:str = "data.snar") -> dict:
+    """Prepare the snapshot file used for an incremental backup run.
+
+    The snapshot state from the previous successful run is kept in the snapshots
+    folder under SAVE_BACKUPS_TO. A working copy of the last snapshot is made so a
+    failed run never changes the saved state. When there is no saved state, or the
+    last run reached DATA.INCREMENTAL_MAX_LEVEL, an empty working snapshot is used
+    and tar takes a new full (level 0) backup.
+
+    Args:
+        logger (logging.Logger): Logger object for recording operations.
+        toml_config (dict): Configuration dictionary with backup settings.
+        snapshot_name (str): Filename of the snapshot file, data.snar for tar and data.json for the python engine.
+
+    Returns:
+        dict: Result containing status information and snapshot file:
+            {"is_working": bool, "msg": str, "backup_level": int, "snapshot_file": str}
+
+    Error Responses:
+        {"is_working": False, "msg": "snapshot state file <path> is not valid"}: If the saved state can not be parsed
+
+    Success Response:
+        {"is_working": True, "msg": "done", "backup_level": <level>, "snapshot_file": "<path>"}
+    """
+    snapshot_folder = os.path.join(toml_config["SAVE_BACKUPS_TO"], SNAPSHOT_FOLDER)
+    saved_snapshot_file = os.path.join(snapshot_folder, snapshot_name)
+    snapshot_file = saved_snapshot_file + ".tmp"
+
+    # Create snapshot folder.
+    if not os.path.exists(snapshot_folder):
+        os.makedirs(snapshot_folder)
+
+    # Remove working snapshot left behind by a failed run.
+    if os.path.exists(snapshot_file):
+        os.remove(snapshot_file)
+
+    result_planned_level = planned_backup_level(logger, toml_config, snapshot_name)
+    if not result_planned_level["is_working"]:
+        return result_planned_level
+
+    backup_level = result_planned_level["backup_level"]
+    if backup_level == 0:
+        return {"is_working": True, "msg": "done", "backup_level": 0, "snapshot_file": snapshot_file}
+
+    shutil.copyfile(saved_snapshot_file, snapshot_file)
+
+    logger.info("taking incremental backup level " + str(backup_level))
+    return {"is_working": True, "msg": "done", "backup_level": backup_level, "snapshot_file": snapshot_file}
+
+def commit_snapshot(logger:logging.Logger, toml_config:dict, snapshot_file:str, backup_level:int, backup_filename:str, snapshot_name:str = "data.snar") -> dict:
+    """Save the working snapshot file after a successful backup run.
+
+    Args:
+        logger (logging.Logger): Logger object for recording operations.
+        toml_config (dict): Configuration dictionary with backup settings.
+        snapshot_file (str): Working snapshot file updated by tar.
+        backup_level (int): Level of the backup that was taken.
+        backup_filename (str): Filename of the backup that was taken.
+        snapshot_name (str): Filename of the snapshot file, data.snar for tar and data.json for the python engine.
+
+    Returns:
+        dict: Result containing status information:
+            {"is_working": bool, "msg": str}
+
+    Error Responses:
+        {"is_working": False, "msg": "snapshot file <path> does not exist"}: If tar did not write the snapshot file
+
+    Success Response:
+        {"is_working": True, "msg": "done"}
+    """
+    snapshot_folder = os.path.join(toml_config["SAVE_BACKUPS_TO"], SNAPSHOT_FOLDER)
+    state_file = os.path.join(snapshot_folder, "state.json")
+    saved_snapshot_file = os.path.join(snapshot_folder, snapshot_name)
+
+    # Check that tar has written the snapshot file.
+    if not os.path.isfile(snapshot_file):
+        msg = "snapshot file " + snapshot_file + " does not exist"
+        logger.error(msg)
+        return {"is_working": False, "msg": msg}
+
+    os.replace(snapshot_file, saved_snapshot_file)
+
+    # Write state to a temporary file first so a crash never leaves a broken state.
+    with open(state_file + ".tmp", "w") as f:
+        json.dump({"level": backup_level, "backup_filename": backup_filename}, f)
+    os.replace(state_file + ".tmp", state_file)
+
+    logger.debug("saved snapshot for backup level " + str(backup_level))
+    return {"is_working": True, "msg": "done"}
 
 def backup_mariadb(logger: logging.Logger, mariadbdump_bin: str, mariadb_root_password: str, dst_folder: str) -> dict:
     """Create a full dump of all MariaDB databases with schema.
@@ -294,7 +722,15 @@ def clear_backups(logger:logging.Logger, toml_config:dict) -> dict:
 
     This function identifies and deletes backup files that exceed the specified
     retention limit, keeping only the most recent backups as defined by the configuration.
-    It uses secure deletion to remove older backup files.
+    Older backups that a kept incremental backup depends on, back to and including
+    the last full backup, are also kept. The volumes and index file of a backup
+    split into volumes, the shards and manifest of a sharded backup and the catalog
+    of a backup count as one backup. The backup with the base dump of a kept
+    delta backup, see backup_mariadb_delta(), and the backups holding the unchanged
+    tables of a kept backup, see backup_changed_tables(), are also kept. It uses
+    secure deletion to remove older backup files. When REPOSITORY.USE is true old
+    snapshots are forgotten and the packs no longer used by a kept snapshot are
+    removed from the repository.
 
     Args:
         logger (logging.Logger): Logger object for recording operations.
@@ -306,6 +742,7 @@ def clear_backups(logger:logging.Logger, toml_config:dict) -> dict:
 
     Error Responses:
         {"is_working": False, "msg": "Failed to delete file <path> with secure-delete"}: If secure deletion fails
+        {"is_working": False, "msg": "Failed to prune repository: <error message>"}: If the repository can not be pruned
 
     Success Response:
         {"is_working": True, "msg": "too few backups for clearing old backups"}: If not enough backups to clear
@@ -320,42 +757,120 @@ def clear_backups(logger:logging.Logger, toml_config:dict) -> dict:
     # Number of backups to keep locally.
     backups_to_save_local = toml_config["BACKUPS_TO_SAVE_LOCAL"]
 
+    # Check if old snapshots and packs in the chunk repository should be removed.
+    if toml_config.get("REPOSITORY", {}).get("USE", False):
+        result_prune_repository = prune_repository(logger, toml_config)
+        if not result_prune_repository["is_working"]:
+            msg = "Failed to prune repository: " + result_prune_repository["msg"]
+            logger.error(msg)
+            return {"is_working": False, "msg": msg}
+
+        for pack in result_prune_repository["unused_packs"]:
+            logger.info("removing " + pack + " with secure-delete")
+            result_secure_delete = secure_delete(logger,toml_config,pack)
+            if not result_secure_delete["is_working"]:
+                msg = "Failed to delete file" + pack + " with secure-delete"
+                logger.error(msg)
+                return {"is_working": False, "msg": msg}
+
     # Get list of backup files in the given directory.
     list_of_files = filter(
             os.path.isfile,
-            glob.glob(save_backups_to + '/backup*.tar.gz*')
+            filter(is_backup_file, glob.glob(save_backups_to + '/backup*.tar*'))
             )
 
-    # Sort list of files based on last modification time in ascending order.
-    list_of_files = sorted(list_of_files, key=os.path.getmtime)
+    # Group the volumes, shards, index, manifest and catalog of a backup as one backup.
+    backups = {}
+    for file in list_of_files:
+        backups.setdefault(backup_stem(file), []).append(file)
+
+    # Sort list of backups based on last modification time in ascending order.
+    list_of_backups = sorted(backups.keys(), key=lambda stem: max(os.path.getmtime(file) for file in backups[stem]))
 
     # If we have less or equal of backups_to_save_local backups then exit.
-    if len(list_of_files) <= backups_to_save_local:
+    if len(list_of_backups) <= backups_to_save_local:
         msg = "too few backups for clearing old backups"
         logger.info(msg)
         return {"is_working": True, "msg": msg}
 
-    list_of_files.reverse()
+    list_of_backups.reverse()
     count = 0
 
+    # Incremental backups need every older backup back to the last full backup.
+    needs_previous_backup = False
+
+    # Delta dumps need the backup with the base dump they were encoded against.
+    bases = delta_bases(os.path.join(save_backups_to, SNAPSHOT_FOLDER, DELTA_STATE))
+
+    # Table dumps reference the older backups that hold their unchanged tables.
+    references = table_backups(os.path.join(save_backups_to, SNAPSHOT_FOLDER, TABLE_STATE))
+    needed_backups = set()
+
     # Only save backups_to_save_local number of backups, remove other.
-    for file in list_of_files:
+    for stem in list_of_backups:
         count = count + 1
-        if count <= backups_to_save_local:
+        if count <= backups_to_save_local or needs_previous_backup or os.path.basename(stem) in needed_backups:
+            needs_previous_backup = is_incremental_backup(stem)
+            if os.path.basename(stem) in bases:
+                needed_backups.add(bases[os.path.basename(stem)])
+            needed_backups.update(references.get(os.path.basename(stem), []))
             continue
         else:
-            logger.info("removing " + file + " with secure-delete")
-            result_secure_delete = secure_delete(logger,toml_config,file)
-            if not result_secure_delete["is_working"]:
-                msg = "Failed to delete file" + file + " with secure-delete"
-                logger.error(msg)
-                return {"is_working": False, "msg": msg}
+            for file in sorted(backups[stem]):
+                logger.info("removing " + file + " with secure-delete")
+                result_secure_delete = secure_delete(logger,toml_config,file)
+                if not result_secure_delete["is_working"]:
+                    msg = "Failed to delete file" + file + " with secure-delete"
+                    logger.error(msg)
+                    return {"is_working": False, "msg": msg}
 
     msg = "finished successfully"
     logger.debug(msg)
     return {"is_working": True, "msg": msg}
 
 
+def is_backup_file(file:str) -> bool:
+    """Check if a file is a backup archive created with one of the supported codecs.
+
+    Volumes and the index file of a backup split into volumes, the shards and
+    manifest of a sharded backup and the catalog of a backup are backup files too.
+
+    Args:
+        file (str): Path or filename of the file.
+
+    Returns:
+        bool: True if the file is a backup archive else False.
+    """
+    extensions = "|".join(re.escape(extension) for extension in CODEC_EXTENSIONS.values())
+    encrypted_extensions = "|".join(re.escape(extension) for extension in ENCRYPTION_EXTENSIONS.values())
+    return re.match(r"^backup.*(" + extensions + r")(" + encrypted_extensions + r")?(\.[0-9]{3,}|\.index|\.manifest|\.catalog)?$", os.path.basename(file)) is not None
+
+
+def backup_stem(file:str) -> str:
+    """Get the backup file path without the shard number, volume number, index, manifest or catalog extension.
+
+    Args:
+        file (str): Path or filename of the backup file, shard, volume, index, manifest or catalog.
+
+    Returns:
+        str: The path shared by all files of the same backup.
+    """
+    file = re.sub(r"(\.[0-9]{3,}|\.index|\.manifest|\.catalog)$", "", file)
+    return re.sub(r"\.shard[0-9]{3,}(?=\.tar)", "", file)
+
+
+def is_incremental_backup(file:str) -> bool:
+    """Check if a backup file is an incremental backup.
+
+    Args:
+        file (str): Path or filename of the backup file.
+
+    Returns:
+        bool: True if the backup file is an incremental backup else False.
+    """
+    return re.search(r"\.incr[0-9]+\.", os.path.basename(file)) is not None
+
+
 def sha256_of_file(logger:logging.Logger, file:str) -> dict:
     """Calculate the SHA256 checksum of a file.
 
@@ -404,6 +919,8 @@ def send_to_backup_receiver(logger:logging.Logger,toml_config:dict, backup_path:
 
     This function calculates the SHA256 checksum of the backup file and sends both
     the file and its checksum to a remote backup receiver endpoint for offsite storage.
+    The multipart body is streamed from the file with MultipartFileBody. With
+    BACKUP_RECEIVER.MODE chunked the file is sent with send_chunked() instead.
 
     Args:
         logger (logging.Logger): Logger object for recording operations.
@@ -431,6 +948,10 @@ def send_to_backup_receiver(logger:logging.Logger,toml_config:dict, backup_path:
     # Password for the ddmail_backup_receiver service.
     password = toml_config["BACKUP_RECEIVER"]["PASSWORD"]
 
+    # Check if the backup should be sent in numbered chunks that can be resumed.
+    if upload_settings(toml_config)["mode"] == "chunked":
+        return send_chunked(logger, toml_config, backup_path, filename)
+
     # Get the sha256 checksum of file.
     result_sha256_of_file = sha256_of_file(logger, backup_path)
 
@@ -441,16 +962,16 @@ def send_to_backup_receiver(logger:logging.Logger,toml_config:dict, backup_path:
 
     sha256 = result_sha256_of_file["checksum"]
 
-    files = {"file": open(backup_path, "rb")}
     data = {
             "filename": filename,
             "password": password,
             "sha256": sha256
             }
 
-    # Send backup to backup_receiver
+    # Send backup to backup_receiver, the file is read while it is sent so memory use does not grow with it.
     try:
-        r = requests.post(url, files=files, data=data, timeout=600)
+        with MultipartFileBody(data, "file", backup_path) as body:
+            r = requests.post(url, data=body, headers={"Content-Type": body.content_type}, timeout=600)
 
         # Log result.
         if str(r.status_code) == "200" and r.text == "done":
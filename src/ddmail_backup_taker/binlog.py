@@ -0,0 +1,179 @@
+import os
+import json
+import shutil
+import logging
+import subprocess
+from typing import Optional
+from ddmail_backup_taker.mariadb import dump_database
+
+# Filename of the binary log state in the snapshots folder.
+BINLOG_STATE = "mariadb_binlog.json"
+
+# Position of the first event in a binary log file, after the magic number.
+BINLOG_START_POSITION = 4
+
+def read_binlog_index(toml_config:dict) -> list[str]:
+    """Get the binary log files listed in MARIADB.BINLOG_INDEX, oldest first, as file names."""
+    with open(toml_config["MARIADB"]["BINLOG_INDEX"], "r") as f:
+        return [os.path.basename(line.strip()) for line in f if line.strip()]
+
+def load_binlog_state(state_file:str) -> Optional[dict]:
+    """Load the binary log coordinates saved by the last successful run, None if there are none."""
+    if not os.path.isfile(state_file):
+        return None
+
+    with open(state_file, "r") as f:
+        return json.load(f)
+
+def save_binlog_state(logger:logging.Logger, state_file:str, coordinates:dict) -> None:
+    """Save the binary log coordinates to continue from after a successful run."""
+    os.makedirs(os.path.dirname(state_file), exist_ok=True)
+
+    # Write state to a temporary file first so a crash never leaves a broken state.
+    with open(state_file + ".tmp", "w") as f:
+        json.dump(coordinates, f)
+    os.replace(state_file + ".tmp", state_file)
+
+    logger.debug("saved binary log coordinates " + coordinates["binlog_file"] + ":" + str(coordinates["binlog_position"]))
+
+def flush_binary_logs(logger:logging.Logger, toml_config:dict) -> dict:
+    """Close the current binary log file and start a new one with the mariadb client.
+
+    Error Responses:
+        {"is_working": False, "msg": "returncode of cmd mariadb is none zero"}: If the mariadb command fails
+
+    Success Response:
+        {"is_working": True, "msg": "done"}
+    """
+    try:
+        subprocess.run(
+                [toml_config["MARIADB"].get("MARIADB_BIN", "/usr/bin/mariadb"),
+                 "-h",
+                 "localhost",
+                 "-uroot",
+                 "-p" + toml_config["MARIADB"]["ROOT_PASSWORD"],
+                 "-e",
+                 "FLUSH BINARY LOGS"],
+                check=True,
+                stdout=subprocess.DEVNULL
+                )
+    except subprocess.CalledProcessError:
+        msg = "returncode of cmd mariadb is none zero"
+        logger.error(msg)
+        return {"is_working": False, "msg": msg}
+
+    return {"is_working": True, "msg": "done"}
+
+def full_dump(logger:logging.Logger, toml_config:dict, dst_folder:str) -> dict:
+    """Dump all databases and record the binary log coordinates of the dump.
+
+    With MARIADB.INCREMENTAL the dump runs with --flush-logs and
+    --single-transaction, so the consistent snapshot of the dump is taken right
+    after mariadb-dump starts a new binary log file. Every change after the dump
+    is in that file and the files after it.
+
+    Args:
+        logger (logging.Logger): Logger object for recording operations.
+        toml_config (dict): Configuration dictionary with backup settings.
+        dst_folder (str): Directory where the database dump will be saved.
+
+    Returns:
+        dict: Result containing status information, file path and coordinates:
+            {"is_working": bool, "msg": str, "db_dump_file": str, "binlog_file": str, "binlog_position": int}
+
+    Error Responses:
+        {"is_working": False, "msg": "<error message>"}: If the dump fails
+        {"is_working": False, "msg": "mariadb-dump did not start a new binary log file"}: If the binary log is not enabled
+
+    Success Response:
+        {"is_working": True, "msg": "done", "db_dump_file": "<path>", "binlog_file": "<file>", "binlog_position": 4}
+    """
+    binlogs_before = read_binlog_index(toml_config)
+
+    result_dump = dump_database(logger, toml_config, None, dst_folder)
+    if not result_dump["is_working"]:
+        return result_dump
+
+    new_binlogs = [binlog for binlog in read_binlog_index(toml_config) if binlog not in binlogs_before]
+
+    # Check that the dump started a new binary log file.
+    if not new_binlogs:
+        msg = "mariadb-dump did not start a new binary log file"
+        logger.error(msg)
+        return {"is_working": False, "msg": msg}
+
+    logger.info("full dump continues at binary log " + new_binlogs[0])
+    return {
+            "is_working": True,
+            "msg": "done",
+            "db_dump_file": result_dump["db_dump_file"],
+            "binlog_file": new_binlogs[0],
+            "binlog_position": BINLOG_START_POSITION
+            }
+
+def copy_binlogs(logger:logging.Logger, toml_config:dict, state_file:str, dst_folder:str) -> dict:
+    """Copy the binary log files written since the last run for an incremental database backup.
+
+    The current binary log file is closed with FLUSH BINARY LOGS, then every
+    complete file from the saved coordinates up to the new current file is copied
+    to dst_folder/binlog. Restoring is the full dump followed by the copied files
+    of every later backup in order, replayed with mariadb-binlog.
+
+    Args:
+        logger (logging.Logger): Logger object for recording operations.
+        toml_config (dict): Configuration dictionary with backup settings.
+        state_file (str): Binary log state file saved by the last successful run.
+        dst_folder (str): Directory where the binary log files will be copied.
+
+    Returns:
+        dict: Result containing status information, file paths and coordinates:
+            {"is_working": bool, "msg": str, "binlog_files": list[str], "binlog_file": str, "binlog_position": int}
+
+    Error Responses:
+        {"is_working": False, "msg": "binary log state file <path> does not exist"}: If there are no saved coordinates
+        {"is_working": False, "msg": "returncode of cmd mariadb is none zero"}: If the binary log can not be flushed
+        {"is_working": False, "msg": "binary log <file> is no longer available"}: If the saved file has been purged
+
+    Success Response:
+        {"is_working": True, "msg": "done", "binlog_files": ["<path>"], "binlog_file": "<file>", "binlog_position": 4}
+    """
+    state = load_binlog_state(state_file)
+
+    # Check if binary log state file exist.
+    if state is None:
+        msg = "binary log state file " + state_file + " does not exist"
+        logger.error(msg)
+        return {"is_working": False, "msg": msg}
+
+    result_flush = flush_binary_logs(logger, toml_config)
+    if not result_flush["is_working"]:
+        return result_flush
+
+    binlogs = read_binlog_index(toml_config)
+
+    # Check that the saved binary log file has not been purged.
+    if state["binlog_file"] not in binlogs:
+        msg = "binary log " + state["binlog_file"] + " is no longer available"
+        logger.error(msg)
+        return {"is_working": False, "msg": msg}
+
+    # The last file is the one started by the flush, it is copied by the next run.
+    new_binlogs = binlogs[binlogs.index(state["binlog_file"]):-1]
+    binlog_folder = os.path.dirname(toml_config["MARIADB"]["BINLOG_INDEX"])
+    dst_binlog_folder = os.path.join(dst_folder, "binlog")
+    os.makedirs(dst_binlog_folder, exist_ok=True)
+
+    binlog_files = []
+    for binlog in new_binlogs:
+        binlog_file = os.path.join(dst_binlog_folder, binlog)
+        shutil.copyfile(os.path.join(binlog_folder, binlog), binlog_file)
+        binlog_files.append(binlog_file)
+
+    logger.info("copied " + str(len(binlog_files)) + " binary log files, continuing at " + binlogs[-1])
+    return {
+            "is_working": True,
+            "msg": "done",
+            "binlog_files": binlog_files,
+            "binlog_file": binlogs[-1],
+            "binlog_position": BINLOG_START_POSITION
+            }
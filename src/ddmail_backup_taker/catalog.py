@@ -0,0 +1,301 @@
+import os
+import io
+import bisect
+import glob
+import json
+import hashlib
+import itertools
+import logging
+import tarfile
+import zlib
+from typing import BinaryIO, Iterable, Iterator
+from ddmail_backup_taker.archive import arcname_of
+from ddmail_backup_taker.compression import decompress_frame
+from ddmail_backup_taker.encryption import CHUNKED_MAGIC, chunked_decrypt_ranges, decrypt_stage, is_encrypted_file
+from ddmail_backup_taker.stages import BUF_SIZE
+
+def iter_file_chunks(paths:list[str]) -> Iterator[bytes]:
+    """Yield the content of files joined in order as buffers."""
+    for path in paths:
+        with open(path, "rb") as f:
+            while True:
+                data = f.read(BUF_SIZE)
+                if not data:
+                    break
+                yield data
+
+def backup_parts(backup_file:str) -> list[str]:
+    """Get the files holding a backup, the backup file itself or its volumes in order."""
+    if os.path.isfile(backup_file):
+        return [backup_file]
+    return sorted(glob.glob(glob.escape(backup_file) + ".[0-9][0-9][0-9]*"))
+
+class VolumeReader:
+    """Read the files holding a backup, the backup file or its volumes, as one seekable file."""
+
+    def __init__(self, paths:list[str]):
+        self.files = [open(path, "rb") for path in paths]
+        self.starts = [0]
+        for f in self.files:
+            self.starts.append(self.starts[-1] + os.fstat(f.fileno()).st_size)
+        self.position = 0
+
+    def seek(self, offset:int, whence:int = os.SEEK_SET) -> int:
+        """Move to offset from the start or, with os.SEEK_END, from the end of the backup."""
+        self.position = offset + (self.starts[-1] if whence == os.SEEK_END else 0)
+        return self.position
+
+    def read(self, size:int) -> bytes:
+        """Read up to size bytes, across volumes."""
+        parts = []
+        while size > 0 and self.position < self.starts[-1]:
+            number = bisect.bisect_right(self.starts, self.position) - 1
+            f = self.files[number]
+            f.seek(self.position - self.starts[number])
+            data = f.read(min(size, self.starts[number + 1] - self.position))
+            if not data:
+                break
+            parts.append(data)
+            self.position = self.position + len(data)
+            size = size - len(data)
+        return b"".join(parts)
+
+    def close(self) -> None:
+        for f in self.files:
+            f.close()
+
+def read_catalog(toml_config:dict, catalog_file:str) -> dict:
+    """Read a catalog written by write_catalog(), encrypted catalogs are decrypted with decrypt_stage()."""
+    with open(catalog_file, "rb") as f:
+        is_gzip = f.read(2) == b"\x1f\x8b"
+
+    chunks = iter_file_chunks([catalog_file])
+    if not is_gzip:
+        chunks = decrypt_stage(chunks, toml_config)
+
+    return json.loads(zlib.decompress(b"".join(chunks), 31))
+
+def read_ranges_from_file(f:BinaryIO, ranges:Iterable[tuple[int, int]]) -> Iterator[bytes]:
+    """Read [offset, size] ranges from a seekable file."""
+    for offset, size in ranges:
+        f.seek(offset)
+        yield f.read(size)
+
+def read_ranges_from_stream(chunks:Iterable[bytes], ranges:Iterable[tuple[int, int]]) -> Iterator[bytes]:
+    """Read ascending [offset, size] ranges from a stream, bytes between them are skipped."""
+    chunks = iter(chunks)
+    buf = bytearray()
+    position = 0
+
+    for offset, size in ranges:
+        while True:
+            # Drop the bytes before the range.
+            if position < offset:
+                drop = min(offset - position, len(buf))
+                del buf[:drop]
+                position = position + drop
+
+            if position >= offset and position + len(buf) >= offset + size:
+                break
+
+            data = next(chunks, None)
+            if data is None:
+                raise ValueError("backup ended before offset " + str(offset + size))
+            buf += data
+
+        yield bytes(buf[offset - position:offset - position + size])
+
+def selected_members(catalog:dict, paths:list[str]) -> list[dict]:
+    """Get the members of the catalog that are one of the paths or are under one of them."""
+    names = [arcname_of(path) for path in paths]
+    return [
+            member for member in catalog["members"]
+            if any(member["path"] == name or member["path"].startswith(name + "/") for name in names)
+            ]
+
+def restore_members(logger:logging.Logger, toml_config:dict, backup_file:str, paths:list[str], dst_folder:str) -> dict:
+    """Restore some folders and files from a backup using its catalog.
+
+    Only the frames holding the selected members are decompressed. Headers and
+    files up to BUF_SIZE bytes are extracted from memory, larger files are written
+    and hashed one frame at a time, see extract_member_stream(). A plain backup
+    and a backup encrypted by the chunked engine, also when split into volumes,
+    are read with seeks straight to the frames, for the chunked engine only the
+    encrypted chunks holding the frames are decrypted. A backup encrypted by gpg is
+    decrypted as a stream and the bytes before and between the frames are skipped
+    without decompressing them. The SHA256 checksum of every restored file is
+    verified against the catalog.
+
+    Args:
+        logger (logging.Logger): Logger object for recording operations.
+        toml_config (dict): Configuration dictionary with backup settings.
+        backup_file (str): Full path of the backup file, for a backup split into volumes the path without volume number.
+        paths (list[str]): Folders and files to restore, as backed up.
+        dst_folder (str): Folder to restore into.
+
+    Returns:
+        dict: Result containing status information:
+            {"is_working": bool, "msg": str, "members": int}
+
+    Error Responses:
+        {"is_working": False, "msg": "catalog file <path> does not exist"}: If the backup has no catalog
+        {"is_working": False, "msg": "no members in the backup match the paths"}: If nothing matches the paths
+        {"is_working": False, "msg": "checksum of <path> does not match the catalog"}: If restored data is corrupt
+        {"is_working": False, "msg": "Error during restore process: <error>"}: For other errors
+
+    Success Response:
+        {"is_working": True, "msg": "restored <count> members successfully", "members": <count>}
+    """
+    catalog_file = backup_file + ".catalog"
+
+    # Check if catalog file exist.
+    if not os.path.isfile(catalog_file):
+        msg = "catalog file " + catalog_file + " does not exist"
+        logger.error(msg)
+        return {"is_working": False, "msg": msg}
+
+    try:
+        catalog = read_catalog(toml_config, catalog_file)
+        members = sorted(selected_members(catalog, paths), key=lambda member: member["offset"])
+
+        if not members:
+            msg = "no members in the backup match the paths"
+            logger.error(msg)
+            return {"is_working": False, "msg": msg}
+
+        frames = catalog["frames"]
+        frame_offsets = [frame[0] for frame in frames]
+
+        def frame_range(member):
+            first = bisect.bisect_right(frame_offsets, member["offset"]) - 1
+            last = bisect.bisect_right(frame_offsets, member["offset"] + member["length"] - 1) - 1
+            return first, last
+
+        # Every frame needed is read once, in order.
+        needed = sorted(set(number for member in members for number in range(frame_range(member)[0], frame_range(member)[1] + 1)))
+        ranges = [(frames[number][2], frames[number][3]) for number in needed]
+        parts = backup_parts(backup_file)
+
+        # Check if the backup can be read with seeks, a backup encrypted by gpg is read as a stream.
+        f = VolumeReader(parts)
+        chunks = None
+        if not is_encrypted_file(backup_file):
+            frame_data = read_ranges_from_file(f, ranges)
+        elif f.read(len(CHUNKED_MAGIC)) == CHUNKED_MAGIC:
+            frame_data = chunked_decrypt_ranges(f, ranges, toml_config)
+        else:
+            f.close()
+            f = None
+            chunks = decrypt_stage(iter_file_chunks(parts), toml_config)
+            frame_data = read_ranges_from_stream(chunks, ranges)
+
+        try:
+            decompressed = {}
+            frame_iter = zip(needed, frame_data)
+
+            def member_chunks(member):
+                first, last = frame_range(member)
+                for number in range(first, last + 1):
+                    # Decompress frames until this frame of the member is there.
+                    while number not in decompressed:
+                        frame_number, data = next(frame_iter)
+                        decompressed[frame_number] = decompress_frame(data, catalog["codec"])
+
+                    # Forget frames before this frame, the last frame can hold the next member.
+                    for old in [old for old in decompressed if old < number]:
+                        del decompressed[old]
+
+                    start = max(member["offset"] - frames[number][0], 0)
+                    end = member["offset"] + member["length"] - frames[number][0]
+                    yield decompressed[number][start:end]
+
+            for member in members:
+                # Check if the member is a large file, it is written to disk frame by frame.
+                if member["size"] > BUF_SIZE:
+                    result_extract = extract_member_stream(logger, member, member_chunks(member), dst_folder)
+                else:
+                    result_extract = extract_member(logger, member, b"".join(member_chunks(member)), dst_folder)
+                if not result_extract["is_working"]:
+                    return result_extract
+        finally:
+            frame_data.close()
+            if f is not None:
+                f.close()
+            if chunks is not None:
+                chunks.close()
+    except Exception as e:
+        msg = f"Error during restore process: {str(e)}"
+        logger.error(msg)
+        return {"is_working": False, "msg": msg}
+
+    msg = "restored " + str(len(members)) + " members successfully"
+    logger.info(msg)
+    return {"is_working": True, "msg": msg, "members": len(members)}
+
+def extract_member(logger:logging.Logger, member:dict, member_data:bytes, dst_folder:str) -> dict:
+    """Verify and extract one tar member, headers and data, into dst_folder."""
+    with tarfile.open(fileobj=io.BytesIO(member_data + bytes(2 * tarfile.BLOCKSIZE)), mode="r:") as tar:
+        tarinfo = tar.next()
+
+        if member["sha256"] is not None:
+            sha256 = hashlib.sha256(tar.extractfile(tarinfo).read()).hexdigest()
+            if sha256 != member["sha256"]:
+                msg = "checksum of " + member["path"] + " does not match the catalog"
+                logger.error(msg)
+                return {"is_working": False, "msg": msg}
+
+        # The tar filter blocks paths outside dst_folder, it exists from python 3.12 and in security updates.
+        if hasattr(tarfile, "tar_filter"):
+            tar.extract(tarinfo, dst_folder, filter="tar")
+        else:
+            tar.extract(tarinfo, dst_folder)
+
+    return {"is_working": True, "msg": "done"}
+
+def extract_member_stream(logger:logging.Logger, member:dict, chunks:Iterable[bytes], dst_folder:str) -> dict:
+    """Extract one tar member of a regular file into dst_folder, the data is written and hashed as it is read.
+
+    The headers are parsed in memory, the member length less the padded file
+    size. A file that does not match the checksum of the catalog is removed.
+    """
+    header_length = member["length"] - -(-member["size"] // tarfile.BLOCKSIZE) * tarfile.BLOCKSIZE
+    chunks = iter(chunks)
+    header = b""
+    while len(header) < header_length:
+        header = header + next(chunks)
+    header, rest = header[:header_length], header[header_length:]
+
+    with tarfile.open(fileobj=io.BytesIO(header + bytes(2 * tarfile.BLOCKSIZE)), mode="r:") as tar:
+        tarinfo = tar.next()
+
+        # Check if the member is a regular file of the size in the catalog.
+        if not tarinfo.isreg() or tarinfo.size != member["size"]:
+            raise ValueError("member " + member["path"] + " is not a regular file of " + str(member["size"]) + " bytes")
+
+        # The tar filter blocks paths outside dst_folder, it exists from python 3.12 and in security updates.
+        if hasattr(tarfile, "tar_filter"):
+            tarinfo = tarfile.tar_filter(tarinfo, dst_folder)
+        path = os.path.join(dst_folder, tarinfo.name)
+        os.makedirs(os.path.dirname(path), exist_ok=True)
+
+        sha256 = hashlib.sha256()
+        remaining = tarinfo.size
+        with open(path, "wb") as f:
+            for chunk in itertools.chain([rest], chunks):
+                # The data is followed by the padding of the last block.
+                chunk = chunk[:remaining]
+                sha256.update(chunk)
+                f.write(chunk)
+                remaining = remaining - len(chunk)
+
+        if member["sha256"] is not None and sha256.hexdigest() != member["sha256"]:
+            os.remove(path)
+            msg = "checksum of " + member["path"] + " does not match the catalog"
+            logger.error(msg)
+            return {"is_working": False, "msg": msg}
+
+        tar.chown(tarinfo, path, False)
+        tar.chmod(tarinfo, path)
+        tar.utime(tarinfo, path)
+
+    return {"is_working": True, "msg": "done"}
@@ -0,0 +1,398 @@
+import os
+import re
+import queue
+import logging
+import secrets
+import subprocess
+import urllib.parse
+import concurrent.futures
+from typing import Iterable, Iterator, Optional
+from ddmail_backup_taker.compression import compress_stage
+from ddmail_backup_taker.mariadb import SKIPPED_DATABASES, dump_cmd, dump_compression_config, dump_extension
+from ddmail_backup_taker.stages import process_source, write_stage
+
+# Data types dumped as hex literals so the bytes are not converted by the connection character set.
+BINARY_TYPES = ["binary", "varbinary", "tinyblob", "blob", "mediumblob", "longblob", "geometry", "point", "linestring", "polygon", "multipoint", "multilinestring", "multipolygon", "geometrycollection", "bit"]
+
+# Primary key data types that can be split into ranges.
+INTEGER_TYPES = ["tinyint", "smallint", "mediumint", "int", "bigint"]
+
+# 1mb, largest INSERT statement in a chunk file, below the default max_allowed_packet.
+STATEMENT_SIZE = 1048576
+
+# Escape sequences of the mariadb client batch mode output.
+BATCH_ESCAPES = {b"n": b"\n", b"t": b"\t", b"0": b"\0", b"\\": b"\\"}
+
+def quote_identifier(name:str) -> str:
+    """Quote a database, table or column name for SQL."""
+    return "`" + name.replace("`", "``") + "`"
+
+def quote_string(value:str) -> str:
+    """Quote a string literal for SQL."""
+    return "'" + value.replace("\\", "\\\\").replace("'", "\\'") + "'"
+
+def unescape_batch(line:bytes) -> bytes:
+    """Undo the escaping of newline, tab, nul and backslash in a line of mariadb client batch output."""
+    return re.sub(rb"\\(.)", lambda m: BATCH_ESCAPES.get(m.group(1), m.group(0)), line)
+
+def session_cmd(toml_config:dict) -> list[str]:
+    """Build the command line of a mariadb client session that runs the statements written to its stdin."""
+    return [toml_config["MARIADB"].get("MARIADB_BIN", "/usr/bin/mariadb"),
+            "-h",
+            "localhost",
+            "-uroot",
+            "-p" + toml_config["MARIADB"]["ROOT_PASSWORD"],
+            "-N",
+            "-B",
+            "--quick",
+            "--unbuffered",
+            "--default-character-set=utf8mb4"]
+
+def open_session(toml_config:dict) -> subprocess.Popen:
+    """Start a mariadb client session, one database connection that is kept open between queries."""
+    return subprocess.Popen(
+            session_cmd(toml_config),
+            stdin=subprocess.PIPE,
+            stdout=subprocess.PIPE,
+            stderr=subprocess.DEVNULL
+            )
+
+def kill_session(session:subprocess.Popen) -> None:
+    """End a mariadb client session without waiting for its statements, an open transaction is rolled back."""
+    session.kill()
+    session.wait()
+
+def close_session(session:subprocess.Popen) -> None:
+    """End a mariadb client session.
+
+    Raises:
+        subprocess.CalledProcessError: If the mariadb client exits with a non zero return code.
+    """
+    session.stdin.close()
+    session.stdout.close()
+    session.wait()
+
+    if session.returncode != 0:
+        raise subprocess.CalledProcessError(session.returncode, session.args)
+
+def session_query(session:subprocess.Popen, sql:str) -> Iterator[bytes]:
+    """Run statements in a mariadb client session and yield the rows of the output as lines.
+
+    A SELECT of a random marker is sent after the statements, the output ends
+    where the marker is printed. The session stays open for the next query.
+
+    Raises:
+        subprocess.CalledProcessError: If the mariadb client exits, it stops at the first failing statement.
+    """
+    marker = "-- ddmail_backup_taker end " + secrets.token_hex(8)
+    try:
+        session.stdin.write((sql + "\nSELECT " + quote_string(marker) + ";\n").encode("utf-8"))
+        session.stdin.flush()
+    except BrokenPipeError:
+        # The mariadb client has exited, its return code tells why.
+        session.wait()
+        raise subprocess.CalledProcessError(session.returncode, session.args)
+
+    for line in session.stdout:
+        line = line.rstrip(b"\n")
+        if line == marker.encode("utf-8"):
+            return
+        yield unescape_batch(line)
+
+    session.wait()
+    raise subprocess.CalledProcessError(session.returncode, session.args)
+
+def start_snapshot_sessions(toml_config:dict, sessions:int) -> list[subprocess.Popen]:
+    """Open sessions that all read from the same consistent snapshot of every InnoDB table.
+
+    Writes are held with FLUSH TABLES WITH READ LOCK only while every session
+    starts its transaction, then the lock is released and the sessions read the
+    same point in time while the server keeps serving writes.
+
+    Raises:
+        subprocess.CalledProcessError: If a mariadb client session fails.
+    """
+    started = []
+    coordinator = open_session(toml_config)
+
+    try:
+        list(session_query(coordinator, "FLUSH TABLES WITH READ LOCK;"))
+
+        for _ in range(sessions):
+            session = open_session(toml_config)
+            started.append(session)
+            list(session_query(session, "SET SESSION TRANSACTION ISOLATION LEVEL REPEATABLE READ;\nSTART TRANSACTION WITH CONSISTENT SNAPSHOT;"))
+
+        list(session_query(coordinator, "UNLOCK TABLES;"))
+        close_session(coordinator)
+    except BaseException:
+        # Ending the coordinator session releases the lock if it is still held.
+        kill_session(coordinator)
+        for session in started:
+            kill_session(session)
+        raise
+
+    return started
+
+def chunk_ranges(min_key:int, max_key:int, table_rows:int, chunk_rows:int) -> list[tuple[Optional[int], Optional[int]]]:
+    """Split a primary key range into ranges of about chunk_rows rows each.
+
+    The first range has no lower bound and the last no upper bound, so a table is
+    always covered completely. A table of at most chunk_rows rows is one range.
+    """
+    chunks = min(max(-(-table_rows // chunk_rows), 1), max_key - min_key + 1)
+    if chunks <= 1:
+        return [(None, None)]
+
+    step = -(-(max_key - min_key + 1) // chunks)
+    bounds = [min_key + step * number for number in range(1, chunks)]
+
+    return list(zip([None] + bounds, bounds + [None]))
+
+def row_expression(columns:list[tuple[str, str]]) -> str:
+    """Build the SQL expression that formats a row as a VALUES tuple from (column, data type) pairs."""
+    values = []
+    for column, data_type in columns:
+        if data_type in BINARY_TYPES:
+            values.append("IF(" + quote_identifier(column) + " IS NULL, 'NULL', CONCAT('0x', HEX(" + quote_identifier(column) + ")))")
+        else:
+            values.append("QUOTE(" + quote_identifier(column) + ")")
+    return "CONCAT('(', CONCAT_WS(','," + ",".join(values) + "), ')')"
+
+def chunk_query(table:dict, key_range:tuple[Optional[int], Optional[int]]) -> str:
+    """Build the SELECT of one chunk of a table."""
+    sql = "SELECT " + row_expression(table["columns"]) + " FROM " + quote_identifier(table["database"]) + "." + quote_identifier(table["table"])
+
+    conditions = []
+    if key_range[0] is not None:
+        conditions.append(quote_identifier(table["key"]) + " >= " + str(key_range[0]))
+    if key_range[1] is not None:
+        conditions.append(quote_identifier(table["key"]) + " < " + str(key_range[1]))
+    if conditions:
+        sql = sql + " WHERE " + " AND ".join(conditions)
+
+    return sql + ";"
+
+def iter_insert_statements(table:dict, rows:Iterable[bytes], statement_size:int = STATEMENT_SIZE) -> Iterator[bytes]:
+    """Join VALUES tuples into multi row INSERT statements of at most about statement_size bytes."""
+    insert = ("INSERT INTO " + quote_identifier(table["table"]) + " (" + ",".join(quote_identifier(column) for column, _ in table["columns"]) + ") VALUES\n").encode("utf-8")
+    statement = []
+    size = 0
+
+    for row in rows:
+        statement.append(row)
+        size = size + len(row) + 2
+        if size >= statement_size:
+            yield insert + b",\n".join(statement) + b";\n"
+            statement = []
+            size = 0
+
+    if statement:
+        yield insert + b",\n".join(statement) + b";\n"
+
+def chunk_source(session:subprocess.Popen, table:dict, key_range:tuple[Optional[int], Optional[int]]) -> Iterator[bytes]:
+    """Yield a chunk of a table as SQL that restores it into an existing table."""
+    yield ("SET NAMES utf8mb4;\nSET FOREIGN_KEY_CHECKS=0;\nSET UNIQUE_CHECKS=0;\nUSE " + quote_identifier(table["database"]) + ";\n").encode("utf-8")
+    yield from iter_insert_statements(table, session_query(session, chunk_query(table, key_range)))
+
+def schema_source(toml_config:dict, session:subprocess.Popen, database:str, tables:list[dict]) -> Iterator[bytes]:
+    """Yield the schema of a database as SQL, the tables as they are in the snapshot of session.
+
+    The CREATE TABLE statements are read with SHOW CREATE TABLE in the snapshot
+    session before any rows, as mariadb-dump --single-transaction does, so they
+    match the columns of the chunks. The triggers and views hold no rows, they
+    are dumped with mariadb-dump after the tables and are not part of the snapshot.
+
+    Raises:
+        subprocess.CalledProcessError: If the mariadb client session or mariadb-dump fails.
+    """
+    line = list(session_query(session, "SHOW CREATE DATABASE IF NOT EXISTS " + quote_identifier(database) + ";"))[0]
+    yield b"SET NAMES utf8mb4;\nSET FOREIGN_KEY_CHECKS=0;\n" + line.split(b"\t", 1)[1] + b";\nUSE " + quote_identifier(database).encode("utf-8") + b";\n"
+
+    for table in tables:
+        line = list(session_query(session, "SHOW CREATE TABLE " + quote_identifier(database) + "." + quote_identifier(table["table"]) + ";"))[0]
+        yield b"DROP TABLE IF EXISTS " + quote_identifier(table["table"]).encode("utf-8") + b";\n" + line.split(b"\t", 1)[1] + b";\n"
+
+    # The triggers of the tables, without CREATE TABLE statements.
+    yield from process_source(dump_cmd(toml_config, database, schema_only=True, options=["--no-create-info", "--no-create-db"]))
+
+    views = [line.decode("utf-8") for line in session_query(session,
+            "SELECT TABLE_NAME FROM information_schema.TABLES WHERE TABLE_SCHEMA = " + quote_string(database) + " AND TABLE_TYPE = 'VIEW'"
+            " ORDER BY TABLE_NAME;")]
+    if views:
+        # One mariadb-dump creates stand-ins of all views first, so views that use other views restore in any order.
+        yield from process_source(dump_cmd(toml_config, database, schema_only=True, table=views[0]) + views[1:])
+
+def chunk_file_of(dst_folder:str, database:str, table:Optional[str], number:int = 0, extension:str = ".sql") -> str:
+    """Get the schema file of a database when table is None, else the file of chunk number of a table.
+
+    Database and table names that are not safe in a file name are quoted.
+    """
+    name = "db_dump_" + urllib.parse.quote(database, safe="")
+    if table is None:
+        return os.path.join(dst_folder, name + ".schema" + extension)
+    return os.path.join(dst_folder, name + "." + urllib.parse.quote(table, safe="") + f".{number:05d}" + extension)
+
+def list_tables(session:subprocess.Popen) -> list[dict]:
+    """List the tables to dump with their columns, primary key and estimated number of rows.
+
+    Only a single column integer primary key is used to split a table, the key is
+    None for other tables. Generated columns are left out, the server computes them.
+    """
+    skipped = ",".join(quote_string(database) for database in SKIPPED_DATABASES)
+    tables = {}
+
+    for line in session_query(session,
+            "SELECT TABLE_SCHEMA, TABLE_NAME, IFNULL(TABLE_ROWS, 0) FROM information_schema.TABLES"
+            " WHERE TABLE_TYPE IN ('BASE TABLE', 'SYSTEM VERSIONED') AND TABLE_SCHEMA NOT IN (" + skipped + ")"
+            " ORDER BY TABLE_SCHEMA, TABLE_NAME;"):
+        database, table, table_rows = line.decode("utf-8").split("\t")
+        tables[(database, table)] = {"database": database, "table": table, "rows": int(table_rows), "columns": [], "keys": []}
+
+    for line in session_query(session,
+            "SELECT TABLE_SCHEMA, TABLE_NAME, COLUMN_NAME, DATA_TYPE, COLUMN_KEY, EXTRA FROM information_schema.COLUMNS"
+            " WHERE TABLE_SCHEMA NOT IN (" + skipped + ")"
+            " ORDER BY TABLE_SCHEMA, TABLE_NAME, ORDINAL_POSITION;"):
+        database, table, column, data_type, column_key, extra = line.decode("utf-8").split("\t")
+        if (database, table) not in tables or "GENERATED" in extra.upper():
+            continue
+        tables[(database, table)]["columns"].append((column, data_type.lower()))
+        if column_key == "PRI":
+            tables[(database, table)]["keys"].append((column, data_type.lower()))
+
+    for table in tables.values():
+        keys = table.pop("keys")
+        table["key"] = keys[0][0] if len(keys) == 1 and keys[0][1] in INTEGER_TYPES else None
+
+    return list(tables.values())
+
+def plan_chunks(session:subprocess.Popen, tables:list[dict], chunk_rows:int) -> list[tuple[dict, tuple[Optional[int], Optional[int]]]]:
+    """Split the tables into (table, key range) chunks, largest tables first.
+
+    The lowest and highest key are read in the snapshot session, so the ranges
+    cover every row of the snapshot.
+    """
+    chunks = []
+
+    for table in sorted(tables, key=lambda table: table["rows"], reverse=True):
+        if table["key"] is None or table["rows"] <= chunk_rows:
+            chunks.append((table, (None, None)))
+            continue
+
+        key = quote_identifier(table["key"])
+        line = list(session_query(session, "SELECT IFNULL(MIN(" + key + "), 0), IFNULL(MAX(" + key + "), 0) FROM " + quote_identifier(table["database"]) + "." + quote_identifier(table["table"]) + ";"))[0]
+        min_key, max_key = [int(value) for value in line.decode("utf-8").split("\t")]
+
+        chunks.extend((table, key_range) for key_range in chunk_ranges(min_key, max_key, table["rows"], chunk_rows))
+
+    return chunks
+
+def backup_mariadb_chunked(logger:logging.Logger, toml_config:dict, dst_folder:str) -> dict:
+    """Dump the MariaDB databases as primary key range chunks dumped in parallel from one snapshot.
+
+    The data is read by MARIADB.PARALLELISM mariadb client sessions that share
+    one consistent snapshot, see start_snapshot_sessions(). The schema of every
+    database is read in the first session, see schema_source(). Tables with a
+    single column integer primary key and more than MARIADB.CHUNK_ROWS rows are
+    split into key ranges so one large table is dumped by all sessions at the
+    same time.
+
+    Restore the schema files first, then the chunk files in any order.
+
+    Args:
+        logger (logging.Logger): Logger object for recording operations.
+        toml_config (dict): Configuration dictionary with backup settings.
+        dst_folder (str): Directory where the database dumps will be saved.
+
+    Returns:
+        dict: Result containing status information and file paths:
+            {"is_working": bool, "msg": str, "db_dump_files": list[str]}
+
+    Error Responses:
+        {"is_working": False, "msg": "dst_folder do not exist"}: If destination folder doesn't exist
+        {"is_working": False, "msg": "returncode of cmd mariadbdump is none zero"}: If a schema dump fails
+        {"is_working": False, "msg": "returncode of cmd mariadb is none zero"}: If a mariadb client session fails
+        {"is_working": False, "msg": "returncode of cmd <compressor> is none zero"}: If the compressor fails
+        {"is_working": False, "msg": "Error during backup process: <error>"}: For other errors
+
+    Success Response:
+        {"is_working": True, "msg": "done", "db_dump_files": ["<path>"]}
+    """
+    # Check if dst_folder exist.
+    if not os.path.exists(dst_folder):
+        msg = "dst_folder do not exist"
+        logger.error(msg)
+        return {"is_working": False, "msg": msg}
+
+    parallelism = toml_config["MARIADB"].get("PARALLELISM", 4)
+    chunk_rows = toml_config["MARIADB"].get("CHUNK_ROWS", 1000000)
+    extension = dump_extension(toml_config)
+    compression_config = dump_compression_config(toml_config)
+    sessions = []
+
+    try:
+        sessions = start_snapshot_sessions(toml_config, parallelism)
+
+        tables = list_tables(sessions[0])
+        chunks = plan_chunks(sessions[0], tables, chunk_rows)
+
+        # Dump the schema of every database that has tables.
+        db_dump_files = []
+        for database in sorted(set(table["database"] for table in tables)):
+            db_dump_file = chunk_file_of(dst_folder, database, None, extension=extension)
+            schema_tables = [table for table in tables if table["database"] == database]
+            write_stage(compress_stage(schema_source(toml_config, sessions[0], database, schema_tables), compression_config), db_dump_file)
+            db_dump_files.append(db_dump_file)
+
+        logger.info("dumping " + str(len(tables)) + " tables as " + str(len(chunks)) + " chunks with " + str(len(sessions)) + " workers")
+
+        # Every session takes the next chunk until all chunks are dumped.
+        todo = queue.Queue()
+        numbers = {}
+        for table, key_range in chunks:
+            numbers[(table["database"], table["table"])] = numbers.get((table["database"], table["table"]), 0) + 1
+            chunk_file = chunk_file_of(dst_folder, table["database"], table["table"], numbers[(table["database"], table["table"])], extension)
+            todo.put((table, key_range, chunk_file))
+            db_dump_files.append(chunk_file)
+
+        def worker(session):
+            while True:
+                try:
+                    table, key_range, chunk_file = todo.get_nowait()
+                except queue.Empty:
+                    return
+                write_stage(compress_stage(chunk_source(session, table, key_range), compression_config), chunk_file)
+
+        with concurrent.futures.ThreadPoolExecutor(max_workers=len(sessions)) as executor:
+            futures = [executor.submit(worker, session) for session in sessions]
+            for future in futures:
+                future.result()
+
+        for session in sessions:
+            close_session(session)
+    except subprocess.CalledProcessError as e:
+        for session in sessions:
+            kill_session(session)
+
+        if e.cmd[0] == toml_config["MARIADB"]["MARIADBDUMP_BIN"]:
+            msg = "returncode of cmd mariadbdump is none zero"
+        elif e.cmd[0] == session_cmd(toml_config)[0]:
+            msg = "returncode of cmd mariadb is none zero"
+        else:
+            msg = "returncode of cmd " + os.path.basename(e.cmd[0]) + " is none zero"
+        logger.error(msg)
+        return {"is_working": False, "msg": msg}
+    except Exception as e:
+        for session in sessions:
+            kill_session(session)
+
+        msg = f"Error during backup process: {str(e)}"
+        logger.error(msg)
+        return {"is_working": False, "msg": msg}
+    except BaseException:
+        # Killing the sessions rolls back their transactions so the snapshot is not held open.
+        for session in sessions:
+            kill_session(session)
+        raise
+
+    return {"is_working": True, "msg": "done", "db_dump_files": db_dump_files}
@@ -0,0 +1,365 @@
+import collections
+import concurrent.futures
+import lzma
+import struct
+import zlib
+from typing import Iterable, Iterator
+from ddmail_backup_taker.stages import process_stage
+
+# 4mb, size of the blocks compressed in parallel.
+BLOCK_SIZE = 4194304
+
+# 1mb, size of the independently decompressible frames of a backup with a catalog.
+FRAME_SIZE = 1048576
+
+# 64kb, size of every sample compressed to check if a block is compressible.
+SAMPLE_SIZE = 65536
+
+# Number of samples taken from a block to check if it is compressible.
+SAMPLES = 4
+
+# A block is stored without compression when its samples do not shrink below this ratio.
+INCOMPRESSIBLE_RATIO = 0.95
+
+# 32kb, the deflate window size used as dictionary from the previous block.
+DICT_SIZE = 32768
+
+# File extension of the backup archive for every supported codec.
+CODEC_EXTENSIONS = {
+        "gzip": ".tar.gz",
+        "zstd": ".tar.zst",
+        "lz4": ".tar.lz4",
+        "xz": ".tar.xz",
+        "none": ".tar",
+        }
+
+# Default, lowest and highest compression level for every supported codec.
+CODEC_LEVELS = {
+        "gzip": (6, 1, 9),
+        "zstd": (3, 1, 22),
+        "lz4": (1, 1, 12),
+        "xz": (6, 0, 9),
+        "none": (0, 0, 0),
+        }
+
+# Codecs that are compressed by the binary in COMPRESSION.BIN.
+BINARY_CODECS = ["zstd", "lz4"]
+
+# Codecs that can be written as independently decompressible frames.
+FRAME_CODECS = ["gzip", "xz", "none"]
+
+def compression_settings(toml_config:dict) -> dict:
+    """Get the compression settings with defaults for the missing values.
+
+    COMPRESSION.SKIP_INCOMPRESSIBLE defaults to true for gzip and xz when the
+    MariaDB dump is compressed with MARIADB.COMPRESSION, so the dump is not
+    compressed twice.
+
+    Args:
+        toml_config (dict): Configuration dictionary with backup settings.
+
+    Returns:
+        dict: {"codec": str, "level": int, "threads": int, "long": bool, "bin": str, "skip_incompressible": bool}
+    """
+    compression_config = toml_config.get("COMPRESSION", {})
+    codec = compression_config.get("CODEC", "gzip")
+
+    # A database dump that is already compressed is stored without compressing it again by default.
+    mariadb_config = toml_config.get("MARIADB", {})
+    dump_compressed = mariadb_config.get("USE", False) and mariadb_config.get("COMPRESSION", "none") != "none" and codec in ["gzip", "xz"]
+
+    return {
+            "codec": codec,
+            "level": compression_config.get("LEVEL", CODEC_LEVELS.get(codec, (0, 0, 0))[0]),
+            "threads": compression_config.get("THREADS", 1),
+            "long": compression_config.get("LONG", False),
+            "bin": compression_config.get("BIN", None),
+            "skip_incompressible": compression_config.get("SKIP_INCOMPRESSIBLE", dump_compressed),
+            }
+
+def archive_extension(toml_config:dict) -> str:
+    """Get the file extension of the backup archive for the configured codec."""
+    return CODEC_EXTENSIONS[compression_settings(toml_config)["codec"]]
+
+def is_tar_compression(toml_config:dict) -> bool:
+    """Check if the configured compression is what tar -z does by itself.
+
+    Args:
+        toml_config (dict): Configuration dictionary with backup settings.
+
+    Returns:
+        bool: True for single threaded gzip with the default level that compresses every block else False.
+    """
+    settings = compression_settings(toml_config)
+    return settings["codec"] == "gzip" and settings["level"] == CODEC_LEVELS["gzip"][0] and settings["threads"] == 1 and not settings["skip_incompressible"]
+
+def compressor_cmd(settings:dict) -> list[str]:
+    """Build the command line of the compressor binary for zstd and lz4.
+
+    Args:
+        settings (dict): Compression settings from compression_settings().
+
+    Returns:
+        list[str]: The compressor command line reading stdin and writing stdout.
+    """
+    cmd = [settings["bin"], "-q", "-c", "-" + str(settings["level"])]
+
+    if settings["codec"] == "zstd":
+        # Levels above 19 need the ultra flag.
+        if settings["level"] > 19:
+            cmd.append("--ultra")
+        cmd.append("-T" + str(settings["threads"]))
+        if settings["long"]:
+            cmd.append("--long=27")
+
+    return cmd
+
+def compress_stage(chunks:Iterable[bytes], toml_config:dict) -> Iterator[bytes]:
+    """Compress buffers according to the COMPRESSION section of the configuration.
+
+    Gzip and xz are compressed in-process, with several threads when
+    COMPRESSION.THREADS is larger than 1. With COMPRESSION.SKIP_INCOMPRESSIBLE true
+    they are compressed as blocks and blocks of already compressed content are
+    stored without compression, see is_incompressible(). Zstd and lz4 use the
+    binary in COMPRESSION.BIN and none passes the buffers through unchanged.
+
+    Args:
+        chunks (Iterable[bytes]): Buffers to compress.
+        toml_config (dict): Configuration dictionary with backup settings.
+
+    Returns:
+        Iterator[bytes]: The compressed stream as buffers.
+    """
+    settings = compression_settings(toml_config)
+    codec = settings["codec"]
+
+    skip_incompressible = settings["skip_incompressible"]
+
+    if codec == "gzip":
+        if settings["threads"] > 1 or skip_incompressible:
+            return parallel_gzip_stage(chunks, level=settings["level"], threads=settings["threads"], skip_incompressible=skip_incompressible)
+        return gzip_stage(chunks, level=settings["level"])
+
+    if codec == "xz":
+        if settings["threads"] > 1 or skip_incompressible:
+            return parallel_xz_stage(chunks, level=settings["level"], threads=settings["threads"], skip_incompressible=skip_incompressible)
+        return xz_stage(chunks, level=settings["level"])
+
+    if codec in BINARY_CODECS:
+        return process_stage(chunks, compressor_cmd(settings))
+
+    return iter(chunks)
+
+def gzip_stage(chunks:Iterable[bytes], level:int = 6) -> Iterator[bytes]:
+    """Compress buffers into a single gzip stream."""
+    compressor = zlib.compressobj(level, zlib.DEFLATED, 31)
+    for chunk in chunks:
+        data = compressor.compress(chunk)
+        if data:
+            yield data
+    yield compressor.flush()
+
+def iter_blocks(chunks:Iterable[bytes], block_size:int) -> Iterator[bytes]:
+    """Join or split buffers into blocks of block_size bytes, the last block may be smaller."""
+    buf = bytearray()
+    for chunk in chunks:
+        buf += chunk
+        while len(buf) >= block_size:
+            yield bytes(buf[:block_size])
+            del buf[:block_size]
+    if buf:
+        yield bytes(buf)
+
+def is_incompressible(block:bytes) -> bool:
+    """Check if a block is already compressed content that does not shrink when compressed again.
+
+    SAMPLES samples of SAMPLE_SIZE bytes spread over the block are compressed with
+    the fastest deflate level. Compressed mails, images, archives and pdf files do
+    not get below INCOMPRESSIBLE_RATIO while text and tar headers shrink far below
+    it, so a sample costs a small part of compressing the whole block.
+    """
+    if len(block) <= SAMPLE_SIZE * SAMPLES:
+        samples = [block]
+    else:
+        step = (len(block) - SAMPLE_SIZE) // (SAMPLES - 1)
+        samples = [block[i * step:i * step + SAMPLE_SIZE] for i in range(SAMPLES)]
+
+    size = sum(len(sample) for sample in samples)
+    if size == 0:
+        return False
+
+    compressed_size = sum(len(zlib.compress(sample, 1)) for sample in samples)
+    return compressed_size >= size * INCOMPRESSIBLE_RATIO
+
+def deflate_block(block:bytes, dictionary:bytes, level:int, last:bool, skip_incompressible:bool = False) -> bytes:
+    """Compress one block as raw deflate data that can be joined with the other blocks.
+
+    The end of the previous block is used as dictionary so the compression ratio is
+    close to a single threaded gzip. Blocks that are not the last one end with a sync
+    flush so they end on a byte boundary without marking the end of the stream. With
+    skip_incompressible true an incompressible block is written as stored deflate
+    blocks, level 0.
+    """
+    if skip_incompressible and is_incompressible(block):
+        level = 0
+
+    if dictionary:
+        compressor = zlib.compressobj(level, zlib.DEFLATED, -15, zdict=dictionary)
+    else:
+        compressor = zlib.compressobj(level, zlib.DEFLATED, -15)
+
+    data = compressor.compress(block)
+    if last:
+        return data + compressor.flush(zlib.Z_FINISH)
+    return data + compressor.flush(zlib.Z_SYNC_FLUSH)
+
+def parallel_gzip_stage(chunks:Iterable[bytes], level:int = 6, threads:int = 2, block_size:int = BLOCK_SIZE, skip_incompressible:bool = False) -> Iterator[bytes]:
+    """Compress buffers into a single gzip stream using several threads.
+
+    The input is split into blocks that are compressed in a thread pool, zlib
+    releases the GIL while compressing so the blocks use one core each. The output
+    is one standard gzip member, the same way as pigz works, so it can be read by
+    gzip, tar and every other gzip reader.
+    """
+    crc = 0
+    size = 0
+
+    # Gzip header, deflate, no flags, no mtime, unix.
+    yield b"\x1f\x8b\x08\x00\x00\x00\x00\x00\x00\x03"
+
+    with concurrent.futures.ThreadPoolExecutor(max_workers=threads) as executor:
+        pending = collections.deque()
+        dictionary = b""
+        previous = None
+
+        for block in iter_blocks(chunks, block_size):
+            # Submit the previous block now that we know it is not the last one.
+            if previous is not None:
+                pending.append(executor.submit(deflate_block, previous, dictionary, level, False, skip_incompressible))
+                dictionary = previous[-DICT_SIZE:]
+
+            crc = zlib.crc32(block, crc)
+            size = size + len(block)
+            previous = block
+
+            # Keep a bounded number of blocks in memory.
+            while len(pending) >= threads * 2:
+                yield pending.popleft().result()
+
+        pending.append(executor.submit(deflate_block, previous or b"", dictionary, level, True, skip_incompressible))
+
+        while pending:
+            yield pending.popleft().result()
+
+    # Gzip trailer, crc32 and size of the uncompressed data.
+    yield struct.pack("<II", crc & 0xffffffff, size & 0xffffffff)
+
+def xz_stage(chunks:Iterable[bytes], level:int = 6) -> Iterator[bytes]:
+    """Compress buffers into a single xz stream."""
+    compressor = lzma.LZMACompressor(format=lzma.FORMAT_XZ, preset=level)
+    for chunk in chunks:
+        data = compressor.compress(chunk)
+        if data:
+            yield data
+    yield compressor.flush()
+
+def xz_block(block:bytes, level:int, skip_incompressible:bool = False) -> bytes:
+    """Compress one block as a complete xz stream.
+
+    With skip_incompressible true an incompressible block is compressed with preset
+    0, xz has no stored format but lzma2 then writes the data as uncompressed chunks
+    at a small part of the cost.
+    """
+    if skip_incompressible and is_incompressible(block):
+        level = 0
+    return lzma.compress(block, format=lzma.FORMAT_XZ, preset=level)
+
+def parallel_xz_stage(chunks:Iterable[bytes], level:int = 6, threads:int = 2, block_size:int = BLOCK_SIZE, skip_incompressible:bool = False) -> Iterator[bytes]:
+    """Compress buffers into joined xz streams using several threads.
+
+    Every block is compressed as its own xz stream, lzma releases the GIL while
+    compressing so the blocks use one core each. Joined xz streams are read as one
+    file by xz and tar, the same way as xz -T works.
+    """
+    blocks = 0
+
+    with concurrent.futures.ThreadPoolExecutor(max_workers=threads) as executor:
+        pending = collections.deque()
+
+        for block in iter_blocks(chunks, block_size):
+            pending.append(executor.submit(xz_block, block, level, skip_incompressible))
+            blocks = blocks + 1
+
+            # Keep a bounded number of blocks in memory.
+            while len(pending) >= threads * 2:
+                yield pending.popleft().result()
+
+        while pending:
+            yield pending.popleft().result()
+
+    # An empty input still needs to be a valid xz file.
+    if blocks == 0:
+        yield lzma.compress(b"", format=lzma.FORMAT_XZ, preset=level)
+
+def compress_frame(block:bytes, codec:str, level:int, skip_incompressible:bool = False) -> bytes:
+    """Compress one frame so it can be decompressed without the other frames.
+
+    A gzip frame is a complete gzip member and an xz frame a complete xz stream, so
+    the joined frames are still read as one file by gzip, xz and tar.
+    """
+    if codec == "gzip":
+        if skip_incompressible and is_incompressible(block):
+            level = 0
+        compressor = zlib.compressobj(level, zlib.DEFLATED, 31)
+        return compressor.compress(block) + compressor.flush()
+
+    if codec == "xz":
+        return xz_block(block, level, skip_incompressible)
+
+    return block
+
+def decompress_frame(data:bytes, codec:str) -> bytes:
+    """Decompress one frame written by compress_frame()."""
+    if codec == "gzip":
+        return zlib.decompress(data, 31)
+
+    if codec == "xz":
+        return lzma.decompress(data, format=lzma.FORMAT_XZ)
+
+    return data
+
+def framed_compress_stage(chunks:Iterable[bytes], toml_config:dict, frames:list, frame_size:int = FRAME_SIZE) -> Iterator[bytes]:
+    """Compress buffers as independently decompressible frames of frame_size bytes.
+
+    The frames are compressed in a thread pool of COMPRESSION.THREADS threads. For
+    every frame [offset, size, compressed offset, compressed size] is appended to
+    frames, so a reader can seek to a frame and decompress only that frame. Only
+    the codecs in FRAME_CODECS can be framed.
+    """
+    settings = compression_settings(toml_config)
+    threads = settings["threads"]
+    offset = 0
+    compressed_offset = 0
+
+    with concurrent.futures.ThreadPoolExecutor(max_workers=threads) as executor:
+        pending = collections.deque()
+
+        for block in iter_blocks(chunks, frame_size):
+            pending.append((len(block), executor.submit(compress_frame, block, settings["codec"], settings["level"], settings["skip_incompressible"])))
+
+            # Keep a bounded number of frames in memory.
+            while len(pending) >= threads * 2 or (pending and pending[0][1].done()):
+                size, future = pending.popleft()
+                data = future.result()
+                frames.append([offset, size, compressed_offset, len(data)])
+                offset = offset + size
+                compressed_offset = compressed_offset + len(data)
+                yield data
+
+        while pending:
+            size, future = pending.popleft()
+            data = future.result()
+            frames.append([offset, size, compressed_offset, len(data)])
+            offset = offset + size
+            compressed_offset = compressed_offset + len(data)
+            yield data
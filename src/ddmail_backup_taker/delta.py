@@ -0,0 +1,419 @@
+import os
+import glob
+import json
+import mmap
+import struct
+import hashlib
+import logging
+from typing import Iterator, Optional, Union
+from ddmail_backup_taker.mariadb import dump_database
+from ddmail_backup_taker.repository import chunk_ends
+
+# Filename of the delta state in the snapshots folder.
+DELTA_STATE = "mariadb_delta.json"
+
+# Filename of the signature of the last full dump in the snapshots folder, the base of the next deltas.
+DELTA_SIGNATURE = "mariadb_delta_base.sig"
+
+# Extension of a dump stored as a delta against the base dump.
+DELTA_EXTENSION = ".delta"
+
+# First bytes of a delta file.
+DELTA_MAGIC = b"DDDELTA1"
+
+# First bytes of a signature file.
+SIGNATURE_MAGIC = b"DDSIG001"
+
+# Smallest and largest average chunk size of a signature, the size grows with the base so a signature has at most about 65536 chunks.
+MIN_AVG_CHUNK_SIZE = 1024
+MAX_AVG_CHUNK_SIZE = 65536
+
+# Largest literal written as one operation.
+LITERAL_SIZE = 1048576
+
+Buffer = Union[bytes, mmap.mmap]
+
+def map_file(f) -> Buffer:
+    """Map an open file read only, an empty file can not be mapped and is returned as empty bytes."""
+    if os.fstat(f.fileno()).st_size == 0:
+        return b""
+    return mmap.mmap(f.fileno(), 0, access=mmap.ACCESS_READ)
+
+def file_digest(path:str) -> str:
+    """Get the SHA-256 hex digest of a file."""
+    digest = hashlib.sha256()
+    with open(path, "rb") as f:
+        for chunk in iter(lambda: f.read(LITERAL_SIZE), b""):
+            digest.update(chunk)
+    return digest.hexdigest()
+
+def signature_chunk_sizes(base_size:int) -> tuple:
+    """Get the min, average and max chunk size of the signature of a base of base_size bytes."""
+    avg_size = MIN_AVG_CHUNK_SIZE
+    while avg_size < MAX_AVG_CHUNK_SIZE and avg_size * 65536 < base_size:
+        avg_size = avg_size * 2
+    return avg_size // 4, avg_size, avg_size * 4
+
+def iter_chunk_bounds(data:Buffer, min_size:int, avg_size:int, max_size:int) -> Iterator[tuple]:
+    """Split data into content-defined chunks, see chunk_ends(), and yield the start and end of every chunk."""
+    start = 0
+    for end in chunk_ends(data, min_size, avg_size, max_size, True):
+        yield start, end
+        start = end
+
+def write_signature(base_path:str, signature_path:str) -> str:
+    """Write the signature of the base dump base_path to signature_path and return the SHA-256 digest of the base.
+
+    The base is split into content-defined chunks and the signature holds the
+    length and SHA-256 digest of every chunk, so deltas can be encoded without
+    keeping a copy of the base. The signature is SIGNATURE_MAGIC, the SHA-256
+    digest of the base and the min, average and max chunk size as unsigned 32 bit
+    big endian integers, followed by the length and digest of every chunk.
+    """
+    digest = hashlib.sha256()
+    records = []
+
+    with open(base_path, "rb") as base_file:
+        base = map_file(base_file)
+        try:
+            sizes = signature_chunk_sizes(len(base))
+            for start, stop in iter_chunk_bounds(base, *sizes):
+                chunk = base[start:stop]
+                digest.update(chunk)
+                records.append(struct.pack(">I", stop - start) + hashlib.sha256(chunk).digest())
+        finally:
+            if isinstance(base, mmap.mmap):
+                base.close()
+
+    # Only the owner can read the signature, like the snapshots of the data backup.
+    fd = os.open(signature_path, os.O_WRONLY | os.O_CREAT | os.O_TRUNC, 0o600)
+    with os.fdopen(fd, "wb") as f:
+        f.write(SIGNATURE_MAGIC + digest.digest() + struct.pack(">III", *sizes))
+        f.write(b"".join(records))
+
+    return digest.hexdigest()
+
+def load_signature(signature_path:str) -> dict:
+    """Load a signature written by write_signature().
+
+    Returns:
+        dict: The base digest, the chunk sizes and the base offset of every chunk keyed by its digest:
+            {"base_digest": "<sha256>", "chunk_sizes": (min, avg, max), "offsets": {<digest>: <offset>}}
+
+    Raises:
+        ValueError: If the file is not a signature.
+    """
+    with open(signature_path, "rb") as f:
+        data = f.read()
+
+    header_size = len(SIGNATURE_MAGIC) + 32 + 12
+    if not data.startswith(SIGNATURE_MAGIC) or len(data) < header_size or (len(data) - header_size) % 36:
+        raise ValueError(signature_path + " is not a signature file")
+
+    offsets = {}
+    offset = 0
+    for length, chunk_digest in struct.iter_unpack(">I32s", data[header_size:]):
+        offsets.setdefault(chunk_digest, offset)
+        offset = offset + length
+
+    return {
+            "base_digest": data[len(SIGNATURE_MAGIC):len(SIGNATURE_MAGIC) + 32].hex(),
+            "chunk_sizes": struct.unpack(">III", data[len(SIGNATURE_MAGIC) + 32:header_size]),
+            "offsets": offsets,
+            }
+
+def iter_delta(signature:dict, data:Buffer) -> Iterator[bytes]:
+    """Encode data as a delta against the base dump of a signature.
+
+    Data is split into content-defined chunks the same way as the base, so a
+    change only moves the chunk boundaries next to it. Every chunk whose digest
+    is in the signature is written as a copy of the base, adjacent copies are
+    joined, and the other chunks are written as literals.
+
+    The delta is DELTA_MAGIC and the SHA-256 digest of the base, followed by
+    operations. A copy is b"C" with the base offset and length, a literal is b"L"
+    with the length and the bytes, both as unsigned 64 bit big endian integers.
+    The delta ends with b"E" and the SHA-256 digest of data.
+    """
+    yield DELTA_MAGIC + bytes.fromhex(signature["base_digest"])
+
+    offsets = signature["offsets"]
+    digest = hashlib.sha256()
+    literal_start = 0
+    copy_offset = 0
+    copy_length = 0
+
+    def literal(start, stop):
+        for chunk_start in range(start, stop, LITERAL_SIZE):
+            chunk = data[chunk_start:min(stop, chunk_start + LITERAL_SIZE)]
+            yield b"L" + struct.pack(">Q", len(chunk)) + chunk
+
+    for start, stop in iter_chunk_bounds(data, *signature["chunk_sizes"]):
+        chunk = data[start:stop]
+        digest.update(chunk)
+        base_offset = offsets.get(hashlib.sha256(chunk).digest())
+
+        if base_offset is None:
+            # Check if a copy ends before this literal.
+            if copy_length:
+                yield b"C" + struct.pack(">QQ", copy_offset, copy_length)
+                copy_length = 0
+
+            # Check if the literal is long enough to be written, so it is never held in memory.
+            if stop - literal_start >= LITERAL_SIZE:
+                yield from literal(literal_start, stop)
+                literal_start = stop
+            continue
+
+        yield from literal(literal_start, start)
+        literal_start = stop
+
+        # Join the copy with the previous one when the base chunks are adjacent.
+        if copy_length and copy_offset + copy_length == base_offset:
+            copy_length = copy_length + stop - start
+        else:
+            if copy_length:
+                yield b"C" + struct.pack(">QQ", copy_offset, copy_length)
+            copy_offset = base_offset
+            copy_length = stop - start
+
+    if copy_length:
+        yield b"C" + struct.pack(">QQ", copy_offset, copy_length)
+    yield from literal(literal_start, len(data))
+    yield b"E" + digest.digest()
+
+def encode_delta(signature_path:str, data_path:str, delta_path:str) -> int:
+    """Write the delta of the file data_path against the base of the signature signature_path to delta_path and return its size."""
+    signature = load_signature(signature_path)
+    with open(data_path, "rb") as data_file, open(delta_path, "wb") as delta_file:
+        data = map_file(data_file)
+        try:
+            for chunk in iter_delta(signature, data):
+                delta_file.write(chunk)
+        finally:
+            if isinstance(data, mmap.mmap):
+                data.close()
+        return delta_file.tell()
+
+def read_exactly(f, size:int) -> bytes:
+    """Read size bytes from a file.
+
+    Raises:
+        ValueError: If the file ends first.
+    """
+    data = f.read(size)
+    if len(data) != size:
+        raise ValueError("delta file is truncated")
+    return data
+
+def apply_delta(logger:logging.Logger, base_path:str, delta_path:str, dst_path:str) -> dict:
+    """Restore a dump from a delta and the base dump the delta was encoded against.
+
+    The base dump is the full_db_dump.sql of the backup listed as the base of the
+    delta backup in DELTA_STATE, the delta is the full_db_dump.sql.delta of the
+    delta backup. The SHA-256 digests of the base and the restored dump are
+    checked.
+
+    Args:
+        logger (logging.Logger): Logger object for recording operations.
+        base_path (str): Path of the base dump.
+        delta_path (str): Path of the delta.
+        dst_path (str): Path where the restored dump will be saved.
+
+    Returns:
+        dict: Result containing status information:
+            {"is_working": bool, "msg": str}
+
+    Error Responses:
+        {"is_working": False, "msg": "<path> is not a delta file"}: If the delta does not start with DELTA_MAGIC
+        {"is_working": False, "msg": "base dump does not match the delta"}: If the delta was encoded against another base
+        {"is_working": False, "msg": "delta file is truncated"}: If the delta ends before its end operation
+        {"is_working": False, "msg": "delta file has an unknown operation"}: If the delta is corrupt
+        {"is_working": False, "msg": "delta file copies past the end of the base"}: If a copy is outside the base
+        {"is_working": False, "msg": "restored dump does not match the delta"}: If the digest of the restored dump is wrong
+
+    Success Response:
+        {"is_working": True, "msg": "done"}
+    """
+    with open(delta_path, "rb") as delta_file:
+        # Check if the file is a delta.
+        if delta_file.read(len(DELTA_MAGIC)) != DELTA_MAGIC:
+            msg = delta_path + " is not a delta file"
+            logger.error(msg)
+            return {"is_working": False, "msg": msg}
+
+        # Check if the delta was encoded against this base.
+        if delta_file.read(32) != bytes.fromhex(file_digest(base_path)):
+            msg = "base dump does not match the delta"
+            logger.error(msg)
+            return {"is_working": False, "msg": msg}
+
+        digest = hashlib.sha256()
+        with open(base_path, "rb") as base_file, open(dst_path, "wb") as dst_file:
+            base = map_file(base_file)
+            try:
+                while True:
+                    operation = read_exactly(delta_file, 1)
+                    if operation == b"C":
+                        base_offset, length = struct.unpack(">QQ", read_exactly(delta_file, 16))
+
+                        # Check if the copy is inside the base.
+                        if base_offset + length > len(base):
+                            raise ValueError("delta file copies past the end of the base")
+
+                        chunks = (base[start:min(start + LITERAL_SIZE, base_offset + length)] for start in range(base_offset, base_offset + length, LITERAL_SIZE))
+                    elif operation == b"L":
+                        length, = struct.unpack(">Q", read_exactly(delta_file, 8))
+                        chunks = (read_exactly(delta_file, min(LITERAL_SIZE, length - done)) for done in range(0, length, LITERAL_SIZE))
+                    elif operation == b"E":
+                        expected_digest = read_exactly(delta_file, 32)
+                        break
+                    else:
+                        raise ValueError("delta file has an unknown operation")
+
+                    # Joined copies span most of the base, they are written LITERAL_SIZE bytes at a time.
+                    for chunk in chunks:
+                        digest.update(chunk)
+                        dst_file.write(chunk)
+            except ValueError as e:
+                msg = str(e)
+                logger.error(msg)
+                return {"is_working": False, "msg": msg}
+            finally:
+                if isinstance(base, mmap.mmap):
+                    base.close()
+
+    # Check if the restored dump is the dump the delta was encoded from.
+    if digest.digest() != expected_digest:
+        msg = "restored dump does not match the delta"
+        logger.error(msg)
+        return {"is_working": False, "msg": msg}
+
+    return {"is_working": True, "msg": "done"}
+
+def load_delta_state(state_file:str) -> Optional[dict]:
+    """Load the base dump and the deltas saved by the last successful run, None if there are none."""
+    if not os.path.isfile(state_file):
+        return None
+
+    with open(state_file, "r") as f:
+        return json.load(f)
+
+def delta_bases(state_file:str) -> dict[str, str]:
+    """Get the backup with the base dump of every delta backup, keyed by backup filename."""
+    state = load_delta_state(state_file)
+    if state is None:
+        return {}
+    return state["deltas"]
+
+def backup_exists(save_backups_to:str, backup_filename:str) -> bool:
+    """Check if a backup, or a volume or shard of it, is still in SAVE_BACKUPS_TO."""
+    stem, extension = backup_filename.split(".tar", 1)
+    return len(glob.glob(os.path.join(save_backups_to, glob.escape(stem)) + "*.tar" + glob.escape(extension) + "*")) > 0
+
+def backup_mariadb_delta(logger:logging.Logger, toml_config:dict, state_file:str, dst_folder:str) -> dict:
+    """Dump all databases and store the dump as a delta against the last full dump.
+
+    The dump is written by dump_database() and encoded as full_db_dump.sql.delta
+    against the signature DELTA_SIGNATURE of the last full dump in the folder of
+    the state file, see iter_delta(). No copy of the base is kept, the base is
+    the dump in the backup it was archived to. A full dump is kept instead when
+    there is no signature, when the backup with the base is no longer in
+    SAVE_BACKUPS_TO, when MARIADB.DELTA_FULL_EVERY runs have passed since the last
+    full dump or when the delta is not smaller than the dump. The returned
+    delta_run is saved with save_delta_state() after the archive has been written.
+
+    Args:
+        logger (logging.Logger): Logger object for recording operations.
+        toml_config (dict): Configuration dictionary with backup settings.
+        state_file (str): Delta state file saved by the last successful run.
+        dst_folder (str): Directory where the dump or delta will be saved.
+
+    Returns:
+        dict: Result containing status information, file path and the run to save:
+            {"is_working": bool, "msg": str, "db_dump_file": str, "delta_run": dict}
+
+    Error Responses:
+        {"is_working": False, "msg": "<error message>"}: If the databases can not be dumped
+
+    Success Response:
+        {"is_working": True, "msg": "done", "db_dump_file": "<path>", "delta_run": {"full": bool, "db_dump_file": "<path>", "digest": "<sha256>"}}
+    """
+    result_dump = dump_database(logger, toml_config, None, dst_folder)
+    if not result_dump["is_working"]:
+        return result_dump
+
+    db_dump_file = result_dump["db_dump_file"]
+    digest = file_digest(db_dump_file)
+    state = load_delta_state(state_file)
+    signature_file = os.path.join(os.path.dirname(state_file), DELTA_SIGNATURE)
+    full_every = toml_config["MARIADB"].get("DELTA_FULL_EVERY", 7)
+
+    # Check if this run has to keep a full dump.
+    if state is None or "base_backup_filename" not in state or not os.path.isfile(signature_file):
+        logger.info("no base dump signature, keeping a full dump")
+    elif not backup_exists(toml_config["SAVE_BACKUPS_TO"], state["base_backup_filename"]):
+        logger.info("backup " + state["base_backup_filename"] + " with the base dump is gone, keeping a full dump")
+    elif state["runs_since_full"] + 1 >= full_every:
+        logger.info("last " + str(full_every) + " runs since the full dump, keeping a full dump")
+    else:
+        delta_file = db_dump_file + DELTA_EXTENSION
+        try:
+            delta_size = encode_delta(signature_file, db_dump_file, delta_file)
+        except ValueError as e:
+            logger.info(str(e) + ", keeping a full dump")
+            delta_size = None
+
+        # Check if the delta saves space.
+        if delta_size is not None and delta_size < os.path.getsize(db_dump_file):
+            logger.info("stored dump of " + str(os.path.getsize(db_dump_file)) + " bytes as a delta of " + str(delta_size) + " bytes")
+            return {"is_working": True, "msg": "done", "db_dump_file": delta_file, "delta_run": {"full": False, "db_dump_file": db_dump_file, "digest": digest}}
+
+        if delta_size is not None:
+            logger.info("delta is not smaller than the dump, keeping a full dump")
+        if os.path.exists(delta_file):
+            os.remove(delta_file)
+
+    return {"is_working": True, "msg": "done", "db_dump_file": db_dump_file, "delta_run": {"full": True, "db_dump_file": db_dump_file, "digest": digest}}
+
+def save_delta_state(logger:logging.Logger, toml_config:dict, state_file:str, delta_run:dict, backup_filename:str) -> None:
+    """Save the signature of the base dump and the deltas after a successful run.
+
+    A full run writes the signature of its dump to DELTA_SIGNATURE as the base of
+    the next deltas, a delta run counts towards MARIADB.DELTA_FULL_EVERY. Every
+    delta backup that is still in SAVE_BACKUPS_TO is listed with the backup that
+    holds its base, so clear_backups() keeps that backup.
+    """
+    snapshot_folder = os.path.dirname(state_file)
+    os.makedirs(snapshot_folder, exist_ok=True)
+    state = load_delta_state(state_file) or {"deltas": {}}
+
+    deltas = {
+            delta: base for delta, base in state["deltas"].items()
+            if backup_exists(toml_config["SAVE_BACKUPS_TO"], delta)
+            }
+
+    if delta_run["full"]:
+        signature_file = os.path.join(snapshot_folder, DELTA_SIGNATURE)
+
+        # Write to a temporary file first so a crash never leaves a broken signature.
+        write_signature(delta_run["db_dump_file"], signature_file + ".tmp")
+        os.replace(signature_file + ".tmp", signature_file)
+
+        state = {
+                "base_backup_filename": backup_filename,
+                "base_digest": delta_run["digest"],
+                "runs_since_full": 0,
+                }
+    else:
+        deltas[backup_filename] = state["base_backup_filename"]
+        state["runs_since_full"] = state["runs_since_full"] + 1
+
+    state["deltas"] = deltas
+
+    # Write state to a temporary file first so a crash never leaves a broken state.
+    with open(state_file + ".tmp", "w") as f:
+        json.dump(state, f)
+    os.replace(state_file + ".tmp", state_file)
+
+    logger.debug("saved delta state, " + str(state["runs_since_full"]) + " runs since the full dump in " + state["base_backup_filename"])
@@ -0,0 +1,451 @@
+import os
+import json
+import struct
+import hashlib
+import logging
+import subprocess
+import collections
+import concurrent.futures
+from typing import BinaryIO, Iterable, Iterator
+import gnupg
+from ddmail_backup_taker.compression import iter_blocks
+from ddmail_backup_taker.stages import BUF_SIZE, SNAPSHOT_FOLDER, process_stage
+
+# Encryption engines, gpg encrypts the whole stream with the gpg binary, chunked
+# encrypts chunks with a session key in a thread pool and only wraps the key with gpg.
+ENCRYPTION_ENGINES = ["gpg", "chunked"]
+
+# Extension added to the backup file by every encryption engine.
+ENCRYPTION_EXTENSIONS = {"gpg": ".gpg", "chunked": ".ddenc"}
+
+# First bytes of a stream encrypted by the chunked engine.
+CHUNKED_MAGIC = b"DDENC001"
+
+# 4mb, default size of the plaintext of an encrypted chunk.
+CHUNK_SIZE = 4194304
+
+# Size of the AES-256-GCM session key, nonce and tag.
+KEY_SIZE = 32
+NONCE_SIZE = 12
+TAG_SIZE = 16
+
+# File in the snapshots folder remembering which public keys were found in the keyring.
+GPG_KEY_CACHE = "gpg_keys.json"
+
+# Files of the gpg home folder holding the public keyring, gpg 2.1+ and older.
+KEYRING_FILES = ["pubring.kbx", "pubring.gpg"]
+
+# Public keys found in the keyring by this process, {fingerprint: {"gpg_bin": str, "keyring": list}}.
+key_cache = {}
+
+def encryption_settings(toml_config:dict) -> dict:
+    """Get the encryption settings from the GPG_ENCRYPTION section with defaults filled in.
+
+    Args:
+        toml_config (dict): Configuration dictionary with backup settings.
+
+    Returns:
+        dict: {"engine": str, "threads": int, "chunk_size": int}
+    """
+    section = toml_config["GPG_ENCRYPTION"]
+    return {
+            "engine": section.get("ENGINE", "gpg"),
+            "threads": section.get("THREADS", os.cpu_count() or 1),
+            "chunk_size": section.get("CHUNK_SIZE", CHUNK_SIZE),
+            }
+
+def encryption_extension(toml_config:dict) -> str:
+    """Get the extension added to an encrypted backup file, .gpg or .ddenc."""
+    return ENCRYPTION_EXTENSIONS[encryption_settings(toml_config)["engine"]]
+
+def is_encrypted_file(path:str) -> bool:
+    """Check if a backup file is encrypted by one of the engines, by its extension."""
+    return path.endswith(tuple(ENCRYPTION_EXTENSIONS.values()))
+
+def gpg_encrypt_cmd(toml_config:dict) -> list[str]:
+    """Build the gpg command encrypting stdin to stdout for the configured public key.
+
+    Args:
+        toml_config (dict): Configuration dictionary with backup settings.
+
+    Returns:
+        list[str]: The gpg command line.
+    """
+    return [
+            toml_config["GPG_ENCRYPTION"]["GPG_BIN"],
+            "-e",
+            "-r",
+            toml_config["GPG_ENCRYPTION"]["PUBKEY_FINGERPRINT"],
+            "--trust-model",
+            "always",
+            "--batch",
+            "-o",
+            "-"
+            ]
+
+def gpg_decrypt_cmd(toml_config:dict) -> list[str]:
+    """Build the gpg command decrypting stdin to stdout."""
+    return [toml_config["GPG_ENCRYPTION"]["GPG_BIN"], "--batch", "-d", "-o", "-"]
+
+def keyring_signature() -> list:
+    """Get [name, mtime in ns, size] of every keyring file in the gpg home folder, GNUPGHOME or ~/.gnupg."""
+    home = os.environ.get("GNUPGHOME") or os.path.expanduser("~/.gnupg")
+    signature = []
+    for name in KEYRING_FILES:
+        try:
+            st = os.stat(os.path.join(home, name))
+        except OSError:
+            continue
+        signature.append([name, st.st_mtime_ns, st.st_size])
+    return signature
+
+def load_key_cache(cache_file:str) -> dict:
+    """Load the public keys found by earlier runs, empty when the cache is missing or broken."""
+    try:
+        with open(cache_file, "r") as f:
+            return json.load(f)["keys"]
+    except (OSError, ValueError, KeyError, TypeError):
+        return {}
+
+def save_key_cache(cache_file:str, keys:dict) -> None:
+    """Save the public keys found, a cache that can not be written is skipped."""
+    try:
+        os.makedirs(os.path.dirname(cache_file), exist_ok=True)
+        with open(cache_file + ".tmp", "w") as f:
+            json.dump({"keys": keys}, f, indent=4)
+        os.replace(cache_file + ".tmp", cache_file)
+    except OSError:
+        pass
+
+def gpg_key_in_keystore(toml_config:dict) -> bool:
+    """Check if the key of GPG_ENCRYPTION.PUBKEY_FINGERPRINT is in the gpg keystore.
+
+    Listing the keys spawns gpg and scans the whole keyring, so a key that was
+    found is remembered together with GPG_BIN and the mtime and size of the
+    keyring files, in key_cache for this process and in GPG_KEY_CACHE in the
+    snapshots folder for later runs. gpg is only asked again when the keyring
+    has changed. A key that was not found is never remembered.
+
+    Args:
+        toml_config (dict): Configuration dictionary with backup settings.
+
+    Returns:
+        bool: True if the key is in the keystore else False.
+    """
+    fingerprint = toml_config["GPG_ENCRYPTION"]["PUBKEY_FINGERPRINT"]
+    gpg_bin = toml_config["GPG_ENCRYPTION"]["GPG_BIN"]
+    entry = {"gpg_bin": gpg_bin, "keyring": keyring_signature()}
+
+    cache_file = None
+    if toml_config.get("SAVE_BACKUPS_TO") and os.path.isdir(toml_config["SAVE_BACKUPS_TO"]):
+        cache_file = os.path.join(toml_config["SAVE_BACKUPS_TO"], SNAPSHOT_FOLDER, GPG_KEY_CACHE)
+
+    # Check if the key was found in the same keyring before, without keyring files there is nothing to compare.
+    if entry["keyring"]:
+        if key_cache.get(fingerprint) == entry:
+            return True
+        if cache_file and load_key_cache(cache_file).get(fingerprint) == entry:
+            key_cache[fingerprint] = entry
+            return True
+
+    gpg = gnupg.GPG(gpgbinary=gpg_bin)
+    gpg.encoding = 'utf-8'
+    if not gpg.list_keys(secret=False, keys=fingerprint):
+        return False
+
+    if entry["keyring"]:
+        key_cache[fingerprint] = entry
+        if cache_file:
+            keys = load_key_cache(cache_file)
+            keys[fingerprint] = entry
+            save_key_cache(cache_file, keys)
+
+    return True
+
+def chunk_nonce(number:int, last:bool) -> bytes:
+    """Get the nonce of a chunk, the chunk number and a flag set only for the last chunk.
+
+    The flag makes a stream cut after any chunk fail authentication.
+    """
+    return number.to_bytes(NONCE_SIZE - 1, "big") + (b"\x01" if last else b"\x00")
+
+def iter_last(blocks:Iterable[bytes]) -> Iterator[tuple[bytes, bool]]:
+    """Yield (block, is last block), an empty stream is one empty last block."""
+    previous = None
+    for block in blocks:
+        if previous is not None:
+            yield previous, False
+        previous = block
+    yield (previous if previous is not None else b""), True
+
+def chunked_encrypt_stage(chunks:Iterable[bytes], toml_config:dict) -> Iterator[bytes]:
+    """Encrypt buffers as independent authenticated chunks with a random session key.
+
+    A random AES-256-GCM session key is encrypted once with gpg for
+    GPG_ENCRYPTION.PUBKEY_FINGERPRINT. The stream is split into chunks of
+    GPG_ENCRYPTION.CHUNK_SIZE bytes that are encrypted by GPG_ENCRYPTION.THREADS
+    threads and written in order.
+
+    The stream is CHUNKED_MAGIC, the chunk size and the length of the wrapped key
+    as unsigned 32 bit big endian integers and the wrapped key. Every chunk
+    follows as the length of its ciphertext and the ciphertext with the tag, the
+    nonce is chunk_nonce() and the SHA-256 digest of the header is the associated
+    data of every chunk.
+
+    Raises:
+        subprocess.CalledProcessError: If gpg can not encrypt the session key.
+    """
+    # The cryptography package is only needed by the chunked engine.
+    from cryptography.hazmat.primitives.ciphers.aead import AESGCM
+
+    settings = encryption_settings(toml_config)
+    key = AESGCM.generate_key(bit_length=KEY_SIZE * 8)
+    wrapped_key = subprocess.run(gpg_encrypt_cmd(toml_config), input=key, check=True, stdout=subprocess.PIPE, stderr=subprocess.PIPE).stdout
+
+    header = CHUNKED_MAGIC + struct.pack(">II", settings["chunk_size"], len(wrapped_key)) + wrapped_key
+    yield header
+
+    aesgcm = AESGCM(key)
+    associated_data = hashlib.sha256(header).digest()
+
+    def encrypt(number, block, last):
+        ciphertext = aesgcm.encrypt(chunk_nonce(number, last), block, associated_data)
+        return struct.pack(">I", len(ciphertext)) + ciphertext
+
+    # At most two chunks per thread are held in memory.
+    with concurrent.futures.ThreadPoolExecutor(max_workers=settings["threads"]) as executor:
+        pending = collections.deque()
+        for number, (block, last) in enumerate(iter_last(iter_blocks(chunks, settings["chunk_size"]))):
+            pending.append(executor.submit(encrypt, number, block, last))
+            if len(pending) >= 2 * settings["threads"]:
+                yield pending.popleft().result()
+
+        while pending:
+            yield pending.popleft().result()
+
+class StreamReader:
+    """Read exact numbers of bytes from a stream of buffers."""
+
+    def __init__(self, chunks:Iterable[bytes]):
+        self.chunks = iter(chunks)
+        self.buf = bytearray()
+
+    def fill(self, size:int) -> None:
+        """Read buffers until size bytes are buffered or the stream ends."""
+        while len(self.buf) < size:
+            chunk = next(self.chunks, None)
+            if chunk is None:
+                return
+            self.buf += chunk
+
+    def read(self, size:int) -> bytes:
+        """Read size bytes.
+
+        Raises:
+            ValueError: If the stream ends first.
+        """
+        self.fill(size)
+        if len(self.buf) < size:
+            raise ValueError("encrypted stream is truncated")
+        data = bytes(self.buf[:size])
+        del self.buf[:size]
+        return data
+
+    def at_end(self) -> bool:
+        """Check if the stream has no more bytes."""
+        self.fill(1)
+        return not self.buf
+
+def chunked_decrypt_stage(chunks:Iterable[bytes], toml_config:dict) -> Iterator[bytes]:
+    """Decrypt a stream written by chunked_encrypt_stage().
+
+    The session key is decrypted with gpg and the chunks are decrypted and
+    authenticated by GPG_ENCRYPTION.THREADS threads.
+
+    Raises:
+        ValueError: If the stream is not encrypted by the chunked engine, is truncated or a chunk fails authentication.
+        subprocess.CalledProcessError: If gpg can not decrypt the session key.
+    """
+    # The cryptography package is only needed by the chunked engine.
+    from cryptography.exceptions import InvalidTag
+    from cryptography.hazmat.primitives.ciphers.aead import AESGCM
+
+    settings = encryption_settings(toml_config)
+    reader = StreamReader(chunks)
+
+    # Check if the stream is encrypted by the chunked engine.
+    if reader.read(len(CHUNKED_MAGIC)) != CHUNKED_MAGIC:
+        raise ValueError("stream is not encrypted by the chunked engine")
+
+    sizes = reader.read(8)
+    chunk_size, wrapped_key_size = struct.unpack(">II", sizes)
+    wrapped_key = reader.read(wrapped_key_size)
+    key = subprocess.run(gpg_decrypt_cmd(toml_config), input=wrapped_key, check=True, stdout=subprocess.PIPE, stderr=subprocess.PIPE).stdout
+
+    aesgcm = AESGCM(key)
+    associated_data = hashlib.sha256(CHUNKED_MAGIC + sizes + wrapped_key).digest()
+
+    def decrypt(number, ciphertext, last):
+        try:
+            return aesgcm.decrypt(chunk_nonce(number, last), ciphertext, associated_data)
+        except InvalidTag:
+            raise ValueError("encrypted chunk " + str(number) + " failed authentication")
+
+    with concurrent.futures.ThreadPoolExecutor(max_workers=settings["threads"]) as executor:
+        pending = collections.deque()
+        number = 0
+        last = False
+        while not last:
+            size, = struct.unpack(">I", reader.read(4))
+
+            # Check if the chunk is larger than a chunk can be.
+            if size > chunk_size + TAG_SIZE:
+                raise ValueError("encrypted chunk " + str(number) + " is too large")
+
+            ciphertext = reader.read(size)
+            last = reader.at_end()
+            pending.append(executor.submit(decrypt, number, ciphertext, last))
+            number = number + 1
+
+            if len(pending) >= 2 * settings["threads"]:
+                yield pending.popleft().result()
+
+        while pending:
+            yield pending.popleft().result()
+
+def chunked_decrypt_ranges(f:BinaryIO, ranges:Iterable[tuple[int, int]], toml_config:dict) -> Iterator[bytes]:
+    """Read ascending [offset, size] ranges of the plaintext from a seekable file written by chunked_encrypt_stage().
+
+    Every chunk but the last holds exactly the chunk size of plaintext, so the
+    record of a plaintext offset is found from the header without reading the
+    records before it. Only the chunks holding the ranges are read, decrypted and
+    authenticated.
+
+    Raises:
+        ValueError: If the file is not encrypted by the chunked engine, is truncated or a chunk fails authentication.
+        subprocess.CalledProcessError: If gpg can not decrypt the session key.
+    """
+    # The cryptography package is only needed by the chunked engine.
+    from cryptography.exceptions import InvalidTag
+    from cryptography.hazmat.primitives.ciphers.aead import AESGCM
+
+    f.seek(0)
+
+    # Check if the file is encrypted by the chunked engine.
+    if f.read(len(CHUNKED_MAGIC)) != CHUNKED_MAGIC:
+        raise ValueError("stream is not encrypted by the chunked engine")
+
+    sizes = f.read(8)
+    chunk_size, wrapped_key_size = struct.unpack(">II", sizes)
+    wrapped_key = f.read(wrapped_key_size)
+    key = subprocess.run(gpg_decrypt_cmd(toml_config), input=wrapped_key, check=True, stdout=subprocess.PIPE, stderr=subprocess.PIPE).stdout
+
+    aesgcm = AESGCM(key)
+    associated_data = hashlib.sha256(CHUNKED_MAGIC + sizes + wrapped_key).digest()
+
+    header_size = len(CHUNKED_MAGIC) + 8 + wrapped_key_size
+    record_size = 4 + chunk_size + TAG_SIZE
+    last_number = max(0, (f.seek(0, os.SEEK_END) - header_size + record_size - 1) // record_size - 1)
+
+    def decrypt(number):
+        f.seek(header_size + number * record_size)
+        record = f.read(4)
+        if len(record) < 4:
+            raise ValueError("encrypted stream is truncated")
+        size, = struct.unpack(">I", record)
+
+        # Check if the chunk is larger than a chunk can be.
+        if size > chunk_size + TAG_SIZE:
+            raise ValueError("encrypted chunk " + str(number) + " is too large")
+
+        ciphertext = f.read(size)
+        if len(ciphertext) < size:
+            raise ValueError("encrypted stream is truncated")
+
+        try:
+            return aesgcm.decrypt(chunk_nonce(number, number == last_number), ciphertext, associated_data)
+        except InvalidTag:
+            raise ValueError("encrypted chunk " + str(number) + " failed authentication")
+
+    # The last chunk decrypted is kept, frames next to each other often share a chunk.
+    current = (None, b"")
+    for offset, size in ranges:
+        parts = []
+        for number in range(offset // chunk_size, (offset + size - 1) // chunk_size + 1):
+            if number > last_number:
+                raise ValueError("backup ended before offset " + str(offset + size))
+            if current[0] != number:
+                current = (number, decrypt(number))
+            parts.append(current[1])
+
+        data = b"".join(parts)
+        start = offset - (offset // chunk_size) * chunk_size
+        if len(data) < start + size:
+            raise ValueError("backup ended before offset " + str(offset + size))
+        yield data[start:start + size]
+
+def encrypt_stage(chunks:Iterable[bytes], toml_config:dict) -> Iterator[bytes]:
+    """Encrypt buffers with the engine in GPG_ENCRYPTION.ENGINE, the gpg binary or chunked_encrypt_stage()."""
+    if encryption_settings(toml_config)["engine"] == "chunked":
+        return chunked_encrypt_stage(chunks, toml_config)
+    return process_stage(chunks, gpg_encrypt_cmd(toml_config))
+
+def decrypt_stage(chunks:Iterable[bytes], toml_config:dict) -> Iterator[bytes]:
+    """Decrypt buffers encrypted by any engine, the engine is told by the first bytes of the stream."""
+    chunks = iter(chunks)
+    first = next(chunks, b"")
+
+    def rejoined():
+        yield first
+        yield from chunks
+
+    if first.startswith(CHUNKED_MAGIC):
+        return chunked_decrypt_stage(rejoined(), toml_config)
+    return process_stage(rejoined(), gpg_decrypt_cmd(toml_config))
+
+def decrypt_file(logger:logging.Logger, toml_config:dict, src:str, dst:str) -> dict:
+    """Decrypt a backup file encrypted by any engine.
+
+    Args:
+        logger (logging.Logger): Logger object for recording operations.
+        toml_config (dict): Configuration dictionary with backup settings.
+        src (str): Path of the encrypted backup file.
+        dst (str): Path where the decrypted backup file will be saved.
+
+    Returns:
+        dict: Result containing status information and size:
+            {"is_working": bool, "msg": str, "size": int}
+
+    Error Responses:
+        {"is_working": False, "msg": "<binary> command failed with return code <code>"}: If gpg can not decrypt the backup or session key
+        {"is_working": False, "msg": "<error message>"}: If the stream is truncated or a chunk fails authentication
+
+    Success Response:
+        {"is_working": True, "msg": "done", "size": <bytes>}
+    """
+    def iter_src():
+        with open(src, "rb") as f:
+            while True:
+                data = f.read(BUF_SIZE)
+                if not data:
+                    break
+                yield data
+
+    try:
+        size = 0
+        with open(dst, "wb") as f:
+            for chunk in decrypt_stage(iter_src(), toml_config):
+                f.write(chunk)
+                size = size + len(chunk)
+    except subprocess.CalledProcessError as e:
+        os.remove(dst)
+        msg = f"{os.path.basename(e.cmd[0])} command failed with return code {e.returncode}"
+        logger.error(msg)
+        return {"is_working": False, "msg": msg}
+    except ValueError as e:
+        os.remove(dst)
+        msg = str(e)
+        logger.error(msg)
+        return {"is_working": False, "msg": msg}
+
+    return {"is_working": True, "msg": "done", "size": size}
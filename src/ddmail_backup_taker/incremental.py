@@ -0,0 +1,200 @@
+import os
+import stat
+import json
+import logging
+import shutil
+import itertools
+from typing import Iterable, Optional
+from ddmail_backup_taker.archive import iter_tar, write_pipeline, arcname_of
+
+# Name of the archive member with the renamed and deleted paths of an incremental backup.
+CHANGES_MEMBER = ".ddmail_backup_taker/changes.json"
+
+# Maildir sub folders holding messages.
+MAILDIR_MESSAGE_FOLDERS = ["cur", "new"]
+
+def message_key(arcname:str) -> Optional[str]:
+    """Get the key of a Maildir message that does not change when the message flags change.
+
+    Maildir message files are never changed, only renamed from new/ to cur/ and
+    when the flags after ":2," change. The key is the maildir folder and the unique
+    base name of the message.
+
+    Args:
+        arcname (str): Member name of the file in the archive.
+
+    Returns:
+        str: The message key, or None if the file is not a Maildir message.
+    """
+    folder, name = os.path.split(arcname)
+    maildir, message_folder = os.path.split(folder)
+
+    if message_folder not in MAILDIR_MESSAGE_FOLDERS or name.startswith("."):
+        return None
+
+    return maildir + "/" + name.split(":", 1)[0]
+
+def load_state(snapshot_file:Optional[str]) -> dict:
+    """Load the state of the previous run from the snapshot file, an empty state if there is none."""
+    if not snapshot_file or not os.path.isfile(snapshot_file):
+        return {"files": {}, "messages": {}}
+
+    with open(snapshot_file, "r") as f:
+        state = json.load(f)
+
+    return {"files": state["files"], "messages": state["messages"]}
+
+def track_path(previous:dict, current:dict, changes:dict, path:str, st:os.stat_result, maildir:bool) -> bool:
+    """Record a path in the current state and check if its content must be archived.
+
+    Regular files are archived when their size, mtime or inode changed since the
+    previous run. With maildir true, Maildir messages are tracked by message key so
+    a message that only got new flags is recorded as a rename instead.
+
+    Args:
+        previous (dict): State of the previous run.
+        current (dict): State of this run, updated in place.
+        changes (dict): Renames of this run, updated in place.
+        path (str): Path of the file.
+        st (os.stat_result): Stat result of the file.
+        maildir (bool): True if Maildir messages should be tracked by message key.
+
+    Returns:
+        bool: True if the path must be archived else False.
+    """
+    # Folders and symlinks are always archived, they are only a header.
+    if not stat.S_ISREG(st.st_mode):
+        return True
+
+    arcname = arcname_of(path)
+    key = message_key(arcname) if maildir else None
+
+    if key is not None:
+        current["messages"][key] = arcname
+        old_arcname = previous["messages"].get(key)
+        if old_arcname is None:
+            return True
+        if old_arcname != arcname:
+            changes["renames"].append([old_arcname, arcname])
+        return False
+
+    signature = [st.st_size, st.st_mtime_ns, st.st_ino]
+    current["files"][arcname] = signature
+    return previous["files"].get(arcname) != signature
+
+def deleted_paths(previous:dict, current:dict) -> list[str]:
+    """Get the paths of the previous run that no longer exist."""
+    deleted = [arcname for arcname in previous["files"] if arcname not in current["files"]]
+    deleted.extend(arcname for key, arcname in previous["messages"].items() if key not in current["messages"])
+    return sorted(deleted)
+
+def stream_incremental_archive(logger:logging.Logger, toml_config:dict, data_to_backup:list[str], backup_file:str, snapshot_file:str, backup_level:int, members:Optional[Iterable[tuple[str, bytes]]] = None) -> dict:
+    """Create an incremental backup archive in-process.
+
+    Only files changed since the previous run in snapshot_file are archived. A
+    level 0 backup archives everything and starts a new state. With DATA.MAILDIR
+    true, Maildir messages are tracked by their unique base name so flag changes
+    and moves from new/ to cur/ are recorded as renames without reading the message.
+    Renamed and deleted paths are stored in the CHANGES_MEMBER json member, last in
+    the archive. On success the new state is written to snapshot_file. The (name,
+    data) members are always archived, before the CHANGES_MEMBER.
+
+    Args:
+        logger (logging.Logger): Logger object for recording operations.
+        toml_config (dict): Configuration dictionary with backup settings.
+        data_to_backup (list[str]): List of files and folders to include in the backup.
+        backup_file (str): Full path of the backup file to create.
+        snapshot_file (str): Working state file from prepare_snapshot().
+        backup_level (int): Level of the backup, 0 is a full backup.
+        members (Iterable[tuple[str, bytes]]): Extra members without a file on disk, or None.
+
+    Returns:
+        dict: Result containing status information, checksum and sizes:
+            {"is_working": bool, "msg": str, "sha256": str, "archive_size": int, "backup_size": int}
+
+    Error Responses:
+        {"is_working": False, "msg": "<binary> command failed with return code <code>"}: If a stage subprocess fails
+        {"is_working": False, "msg": "Error during backup process: <error>"}: For other errors
+
+    Success Response:
+        {"is_working": True, "msg": "finished successfully", "sha256": "<checksum>", "archive_size": <bytes>, "backup_size": <bytes>}
+    """
+    maildir = toml_config["DATA"].get("MAILDIR", False)
+
+    # A full backup starts a new state.
+    if backup_level == 0:
+        previous = load_state(None)
+    else:
+        previous = load_state(snapshot_file)
+
+    current = {"files": {}, "messages": {}}
+    changes = {"level": backup_level, "renames": [], "deletes": []}
+
+    def select(path, st):
+        return track_path(previous, current, changes, path, st, maildir)
+
+    def trailer():
+        changes["deletes"] = deleted_paths(previous, current)
+        changes_members = [(CHANGES_MEMBER, json.dumps(changes).encode("utf-8"))]
+        if members is not None:
+            return itertools.chain(members, changes_members)
+        return changes_members
+
+    index = [] if toml_config.get("ARCHIVE", {}).get("INDEX", False) else None
+    result = write_pipeline(logger, toml_config, iter_tar(logger, data_to_backup, select, trailer, index=index), backup_file, index)
+    if not result["is_working"]:
+        return result
+
+    # Write state to a temporary file first so a crash never leaves a broken state.
+    with open(snapshot_file + ".new", "w") as f:
+        json.dump(current, f)
+    os.replace(snapshot_file + ".new", snapshot_file)
+
+    logger.info("recorded " + str(len(changes["renames"])) + " renamed and " + str(len(changes["deletes"])) + " deleted paths")
+    return result
+
+def apply_changes(logger:logging.Logger, changes_file:str, dst_folder:str) -> dict:
+    """Apply the renames and deletes of an incremental backup to a restored tree.
+
+    Used when restoring, after the full backup and every incremental backup up to
+    this one have been extracted to dst_folder in order.
+
+    Args:
+        logger (logging.Logger): Logger object for recording operations.
+        changes_file (str): The extracted CHANGES_MEMBER file of the incremental backup.
+        dst_folder (str): Folder the backups are extracted to.
+
+    Returns:
+        dict: Result containing status information:
+            {"is_working": bool, "msg": str}
+
+    Error Responses:
+        {"is_working": False, "msg": "changes file <path> does not exist"}: If the changes file does not exist
+
+    Success Response:
+        {"is_working": True, "msg": "done"}
+    """
+    # Check if changes file exist.
+    if not os.path.isfile(changes_file):
+        msg = "changes file " + changes_file + " does not exist"
+        logger.error(msg)
+        return {"is_working": False, "msg": msg}
+
+    with open(changes_file, "r") as f:
+        changes = json.load(f)
+
+    for old_arcname, new_arcname in changes["renames"]:
+        old_path = os.path.join(dst_folder, old_arcname)
+        new_path = os.path.join(dst_folder, new_arcname)
+        if not os.path.lexists(old_path):
+            logger.warning("renamed file " + old_path + " does not exist")
+            continue
+        os.makedirs(os.path.dirname(new_path), exist_ok=True)
+        shutil.move(old_path, new_path)
+
+    for arcname in changes["deletes"]:
+        path = os.path.join(dst_folder, arcname)
+        if os.path.lexists(path):
+            os.remove(path)
+
+    return {"is_working": True, "msg": "done"}
@@ -0,0 +1,179 @@
+import os
+import json
+import shutil
+import hashlib
+import threading
+import time
+import email.parser
+import http.server
+import urllib.parse
+from typing import Iterable
+
+class LocalReceiver:
+    """Stand-in for ddmail_backup_receiver on localhost, for tests and benchmarks.
+
+    Receives a backup in one multipart POST to /receive_backup like the receiver
+    does and implements the chunked upload protocol of upload.send_chunked() below
+    it. Received files are saved in folder. Every request is recorded in requests
+    as (endpoint, chunk number or None), the client ports in client_ports and the
+    most requests handled at the same time in max_active.
+
+    Args:
+        folder (str): Folder the received files are saved in.
+        password (str): Password every request must have.
+        drop_chunks (Iterable[int]): Chunk numbers whose first upload is cut off without a reply, to simulate an interrupted connection.
+        latency (float): Seconds every request waits before it is answered, to simulate a slow link.
+    """
+
+    def __init__(self, folder:str, password:str, drop_chunks:Iterable[int] = (), latency:float = 0.0):
+        self.folder = folder
+        self.password = password
+        self.drop_chunks = set(drop_chunks)
+        self.latency = latency
+        self.requests = []
+        self.client_ports = set()
+        self.active = 0
+        self.max_active = 0
+        self.lock = threading.Lock()
+        self.server = http.server.ThreadingHTTPServer(("127.0.0.1", 0), ReceiverHandler)
+        self.server.receiver = self
+        self.thread = None
+
+    @property
+    def url(self) -> str:
+        """URL to set as BACKUP_RECEIVER.URL."""
+        return "http://127.0.0.1:" + str(self.server.server_port) + "/receive_backup"
+
+    def start(self) -> None:
+        """Serve requests in a thread."""
+        self.thread = threading.Thread(target=self.server.serve_forever, daemon=True)
+        self.thread.start()
+
+    def stop(self) -> None:
+        """Stop serving and close the socket."""
+        self.server.shutdown()
+        self.server.server_close()
+        self.thread.join()
+
+    def __enter__(self):
+        self.start()
+        return self
+
+    def __exit__(self, *exc_info):
+        self.stop()
+
+    def parts_folder(self, sha256:str) -> str:
+        """Folder holding the received chunks of an upload."""
+        return os.path.join(self.folder, ".parts", sha256)
+
+    def received_chunks(self, sha256:str) -> list[int]:
+        """Numbers of the chunks received of an upload."""
+        folder = self.parts_folder(sha256)
+        if not os.path.isdir(folder):
+            return []
+        return sorted(int(name) for name in os.listdir(folder) if name.isdigit())
+
+class ReceiverHandler(http.server.BaseHTTPRequestHandler):
+    """Request handler of LocalReceiver."""
+
+    protocol_version = "HTTP/1.1"
+
+    def reply(self, status:int, text:str) -> None:
+        data = text.encode("utf-8")
+        self.send_response(status)
+        self.send_header("Content-Length", str(len(data)))
+        self.end_headers()
+        self.wfile.write(data)
+
+    def read_form(self) -> dict:
+        """Read a multipart or urlencoded form as {name: bytes}."""
+        body = self.rfile.read(int(self.headers.get("Content-Length", 0)))
+        content_type = self.headers.get("Content-Type", "")
+
+        if content_type.startswith("multipart/form-data"):
+            message = email.parser.BytesParser().parsebytes(b"Content-Type: " + content_type.encode("ascii") + b"\r\n\r\n" + body)
+            return {part.get_param("name", header="content-disposition"): part.get_payload(decode=True) for part in message.get_payload()}
+
+        return {name: values[0].encode("utf-8") for name, values in urllib.parse.parse_qs(body.decode("ascii")).items()}
+
+    def do_POST(self):
+        receiver = self.server.receiver
+        endpoint = self.path.rsplit("/", 1)[-1]
+        form = self.read_form()
+        number = int(form["number"]) if "number" in form else None
+
+        with receiver.lock:
+            receiver.requests.append((endpoint, number))
+            receiver.client_ports.add(self.client_address[1])
+            drop = number is not None and number in receiver.drop_chunks
+            receiver.drop_chunks.discard(number)
+            receiver.active = receiver.active + 1
+            receiver.max_active = max(receiver.max_active, receiver.active)
+
+        try:
+            if receiver.latency:
+                time.sleep(receiver.latency)
+        finally:
+            with receiver.lock:
+                receiver.active = receiver.active - 1
+
+        # Cut the connection without a reply, like a network failure.
+        if drop:
+            self.close_connection = True
+            return
+
+        if form.get("password", b"").decode("utf-8") != receiver.password:
+            self.reply(403, "wrong password")
+            return
+
+        filename = os.path.basename(form["filename"].decode("utf-8"))
+        sha256 = form["sha256"].decode("ascii")
+
+        if endpoint == "receive_backup":
+            if hashlib.sha256(form["file"]).hexdigest() != sha256:
+                self.reply(400, "checksum mismatch")
+                return
+            with open(os.path.join(receiver.folder, filename), "wb") as f:
+                f.write(form["file"])
+            self.reply(200, "done")
+        elif endpoint == "status":
+            os.makedirs(receiver.parts_folder(sha256), exist_ok=True)
+            with open(os.path.join(receiver.parts_folder(sha256), "upload.json"), "w") as f:
+                json.dump({"size": int(form["size"]), "chunk_size": int(form["chunk_size"])}, f)
+            self.reply(200, json.dumps({"chunks": receiver.received_chunks(sha256)}))
+        elif endpoint == "chunk":
+            if hashlib.sha256(form["file"]).hexdigest() != form["chunk_sha256"].decode("ascii"):
+                self.reply(400, "chunk checksum mismatch")
+                return
+            part = os.path.join(receiver.parts_folder(sha256), str(number))
+            with open(part + ".tmp", "wb") as f:
+                f.write(form["file"])
+            os.replace(part + ".tmp", part)
+            self.reply(200, "done")
+        elif endpoint == "finish":
+            with open(os.path.join(receiver.parts_folder(sha256), "upload.json"), "r") as f:
+                upload = json.load(f)
+            count = max(1, -(-upload["size"] // upload["chunk_size"]))
+            if receiver.received_chunks(sha256) != list(range(count)):
+                self.reply(400, "missing chunks")
+                return
+
+            # Join the chunks and check the whole file.
+            hasher = hashlib.sha256()
+            with open(os.path.join(receiver.folder, filename), "wb") as dst:
+                for part in range(count):
+                    with open(os.path.join(receiver.parts_folder(sha256), str(part)), "rb") as src:
+                        data = src.read()
+                    hasher.update(data)
+                    dst.write(data)
+            if hasher.hexdigest() != sha256:
+                os.remove(os.path.join(receiver.folder, filename))
+                self.reply(400, "checksum mismatch")
+                return
+            shutil.rmtree(receiver.parts_folder(sha256))
+            self.reply(200, "done")
+        else:
+            self.reply(404, "not found")
+
+    def log_message(self, *args):
+        pass
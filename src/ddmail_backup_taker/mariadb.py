@@ -0,0 +1,294 @@
+import os
+import logging
+import subprocess
+import urllib.parse
+import concurrent.futures
+from typing import Iterable, Iterator, Optional
+from ddmail_backup_taker.compression import CODEC_EXTENSIONS, CODEC_LEVELS, compress_stage, iter_blocks
+from ddmail_backup_taker.stages import process_source, write_stage
+
+# Dump modes, lock tables while they are dumped, one consistent snapshot, key range
+# chunks of one snapshot or a physical copy of the data files with mariabackup.
+DUMP_MODES = ["lock", "consistent", "chunked", "physical"]
+
+# Databases that are not dumped, the same as mariadb-dump --all-databases skips.
+SKIPPED_DATABASES = ["information_schema", "performance_schema"]
+
+# Codecs the database dump can be compressed with while it is written.
+DUMP_CODECS = ["none", "gzip", "zstd"]
+
+# Folder in the archive with the database dumps streamed into the archive.
+DUMP_MEMBER_FOLDER = ".ddmail_backup_taker/mariadb"
+
+# 64mb, largest archive member of a streamed database dump, a part is held in memory until it is archived.
+PART_SIZE = 67108864
+
+def list_databases(logger:logging.Logger, toml_config:dict) -> dict:
+    """List the databases to dump with the mariadb client binary.
+
+    Args:
+        logger (logging.Logger): Logger object for recording operations.
+        toml_config (dict): Configuration dictionary with backup settings.
+
+    Returns:
+        dict: Result containing status information and databases:
+            {"is_working": bool, "msg": str, "databases": list[str]}
+
+    Error Responses:
+        {"is_working": False, "msg": "mariadb binary location is wrong"}: If the mariadb binary doesn't exist
+        {"is_working": False, "msg": "returncode of cmd mariadb is none zero"}: If the mariadb command fails
+
+    Success Response:
+        {"is_working": True, "msg": "done", "databases": ["<database>"]}
+    """
+    mariadb_bin = toml_config["MARIADB"].get("MARIADB_BIN", "/usr/bin/mariadb")
+
+    # Check if mariadb binary exist.
+    if not os.path.exists(mariadb_bin):
+        msg = "mariadb binary location is wrong"
+        logger.error(msg)
+        return {"is_working": False, "msg": msg}
+
+    try:
+        output = subprocess.run(
+                [mariadb_bin,
+                 "-h",
+                 "localhost",
+                 "-uroot",
+                 "-p" + toml_config["MARIADB"]["ROOT_PASSWORD"],
+                 "-N",
+                 "-B",
+                 "-e",
+                 "SHOW DATABASES"],
+                check=True,
+                stdout=subprocess.PIPE
+                )
+    except subprocess.CalledProcessError:
+        msg = "returncode of cmd mariadb is none zero"
+        logger.error(msg)
+        return {"is_working": False, "msg": msg}
+
+    databases = [
+            database for database in output.stdout.decode("utf-8").splitlines()
+            if database and database not in SKIPPED_DATABASES
+            ]
+
+    return {"is_working": True, "msg": "done", "databases": databases}
+
+def dump_compression_config(toml_config:dict) -> dict:
+    """Get the COMPRESSION section for compress_stage() of the database dump.
+
+    The dump is compressed with MARIADB.COMPRESSION at MARIADB.COMPRESSION_LEVEL,
+    the fastest level of the codec by default.
+    """
+    codec = toml_config["MARIADB"].get("COMPRESSION", "none")
+
+    return {
+            "COMPRESSION": {
+                "CODEC": codec,
+                "LEVEL": toml_config["MARIADB"].get("COMPRESSION_LEVEL", CODEC_LEVELS[codec][1]),
+                "BIN": toml_config["MARIADB"].get("COMPRESSION_BIN", "/usr/bin/zstd"),
+                }
+            }
+
+def dump_extension(toml_config:dict) -> str:
+    """Get the file extension of the database dump, .sql, .sql.gz or .sql.zst, .xbstream for MARIADB.MODE physical."""
+    extension = ".xbstream" if toml_config["MARIADB"].get("MODE", "lock") == "physical" else ".sql"
+    return extension + CODEC_EXTENSIONS[toml_config["MARIADB"].get("COMPRESSION", "none")][len(".tar"):]
+
+def db_dump_file_of(dst_folder:str, database:Optional[str], extension:str = ".sql", table:Optional[str] = None) -> str:
+    """Get the dump file of a database or of all databases when database is None, or of one table of a database.
+
+    Database and table names that are not safe in a file name are quoted.
+    """
+    if database is None:
+        return os.path.join(dst_folder, "full_db_dump" + extension)
+    if table is not None:
+        return os.path.join(dst_folder, "db_dump_" + urllib.parse.quote(database, safe="") + "." + urllib.parse.quote(table, safe="") + extension)
+    return os.path.join(dst_folder, "db_dump_" + urllib.parse.quote(database, safe="") + extension)
+
+def dump_cmd(toml_config:dict, database:Optional[str] = None, schema_only:bool = False, table:Optional[str] = None, options:Optional[list[str]] = None) -> list[str]:
+    """Build the mariadb-dump command line for one database, or all databases when database is None, or one table of a database.
+
+    With MARIADB.MODE consistent the dump reads one consistent snapshot without
+    locking the InnoDB tables and writes the rows as they are read instead of
+    buffering whole tables. With MARIADB.INCREMENTAL the dump also starts a new
+    binary log file at its snapshot and writes the binary log coordinates as a
+    comment. With schema_only true only the schema is dumped. Extra mariadb-dump
+    options are added before the databases and tables.
+    """
+    cmd = [toml_config["MARIADB"]["MARIADBDUMP_BIN"],
+           "-h",
+           "localhost",
+           "-uroot",
+           "-p" + toml_config["MARIADB"]["ROOT_PASSWORD"]]
+
+    if toml_config["MARIADB"].get("MODE", "lock") == "consistent" or toml_config["MARIADB"].get("INCREMENTAL", False) or schema_only:
+        cmd = cmd + ["--single-transaction", "--quick"]
+
+    if toml_config["MARIADB"].get("INCREMENTAL", False):
+        cmd = cmd + ["--flush-logs", "--master-data=2"]
+
+    if schema_only:
+        cmd = cmd + ["--no-data"]
+
+    if options:
+        cmd = cmd + options
+
+    if database is None:
+        return cmd + ["--all-databases"]
+    if table is not None:
+        return cmd + [database, table]
+    return cmd + ["--databases", database]
+
+def mariabackup_cmd(toml_config:dict) -> list[str]:
+    """Build the mariabackup command line that streams a physical backup of all databases as xbstream to stdout."""
+    return [toml_config["MARIADB"].get("MARIABACKUP_BIN", "/usr/bin/mariabackup"),
+            "--backup",
+            "--stream=xbstream",
+            "--host=localhost",
+            "--user=root",
+            "--password=" + toml_config["MARIADB"]["ROOT_PASSWORD"]]
+
+def dump_source(toml_config:dict, database:Optional[str] = None, table:Optional[str] = None) -> Iterator[bytes]:
+    """Yield the output of mariadb-dump compressed according to MARIADB.COMPRESSION.
+
+    With MARIADB.MODE physical the xbstream of mariabackup is yielded instead,
+    it always holds all databases.
+
+    Raises:
+        subprocess.CalledProcessError: If mariadb-dump, mariabackup or the compressor exits with a non zero return code.
+    """
+    if toml_config["MARIADB"].get("MODE", "lock") == "physical":
+        return compress_stage(process_source(mariabackup_cmd(toml_config)), dump_compression_config(toml_config))
+    return compress_stage(process_source(dump_cmd(toml_config, database, table=table)), dump_compression_config(toml_config))
+
+def iter_dump_parts(name:str, chunks:Iterable[bytes], part_size:int = PART_SIZE) -> Iterator[tuple[str, bytes]]:
+    """Split a dump stream into archive members name.part0001, name.part0002 and so on.
+
+    A tar header holds the member size, so a stream of unknown size is archived as
+    parts of at most part_size bytes. Joining the parts in order gives the dump. An
+    empty dump is one empty part.
+    """
+    number = 0
+    for number, part in enumerate(iter_blocks(chunks, part_size), start=1):
+        yield (f"{name}.part{number:04d}", part)
+
+    if number == 0:
+        yield (f"{name}.part0001", b"")
+
+def iter_dump_members(toml_config:dict, databases:Optional[list[str]] = None, part_size:int = PART_SIZE) -> Iterator[tuple[str, bytes]]:
+    """Stream the output of mariadb-dump as archive members without a temporary file.
+
+    With databases None all databases are dumped to DUMP_MEMBER_FOLDER/full_db_dump.sql
+    parts, else every database is dumped in turn to DUMP_MEMBER_FOLDER/db_dump_<name>.sql
+    parts, see iter_dump_parts(). With MARIADB.COMPRESSION the parts are compressed
+    and named .sql.gz or .sql.zst.
+
+    Raises:
+        subprocess.CalledProcessError: If mariadb-dump exits with a non zero return code.
+    """
+    extension = dump_extension(toml_config)
+
+    for database in ([None] if databases is None else databases):
+        yield from iter_dump_parts(db_dump_file_of(DUMP_MEMBER_FOLDER, database, extension), dump_source(toml_config, database), part_size)
+
+def dump_database(logger:logging.Logger, toml_config:dict, database:Optional[str], dst_folder:str, table:Optional[str] = None) -> dict:
+    """Dump one database with schema using its own mariadb-dump process, or only one table of it.
+
+    With MARIADB.COMPRESSION the dump is compressed while it is written so the
+    plain dump never takes up scratch space, see dump_source(). With MARIADB.MODE
+    physical the xbstream of mariabackup is written to full_db_dump.xbstream.
+
+    Args:
+        logger (logging.Logger): Logger object for recording operations.
+        toml_config (dict): Configuration dictionary with backup settings.
+        database (str): Name of the database to dump, None for all databases.
+        dst_folder (str): Directory where the database dump will be saved.
+        table (str): Name of the one table of the database to dump, None for the whole database.
+
+    Returns:
+        dict: Result containing status information and file path:
+            {"is_working": bool, "msg": str, "db_dump_file": str}
+
+    Error Responses:
+        {"is_working": False, "msg": "returncode of cmd mariadbdump is none zero"}: If mariadbdump command fails
+        {"is_working": False, "msg": "returncode of cmd <compressor> is none zero"}: If the compressor fails
+        {"is_working": False, "msg": "returncode of cmd mariabackup is none zero"}: If the mariabackup command fails
+
+    Success Response:
+        {"is_working": True, "msg": "done", "db_dump_file": "<path>"}
+    """
+    db_dump_file = db_dump_file_of(dst_folder, database, dump_extension(toml_config), table)
+
+    try:
+        write_stage(dump_source(toml_config, database, table), db_dump_file)
+    except subprocess.CalledProcessError as e:
+        if e.cmd[0] == toml_config["MARIADB"]["MARIADBDUMP_BIN"]:
+            msg = "returncode of cmd mariadbdump is none zero"
+        else:
+            msg = "returncode of cmd " + os.path.basename(e.cmd[0]) + " is none zero"
+        logger.error(msg)
+        return {"is_working": False, "msg": msg}
+
+    logger.debug("dumped " + (database or "all databases") + ("." + table if table else "") + " to " + db_dump_file)
+    return {"is_working": True, "msg": "done", "db_dump_file": db_dump_file}
+
+def backup_mariadb_databases(logger:logging.Logger, toml_config:dict, dst_folder:str) -> dict:
+    """Dump every MariaDB database to its own file with a bounded pool of concurrent workers.
+
+    The databases are listed with list_databases() and every database is dumped by
+    its own mariadb-dump process so one large database does not hold up the others.
+    At most MARIADB.PARALLELISM dumps run at the same time.
+
+    Args:
+        logger (logging.Logger): Logger object for recording operations.
+        toml_config (dict): Configuration dictionary with backup settings.
+        dst_folder (str): Directory where the database dumps will be saved.
+
+    Returns:
+        dict: Result containing status information and file paths:
+            {"is_working": bool, "msg": str, "db_dump_files": list[str]}
+
+    Error Responses:
+        {"is_working": False, "msg": "mariadbdump binary location is wrong"}: If mariadbdump binary doesn't exist
+        {"is_working": False, "msg": "dst_folder do not exist"}: If destination folder doesn't exist
+        {"is_working": False, "msg": "<error message>"}: If the databases can not be listed
+        {"is_working": False, "msg": "dump of database <name> failed: <error message>"}: If dumping a database fails
+
+    Success Response:
+        {"is_working": True, "msg": "done", "db_dump_files": ["<path>"]}
+    """
+    # Check if mariadbdump binary exist.
+    if not os.path.exists(toml_config["MARIADB"]["MARIADBDUMP_BIN"]):
+        msg = "mariadbdump binary location is wrong"
+        logger.error(msg)
+        return {"is_working": False, "msg": msg}
+
+    # Check if dst_folder exist.
+    if not os.path.exists(dst_folder):
+        msg = "dst_folder do not exist"
+        logger.error(msg)
+        return {"is_working": False, "msg": msg}
+
+    result_list_databases = list_databases(logger, toml_config)
+    if not result_list_databases["is_working"]:
+        return result_list_databases
+
+    databases = result_list_databases["databases"]
+    parallelism = toml_config["MARIADB"].get("PARALLELISM", 4)
+
+    logger.info("dumping " + str(len(databases)) + " databases with " + str(parallelism) + " workers")
+
+    with concurrent.futures.ThreadPoolExecutor(max_workers=parallelism) as executor:
+        futures = [executor.submit(dump_database, logger, toml_config, database, dst_folder) for database in databases]
+        results = [future.result() for future in futures]
+
+    # Check if any dump failed.
+    for database, result in zip(databases, results):
+        if not result["is_working"]:
+            msg = "dump of database " + database + " failed: " + result["msg"]
+            logger.error(msg)
+            return {"is_working": False, "msg": msg}
+
+    return {"is_working": True, "msg": "done", "db_dump_files": [result["db_dump_file"] for result in results]}
@@ -0,0 +1,264 @@
+import os
+import stat
+import errno
+import fcntl
+import signal
+import ctypes
+import functools
+import subprocess
+import tempfile
+import threading
+from typing import Callable, Optional
+
+# 1mb, size asked for every pipe between the stages, the kernel default is 64kb.
+PIPE_SIZE = 1048576
+
+# Commands of fcntl() to set and get the size of a pipe, in the fcntl module from Python 3.10.
+F_SETPIPE_SZ = getattr(fcntl, "F_SETPIPE_SZ", 1031)
+F_GETPIPE_SZ = getattr(fcntl, "F_GETPIPE_SZ", 1032)
+
+# Largest pipe size an unprivileged process may set.
+PIPE_MAX_SIZE_FILE = "/proc/sys/fs/pipe-max-size"
+
+def pipe_max_size() -> int:
+    """Get the largest pipe size an unprivileged process may set, PIPE_SIZE when the kernel does not tell."""
+    try:
+        with open(PIPE_MAX_SIZE_FILE, "r") as f:
+            return int(f.read())
+    except (OSError, ValueError):
+        return PIPE_SIZE
+
+def enlarge_pipe(fd:int, size:int = PIPE_SIZE) -> int:
+    """Ask the kernel for a pipe buffer of size bytes, capped at pipe_max_size().
+
+    Returns:
+        int: The size of the pipe buffer, 0 when fd is not a pipe.
+    """
+    try:
+        return fcntl.fcntl(fd, F_SETPIPE_SZ, min(size, pipe_max_size()))
+    except OSError:
+        try:
+            return fcntl.fcntl(fd, F_GETPIPE_SZ)
+        except OSError:
+            return 0
+
+@functools.lru_cache(maxsize=None)
+def libc_tee() -> Optional[Callable]:
+    """Get tee(2) from the C library, Python has os.splice() but no os.tee(). None when there is no tee."""
+    try:
+        tee = ctypes.CDLL(None, use_errno=True).tee
+    except (OSError, AttributeError):
+        return None
+
+    tee.argtypes = [ctypes.c_int, ctypes.c_int, ctypes.c_size_t, ctypes.c_uint]
+    tee.restype = ctypes.c_ssize_t
+    return tee
+
+def tee(fd_in:int, fd_out:int, count:int) -> int:
+    """Duplicate up to count bytes from the pipe fd_in to the pipe fd_out without consuming them.
+
+    Raises:
+        OSError: If tee(2) fails.
+    """
+    while True:
+        n = libc_tee()(fd_in, fd_out, count, 0)
+        if n >= 0:
+            return n
+        error = ctypes.get_errno()
+        if error != errno.EINTR:
+            raise OSError(error, os.strerror(error))
+
+def is_pipe(fd:int) -> bool:
+    """Check if a file descriptor is a pipe."""
+    return stat.S_ISFIFO(os.fstat(fd).st_mode)
+
+def write_all(fd:int, view:memoryview) -> None:
+    """Write all of a buffer to a file descriptor."""
+    while view:
+        view = view[os.write(fd, view):]
+
+def read_exactly_into(fd:int, view:memoryview) -> None:
+    """Fill a buffer from a file descriptor.
+
+    Raises:
+        EOFError: If fd ends first.
+    """
+    while view:
+        n = os.readv(fd, [view])
+        if n == 0:
+            raise EOFError("pipe ended early")
+        view = view[n:]
+
+def copy_relay(src:int, dst:int, hasher = None, size:int = PIPE_SIZE) -> int:
+    """Copy src to dst through one reused buffer read with readinto, updating hasher, and return the number of bytes."""
+    buffer = bytearray(size)
+    view = memoryview(buffer)
+    total = 0
+
+    while True:
+        n = os.readv(src, [buffer])
+        if n == 0:
+            return total
+        if hasher is not None:
+            hasher.update(view[:n])
+        write_all(dst, view[:n])
+        total = total + n
+
+def splice_all(src:int, dst:int, count:int) -> None:
+    """Move count bytes that are already in the pipe src to dst."""
+    while count:
+        count = count - os.splice(src, dst, count)
+
+def relay(src:int, dst:int, hasher = None, zero_copy:bool = True) -> int:
+    """Move everything from src to dst until src ends and return the number of bytes.
+
+    When src is a pipe the bytes are moved with os.splice() and never copied to
+    user space. With a hasher the bytes are first duplicated with tee(2) to a tap
+    pipe, only the tap is read to update the hasher. Without os.splice(), tee(2)
+    or when dst can not be spliced to, like a file opened for appending, the bytes
+    are copied through one reused buffer by copy_relay().
+
+    Args:
+        src (int): File descriptor to read.
+        dst (int): File descriptor to write.
+        hasher: hashlib object updated with every byte, or None.
+        zero_copy (bool): False to always copy through a buffer.
+
+    Returns:
+        int: The number of bytes moved.
+    """
+    if not zero_copy or not hasattr(os, "splice") or not is_pipe(src) or (hasher is not None and libc_tee() is None):
+        return copy_relay(src, dst, hasher)
+
+    size = enlarge_pipe(src) or PIPE_SIZE
+    total = 0
+
+    if hasher is None:
+        while True:
+            try:
+                n = os.splice(src, dst, size)
+            except OSError as e:
+                # Nothing is consumed when the first splice fails, copy instead.
+                if total == 0 and e.errno in (errno.EINVAL, errno.ENOSYS):
+                    return copy_relay(src, dst)
+                raise
+            if n == 0:
+                return total
+            total = total + n
+
+    tap_read, tap_write = os.pipe()
+    try:
+        size = min(size, enlarge_pipe(tap_write, size) or PIPE_SIZE)
+        buffer = bytearray(size)
+        view = memoryview(buffer)
+
+        while True:
+            n = tee(src, tap_write, size)
+            if n == 0:
+                return total
+
+            try:
+                splice_all(src, dst, n)
+            except OSError as e:
+                # Nothing is consumed when the first splice fails, copy instead.
+                if total == 0 and e.errno in (errno.EINVAL, errno.ENOSYS):
+                    return copy_relay(src, dst, hasher)
+                raise
+
+            read_exactly_into(tap_read, view[:n])
+            hasher.update(view[:n])
+            total = total + n
+    finally:
+        os.close(tap_read)
+        os.close(tap_write)
+
+def run_pipeline(cmds:list[list[str]], dst_path:str, hasher = None, zero_copy:bool = True) -> list[int]:
+    """Run subprocesses as a pipeline and write the output of the last one to dst_path.
+
+    Every subprocess writes to an enlarged pipe that a thread relays to the stdin
+    of the next subprocess with relay(), the output of the last subprocess is
+    relayed to dst_path while hasher is updated. No byte passes through a Python
+    buffer unless os.splice() or tee(2) can not be used, while the number of
+    bytes between every two stages is still counted.
+
+    Args:
+        cmds (list[list[str]]): The command lines, the first reads nothing and each next one reads the output of the previous one.
+        dst_path (str): Path of the file the output is written to.
+        hasher: hashlib object updated with the output, or None.
+        zero_copy (bool): False to copy every byte through a buffer like a Python stage would.
+
+    Returns:
+        list[int]: The number of bytes written by every subprocess.
+
+    Raises:
+        subprocess.CalledProcessError: If a subprocess exits with a non zero return code, the first one that was not killed by SIGPIPE.
+    """
+    stderr_files = [tempfile.TemporaryFile() for _ in cmds]
+    processes = []
+    threads = []
+    counts = [0] * len(cmds)
+    relay_errors = []
+
+    def link(number, dst, link_hasher):
+        try:
+            counts[number] = relay(processes[number].stdout.fileno(), dst, link_hasher, zero_copy)
+        except BrokenPipeError:
+            # The next subprocess has exited, its return code tells why.
+            pass
+        except BaseException as e:
+            relay_errors.append(e)
+        finally:
+            processes[number].stdout.close()
+
+    def forward(number, stdin):
+        try:
+            link(number - 1, stdin.fileno(), None)
+        finally:
+            stdin.close()
+
+    try:
+        for number, cmd in enumerate(cmds):
+            process = subprocess.Popen(
+                    cmd,
+                    stdin=subprocess.PIPE if number > 0 else None,
+                    stdout=subprocess.PIPE,
+                    stderr=stderr_files[number]
+                    )
+            processes.append(process)
+            enlarge_pipe(process.stdout.fileno())
+
+            if number > 0:
+                enlarge_pipe(process.stdin.fileno())
+                thread = threading.Thread(target=forward, args=(number, process.stdin), daemon=True)
+                thread.start()
+                threads.append(thread)
+
+        with open(dst_path, "wb") as f:
+            link(len(cmds) - 1, f.fileno(), hasher)
+    except BaseException:
+        # Stop the started subprocesses so the relay threads see the end of their pipes.
+        for process in processes:
+            process.kill()
+        raise
+    finally:
+        for thread in threads:
+            thread.join()
+        for process in processes:
+            process.wait()
+
+    try:
+        # A subprocess killed by SIGPIPE failed because a later one exited, that one is reported.
+        failed = [(process, stderr_file) for process, stderr_file in zip(processes, stderr_files) if process.returncode != 0]
+        failed.sort(key=lambda item: item[0].returncode == -signal.SIGPIPE)
+        if failed:
+            process, stderr_file = failed[0]
+            stderr_file.seek(0)
+            raise subprocess.CalledProcessError(process.returncode, process.args, stderr=stderr_file.read())
+
+        if relay_errors:
+            raise relay_errors[0]
+    finally:
+        for stderr_file in stderr_files:
+            stderr_file.close()
+
+    return counts
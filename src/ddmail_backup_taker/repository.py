@@ -0,0 +1,608 @@
+import os
+import json
+import hmac
+import hashlib
+import logging
+import sqlite3
+import bisect
+import datetime
+import subprocess
+import tarfile
+import tempfile
+import time
+import zlib
+from typing import BinaryIO, Iterator, Optional
+from ddmail_backup_taker.archive import iter_paths, make_tarinfo, arcname_of, tar_header, gpg_encrypt_cmd, remove_partial_file
+from ddmail_backup_taker.stages import process_stage, write_stage
+
+# 1mb, default average chunk size of the content-defined chunking.
+AVG_CHUNK_SIZE = 1048576
+
+# Name of the manifest member in every pack.
+SNAPSHOT_MEMBER = "snapshot.json"
+
+# Number of bytes every content-defined chunk boundary depends on.
+WINDOW_SIZE = 32
+
+# Number of bytes of the window hash that preselects the windows whose CRC-32 is
+# checked, a power of two. Every doubling costs one more pass over the data.
+HASH_WINDOW_SIZE = 4
+
+# Size of the blocks the window hashes are calculated for at once, small enough to stay in the cpu cache.
+WINDOW_BLOCK_SIZE = 1048576
+
+def window_permutation(level:int) -> bytes:
+    """Get a random byte permutation that is one cycle, so no byte maps to itself and a run of one byte never hashes to zero."""
+    order = sorted(range(256), key=lambda i: hashlib.sha256(b"ddmail_backup_taker window " + str(level).encode() + b" " + str(i).encode()).digest())
+    permutation = bytearray(256)
+    for position, byte in enumerate(order):
+        permutation[byte] = order[(position + 1) % 256]
+    return bytes(permutation)
+
+# Tables of the window hash, generated from a fixed seed so the chunk boundaries are
+# the same on every run. WINDOW_TABLE maps every byte to a random byte and every
+# step of window_hashes() mixes the hashes with one of the WINDOW_PERMUTATIONS.
+WINDOW_TABLE = bytes(hashlib.sha256(b"ddmail_backup_taker window " + str(i).encode()).digest()[0] for i in range(256))
+WINDOW_PERMUTATIONS = [window_permutation(level) for level in range(HASH_WINDOW_SIZE.bit_length() - 1)]
+
+def chunk_sizes(toml_config:dict) -> tuple:
+    """Get the min, average and max chunk size from the configuration."""
+    avg_size = toml_config["REPOSITORY"].get("AVG_CHUNK_SIZE", AVG_CHUNK_SIZE)
+    return avg_size // 4, avg_size, avg_size * 4
+
+def window_hashes(data:bytes) -> bytes:
+    """Hash every window of HASH_WINDOW_SIZE bytes of data to one byte.
+
+    Byte i of the result is the hash of data[i:i + HASH_WINDOW_SIZE], the last
+    HASH_WINDOW_SIZE - 1 bytes hash incomplete windows. The hash of a window is built
+    in log2(HASH_WINDOW_SIZE) steps, every step combines the hash of the first half of
+    the window with the permuted hash of the second half. A step is done for all
+    windows at once with bytes.translate() and a big integer XOR, so no Python
+    code runs per byte.
+    """
+    size = len(data)
+    hashes = data.translate(WINDOW_TABLE)
+    value = int.from_bytes(hashes, "little")
+    for level, permutation in enumerate(WINDOW_PERMUTATIONS):
+        value = value ^ (int.from_bytes(hashes.translate(permutation), "little") >> (8 << level))
+        hashes = value.to_bytes(size, "little")
+    return hashes
+
+def find_candidates(data:bytes, avg_size:int) -> list[int]:
+    """Find the positions in data where a content-defined chunk may end.
+
+    A chunk may end after a window of WINDOW_SIZE bytes whose first
+    HASH_WINDOW_SIZE bytes have the window hash zero and whose CRC-32 has its low
+    log2(avg_size) - 8 bits zero, on average every avg_size bytes. The zero hashes are found with bytes.find(), only those
+    windows are checked in Python.
+
+    Args:
+        data (bytes): Data to find the positions in.
+        avg_size (int): Average chunk size, a power of two of at least 256.
+
+    Returns:
+        list[int]: Offsets in data right after the windows, in ascending order.
+    """
+    mask = (avg_size >> 8) - 1
+    candidates = []
+
+    for block_start in range(0, len(data), WINDOW_BLOCK_SIZE):
+        # The windows starting in this block end in the next one.
+        block = data[block_start:block_start + WINDOW_BLOCK_SIZE + WINDOW_SIZE - 1]
+        last = len(block) - WINDOW_SIZE
+        hashes = window_hashes(block)
+        i = hashes.find(0, 0, last + 1)
+        while i != -1:
+            if not zlib.crc32(block[i:i + WINDOW_SIZE]) & mask:
+                candidates.append(block_start + i + WINDOW_SIZE)
+            i = hashes.find(0, i + 1, last + 1)
+
+    return candidates
+
+def chunk_ends(data:bytes, min_size:int, avg_size:int, max_size:int, eof:bool) -> list[int]:
+    """Split data into content-defined chunks and return the offset where every chunk ends.
+
+    A chunk ends at the first position of find_candidates() after min_size bytes,
+    the positions before it are skipped the same way as FastCDC does, or after
+    max_size bytes. When eof is false the bytes after the last chunk are left for
+    the caller to join with the next data.
+
+    Args:
+        data (bytes): Data to split, bytes or a mmap.
+        min_size (int): Smallest chunk size.
+        avg_size (int): Average chunk size, a power of two of at least 256.
+        max_size (int): Largest chunk size.
+        eof (bool): True if data is the end of the file.
+
+    Returns:
+        list[int]: Offsets in data where the chunks end.
+    """
+    candidates = find_candidates(data, avg_size)
+    ends = []
+    start = 0
+    index = 0
+
+    while start < len(data):
+        index = bisect.bisect_right(candidates, start + min_size, index)
+        if index < len(candidates) and candidates[index] <= start + max_size:
+            start = candidates[index]
+        elif len(data) - start >= max_size:
+            start = start + max_size
+        elif eof:
+            start = len(data)
+        else:
+            break
+        ends.append(start)
+
+    return ends
+
+def iter_chunks(f:BinaryIO, min_size:int, avg_size:int, max_size:int) -> Iterator[bytes]:
+    """Split the content of a file object into content-defined chunks, see chunk_ends()."""
+    read_size = max(4 * max_size, 4 * WINDOW_BLOCK_SIZE)
+    buf = b""
+    eof = False
+
+    while not eof:
+        data = f.read(read_size)
+        eof = not data
+        buf = buf + data
+
+        start = 0
+        for end in chunk_ends(buf, min_size, avg_size, max_size, eof):
+            yield buf[start:end]
+            start = end
+        buf = buf[start:]
+
+def chunk_id(id_key:bytes, chunk:bytes) -> str:
+    """Get the id of a chunk, a keyed hash so chunk ids do not reveal the content."""
+    return hmac.new(id_key, chunk, hashlib.sha256).hexdigest()
+
+def open_repository(logger:logging.Logger, toml_config:dict) -> dict:
+    """Open the repository in REPOSITORY.PATH, create it if it does not exist.
+
+    The repository holds the packs folder, the id key used for chunk ids and a
+    sqlite index of the chunks in every pack, the chunks used by every snapshot and
+    the chunks of every file of the last snapshot, see cached_chunks().
+
+    Args:
+        logger (logging.Logger): Logger object for recording operations.
+        toml_config (dict): Configuration dictionary with backup settings.
+
+    Returns:
+        dict: Result containing status information, index connection and id key:
+            {"is_working": bool, "msg": str, "db": sqlite3.Connection, "id_key": bytes, "packs_folder": str}
+
+    Error Responses:
+        {"is_working": False, "msg": "repository id key <path> is not valid"}: If the id key file is broken
+
+    Success Response:
+        {"is_working": True, "msg": "done", "db": <connection>, "id_key": <key>, "packs_folder": "<path>"}
+    """
+    repository_path = toml_config["REPOSITORY"]["PATH"]
+    packs_folder = os.path.join(repository_path, "packs")
+    id_key_file = os.path.join(repository_path, "id_key")
+
+    # Create repository folders.
+    if not os.path.exists(packs_folder):
+        logger.info("creating repository in " + repository_path)
+        os.makedirs(packs_folder)
+
+    # Create the id key, only readable by the owner.
+    if not os.path.exists(id_key_file):
+        fd = os.open(id_key_file, os.O_WRONLY | os.O_CREAT | os.O_EXCL, 0o600)
+        with os.fdopen(fd, "wb") as f:
+            f.write(os.urandom(32))
+
+    with open(id_key_file, "rb") as f:
+        id_key = f.read()
+
+    if len(id_key) != 32:
+        msg = "repository id key " + id_key_file + " is not valid"
+        logger.error(msg)
+        return {"is_working": False, "msg": msg}
+
+    # The pack generator runs in the thread feeding gpg so the connection is shared.
+    db = sqlite3.connect(os.path.join(repository_path, "index.sqlite"), check_same_thread=False)
+    db.execute("CREATE TABLE IF NOT EXISTS chunks (id TEXT PRIMARY KEY, pack TEXT NOT NULL, size INTEGER NOT NULL)")
+    db.execute("CREATE TABLE IF NOT EXISTS snapshots (name TEXT PRIMARY KEY, pack TEXT NOT NULL)")
+    db.execute("CREATE TABLE IF NOT EXISTS snapshot_chunks (snapshot TEXT NOT NULL, chunk TEXT NOT NULL, PRIMARY KEY (snapshot, chunk)) WITHOUT ROWID")
+    db.execute("CREATE TABLE IF NOT EXISTS files (path TEXT PRIMARY KEY, inode INTEGER NOT NULL, size INTEGER NOT NULL, mtime_ns INTEGER NOT NULL, ctime_ns INTEGER NOT NULL, chunks TEXT NOT NULL)")
+    db.commit()
+
+    return {"is_working": True, "msg": "done", "db": db, "id_key": id_key, "packs_folder": packs_folder}
+
+def tar_member(name:str, data:bytes) -> bytes:
+    """Encode a regular file tar member with header, data and padding."""
+    tarinfo = tarfile.TarInfo(name)
+    tarinfo.size = len(data)
+    tarinfo.mode = 0o600
+    padding = (tarfile.BLOCKSIZE - len(data) % tarfile.BLOCKSIZE) % tarfile.BLOCKSIZE
+    return tar_header(tarinfo) + data + bytes(padding)
+
+def cached_chunks(db:sqlite3.Connection, path:str, st:os.stat_result) -> Optional[list[str]]:
+    """Get the chunk ids of a file from the last snapshot if the file has not changed since.
+
+    A file has not changed if it has the same inode, size, mtime and ctime as when
+    it was chunked and all its chunks are still in the repository.
+
+    Returns:
+        Optional[list[str]]: The chunk ids, None if the file has to be read.
+    """
+    row = db.execute(
+            "SELECT chunks FROM files WHERE path = ? AND inode = ? AND size = ? AND mtime_ns = ? AND ctime_ns = ?",
+            (path, st.st_ino, st.st_size, st.st_mtime_ns, st.st_ctime_ns)
+            ).fetchone()
+    if row is None:
+        return None
+
+    cids = json.loads(row[0])
+    for cid in cids:
+        if not db.execute("SELECT 1 FROM chunks WHERE id = ?", (cid,)).fetchone():
+            return None
+    return cids
+
+def iter_pack(logger:logging.Logger, toml_config:dict, repository:dict, data_to_backup:list[str], snapshot:dict) -> Iterator[bytes]:
+    """Build the pack of a backup run as a tar stream.
+
+    The pack holds every chunk that is not already in the repository, compressed
+    with zlib, followed by the snapshot manifest with the metadata and chunk ids of
+    every folder and file. Files that have not changed since the last snapshot are
+    not read again, see cached_chunks(). The snapshot dict is filled in while the
+    pack is built.
+    """
+    min_size, avg_size, max_size = chunk_sizes(toml_config)
+    db = repository["db"]
+    id_key = repository["id_key"]
+    pack_size = 0
+
+    for path in iter_paths(logger, data_to_backup):
+        f = None
+        cids = None
+        try:
+            st = os.lstat(path)
+            tarinfo = make_tarinfo(path, st, arcname_of(path))
+            if tarinfo is not None and tarinfo.isreg():
+                cids = cached_chunks(db, path, st)
+                if cids is None:
+                    f = open(path, "rb")
+        except FileNotFoundError:
+            logger.warning("file " + path + " vanished before it was archived")
+            continue
+
+        if tarinfo is None:
+            logger.warning("file " + path + " has a type that can not be archived, skipping it")
+            continue
+
+        entry = {
+                "path": tarinfo.name,
+                "type": tarinfo.type.decode("ascii"),
+                "mode": tarinfo.mode,
+                "uid": tarinfo.uid,
+                "gid": tarinfo.gid,
+                "mtime": tarinfo.mtime,
+                "linkname": tarinfo.linkname,
+                "size": 0,
+                "chunks": [],
+                }
+
+        if cids is not None:
+            entry["chunks"] = cids
+            entry["size"] = st.st_size
+            snapshot["chunks"].update(cids)
+            snapshot["cached_files"] = snapshot["cached_files"] + 1
+
+        if f is not None:
+            with f:
+                for chunk in iter_chunks(f, min_size, avg_size, max_size):
+                    cid = chunk_id(id_key, chunk)
+                    entry["chunks"].append(cid)
+                    entry["size"] = entry["size"] + len(chunk)
+                    snapshot["chunks"].add(cid)
+
+                    # Only store chunks that are not in the repository or this pack.
+                    if cid in snapshot["new_chunks"]:
+                        continue
+                    if db.execute("SELECT 1 FROM chunks WHERE id = ?", (cid,)).fetchone():
+                        continue
+
+                    snapshot["new_chunks"][cid] = len(chunk)
+                    member = tar_member("chunks/" + cid, zlib.compress(chunk))
+                    pack_size = pack_size + len(member)
+                    yield member
+
+            # A file changed within the same second as it was read may look unchanged next run.
+            if entry["size"] != st.st_size or time.time_ns() - st.st_mtime_ns < 1000000000:
+                cids = None
+            else:
+                cids = entry["chunks"]
+
+        if cids is not None:
+            snapshot["file_cache"].append((path, st.st_ino, st.st_size, st.st_mtime_ns, st.st_ctime_ns, json.dumps(cids)))
+
+        snapshot["files"].append(entry)
+
+    # The manifest is the last member of the pack.
+    manifest = json.dumps({"name": snapshot["name"], "files": snapshot["files"]}).encode("utf-8")
+    member = tar_member(SNAPSHOT_MEMBER, manifest)
+    pack_size = pack_size + len(member) + 2 * tarfile.BLOCKSIZE
+    yield member + bytes(2 * tarfile.BLOCKSIZE) + bytes((tarfile.RECORDSIZE - pack_size % tarfile.RECORDSIZE) % tarfile.RECORDSIZE)
+
+def backup_to_repository(logger:logging.Logger, toml_config:dict, data_to_backup:list[str]) -> dict:
+    """Store a backup in the deduplicating chunk repository.
+
+    Every regular file is split into content-defined chunks and every chunk is
+    stored only once in the repository, files that have not changed since the last
+    snapshot reuse its chunk ids without being read. The new chunks of a run are written to one
+    pack file together with the snapshot manifest, the pack is encrypted with gpg
+    when GPG_ENCRYPTION.USE is true. The pack is the backup file of the run and is
+    what is sent to the backup receiver.
+
+    Args:
+        logger (logging.Logger): Logger object for recording operations.
+        toml_config (dict): Configuration dictionary with backup settings.
+        data_to_backup (list[str]): List of files and folders to include in the backup.
+
+    Returns:
+        dict: Result containing status information and file path:
+            {"is_working": bool, "msg": str, "backup_file": str, "backup_filename": str, "backup_type": str, "backup_level": int, "new_chunks": int, "chunks": int}
+
+    Error Responses:
+        {"is_working": False, "msg": "Failed to open repository: <error message>"}: If the repository can not be opened
+        {"is_working": False, "msg": "<binary> command failed with return code <code>"}: If gpg fails
+        {"is_working": False, "msg": "Error during backup process: <error>"}: For other errors
+
+    Success Response:
+        {"is_working": True, "msg": "finished successfully", "backup_file": "<path>", "backup_filename": "<filename>", "backup_type": "snapshot", "backup_level": 0, "new_chunks": <count>, "chunks": <count>}
+    """
+    result_open_repository = open_repository(logger, toml_config)
+    if not result_open_repository["is_working"]:
+        msg = "Failed to open repository: " + result_open_repository["msg"]
+        logger.error(msg)
+        return {"is_working": False, "msg": msg}
+
+    db = result_open_repository["db"]
+
+    # Create pack file name.
+    name = f"backup_{datetime.datetime.now().strftime('%Y%m%d%H%M%S')}"
+    backup_filename = name + ".pack"
+    if toml_config["GPG_ENCRYPTION"]["USE"]:
+        backup_filename = backup_filename + ".gpg"
+    backup_file = os.path.join(result_open_repository["packs_folder"], backup_filename)
+
+    snapshot = {"name": name, "files": [], "chunks": set(), "new_chunks": {}, "file_cache": [], "cached_files": 0}
+
+    try:
+        chunks = iter_pack(logger, toml_config, result_open_repository, data_to_backup, snapshot)
+        if toml_config["GPG_ENCRYPTION"]["USE"]:
+            chunks = process_stage(chunks, gpg_encrypt_cmd(toml_config))
+        write_stage(chunks, backup_file)
+
+        # Index the pack only after it has been written.
+        with db:
+            db.executemany(
+                    "INSERT INTO chunks (id, pack, size) VALUES (?, ?, ?)",
+                    [(cid, backup_filename, size) for cid, size in snapshot["new_chunks"].items()]
+                    )
+            db.execute("INSERT INTO snapshots (name, pack) VALUES (?, ?)", (name, backup_filename))
+            db.executemany(
+                    "INSERT INTO snapshot_chunks (snapshot, chunk) VALUES (?, ?)",
+                    [(name, cid) for cid in snapshot["chunks"]]
+                    )
+
+            # The files of this snapshot are the ones the next run can skip.
+            db.execute("DELETE FROM files")
+            db.executemany(
+                    "INSERT OR REPLACE INTO files (path, inode, size, mtime_ns, ctime_ns, chunks) VALUES (?, ?, ?, ?, ?, ?)",
+                    snapshot["file_cache"]
+                    )
+    except subprocess.CalledProcessError as e:
+        remove_partial_file(backup_file)
+        msg = f"{os.path.basename(e.cmd[0])} command failed with return code {e.returncode}"
+        logger.error(msg)
+        return {"is_working": False, "msg": msg}
+    except Exception as e:
+        remove_partial_file(backup_file)
+        msg = f"Error during backup process: {str(e)}"
+        logger.error(msg)
+        return {"is_working": False, "msg": msg}
+    finally:
+        db.close()
+
+    logger.info("stored " + str(len(snapshot["new_chunks"])) + " new chunks of " + str(len(snapshot["chunks"])) + " chunks in " + backup_filename + ", " + str(snapshot["cached_files"]) + " unchanged files were not read")
+
+    msg = "finished successfully"
+    return {
+            "is_working": True,
+            "msg": msg,
+            "backup_file": backup_file,
+            "backup_filename": backup_filename,
+            "backup_type": "snapshot",
+            "backup_level": 0,
+            "new_chunks": len(snapshot["new_chunks"]),
+            "chunks": len(snapshot["chunks"])
+            }
+
+def prune_repository(logger:logging.Logger, toml_config:dict) -> dict:
+    """Forget old snapshots and find the packs that are no longer needed.
+
+    Only the BACKUPS_TO_SAVE_LOCAL newest snapshots are kept. A pack is still needed
+    if it holds the manifest of a kept snapshot or a chunk used by a kept snapshot.
+    The chunks of packs that are not needed are removed from the index, the caller
+    removes the pack files.
+
+    Args:
+        logger (logging.Logger): Logger object for recording operations.
+        toml_config (dict): Configuration dictionary with backup settings.
+
+    Returns:
+        dict: Result containing status information and the packs to remove:
+            {"is_working": bool, "msg": str, "unused_packs": list[str]}
+
+    Error Responses:
+        {"is_working": False, "msg": "Failed to open repository: <error message>"}: If the repository can not be opened
+
+    Success Response:
+        {"is_working": True, "msg": "done", "unused_packs": ["<path>"]}
+    """
+    result_open_repository = open_repository(logger, toml_config)
+    if not result_open_repository["is_working"]:
+        msg = "Failed to open repository: " + result_open_repository["msg"]
+        logger.error(msg)
+        return {"is_working": False, "msg": msg}
+
+    db = result_open_repository["db"]
+    packs_folder = result_open_repository["packs_folder"]
+    backups_to_save_local = toml_config["BACKUPS_TO_SAVE_LOCAL"]
+
+    try:
+        with db:
+            # Snapshot names start with a timestamp so they sort by age.
+            names = [row[0] for row in db.execute("SELECT name FROM snapshots ORDER BY name DESC")]
+            for name in names[backups_to_save_local:]:
+                logger.info("forgetting snapshot " + name)
+                db.execute("DELETE FROM snapshot_chunks WHERE snapshot = ?", (name,))
+                db.execute("DELETE FROM snapshots WHERE name = ?", (name,))
+
+            used_packs = set(row[0] for row in db.execute(
+                    "SELECT pack FROM snapshots UNION SELECT DISTINCT chunks.pack FROM chunks JOIN snapshot_chunks ON chunks.id = snapshot_chunks.chunk"
+                    ))
+
+            unused_packs = []
+            for pack in sorted(os.listdir(packs_folder)):
+                if pack in used_packs:
+                    continue
+                db.execute("DELETE FROM chunks WHERE pack = ?", (pack,))
+                unused_packs.append(os.path.join(packs_folder, pack))
+    finally:
+        db.close()
+
+    return {"is_working": True, "msg": "done", "unused_packs": unused_packs}
+
+def read_pack(logger:logging.Logger, toml_config:dict, pack_file:str, tmp_folder:str) -> tarfile.TarFile:
+    """Open a pack as a tar file, encrypted packs are decrypted to tmp_folder first.
+
+    Raises:
+        subprocess.CalledProcessError: If gpg fails to decrypt the pack.
+    """
+    if not pack_file.endswith(".gpg"):
+        return tarfile.open(pack_file, mode="r:")
+
+    decrypted_file = os.path.join(tmp_folder, os.path.basename(pack_file)[:-len(".gpg")])
+    subprocess.run(
+            [toml_config["GPG_ENCRYPTION"]["GPG_BIN"], "--batch", "--yes", "-d", "-o", decrypted_file, pack_file],
+            check=True,
+            stdout=subprocess.PIPE,
+            stderr=subprocess.PIPE
+            )
+    return tarfile.open(decrypted_file, mode="r:")
+
+def restore_snapshot(logger:logging.Logger, toml_config:dict, name:str, dst_folder:str) -> dict:
+    """Restore all folders and files of a snapshot into dst_folder.
+
+    Encrypted packs need the secret key of GPG_ENCRYPTION.PUBKEY_FINGERPRINT in
+    the gpg keystore.
+
+    Args:
+        logger (logging.Logger): Logger object for recording operations.
+        toml_config (dict): Configuration dictionary with backup settings.
+        name (str): Name of the snapshot, for example backup_20250101020000.
+        dst_folder (str): Folder to restore the snapshot into.
+
+    Returns:
+        dict: Result containing status information:
+            {"is_working": bool, "msg": str}
+
+    Error Responses:
+        {"is_working": False, "msg": "Failed to open repository: <error message>"}: If the repository can not be opened
+        {"is_working": False, "msg": "snapshot <name> does not exist"}: If the snapshot is not in the repository
+        {"is_working": False, "msg": "chunk <id> is missing in the repository"}: If a chunk used by the snapshot is missing
+        {"is_working": False, "msg": "Error during restore process: <error>"}: For other errors
+
+    Success Response:
+        {"is_working": True, "msg": "restored snapshot <name> successfully"}
+    """
+    result_open_repository = open_repository(logger, toml_config)
+    if not result_open_repository["is_working"]:
+        msg = "Failed to open repository: " + result_open_repository["msg"]
+        logger.error(msg)
+        return {"is_working": False, "msg": msg}
+
+    db = result_open_repository["db"]
+    packs_folder = result_open_repository["packs_folder"]
+
+    try:
+        row = db.execute("SELECT pack FROM snapshots WHERE name = ?", (name,)).fetchone()
+        if row is None:
+            msg = "snapshot " + name + " does not exist"
+            logger.error(msg)
+            return {"is_working": False, "msg": msg}
+
+        with tempfile.TemporaryDirectory() as tmp_folder:
+            # Read the manifest of the snapshot.
+            with read_pack(logger, toml_config, os.path.join(packs_folder, row[0]), tmp_folder) as tar:
+                manifest = json.load(tar.extractfile(SNAPSHOT_MEMBER))
+
+            # Find the pack of every chunk used by the snapshot.
+            chunks_by_pack = {}
+            for entry in manifest["files"]:
+                for cid in entry["chunks"]:
+                    chunk_row = db.execute("SELECT pack FROM chunks WHERE id = ?", (cid,)).fetchone()
+                    if chunk_row is None:
+                        msg = "chunk " + cid + " is missing in the repository"
+                        logger.error(msg)
+                        return {"is_working": False, "msg": msg}
+                    chunks_by_pack.setdefault(chunk_row[0], set()).add(cid)
+
+            # Extract the chunks, one pack at a time.
+            chunks_folder = os.path.join(tmp_folder, "chunks")
+            os.makedirs(chunks_folder)
+            for pack, cids in chunks_by_pack.items():
+                with read_pack(logger, toml_config, os.path.join(packs_folder, pack), tmp_folder) as tar:
+                    for member in tar:
+                        cid = member.name[len("chunks/"):]
+                        if member.name.startswith("chunks/") and cid in cids:
+                            with open(os.path.join(chunks_folder, cid), "wb") as f:
+                                f.write(zlib.decompress(tar.extractfile(member).read()))
+                remove_partial_file(os.path.join(tmp_folder, pack[:-len(".gpg")]))
+
+            restore_entries(manifest["files"], chunks_folder, dst_folder)
+    except Exception as e:
+        msg = f"Error during restore process: {str(e)}"
+        logger.error(msg)
+        return {"is_working": False, "msg": msg}
+    finally:
+        db.close()
+
+    msg = "restored snapshot " + name + " successfully"
+    logger.info(msg)
+    return {"is_working": True, "msg": msg}
+
+def restore_entries(entries:list[dict], chunks_folder:str, dst_folder:str) -> None:
+    """Create the folders, files and symlinks of a snapshot manifest in dst_folder."""
+    folders = []
+
+    for entry in entries:
+        path = os.path.join(dst_folder, entry["path"])
+        kind = entry["type"].encode("ascii")
+
+        if kind == tarfile.DIRTYPE:
+            os.makedirs(path, exist_ok=True)
+            folders.append((path, entry))
+            continue
+
+        os.makedirs(os.path.dirname(path), exist_ok=True)
+
+        if kind == tarfile.SYMTYPE:
+            os.symlink(entry["linkname"], path)
+        elif kind == tarfile.REGTYPE:
+            with open(path, "wb") as f:
+                for cid in entry["chunks"]:
+                    with open(os.path.join(chunks_folder, cid), "rb") as chunk_file:
+                        f.write(chunk_file.read())
+            os.chmod(path, entry["mode"])
+            os.utime(path, (entry["mtime"], entry["mtime"]))
+
+    # Set folder times last, creating files in them changes the times.
+    for path, entry in reversed(folders):
+        os.chmod(path, entry["mode"])
+        os.utime(path, (entry["mtime"], entry["mtime"]))
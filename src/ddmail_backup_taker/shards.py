@@ -0,0 +1,160 @@
+import os
+import json
+import logging
+import hashlib
+import concurrent.futures
+from ddmail_backup_taker.archive import stream_archive, stream_tar_process, remove_partial_backup
+
+def plan_shards(logger:logging.Logger, data_to_backup:list[str], depth:int) -> list[dict]:
+    """Split the paths to backup into shards that can be archived concurrently.
+
+    With depth 0 every path in data_to_backup is one shard. With depth 1 every
+    folder directly under a path is one shard, for example every user folder under
+    /var/mail, with depth 2 every folder two levels down and so on. The folders
+    above the shard folders and the files in them are archived without recursion in
+    one extra shard, first in the list.
+
+    Args:
+        logger (logging.Logger): Logger object for recording operations.
+        data_to_backup (list[str]): List of files and folders to include in the backup.
+        depth (int): Folder depth under each path where shards are made.
+
+    Returns:
+        list[dict]: One {"paths": list[str], "recursive": bool} per shard.
+    """
+    shards = []
+    base_paths = []
+
+    for data in data_to_backup:
+        if not os.path.lexists(data):
+            logger.warning("path " + data + " does not exist, skipping it")
+            continue
+
+        if depth == 0 or not os.path.isdir(data) or os.path.islink(data):
+            shards.append({"paths": [data], "recursive": True})
+            continue
+
+        base_paths.append(data)
+        folders = [data]
+
+        for level in range(1, depth + 1):
+            next_folders = []
+            for folder in folders:
+                # A folder that can not be read is archived without its content, like iter_paths() does.
+                try:
+                    names = sorted(os.listdir(folder))
+                except OSError as e:
+                    logger.warning(str(e))
+                    continue
+
+                for name in names:
+                    path = os.path.join(folder, name)
+                    is_folder = os.path.isdir(path) and not os.path.islink(path)
+
+                    if is_folder and level == depth:
+                        shards.append({"paths": [path], "recursive": True})
+                    elif is_folder:
+                        base_paths.append(path)
+                        next_folders.append(path)
+                    else:
+                        base_paths.append(path)
+            folders = next_folders
+
+    if base_paths:
+        shards.insert(0, {"paths": base_paths, "recursive": False})
+
+    return shards
+
+def shard_file(backup_file:str, extension:str, number:int) -> str:
+    """Get the file name of a shard, backup_<ts>.shard001.tar.gz for backup_<ts>.tar.gz."""
+    return backup_file[:-len(extension)] + f".shard{number:03d}" + extension
+
+def archive_shard(logger:logging.Logger, toml_config:dict, shard:dict, backup_file:str) -> dict:
+    """Archive one shard with the configured archive engine."""
+    if toml_config.get("ARCHIVE", {}).get("ENGINE", "tar") == "python":
+        return stream_archive(logger, toml_config, shard["paths"], backup_file, recursive=shard["recursive"])
+
+    tar_cmd = [toml_config["TAR_BIN"], "-cf", "-"]
+    if not shard["recursive"]:
+        tar_cmd.append("--no-recursion")
+    return stream_tar_process(logger, toml_config, tar_cmd + shard["paths"], backup_file)
+
+def archive_shards(logger:logging.Logger, toml_config:dict, data_to_backup:list[str], backup_file:str, extension:str) -> dict:
+    """Archive the paths to backup as shards with a bounded pool of concurrent workers.
+
+    The shards from plan_shards() are archived by ARCHIVE.SHARD_WORKERS workers at
+    the same time, every shard into its own backup file that is compressed and
+    encrypted on its own. The json manifest backup_file.manifest ties the shards of
+    the backup set together with the paths, files and checksum of every shard.
+
+    Args:
+        logger (logging.Logger): Logger object for recording operations.
+        toml_config (dict): Configuration dictionary with backup settings.
+        data_to_backup (list[str]): List of files and folders to include in the backup.
+        backup_file (str): Full path of the backup file, the shards and manifest are named after it.
+        extension (str): Archive extension of backup_file, including .gpg when encrypted.
+
+    Returns:
+        dict: Result containing status information, checksum and files:
+            {"is_working": bool, "msg": str, "sha256": str, "backup_size": int, "backup_files": list[str], "manifest_file": str}
+
+    Error Responses:
+        {"is_working": False, "msg": "shard <number> failed: <error message>"}: If archiving a shard fails
+
+    Success Response:
+        {"is_working": True, "msg": "finished successfully", "sha256": "<checksum of manifest>", "backup_size": <bytes>, "backup_files": ["<path>"], "manifest_file": "<path>"}
+    """
+    archive_config = toml_config.get("ARCHIVE", {})
+    shards = plan_shards(logger, data_to_backup, archive_config.get("SHARD_DEPTH", 0))
+    workers = archive_config.get("SHARD_WORKERS", 4)
+
+    logger.info("archiving " + str(len(shards)) + " shards with " + str(workers) + " workers")
+
+    with concurrent.futures.ThreadPoolExecutor(max_workers=workers) as executor:
+        futures = [
+                executor.submit(archive_shard, logger, toml_config, shard, shard_file(backup_file, extension, number))
+                for number, shard in enumerate(shards, start=1)
+                ]
+        results = [future.result() for future in futures]
+
+    # Check if any shard failed, then the whole backup set is removed.
+    for number, result in enumerate(results, start=1):
+        if not result["is_working"]:
+            for other_number in range(1, len(shards) + 1):
+                remove_partial_backup(shard_file(backup_file, extension, other_number))
+            msg = "shard " + str(number) + " failed: " + result["msg"]
+            logger.error(msg)
+            return {"is_working": False, "msg": msg}
+
+    manifest = {
+            "backup_filename": os.path.basename(backup_file),
+            "shards": [
+                {
+                    "paths": shard["paths"],
+                    "recursive": shard["recursive"],
+                    "filename": os.path.basename(shard_file(backup_file, extension, number)),
+                    "files": [os.path.basename(file) for file in result["backup_files"]],
+                    "sha256": result["sha256"],
+                    "size": result["backup_size"],
+                    }
+                for number, (shard, result) in enumerate(zip(shards, results), start=1)
+                ]
+            }
+
+    manifest_file = backup_file + ".manifest"
+    manifest_data = json.dumps(manifest, indent=4).encode("utf-8")
+    with open(manifest_file, "wb") as f:
+        f.write(manifest_data)
+
+    backup_files = [file for result in results for file in result["backup_files"]]
+    backup_files.append(manifest_file)
+
+    msg = "finished successfully"
+    return {
+            "is_working": True,
+            "msg": msg,
+            "sha256": hashlib.sha256(manifest_data).hexdigest(),
+            "backup_size": sum(result["backup_size"] for result in results),
+            "backup_files": backup_files,
+            "manifest_file": manifest_file
+            }
@@ -0,0 +1,170 @@
+import hashlib
+import subprocess
+import tempfile
+import threading
+from typing import Iterable, Iterator
+
+# 1mb, size of the buffers passed between the stages.
+BUF_SIZE = 1048576
+
+# Folder under SAVE_BACKUPS_TO where the state kept between runs is saved.
+SNAPSHOT_FOLDER = "snapshots"
+
+def count_stage(chunks:Iterable[bytes], stats:dict) -> Iterator[bytes]:
+    """Pass buffers through unchanged while counting the bytes in stats["bytes"]."""
+    for chunk in chunks:
+        stats["bytes"] = stats["bytes"] + len(chunk)
+        yield chunk
+
+def hash_stage(chunks:Iterable[bytes], hasher) -> Iterator[bytes]:
+    """Pass buffers through unchanged while updating a hashlib object."""
+    for chunk in chunks:
+        hasher.update(chunk)
+        yield chunk
+
+def process_source(cmd:list[str]) -> Iterator[bytes]:
+    """Yield the stdout of a subprocess as buffers.
+
+    Raises:
+        subprocess.CalledProcessError: If the subprocess exits with a non zero return code.
+    """
+    stderr_file = tempfile.TemporaryFile()
+    process = subprocess.Popen(
+            cmd,
+            stdout=subprocess.PIPE,
+            stderr=stderr_file
+            )
+
+    try:
+        while True:
+            data = process.stdout.read(BUF_SIZE)
+            if not data:
+                break
+            yield data
+    finally:
+        process.stdout.close()
+        process.wait()
+
+    if process.returncode != 0:
+        stderr_file.seek(0)
+        stderr = stderr_file.read()
+        stderr_file.close()
+        raise subprocess.CalledProcessError(process.returncode, cmd, stderr=stderr)
+
+    stderr_file.close()
+
+def process_stage(chunks:Iterable[bytes], cmd:list[str]) -> Iterator[bytes]:
+    """Pass buffers through a subprocess that reads stdin and writes stdout.
+
+    A thread feeds the subprocess stdin while the generator reads its stdout.
+
+    Raises:
+        subprocess.CalledProcessError: If the subprocess exits with a non zero return code.
+    """
+    stderr_file = tempfile.TemporaryFile()
+    process = subprocess.Popen(
+            cmd,
+            stdin=subprocess.PIPE,
+            stdout=subprocess.PIPE,
+            stderr=stderr_file
+            )
+    feed_errors = []
+
+    def feed():
+        try:
+            for chunk in chunks:
+                process.stdin.write(chunk)
+        except BrokenPipeError:
+            # The subprocess has exited, its return code tells why.
+            pass
+        except BaseException as e:
+            feed_errors.append(e)
+        finally:
+            try:
+                process.stdin.close()
+            except BrokenPipeError:
+                pass
+
+    feeder = threading.Thread(target=feed, daemon=True)
+    feeder.start()
+
+    try:
+        while True:
+            data = process.stdout.read(BUF_SIZE)
+            if not data:
+                break
+            yield data
+    finally:
+        process.stdout.close()
+        feeder.join()
+        process.wait()
+
+    # Errors from earlier stages are raised before the subprocess return code.
+    if feed_errors:
+        raise feed_errors[0]
+
+    if process.returncode != 0:
+        stderr_file.seek(0)
+        stderr = stderr_file.read()
+        stderr_file.close()
+        raise subprocess.CalledProcessError(process.returncode, cmd, stderr=stderr)
+
+    stderr_file.close()
+
+def write_stage(chunks:Iterable[bytes], path:str) -> int:
+    """Write all buffers to a file and return the number of bytes written."""
+    written = 0
+    with open(path, "wb") as f:
+        for chunk in chunks:
+            f.write(chunk)
+            written = written + len(chunk)
+    return written
+
+def volume_file(path:str, number:int) -> str:
+    """Get the file name of a volume, numbered from 1 as path.001, path.002 and so on."""
+    return f"{path}.{number:03d}"
+
+def write_volumes_stage(chunks:Iterable[bytes], path:str, volume_size:int) -> list[dict]:
+    """Write buffers to numbered volume files of at most volume_size bytes each.
+
+    Every volume is closed and its SHA256 checksum is known as soon as it is full,
+    joining the volumes in order gives the complete stream.
+
+    Returns:
+        list[dict]: One {"file": str, "size": int, "sha256": str} per volume.
+    """
+    volumes = []
+    f = None
+    sha256 = None
+    size = 0
+
+    def close_volume():
+        f.close()
+        volumes.append({"file": volume_file(path, len(volumes) + 1), "size": size, "sha256": sha256.hexdigest()})
+
+    for chunk in chunks:
+        view = memoryview(chunk)
+        while view:
+            if f is None:
+                f = open(volume_file(path, len(volumes) + 1), "wb")
+                sha256 = hashlib.sha256()
+                size = 0
+
+            data = view[:volume_size - size]
+            f.write(data)
+            sha256.update(data)
+            size = size + len(data)
+            view = view[len(data):]
+
+            if size == volume_size:
+                close_volume()
+                f = None
+
+    # The last volume, an empty stream still gets one volume.
+    if f is not None or not volumes:
+        if f is None:
+            f = open(volume_file(path, 1), "wb")
+            sha256 = hashlib.sha256()
+        close_volume()
+
+    return volumes
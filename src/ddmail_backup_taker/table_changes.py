@@ -0,0 +1,236 @@
+import os
+import json
+import logging
+import subprocess
+import concurrent.futures
+from typing import Optional
+from ddmail_backup_taker.chunked_dump import quote_identifier, quote_string, unescape_batch
+from ddmail_backup_taker.compression import compress_stage
+from ddmail_backup_taker.delta import backup_exists
+from ddmail_backup_taker.mariadb import SKIPPED_DATABASES, db_dump_file_of, dump_cmd, dump_compression_config, dump_database, dump_extension
+from ddmail_backup_taker.stages import process_source, write_stage
+
+# Filename of the table fingerprints in the snapshots folder.
+TABLE_STATE = "mariadb_tables.json"
+
+# Filename of the manifest of the dumped and unchanged tables next to the table dumps.
+TABLE_MANIFEST = "mariadb_tables.json"
+
+# Ways to tell if a table changed, CHECKSUM TABLE reads every row, update_time only reads information_schema.
+CHANGE_DETECTIONS = ["checksum", "update_time"]
+
+def query_rows(toml_config:dict, sql:str) -> list[list[str]]:
+    """Run statements with the mariadb client and return the rows of the output as lists of columns.
+
+    Raises:
+        subprocess.CalledProcessError: If the mariadb command fails.
+    """
+    output = subprocess.run(
+            [toml_config["MARIADB"].get("MARIADB_BIN", "/usr/bin/mariadb"),
+             "-h",
+             "localhost",
+             "-uroot",
+             "-p" + toml_config["MARIADB"]["ROOT_PASSWORD"],
+             "-N",
+             "-B",
+             "-e",
+             sql],
+            check=True,
+            stdout=subprocess.PIPE
+            )
+
+    return [
+            [unescape_batch(column).decode("utf-8") for column in line.split(b"\t")]
+            for line in output.stdout.splitlines() if line
+            ]
+
+def list_table_fingerprints(logger:logging.Logger, toml_config:dict) -> dict:
+    """List the tables to dump with a fingerprint that changes when the table changes.
+
+    With MARIADB.CHANGE_DETECTION checksum the fingerprint is the result of
+    CHECKSUM TABLE. With update_time it is the UPDATE_TIME, TABLE_ROWS and
+    DATA_LENGTH of the table in information_schema, which costs nothing but is not
+    kept by every storage engine. A table without a fingerprint is always dumped.
+
+    Args:
+        logger (logging.Logger): Logger object for recording operations.
+        toml_config (dict): Configuration dictionary with backup settings.
+
+    Returns:
+        dict: Result containing status information and tables:
+            {"is_working": bool, "msg": str, "tables": list[dict]}
+
+    Error Responses:
+        {"is_working": False, "msg": "returncode of cmd mariadb is none zero"}: If the mariadb command fails
+
+    Success Response:
+        {"is_working": True, "msg": "done", "tables": [{"database": "<database>", "table": "<table>", "fingerprint": "<fingerprint>"}]}
+    """
+    skipped = ",".join(quote_string(database) for database in SKIPPED_DATABASES)
+
+    try:
+        rows = query_rows(toml_config,
+                "SELECT TABLE_SCHEMA, TABLE_NAME, IFNULL(UPDATE_TIME, ''), IFNULL(TABLE_ROWS, ''), IFNULL(DATA_LENGTH, '') FROM information_schema.TABLES"
+                " WHERE TABLE_TYPE IN ('BASE TABLE', 'SYSTEM VERSIONED') AND TABLE_SCHEMA NOT IN (" + skipped + ")"
+                " ORDER BY TABLE_SCHEMA, TABLE_NAME;")
+
+        if toml_config["MARIADB"].get("CHANGE_DETECTION", "checksum") == "checksum":
+            # One CHECKSUM TABLE per table so every result row matches its table in order.
+            checksums = []
+            if rows:
+                checksums = query_rows(toml_config, "\n".join(
+                    "CHECKSUM TABLE " + quote_identifier(database) + "." + quote_identifier(table) + ";"
+                    for database, table, *_ in rows))
+            fingerprints = [checksum[1] if checksum[1] != "NULL" else None for checksum in checksums]
+        else:
+            fingerprints = [update_time + "|" + table_rows + "|" + data_length if update_time else None for _, _, update_time, table_rows, data_length in rows]
+    except subprocess.CalledProcessError:
+        msg = "returncode of cmd mariadb is none zero"
+        logger.error(msg)
+        return {"is_working": False, "msg": msg}
+
+    tables = [
+            {"database": row[0], "table": row[1], "fingerprint": fingerprint}
+            for row, fingerprint in zip(rows, fingerprints)
+            ]
+
+    return {"is_working": True, "msg": "done", "tables": tables}
+
+def load_table_state(state_file:str) -> dict:
+    """Load the fingerprints and backups of the tables saved by the last successful run, keyed by (database, table)."""
+    if not os.path.isfile(state_file):
+        return {}
+
+    with open(state_file, "r") as f:
+        return {(table["database"], table["table"]): table for table in json.load(f)["tables"]}
+
+def table_backups(state_file:str) -> dict[str, list[str]]:
+    """Get the older backups that hold the unchanged tables of every backup, keyed by backup filename."""
+    if not os.path.isfile(state_file):
+        return {}
+
+    with open(state_file, "r") as f:
+        return json.load(f).get("references", {})
+
+def save_table_state(logger:logging.Logger, toml_config:dict, state_file:str, tables:list[dict], backup_filename:str) -> None:
+    """Save the fingerprints of the tables after a successful run.
+
+    Tables dumped by this run get backup_filename as the backup that holds them,
+    unchanged tables keep the backup they were last dumped to. Every backup that
+    is still in SAVE_BACKUPS_TO is listed with the older backups its manifest
+    references, so clear_backups() keeps those backups.
+    """
+    os.makedirs(os.path.dirname(state_file), exist_ok=True)
+
+    state = [dict(table, backup_filename=table["backup_filename"] or backup_filename) for table in tables]
+
+    references = {
+            backup: referenced for backup, referenced in table_backups(state_file).items()
+            if backup_exists(toml_config["SAVE_BACKUPS_TO"], backup)
+            }
+    references[backup_filename] = sorted(set(table["backup_filename"] for table in tables if table["backup_filename"]))
+
+    # Write state to a temporary file first so a crash never leaves a broken state.
+    with open(state_file + ".tmp", "w") as f:
+        json.dump({"tables": state, "references": references}, f)
+    os.replace(state_file + ".tmp", state_file)
+
+    logger.debug("saved fingerprints of " + str(len(state)) + " tables")
+
+def is_unchanged(toml_config:dict, table:dict, previous:Optional[dict]) -> bool:
+    """Check if a table has the same fingerprint as in a backup that is still in SAVE_BACKUPS_TO, as one file, volumes or shards."""
+    return (
+            previous is not None
+            and table["fingerprint"] is not None
+            and previous["fingerprint"] == table["fingerprint"]
+            and backup_exists(toml_config["SAVE_BACKUPS_TO"], previous["backup_filename"])
+            )
+
+def backup_changed_tables(logger:logging.Logger, toml_config:dict, state_file:str, dst_folder:str) -> dict:
+    """Dump only the MariaDB tables that changed since they were last dumped.
+
+    Every table with a new fingerprint, see list_table_fingerprints(), is dumped to
+    its own file by MARIADB.PARALLELISM concurrent workers. A table with the same
+    fingerprint as in the state file is referenced from the backup it was last
+    dumped to, as long as that backup is still in SAVE_BACKUPS_TO. The schema of
+    every database is always dumped. The manifest TABLE_MANIFEST lists the file
+    of every table and the backup that holds it, null for this backup.
+
+    Args:
+        logger (logging.Logger): Logger object for recording operations.
+        toml_config (dict): Configuration dictionary with backup settings.
+        state_file (str): Table state file saved by the last successful run.
+        dst_folder (str): Directory where the table dumps will be saved.
+
+    Returns:
+        dict: Result containing status information, file paths and tables:
+            {"is_working": bool, "msg": str, "db_dump_files": list[str], "tables": list[dict]}
+
+    Error Responses:
+        {"is_working": False, "msg": "dst_folder do not exist"}: If destination folder doesn't exist
+        {"is_working": False, "msg": "<error message>"}: If the tables can not be listed
+        {"is_working": False, "msg": "returncode of cmd mariadbdump is none zero"}: If a schema dump fails
+        {"is_working": False, "msg": "dump of table <database>.<table> failed: <error message>"}: If dumping a table fails
+
+    Success Response:
+        {"is_working": True, "msg": "done", "db_dump_files": ["<path>"], "tables": [<table>]}
+    """
+    # Check if dst_folder exist.
+    if not os.path.exists(dst_folder):
+        msg = "dst_folder do not exist"
+        logger.error(msg)
+        return {"is_working": False, "msg": msg}
+
+    result_fingerprints = list_table_fingerprints(logger, toml_config)
+    if not result_fingerprints["is_working"]:
+        return result_fingerprints
+
+    previous_tables = load_table_state(state_file)
+    extension = dump_extension(toml_config)
+    tables = []
+    changed = []
+
+    for table in result_fingerprints["tables"]:
+        previous = previous_tables.get((table["database"], table["table"]))
+        if is_unchanged(toml_config, table, previous):
+            tables.append(dict(table, file=previous["file"], backup_filename=previous["backup_filename"]))
+        else:
+            file = os.path.basename(db_dump_file_of(dst_folder, table["database"], extension, table["table"]))
+            tables.append(dict(table, file=file, backup_filename=None))
+            changed.append(table)
+
+    # Dump the schema of every database.
+    db_dump_files = []
+    for database in sorted(set(table["database"] for table in tables)):
+        db_dump_file = db_dump_file_of(dst_folder, database, ".schema" + extension)
+        try:
+            write_stage(compress_stage(process_source(dump_cmd(toml_config, database, schema_only=True)), dump_compression_config(toml_config)), db_dump_file)
+        except subprocess.CalledProcessError:
+            msg = "returncode of cmd mariadbdump is none zero"
+            logger.error(msg)
+            return {"is_working": False, "msg": msg}
+        db_dump_files.append(db_dump_file)
+
+    parallelism = toml_config["MARIADB"].get("PARALLELISM", 4)
+    logger.info("dumping " + str(len(changed)) + " changed tables of " + str(len(tables)) + " with " + str(parallelism) + " workers")
+
+    with concurrent.futures.ThreadPoolExecutor(max_workers=parallelism) as executor:
+        futures = [executor.submit(dump_database, logger, toml_config, table["database"], dst_folder, table["table"]) for table in changed]
+        results = [future.result() for future in futures]
+
+    # Check if any dump failed.
+    for table, result in zip(changed, results):
+        if not result["is_working"]:
+            msg = "dump of table " + table["database"] + "." + table["table"] + " failed: " + result["msg"]
+            logger.error(msg)
+            return {"is_working": False, "msg": msg}
+
+    db_dump_files.extend(result["db_dump_file"] for result in results)
+
+    # The manifest tells where every table of this backup is.
+    manifest_file = os.path.join(dst_folder, TABLE_MANIFEST)
+    with open(manifest_file, "w") as f:
+        json.dump({"tables": tables}, f, indent=1)
+    db_dump_files.append(manifest_file)
+
+    return {"is_working": True, "msg": "done", "db_dump_files": db_dump_files, "tables": tables}
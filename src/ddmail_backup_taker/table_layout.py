@@ -0,0 +1,347 @@
+import os
+import json
+import zlib
+import queue
+import logging
+import subprocess
+import urllib.parse
+import concurrent.futures
+from typing import Iterable, Iterator, Optional, Union
+from ddmail_backup_taker.catalog import iter_file_chunks
+from ddmail_backup_taker.chunked_dump import chunk_source, close_session, kill_session, list_tables, quote_string, session_cmd, session_query, start_snapshot_sessions
+from ddmail_backup_taker.compression import compress_stage
+from ddmail_backup_taker.mariadb import SKIPPED_DATABASES, dump_cmd, dump_compression_config, dump_extension
+from ddmail_backup_taker.stages import process_source, process_stage, write_stage
+
+# Dump layouts, one dump file or a folder with a schema and a data file for every table.
+DUMP_LAYOUTS = ["file", "tables"]
+
+# Folder with the dump files of the tables layout.
+LAYOUT_FOLDER = "mariadb"
+
+# Filename of the manifest of the tables layout in LAYOUT_FOLDER.
+LAYOUT_MANIFEST = "manifest.json"
+
+def layout_file_of(database:str, name:Optional[str], kind:str, extension:str = ".sql") -> str:
+    """Get the path in LAYOUT_FOLDER of the database file when name is None, else of a schema, data or triggers file of a table or view.
+
+    Database and table names that are not safe in a file name are quoted.
+    """
+    folder = urllib.parse.quote(database, safe="")
+    if name is None:
+        return folder + "/database" + extension
+    return folder + "/" + urllib.parse.quote(name, safe="") + "." + kind + extension
+
+def layout_jobs(toml_config:dict, databases:list[str], objects:list[list[str]], tables:dict) -> tuple[dict, list[tuple[str, Union[list[str], dict]]]]:
+    """Plan the manifest and the (file, source) jobs of the tables layout.
+
+    Every database gets a database file with CREATE DATABASE, routines and events.
+    Every table gets a schema file without triggers, a data file and a triggers
+    file, so the data can be loaded before the triggers exist. Every view gets a
+    schema file.
+
+    The source is a mariadb-dump command, or for the data file of a table in
+    tables, keyed by (database, table) as listed by list_tables(), the table that
+    is read in a snapshot session.
+    """
+    extension = dump_extension(toml_config)
+    manifest = {"databases": []}
+    jobs = []
+
+    for database in databases:
+        entry = {"database": database, "file": layout_file_of(database, None, "database", extension), "tables": [], "views": []}
+        jobs.append((entry["file"], dump_cmd(toml_config, database, schema_only=True, options=["--no-create-info", "--routines", "--events", "--skip-triggers"])))
+
+        for object_database, name, table_type, data_length in objects:
+            if object_database != database:
+                continue
+
+            if table_type == "VIEW":
+                view = {"view": name, "schema": layout_file_of(database, name, "schema", extension)}
+                jobs.append((view["schema"], dump_cmd(toml_config, database, schema_only=True, table=name)))
+                entry["views"].append(view)
+                continue
+
+            table = {
+                    "table": name,
+                    "schema": layout_file_of(database, name, "schema", extension),
+                    "data": layout_file_of(database, name, "data", extension),
+                    "triggers": layout_file_of(database, name, "triggers", extension),
+                    "size": int(data_length),
+                    }
+            jobs.append((table["schema"], dump_cmd(toml_config, database, schema_only=True, table=name, options=["--skip-triggers"])))
+            jobs.append((table["data"], tables.get((database, name), dump_cmd(toml_config, database, table=name, options=["--no-create-info", "--skip-triggers"]))))
+            jobs.append((table["triggers"], dump_cmd(toml_config, database, schema_only=True, table=name, options=["--no-create-info"])))
+            entry["tables"].append(table)
+
+        manifest["databases"].append(entry)
+
+    return manifest, jobs
+
+def backup_mariadb_table_layout(logger:logging.Logger, toml_config:dict, dst_folder:str) -> dict:
+    """Dump the MariaDB databases as a folder with a schema and a data file for every table.
+
+    The files are written by MARIADB.PARALLELISM workers into
+    dst_folder/LAYOUT_FOLDER, see layout_jobs(), and listed in LAYOUT_MANIFEST.
+    Every worker has a mariadb client session and the sessions share one
+    consistent snapshot, see start_snapshot_sessions(), so the data files of all
+    tables are from the same point in time. The schema files are dumped with
+    mariadb-dump. restore_table_layout() loads the tables concurrently.
+
+    Args:
+        logger (logging.Logger): Logger object for recording operations.
+        toml_config (dict): Configuration dictionary with backup settings.
+        dst_folder (str): Directory where the dump folder will be saved.
+
+    Returns:
+        dict: Result containing status information and folder path:
+            {"is_working": bool, "msg": str, "db_dump_folder": str}
+
+    Error Responses:
+        {"is_working": False, "msg": "dst_folder do not exist"}: If destination folder doesn't exist
+        {"is_working": False, "msg": "returncode of cmd mariadb is none zero"}: If the snapshot sessions can not be started or the tables can not be listed
+        {"is_working": False, "msg": "can not create <folder>: <error>"}: If the dump folder can not be created
+        {"is_working": False, "msg": "dump of <file> failed: <error message>"}: If a dump fails
+
+    Success Response:
+        {"is_working": True, "msg": "done", "db_dump_folder": "<path>"}
+    """
+    # Check if dst_folder exist.
+    if not os.path.exists(dst_folder):
+        msg = "dst_folder do not exist"
+        logger.error(msg)
+        return {"is_working": False, "msg": msg}
+
+    skipped = ",".join(quote_string(database) for database in SKIPPED_DATABASES)
+    parallelism = toml_config["MARIADB"].get("PARALLELISM", 4)
+    sessions = []
+
+    try:
+        sessions = start_snapshot_sessions(toml_config, parallelism)
+
+        databases = [line.decode("utf-8") for line in session_query(sessions[0], "SELECT SCHEMA_NAME FROM information_schema.SCHEMATA WHERE SCHEMA_NAME NOT IN (" + skipped + ") ORDER BY SCHEMA_NAME;")]
+        objects = [line.decode("utf-8").split("\t") for line in session_query(sessions[0],
+                "SELECT TABLE_SCHEMA, TABLE_NAME, TABLE_TYPE, IFNULL(DATA_LENGTH, 0) FROM information_schema.TABLES"
+                " WHERE TABLE_SCHEMA NOT IN (" + skipped + ") ORDER BY TABLE_SCHEMA, TABLE_NAME;")]
+        tables = {(table["database"], table["table"]): table for table in list_tables(sessions[0])}
+    except subprocess.CalledProcessError:
+        for session in sessions:
+            kill_session(session)
+
+        msg = "returncode of cmd mariadb is none zero"
+        logger.error(msg)
+        return {"is_working": False, "msg": msg}
+
+    manifest, jobs = layout_jobs(toml_config, databases, objects, tables)
+    layout_folder = os.path.join(dst_folder, LAYOUT_FOLDER)
+    compression_config = dump_compression_config(toml_config)
+
+    try:
+        os.makedirs(layout_folder, exist_ok=True)
+        for database in databases:
+            os.makedirs(os.path.join(layout_folder, urllib.parse.quote(database, safe="")), exist_ok=True)
+    except OSError as e:
+        for session in sessions:
+            kill_session(session)
+
+        msg = "can not create " + layout_folder + ": " + str(e)
+        logger.error(msg)
+        return {"is_working": False, "msg": msg}
+
+    # The largest tables are read first so the workers finish at about the same time.
+    sizes = {table["data"]: table["size"] for entry in manifest["databases"] for table in entry["tables"]}
+    todo = queue.Queue()
+    for file, source in sorted(jobs, key=lambda job: sizes.get(job[0], 0), reverse=True):
+        todo.put((file, source))
+
+    def worker(session):
+        while True:
+            try:
+                file, source = todo.get_nowait()
+            except queue.Empty:
+                return None
+
+            if isinstance(source, dict):
+                chunks = chunk_source(session, source, (None, None))
+            else:
+                chunks = process_source(source)
+
+            try:
+                write_stage(compress_stage(chunks, compression_config), os.path.join(layout_folder, file))
+            except subprocess.CalledProcessError as e:
+                # A failed session can not read more tables, the worker stops at the first error.
+                if e.cmd[0] == toml_config["MARIADB"]["MARIADBDUMP_BIN"]:
+                    return file, "returncode of cmd mariadbdump is none zero"
+                if e.cmd[0] == session_cmd(toml_config)[0]:
+                    return file, "returncode of cmd mariadb is none zero"
+                return file, "returncode of cmd " + os.path.basename(e.cmd[0]) + " is none zero"
+            except Exception as e:
+                return file, str(e)
+
+    logger.info("dumping " + str(len(jobs)) + " files of " + str(len(databases)) + " databases with " + str(len(sessions)) + " workers from one snapshot")
+
+    try:
+        with concurrent.futures.ThreadPoolExecutor(max_workers=len(sessions)) as executor:
+            futures = [executor.submit(worker, session) for session in sessions]
+            errors = [future.result() for future in futures]
+    except BaseException:
+        # Killing the sessions rolls back their transactions so the snapshot is not held open.
+        for session in sessions:
+            kill_session(session)
+        raise
+
+    # Check if any dump failed.
+    for error in errors:
+        if error is not None:
+            for session in sessions:
+                kill_session(session)
+
+            msg = "dump of " + error[0] + " failed: " + error[1]
+            logger.error(msg)
+            return {"is_working": False, "msg": msg}
+
+    try:
+        for session in sessions:
+            close_session(session)
+    except subprocess.CalledProcessError:
+        for session in sessions:
+            kill_session(session)
+
+        msg = "returncode of cmd mariadb is none zero"
+        logger.error(msg)
+        return {"is_working": False, "msg": msg}
+
+    with open(os.path.join(layout_folder, LAYOUT_MANIFEST), "w") as f:
+        json.dump(manifest, f, indent=1)
+
+    return {"is_working": True, "msg": "done", "db_dump_folder": layout_folder}
+
+def gunzip_stage(chunks:Iterable[bytes]) -> Iterator[bytes]:
+    """Decompress a gzip stream of buffers."""
+    decompressor = zlib.decompressobj(16 + zlib.MAX_WBITS)
+    for chunk in chunks:
+        data = decompressor.decompress(chunk)
+        if data:
+            yield data
+    data = decompressor.flush()
+    if data:
+        yield data
+
+def restore_cmd(toml_config:dict, database:Optional[str] = None) -> list[str]:
+    """Build the mariadb client command line that runs a dump file read from stdin in database."""
+    cmd = [toml_config["MARIADB"].get("MARIADB_BIN", "/usr/bin/mariadb"),
+           "-h",
+           "localhost",
+           "-uroot",
+           "-p" + toml_config["MARIADB"]["ROOT_PASSWORD"]]
+
+    if database is not None:
+        cmd = cmd + [database]
+    return cmd
+
+def restore_file(toml_config:dict, path:str, database:Optional[str] = None) -> None:
+    """Run a dump file of the tables layout with the mariadb client, a .gz or .zst file is decompressed first.
+
+    Raises:
+        subprocess.CalledProcessError: If the mariadb client or the decompressor exits with a non zero return code.
+    """
+    chunks = iter_file_chunks([path])
+
+    if path.endswith(".gz"):
+        chunks = gunzip_stage(chunks)
+    elif path.endswith(".zst"):
+        chunks = process_stage(chunks, [toml_config["MARIADB"].get("COMPRESSION_BIN", "/usr/bin/zstd"), "-q", "-d", "-c"])
+
+    for _ in process_stage(chunks, restore_cmd(toml_config, database)):
+        pass
+
+def restore_table_layout(logger:logging.Logger, toml_config:dict, dump_folder:str, workers:int = 4) -> dict:
+    """Restore a dump folder of the tables layout with a bounded pool of concurrent mariadb clients.
+
+    The database files run first, then the table schemas and the table data with
+    at most workers files at the same time, the largest tables first. The triggers
+    and views run last, when every table they use exists. The views run one at a
+    time, a view that fails because it uses a view that is not restored yet is
+    tried again after the other views.
+
+    Args:
+        logger (logging.Logger): Logger object for recording operations.
+        toml_config (dict): Configuration dictionary with backup settings.
+        dump_folder (str): Folder with the LAYOUT_MANIFEST and the dump files.
+        workers (int): Number of files restored at the same time.
+
+    Returns:
+        dict: Result containing status information and number of restored tables:
+            {"is_working": bool, "msg": str, "tables": int}
+
+    Error Responses:
+        {"is_working": False, "msg": "manifest <path> does not exist"}: If the folder is not a dump of the tables layout
+        {"is_working": False, "msg": "restore of <file> failed: returncode of cmd <cmd> is none zero"}: If a file can not be restored
+
+    Success Response:
+        {"is_working": True, "msg": "done", "tables": <number of tables>}
+    """
+    manifest_file = os.path.join(dump_folder, LAYOUT_MANIFEST)
+
+    # Check if manifest exist.
+    if not os.path.isfile(manifest_file):
+        msg = "manifest " + manifest_file + " does not exist"
+        logger.error(msg)
+        return {"is_working": False, "msg": msg}
+
+    with open(manifest_file, "r") as f:
+        manifest = json.load(f)
+
+    databases = manifest["databases"]
+    tables = [(entry["database"], table) for entry in databases for table in entry["tables"]]
+    largest_first = sorted(tables, key=lambda item: item[1]["size"], reverse=True)
+
+    # Every step is a list of (file, database) restored concurrently, the steps run in order.
+    steps = [
+            [(entry["file"], None) for entry in databases],
+            [(table["schema"], database) for database, table in tables],
+            [(table["data"], database) for database, table in largest_first],
+            [(table["triggers"], database) for database, table in tables],
+            ]
+
+    views = [(view["schema"], entry["database"]) for entry in databases for view in entry["views"]]
+
+    def restore(file, database):
+        try:
+            restore_file(toml_config, os.path.join(dump_folder, file), database)
+        except subprocess.CalledProcessError as e:
+            return "returncode of cmd " + os.path.basename(e.cmd[0]) + " is none zero"
+        return None
+
+    logger.info("restoring " + str(len(tables)) + " tables with " + str(workers) + " workers")
+
+    with concurrent.futures.ThreadPoolExecutor(max_workers=workers) as executor:
+        for step in steps:
+            futures = [executor.submit(restore, file, database) for file, database in step]
+            errors = [future.result() for future in futures]
+
+            # Check if any restore failed.
+            for (file, _), error in zip(step, errors):
+                if error is not None:
+                    msg = "restore of " + file + " failed: " + error
+                    logger.error(msg)
+                    return {"is_working": False, "msg": msg}
+
+    # Views can use views later in the manifest, the views that fail are tried again as long as another view was restored.
+    while views:
+        failed = []
+        for file, database in views:
+            error = restore(file, database)
+            if error is not None:
+                failed.append((file, database, error))
+
+        # Check if no view could be restored in this round.
+        if len(failed) == len(views):
+            file, _, error = failed[0]
+            msg = "restore of " + file + " failed: " + error
+            logger.error(msg)
+            return {"is_working": False, "msg": msg}
+
+        views = [(file, database) for file, database, _ in failed]
+
+    return {"is_working": True, "msg": "done", "tables": len(tables)}
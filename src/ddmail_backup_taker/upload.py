@@ -0,0 +1,349 @@
+import os
+import json
+import hashlib
+import logging
+import secrets
+import concurrent.futures
+from typing import Iterator, Optional
+import requests
+import requests.adapters
+from ddmail_backup_taker.stages import BUF_SIZE, SNAPSHOT_FOLDER
+
+# Upload modes, single sends the whole file in one request, chunked sends numbered chunks that can be resumed.
+UPLOAD_MODES = ["single", "chunked"]
+
+# 16mb, default size of a chunk of the chunked upload.
+UPLOAD_CHUNK_SIZE = 16777216
+
+# Prefix of the files in the snapshots folder holding the progress of a chunked upload.
+UPLOAD_PROGRESS_PREFIX = "upload_"
+
+class MultipartFileBody:
+    """Multipart form data body of form fields and one file that is read from disk while it is sent.
+
+    requests builds a body from files= in memory, this body is passed as data= and
+    read in the buffer sizes asked for by the HTTP connection, so memory use does
+    not grow with the file. The length is known up front so the body is sent with
+    a Content-Length header like the body requests would have built. The file is
+    opened by the with statement and closed when it ends.
+
+    Args:
+        fields (dict): Form fields sent before the file, name to value.
+        file_field (str): Name of the form field of the file.
+        path (str): Path of the file to send.
+        filename (str): Filename sent for the file, the basename of path by default.
+        offset (int): Offset of the first byte of the file to send.
+        length (int): Number of bytes of the file to send, the rest of the file by default.
+    """
+
+    def __init__(self, fields:dict, file_field:str, path:str, filename:Optional[str] = None, offset:int = 0, length:Optional[int] = None):
+        self.boundary = secrets.token_hex(16)
+        self.path = path
+        self.offset = offset
+        self.file_size = length if length is not None else os.path.getsize(path) - offset
+        self.position = 0
+        self.f = None
+
+        filename = filename if filename is not None else os.path.basename(path)
+        head = b""
+        for name, value in fields.items():
+            head = head + self.part_header(name) + b"\r\n" + str(value).encode("utf-8") + b"\r\n"
+        head = head + self.part_header(file_field, filename) + b"Content-Type: application/octet-stream\r\n\r\n"
+
+        self.head = head
+        self.tail = b"\r\n--" + self.boundary.encode("ascii") + b"--\r\n"
+
+    def part_header(self, name:str, filename:Optional[str] = None) -> bytes:
+        """Build the boundary and Content-Disposition header of a part, quoted like requests does."""
+        def quote(value):
+            return value.replace("\\", "\\\\").replace('"', "%22").replace("\r", "%0D").replace("\n", "%0A")
+
+        disposition = 'form-data; name="' + quote(name) + '"'
+        if filename is not None:
+            disposition = disposition + '; filename="' + quote(filename) + '"'
+        return ("--" + self.boundary + "\r\nContent-Disposition: " + disposition + "\r\n").encode("utf-8")
+
+    @property
+    def content_type(self) -> str:
+        """The Content-Type header of the body."""
+        return "multipart/form-data; boundary=" + self.boundary
+
+    def __len__(self) -> int:
+        return len(self.head) + self.file_size + len(self.tail)
+
+    def __enter__(self):
+        self.f = open(self.path, "rb")
+        self.f.seek(self.offset)
+        return self
+
+    def __exit__(self, *exc_info):
+        self.f.close()
+
+    def read(self, size:int = -1) -> bytes:
+        """Read up to size bytes of the body, the rest of the body when size is negative.
+
+        Raises:
+            OSError: If the file is shorter than when the body was created.
+        """
+        if size is None or size < 0:
+            size = len(self) - self.position
+
+        data = []
+        file_end = len(self.head) + self.file_size
+        while size > 0 and self.position < len(self):
+            if self.position < len(self.head):
+                buf = self.head[self.position:self.position + size]
+            elif self.position < file_end:
+                buf = self.f.read(min(size, file_end - self.position))
+                if not buf:
+                    raise OSError("file " + self.path + " shrank while it was sent")
+            else:
+                offset = self.position - file_end
+                buf = self.tail[offset:offset + size]
+
+            data.append(buf)
+            self.position = self.position + len(buf)
+            size = size - len(buf)
+
+        return b"".join(data)
+
+    def __iter__(self) -> Iterator[bytes]:
+        while True:
+            data = self.read(BUF_SIZE)
+            if not data:
+                return
+            yield data
+
+def upload_settings(toml_config:dict) -> dict:
+    """Get the upload settings from the BACKUP_RECEIVER section with defaults filled in.
+
+    Args:
+        toml_config (dict): Configuration dictionary with backup settings.
+
+    Returns:
+        dict: {"mode": str, "chunk_size": int, "retries": int, "concurrency": int}
+    """
+    section = toml_config["BACKUP_RECEIVER"]
+    return {
+            "mode": section.get("MODE", "single"),
+            "chunk_size": section.get("CHUNK_SIZE", UPLOAD_CHUNK_SIZE),
+            "retries": section.get("RETRIES", 3),
+            "concurrency": section.get("CONCURRENCY", 4),
+            }
+
+def progress_file_of(toml_config:dict, filename:str) -> str:
+    """Get the path of the file holding the upload progress of a backup file."""
+    return os.path.join(toml_config["SAVE_BACKUPS_TO"], SNAPSHOT_FOLDER, UPLOAD_PROGRESS_PREFIX + filename + ".json")
+
+def load_upload_progress(progress_file:str) -> Optional[dict]:
+    """Load the upload progress of an earlier run, None when it is missing or broken."""
+    try:
+        with open(progress_file, "r") as f:
+            return json.load(f)
+    except (OSError, ValueError):
+        return None
+
+def save_upload_progress(progress_file:str, progress:dict) -> None:
+    """Save the upload progress, the file is replaced atomically so an interruption leaves the old or new progress."""
+    os.makedirs(os.path.dirname(progress_file), exist_ok=True)
+    with open(progress_file + ".tmp", "w") as f:
+        json.dump(progress, f)
+    os.replace(progress_file + ".tmp", progress_file)
+
+def upload_progress(backup_path:str, filename:str, chunk_size:int, progress_file:str) -> dict:
+    """Get the upload progress of a backup file, the checksums are only calculated when the file is new or changed.
+
+    The SHA256 checksum of the whole file and of every chunk are calculated in one
+    pass and saved in the progress, so resuming the upload of a large backup does
+    not read it once more before sending the missing chunks.
+
+    Returns:
+        dict: {"filename": str, "size": int, "mtime_ns": int, "chunk_size": int, "sha256": str, "chunks": list[str], "sent": list[int]}
+    """
+    st = os.stat(backup_path)
+    progress = load_upload_progress(progress_file)
+
+    # Check if the progress belongs to the same file split in the same chunks.
+    if progress is not None and progress.get("filename") == filename and progress.get("size") == st.st_size and progress.get("mtime_ns") == st.st_mtime_ns and progress.get("chunk_size") == chunk_size:
+        return progress
+
+    sha256 = hashlib.sha256()
+    chunks = []
+    with open(backup_path, "rb") as f:
+        while True:
+            chunk_sha256 = hashlib.sha256()
+            left = chunk_size
+            while left > 0:
+                data = f.read(min(BUF_SIZE, left))
+                if not data:
+                    break
+                sha256.update(data)
+                chunk_sha256.update(data)
+                left = left - len(data)
+            if left == chunk_size and chunks:
+                break
+            chunks.append(chunk_sha256.hexdigest())
+            if left > 0:
+                break
+
+    progress = {
+            "filename": filename,
+            "size": st.st_size,
+            "mtime_ns": st.st_mtime_ns,
+            "chunk_size": chunk_size,
+            "sha256": sha256.hexdigest(),
+            "chunks": chunks,
+            "sent": []
+            }
+    save_upload_progress(progress_file, progress)
+    return progress
+
+def receiver_error(r:requests.Response) -> str:
+    """Build the error message of a failed request to the backup receiver."""
+    return "failed to sent backup to backup_receiver " + \
+           "got http status code: " + str(r.status_code) + \
+           " and message: " + r.text
+
+def send_chunk(session:requests.Session, url:str, fields:dict, backup_path:str, filename:str, progress:dict, number:int) -> requests.Response:
+    """Send one chunk of a chunked upload with the chunk number and checksum."""
+    chunk_size = progress["chunk_size"]
+    offset = number * chunk_size
+    chunk_fields = dict(fields, number=number, chunk_sha256=progress["chunks"][number])
+
+    with MultipartFileBody(chunk_fields, "file", backup_path, filename, offset, min(chunk_size, progress["size"] - offset)) as body:
+        return session.post(url + "/chunk", data=body, headers={"Content-Type": body.content_type}, timeout=600)
+
+def send_chunked(logger:logging.Logger, toml_config:dict, backup_path:str, filename:str) -> dict:
+    """Upload a backup file to the backup receiver in numbered chunks that are resumed after an interruption.
+
+    The protocol has three requests below BACKUP_RECEIVER.URL, every request is a
+    multipart form with the filename, password and sha256 of the whole file:
+        status: with size and chunk_size, replies json {"chunks": [<numbers>]} of the chunks the receiver has.
+        chunk: with number, chunk_sha256 and the chunk as the file part, replies done when the checksum matched.
+        finish: the receiver joins the chunks, replies done when the sha256 of the whole file matched.
+
+    The chunks are sent on BACKUP_RECEIVER.CONCURRENCY streams over one pooled
+    session, so a link with a high latency is not limited to what one stream
+    carries. The receiver joins the chunks in order and checks the sha256 of the
+    whole file that was calculated before the first chunk was sent.
+
+    The progress is saved in the snapshots folder after every chunk. When the
+    connection fails the receiver is asked for its chunks again and only the
+    missing chunks are sent, BACKUP_RECEIVER.RETRIES times in a row. A later run
+    sending the same file resumes from the chunks the receiver has.
+
+    Args:
+        logger (logging.Logger): Logger object for recording operations.
+        toml_config (dict): Configuration dictionary with backup settings.
+        backup_path (str): Full path to the backup file to upload.
+        filename (str): Name of the file as it will be stored on the receiver.
+
+    Returns:
+        dict: Result containing status information:
+            {"is_working": bool, "msg": str}
+
+    Error Responses:
+        {"is_working": False, "msg": "file does not exist"}: If the backup file doesn't exist
+        {"is_working": False, "msg": "failed to sent backup to backup_receiver got http status code: <code> and message: <msg>"}: If the receiver refuses a request
+        {"is_working": False, "msg": "failed to sent backup to backup_receiver request exception ConnectionError"}: If the connection fails more than BACKUP_RECEIVER.RETRIES times in a row
+
+    Success Response:
+        {"is_working": True, "msg": "successfully sent backup to backup_receiver"}
+    """
+    url = toml_config["BACKUP_RECEIVER"]["URL"].rstrip("/")
+    password = toml_config["BACKUP_RECEIVER"]["PASSWORD"]
+    settings = upload_settings(toml_config)
+    progress_file = progress_file_of(toml_config, filename)
+
+    # Check if file exist.
+    if not os.path.exists(backup_path):
+        msg = "file does not exist"
+        logger.error(msg)
+        return {"is_working": False, "msg": msg}
+
+    progress = upload_progress(backup_path, filename, settings["chunk_size"], progress_file)
+    fields = {"filename": filename, "password": password, "sha256": progress["sha256"]}
+
+    if progress["sent"]:
+        logger.info("resuming upload of " + filename + " after " + str(len(progress["sent"])) + " of " + str(len(progress["chunks"])) + " chunks")
+
+    # One session with a connection per stream, the connections are kept open between the chunks.
+    with requests.Session() as session, concurrent.futures.ThreadPoolExecutor(max_workers=settings["concurrency"]) as executor:
+        adapter = requests.adapters.HTTPAdapter(pool_connections=1, pool_maxsize=settings["concurrency"])
+        session.mount("http://", adapter)
+        session.mount("https://", adapter)
+
+        failures = 0
+        while True:
+            try:
+                # Ask the receiver which chunks it already has.
+                r = session.post(url + "/status", data=dict(fields, size=progress["size"], chunk_size=settings["chunk_size"]), timeout=600)
+                if r.status_code != 200:
+                    msg = receiver_error(r)
+                    logger.error(msg)
+                    return {"is_working": False, "msg": msg}
+                try:
+                    received = set(r.json()["chunks"])
+                except (ValueError, KeyError, TypeError):
+                    msg = receiver_error(r)
+                    logger.error(msg)
+                    return {"is_working": False, "msg": msg}
+                progress["sent"] = sorted(received)
+
+                # Send the missing chunks on BACKUP_RECEIVER.CONCURRENCY streams, no new chunk is started after a failure.
+                missing = iter([number for number in range(len(progress["chunks"])) if number not in received])
+                running = {}
+                msg = None
+                interruption = None
+                while True:
+                    while msg is None and interruption is None and len(running) < settings["concurrency"]:
+                        number = next(missing, None)
+                        if number is None:
+                            break
+                        running[executor.submit(send_chunk, session, url, fields, backup_path, filename, progress, number)] = number
+                    if not running:
+                        break
+
+                    done, _ = concurrent.futures.wait(running, return_when=concurrent.futures.FIRST_COMPLETED)
+                    for future in done:
+                        number = running.pop(future)
+                        try:
+                            r = future.result()
+                        except (requests.ConnectionError, requests.Timeout) as e:
+                            # The chunks that are not sent are found by asking for the status again.
+                            interruption = e
+                            continue
+
+                        if r.status_code != 200 or r.text != "done":
+                            msg = msg or receiver_error(r)
+                            continue
+
+                        progress["sent"] = sorted(progress["sent"] + [number])
+                        save_upload_progress(progress_file, progress)
+                        failures = 0
+
+                if msg:
+                    logger.error(msg)
+                    return {"is_working": False, "msg": msg}
+                if interruption:
+                    raise interruption
+
+                # Let the receiver join the chunks and verify the sha256 of the whole file.
+                r = session.post(url + "/finish", data=fields, timeout=600)
+                if r.status_code != 200 or r.text != "done":
+                    msg = receiver_error(r)
+                    logger.error(msg)
+                    return {"is_working": False, "msg": msg}
+                break
+            except (requests.ConnectionError, requests.Timeout):
+                failures = failures + 1
+                if failures > settings["retries"]:
+                    msg = "failed to sent backup to backup_receiver request exception ConnectionError"
+                    logger.error(msg)
+                    return {"is_working": False, "msg": msg}
+                logger.warning("upload of " + filename + " was interrupted, resuming")
+
+    os.remove(progress_file)
+    msg = "successfully sent backup to backup_receiver"
+    logger.info(msg)
+    return {"is_working": True, "msg": msg}
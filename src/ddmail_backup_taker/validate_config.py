@@ -1,7 +1,16 @@
 import logging
 import os
 import re
-import gnupg
+import importlib.util
+from ddmail_backup_taker.compression import BINARY_CODECS, CODEC_EXTENSIONS, CODEC_LEVELS, FRAME_CODECS, compression_settings
+from ddmail_backup_taker.encryption import ENCRYPTION_ENGINES, encryption_settings, gpg_key_in_keystore
+from ddmail_backup_taker.mariadb import DUMP_CODECS, DUMP_MODES, dump_compression_config
+from ddmail_backup_taker.table_changes import CHANGE_DETECTIONS
+from ddmail_backup_taker.table_layout import DUMP_LAYOUTS
+from ddmail_backup_taker.upload import UPLOAD_MODES, upload_settings
+
+# Supported values of ARCHIVE.ENGINE.
+ARCHIVE_ENGINES = ["tar", "python"]
 
 def check_main_vars(logger:logging.Logger, toml_config:dict) -> dict:
     """Validate the main configuration variables.
@@ -139,6 +148,9 @@ def check_data_vars(logger:logging.Logger, toml_config:dict) -> dict:
         {"is_working": False, "msg": "config DATA.DATA_TO_BACKUP must be a string"}: If data paths aren't specified correctly
         {"is_working": False, "msg": "config DATA.DATA_TO_BACKUP contains non-existent path: <path>"}: If a data path doesn't exist
         {"is_working": False, "msg": "config DATA.DATA_TO_BACKUP contains unreadable path: <path>"}: If a data path isn't readable
+        {"is_working": False, "msg": "config DATA.INCREMENTAL must be a boolean"}: If incremental setting isn't a boolean
+        {"is_working": False, "msg": "config DATA.INCREMENTAL_MAX_LEVEL must be a positive integer"}: If incremental max level is invalid
+        {"is_working": False, "msg": "config DATA.MAILDIR must be a boolean"}: If maildir setting isn't a boolean
 
     Success Response:
         {"is_working": True, "msg": "Configurations file DATA section variables is valid."}
@@ -165,8 +177,276 @@ def check_data_vars(logger:logging.Logger, toml_config:dict) -> dict:
                 logger.error(msg)
                 return {"is_working": False, "msg": msg}
 
+        # Check if DATA.INCREMENTAL is a boolean.
+        if not isinstance(toml_config["DATA"].get("INCREMENTAL", False), bool):
+            msg = "config DATA.INCREMENTAL must be a boolean"
+            logger.error(msg)
+            return {"is_working": False, "msg": msg}
+
+        # Check if DATA.INCREMENTAL_MAX_LEVEL is a positive int.
+        max_level = toml_config["DATA"].get("INCREMENTAL_MAX_LEVEL", 6)
+        if not isinstance(max_level, int) or isinstance(max_level, bool) or max_level <= 0:
+            msg = "config DATA.INCREMENTAL_MAX_LEVEL must be a positive integer"
+            logger.error(msg)
+            return {"is_working": False, "msg": msg}
+
+        # Check if DATA.MAILDIR is a boolean.
+        if not isinstance(toml_config["DATA"].get("MAILDIR", False), bool):
+            msg = "config DATA.MAILDIR must be a boolean"
+            logger.error(msg)
+            return {"is_working": False, "msg": msg}
+
     return {"is_working": True, "msg": "Configurations file DATA section variables is valid."}
 
+def check_archive_vars(logger:logging.Logger, toml_config:dict) -> dict:
+    """Validate the archive section configuration variables.
+
+    This function checks that the archive engine is supported and that it can be
+    combined with the other configured features. The ARCHIVE section is optional.
+
+    Args:
+        logger (logging.Logger): Logger object for recording operations.
+        toml_config (dict): Configuration dictionary with backup settings.
+
+    Returns:
+        dict: Result containing validation status:
+            {"is_working": bool, "msg": str}
+
+    Error Responses:
+        {"is_working": False, "msg": "config ARCHIVE.ENGINE must be tar or python"}: If the archive engine is unknown
+        {"is_working": False, "msg": "config ARCHIVE.VOLUME_SIZE must be 0 or at least 1048576"}: If the volume size is invalid
+        {"is_working": False, "msg": "config ARCHIVE.VOLUME_SIZE is not supported with REPOSITORY.USE"}: If volumes are used with the chunk repository
+        {"is_working": False, "msg": "config ARCHIVE.SHARDED must be a boolean"}: If the sharded setting isn't a boolean
+        {"is_working": False, "msg": "config ARCHIVE.SHARD_WORKERS must be a positive integer"}: If the number of shard workers is invalid
+        {"is_working": False, "msg": "config ARCHIVE.SHARD_DEPTH must be 0 or a positive integer"}: If the shard depth is invalid
+        {"is_working": False, "msg": "config ARCHIVE.SHARDED does not support DATA.INCREMENTAL"}: If sharded backups are used with incremental backups
+        {"is_working": False, "msg": "config DATA.MAILDIR needs ARCHIVE.ENGINE python"}: If Maildir change detection is used with the tar engine
+        {"is_working": False, "msg": "config ARCHIVE.INDEX must be a boolean"}: If the index setting isn't a boolean
+        {"is_working": False, "msg": "config ARCHIVE.INDEX needs ARCHIVE.ENGINE python"}: If the catalog is used with the tar engine
+        {"is_working": False, "msg": "config ARCHIVE.INDEX needs COMPRESSION.CODEC gzip, xz or none"}: If the codec can not be written as frames
+
+    Success Response:
+        {"is_working": True, "msg": "Configurations file ARCHIVE section variables is valid."}
+    """
+    archive_config = toml_config.get("ARCHIVE", {})
+
+    # Check if ARCHIVE.ENGINE is a supported engine.
+    if archive_config.get("ENGINE", "tar") not in ARCHIVE_ENGINES:
+        msg = "config ARCHIVE.ENGINE must be tar or python"
+        logger.error(msg)
+        return {"is_working": False, "msg": msg}
+
+    # Check if ARCHIVE.VOLUME_SIZE is 0 or a reasonable volume size.
+    volume_size = archive_config.get("VOLUME_SIZE", 0)
+    if not isinstance(volume_size, int) or isinstance(volume_size, bool) or (volume_size != 0 and volume_size < 1048576):
+        msg = "config ARCHIVE.VOLUME_SIZE must be 0 or at least 1048576"
+        logger.error(msg)
+        return {"is_working": False, "msg": msg}
+
+    # Check that volumes are not used with the chunk repository, it writes its own pack files.
+    if volume_size and toml_config.get("REPOSITORY", {}).get("USE", False):
+        msg = "config ARCHIVE.VOLUME_SIZE is not supported with REPOSITORY.USE"
+        logger.error(msg)
+        return {"is_working": False, "msg": msg}
+
+    # Check if ARCHIVE.SHARDED is a boolean.
+    if not isinstance(archive_config.get("SHARDED", False), bool):
+        msg = "config ARCHIVE.SHARDED must be a boolean"
+        logger.error(msg)
+        return {"is_working": False, "msg": msg}
+
+    # Check if ARCHIVE.SHARD_WORKERS is a positive int.
+    shard_workers = archive_config.get("SHARD_WORKERS", 4)
+    if not isinstance(shard_workers, int) or isinstance(shard_workers, bool) or shard_workers <= 0:
+        msg = "config ARCHIVE.SHARD_WORKERS must be a positive integer"
+        logger.error(msg)
+        return {"is_working": False, "msg": msg}
+
+    # Check if ARCHIVE.SHARD_DEPTH is zero or a positive int.
+    shard_depth = archive_config.get("SHARD_DEPTH", 0)
+    if not isinstance(shard_depth, int) or isinstance(shard_depth, bool) or shard_depth < 0:
+        msg = "config ARCHIVE.SHARD_DEPTH must be 0 or a positive integer"
+        logger.error(msg)
+        return {"is_working": False, "msg": msg}
+
+    # Check that sharded backups are not combined with incremental backups, every shard would need its own snapshot.
+    if archive_config.get("SHARDED", False) and toml_config["DATA"].get("INCREMENTAL", False):
+        msg = "config ARCHIVE.SHARDED does not support DATA.INCREMENTAL"
+        logger.error(msg)
+        return {"is_working": False, "msg": msg}
+
+    # Check that Maildir change detection is only used with the python engine.
+    if archive_config.get("ENGINE", "tar") != "python" and toml_config["DATA"].get("MAILDIR", False):
+        msg = "config DATA.MAILDIR needs ARCHIVE.ENGINE python"
+        logger.error(msg)
+        return {"is_working": False, "msg": msg}
+
+    # Check if ARCHIVE.INDEX is a boolean.
+    if not isinstance(archive_config.get("INDEX", False), bool):
+        msg = "config ARCHIVE.INDEX must be a boolean"
+        logger.error(msg)
+        return {"is_working": False, "msg": msg}
+
+    # Check that the catalog is only used with the python engine, the member offsets are only known there.
+    if archive_config.get("INDEX", False) and archive_config.get("ENGINE", "tar") != "python":
+        msg = "config ARCHIVE.INDEX needs ARCHIVE.ENGINE python"
+        logger.error(msg)
+        return {"is_working": False, "msg": msg}
+
+    # Check that the catalog is only used with a codec that can be written as frames.
+    if archive_config.get("INDEX", False) and toml_config.get("COMPRESSION", {}).get("CODEC", "gzip") not in FRAME_CODECS:
+        msg = "config ARCHIVE.INDEX needs COMPRESSION.CODEC " + ", ".join(FRAME_CODECS[:-1]) + " or " + FRAME_CODECS[-1]
+        logger.error(msg)
+        return {"is_working": False, "msg": msg}
+
+    return {"is_working": True, "msg": "Configurations file ARCHIVE section variables is valid."}
+
+def check_compression_vars(logger:logging.Logger, toml_config:dict) -> dict:
+    """Validate the compression section configuration variables.
+
+    This function checks that the codec is supported, that the level is valid for
+    the codec and that the compressor binary exists for the codecs that need one.
+    The COMPRESSION section is optional.
+
+    Args:
+        logger (logging.Logger): Logger object for recording operations.
+        toml_config (dict): Configuration dictionary with backup settings.
+
+    Returns:
+        dict: Result containing validation status:
+            {"is_working": bool, "msg": str}
+
+    Error Responses:
+        {"is_working": False, "msg": "config COMPRESSION.CODEC must be one of gzip, zstd, lz4, xz, none"}: If the codec is unknown
+        {"is_working": False, "msg": "config COMPRESSION.LEVEL must be an integer between <min> and <max>"}: If the level is invalid for the codec
+        {"is_working": False, "msg": "config COMPRESSION.THREADS must be a positive integer"}: If compression threads is invalid
+        {"is_working": False, "msg": "config COMPRESSION.LONG must be a boolean"}: If long-range matching isn't a boolean
+        {"is_working": False, "msg": "config COMPRESSION.LONG is only supported by codec zstd"}: If long-range matching is used with another codec
+        {"is_working": False, "msg": "config COMPRESSION.SKIP_INCOMPRESSIBLE must be a boolean"}: If skipping incompressible blocks isn't a boolean
+        {"is_working": False, "msg": "config COMPRESSION.SKIP_INCOMPRESSIBLE is only supported by codec gzip and xz"}: If skipping incompressible blocks is used with another codec
+        {"is_working": False, "msg": "config COMPRESSION.BIN must be a valid path"}: If the compressor binary doesn't exist
+        {"is_working": False, "msg": "config COMPRESSION.BIN must be executable"}: If the compressor binary isn't executable
+
+    Success Response:
+        {"is_working": True, "msg": "Configurations file COMPRESSION section variables is valid."}
+    """
+    settings = compression_settings(toml_config)
+
+    # Check if COMPRESSION.CODEC is a supported codec.
+    if settings["codec"] not in CODEC_EXTENSIONS:
+        msg = "config COMPRESSION.CODEC must be one of " + ", ".join(CODEC_EXTENSIONS)
+        logger.error(msg)
+        return {"is_working": False, "msg": msg}
+
+    # Check if COMPRESSION.LEVEL is valid for the codec.
+    _, min_level, max_level = CODEC_LEVELS[settings["codec"]]
+    level = settings["level"]
+    if not isinstance(level, int) or isinstance(level, bool) or level < min_level or level > max_level:
+        msg = "config COMPRESSION.LEVEL must be an integer between " + str(min_level) + " and " + str(max_level)
+        logger.error(msg)
+        return {"is_working": False, "msg": msg}
+
+    # Check if COMPRESSION.THREADS is a positive int.
+    threads = settings["threads"]
+    if not isinstance(threads, int) or isinstance(threads, bool) or threads <= 0:
+        msg = "config COMPRESSION.THREADS must be a positive integer"
+        logger.error(msg)
+        return {"is_working": False, "msg": msg}
+
+    # Check if COMPRESSION.LONG is a boolean.
+    if not isinstance(settings["long"], bool):
+        msg = "config COMPRESSION.LONG must be a boolean"
+        logger.error(msg)
+        return {"is_working": False, "msg": msg}
+
+    # Check that long-range matching is only used with zstd.
+    if settings["long"] and settings["codec"] != "zstd":
+        msg = "config COMPRESSION.LONG is only supported by codec zstd"
+        logger.error(msg)
+        return {"is_working": False, "msg": msg}
+
+    # Check if COMPRESSION.SKIP_INCOMPRESSIBLE is a boolean.
+    if not isinstance(settings["skip_incompressible"], bool):
+        msg = "config COMPRESSION.SKIP_INCOMPRESSIBLE must be a boolean"
+        logger.error(msg)
+        return {"is_working": False, "msg": msg}
+
+    # Check that skipping incompressible blocks is only used with the in-process codecs, zstd and lz4 detect it by themselves.
+    if settings["skip_incompressible"] and settings["codec"] not in ["gzip", "xz"]:
+        msg = "config COMPRESSION.SKIP_INCOMPRESSIBLE is only supported by codec gzip and xz"
+        logger.error(msg)
+        return {"is_working": False, "msg": msg}
+
+    if settings["codec"] in BINARY_CODECS:
+        # Check if COMPRESSION.BIN is a file.
+        if not isinstance(settings["bin"], str) or not os.path.isfile(settings["bin"]):
+            msg = "config COMPRESSION.BIN must be a valid path"
+            logger.error(msg)
+            return {"is_working": False, "msg": msg}
+
+        # Check if COMPRESSION.BIN is executable.
+        if not os.access(settings["bin"], os.X_OK):
+            msg = "config COMPRESSION.BIN must be executable"
+            logger.error(msg)
+            return {"is_working": False, "msg": msg}
+
+    return {"is_working": True, "msg": "Configurations file COMPRESSION section variables is valid."}
+
+def check_repository_vars(logger:logging.Logger, toml_config:dict) -> dict:
+    """Validate the repository section configuration variables.
+
+    This function checks the settings of the deduplicating chunk repository. The
+    REPOSITORY section is optional.
+
+    Args:
+        logger (logging.Logger): Logger object for recording operations.
+        toml_config (dict): Configuration dictionary with backup settings.
+
+    Returns:
+        dict: Result containing validation status:
+            {"is_working": bool, "msg": str}
+
+    Error Responses:
+        {"is_working": False, "msg": "config REPOSITORY.USE must be true or false"}: If REPOSITORY.USE is not a boolean
+        {"is_working": False, "msg": "config REPOSITORY.PATH is None"}: If the repository path is not specified
+        {"is_working": False, "msg": "config REPOSITORY.AVG_CHUNK_SIZE must be a power of two of at least 65536"}: If the chunk size is invalid
+        {"is_working": False, "msg": "config REPOSITORY.USE does not support DATA.INCREMENTAL"}: If incremental backups are used with the repository
+
+    Success Response:
+        {"is_working": True, "msg": "Configurations file REPOSITORY section variables is valid."}
+    """
+    repository_config = toml_config.get("REPOSITORY", {})
+
+    # Check if REPOSITORY.USE is a boolean.
+    if not isinstance(repository_config.get("USE", False), bool):
+        msg = "config REPOSITORY.USE must be true or false"
+        logger.error(msg)
+        return {"is_working": False, "msg": msg}
+
+    if not repository_config.get("USE", False):
+        return {"is_working": True, "msg": "Configurations file REPOSITORY section variables is valid."}
+
+    # Check if REPOSITORY.PATH is None.
+    if not repository_config.get("PATH"):
+        msg = "config REPOSITORY.PATH is None"
+        logger.error(msg)
+        return {"is_working": False, "msg": msg}
+
+    # Check if REPOSITORY.AVG_CHUNK_SIZE is a power of two.
+    avg_chunk_size = repository_config.get("AVG_CHUNK_SIZE", 1048576)
+    if not isinstance(avg_chunk_size, int) or isinstance(avg_chunk_size, bool) or avg_chunk_size < 65536 or avg_chunk_size & (avg_chunk_size - 1):
+        msg = "config REPOSITORY.AVG_CHUNK_SIZE must be a power of two of at least 65536"
+        logger.error(msg)
+        return {"is_working": False, "msg": msg}
+
+    # Check that incremental tar backups are not used with the repository.
+    if toml_config["DATA"].get("INCREMENTAL", False):
+        msg = "config REPOSITORY.USE does not support DATA.INCREMENTAL"
+        logger.error(msg)
+        return {"is_working": False, "msg": msg}
+
+    return {"is_working": True, "msg": "Configurations file REPOSITORY section variables is valid."}
+
 def check_mariadb_vars(logger:logging.Logger, toml_config:dict) -> dict:
     """Validate the MariaDB section configuration variables.
 
@@ -185,6 +465,36 @@ def check_mariadb_vars(logger:logging.Logger, toml_config:dict) -> dict:
         {"is_working": False, "msg": "config MARIADB.MARIADBDUMP_BIN must be a valid path"}: If mariadbdump binary path is invalid
         {"is_working": False, "msg": "config MARIADB.MARIADBDUMP_BIN must be executable"}: If mariadbdump binary isn't executable
         {"is_working": False, "msg": "config MARIADB.ROOT_PASSWORD must be a string"}: If root password isn't specified
+        {"is_working": False, "msg": "config MARIADB.PER_DATABASE must be a boolean"}: If the per database setting isn't a boolean
+        {"is_working": False, "msg": "config MARIADB.PARALLELISM must be a positive integer"}: If the number of dump workers is invalid
+        {"is_working": False, "msg": "config MARIADB.MARIADB_BIN must be a valid path"}: If mariadb binary path is invalid
+        {"is_working": False, "msg": "config MARIADB.MARIADB_BIN must be executable"}: If mariadb binary isn't executable
+        {"is_working": False, "msg": "config MARIADB.STREAM must be a boolean"}: If the stream setting isn't a boolean
+        {"is_working": False, "msg": "config MARIADB.COMPRESSION must be one of none, gzip, zstd"}: If the dump codec is unknown
+        {"is_working": False, "msg": "config MARIADB.COMPRESSION_LEVEL must be an integer between <min> and <max>"}: If the dump compression level is invalid
+        {"is_working": False, "msg": "config MARIADB.COMPRESSION_BIN must be a valid path"}: If the zstd binary doesn't exist
+        {"is_working": False, "msg": "config MARIADB.COMPRESSION_BIN must be executable"}: If the zstd binary isn't executable
+        {"is_working": False, "msg": "config MARIADB.STREAM needs ARCHIVE.ENGINE python"}: If the dump is streamed with the tar engine
+        {"is_working": False, "msg": "config MARIADB.STREAM does not support ARCHIVE.SHARDED or REPOSITORY.USE"}: If the dump is streamed into shards or the chunk repository
+        {"is_working": False, "msg": "config MARIADB.MODE must be one of lock, consistent, chunked, physical"}: If the dump mode is unknown
+        {"is_working": False, "msg": "config MARIADB.CHUNK_ROWS must be a positive integer"}: If the number of rows of a chunk is invalid
+        {"is_working": False, "msg": "config MARIADB.MODE chunked does not support MARIADB.PER_DATABASE, MARIADB.STREAM or MARIADB.INCREMENTAL"}: If chunks are combined with another dump layout
+        {"is_working": False, "msg": "config MARIADB.MODE physical does not support MARIADB.PER_DATABASE or MARIADB.INCREMENTAL"}: If the physical backup is combined with a dump layout
+        {"is_working": False, "msg": "config MARIADB.MARIABACKUP_BIN must be a valid path"}: If mariabackup binary path is invalid
+        {"is_working": False, "msg": "config MARIADB.MARIABACKUP_BIN must be executable"}: If mariabackup binary isn't executable
+        {"is_working": False, "msg": "config MARIADB.SKIP_UNCHANGED must be a boolean"}: If the skip unchanged tables setting isn't a boolean
+        {"is_working": False, "msg": "config MARIADB.CHANGE_DETECTION must be one of checksum, update_time"}: If the change detection is unknown
+        {"is_working": False, "msg": "config MARIADB.SKIP_UNCHANGED does not support MARIADB.PER_DATABASE, MARIADB.STREAM, MARIADB.INCREMENTAL or MARIADB.MODE chunked and physical"}: If table dumps are combined with another dump layout
+        {"is_working": False, "msg": "config MARIADB.SKIP_UNCHANGED does not support REPOSITORY.USE"}: If unchanged tables would be referenced from repository snapshots
+        {"is_working": False, "msg": "config MARIADB.LAYOUT must be one of file, tables"}: If the dump layout is unknown
+        {"is_working": False, "msg": "config MARIADB.LAYOUT tables does not support MARIADB.PER_DATABASE, MARIADB.STREAM, MARIADB.INCREMENTAL, MARIADB.SKIP_UNCHANGED or MARIADB.MODE chunked and physical"}: If the tables layout is combined with another dump layout
+        {"is_working": False, "msg": "config MARIADB.DELTA must be a boolean"}: If the delta setting isn't a boolean
+        {"is_working": False, "msg": "config MARIADB.DELTA_FULL_EVERY must be a positive integer"}: If the number of runs between full dumps is invalid
+        {"is_working": False, "msg": "config MARIADB.DELTA only supports one uncompressed dump file of MARIADB.MODE lock or consistent without REPOSITORY.USE"}: If deltas are combined with another dump layout
+        {"is_working": False, "msg": "config MARIADB.INCREMENTAL must be a boolean"}: If the incremental setting isn't a boolean
+        {"is_working": False, "msg": "config MARIADB.INCREMENTAL needs DATA.INCREMENTAL"}: If there is no backup level schedule to follow
+        {"is_working": False, "msg": "config MARIADB.INCREMENTAL does not support MARIADB.PER_DATABASE or MARIADB.STREAM"}: If the full dump is not one file
+        {"is_working": False, "msg": "config MARIADB.BINLOG_INDEX must be a valid path"}: If the binary log index file doesn't exist
 
     Success Response:
         {"is_working": True, "msg": "Configurations file MARIADB section variables is valid."}
@@ -215,6 +525,212 @@ def check_mariadb_vars(logger:logging.Logger, toml_config:dict) -> dict:
             logger.error(msg)
             return {"is_working": False, "msg": msg}
 
+        # Check if MARIADB.PER_DATABASE is a boolean.
+        per_database = toml_config["MARIADB"].get("PER_DATABASE", False)
+        if not isinstance(per_database, bool):
+            msg = "config MARIADB.PER_DATABASE must be a boolean"
+            logger.error(msg)
+            return {"is_working": False, "msg": msg}
+
+        # Check if MARIADB.PARALLELISM is a positive int.
+        parallelism = toml_config["MARIADB"].get("PARALLELISM", 4)
+        if not isinstance(parallelism, int) or isinstance(parallelism, bool) or parallelism <= 0:
+            msg = "config MARIADB.PARALLELISM must be a positive integer"
+            logger.error(msg)
+            return {"is_working": False, "msg": msg}
+
+        # Check if MARIADB.INCREMENTAL is a boolean.
+        incremental = toml_config["MARIADB"].get("INCREMENTAL", False)
+        if not isinstance(incremental, bool):
+            msg = "config MARIADB.INCREMENTAL must be a boolean"
+            logger.error(msg)
+            return {"is_working": False, "msg": msg}
+
+        # Check if MARIADB.MODE is a supported dump mode.
+        mode = toml_config["MARIADB"].get("MODE", "lock")
+        if mode not in DUMP_MODES:
+            msg = "config MARIADB.MODE must be one of " + ", ".join(DUMP_MODES)
+            logger.error(msg)
+            return {"is_working": False, "msg": msg}
+
+        # Check if MARIADB.CHUNK_ROWS is a positive int.
+        chunk_rows = toml_config["MARIADB"].get("CHUNK_ROWS", 1000000)
+        if not isinstance(chunk_rows, int) or isinstance(chunk_rows, bool) or chunk_rows <= 0:
+            msg = "config MARIADB.CHUNK_ROWS must be a positive integer"
+            logger.error(msg)
+            return {"is_working": False, "msg": msg}
+
+        # Check that chunks are the only layout of the dump.
+        if mode == "chunked" and (per_database or toml_config["MARIADB"].get("STREAM", False) or incremental):
+            msg = "config MARIADB.MODE chunked does not support MARIADB.PER_DATABASE, MARIADB.STREAM or MARIADB.INCREMENTAL"
+            logger.error(msg)
+            return {"is_working": False, "msg": msg}
+
+        if mode == "physical":
+            # Check that the physical backup is one stream of all databases.
+            if per_database or incremental:
+                msg = "config MARIADB.MODE physical does not support MARIADB.PER_DATABASE or MARIADB.INCREMENTAL"
+                logger.error(msg)
+                return {"is_working": False, "msg": msg}
+
+            mariabackup_bin = toml_config["MARIADB"].get("MARIABACKUP_BIN", "/usr/bin/mariabackup")
+
+            # Check if MARIADB.MARIABACKUP_BIN is a file.
+            if not isinstance(mariabackup_bin, str) or not os.path.isfile(mariabackup_bin):
+                msg = "config MARIADB.MARIABACKUP_BIN must be a valid path"
+                logger.error(msg)
+                return {"is_working": False, "msg": msg}
+
+            # Check if MARIADB.MARIABACKUP_BIN is executable.
+            if not os.access(mariabackup_bin, os.X_OK):
+                msg = "config MARIADB.MARIABACKUP_BIN must be executable"
+                logger.error(msg)
+                return {"is_working": False, "msg": msg}
+
+        # Check if MARIADB.SKIP_UNCHANGED is a boolean.
+        skip_unchanged = toml_config["MARIADB"].get("SKIP_UNCHANGED", False)
+        if not isinstance(skip_unchanged, bool):
+            msg = "config MARIADB.SKIP_UNCHANGED must be a boolean"
+            logger.error(msg)
+            return {"is_working": False, "msg": msg}
+
+        # Check if MARIADB.CHANGE_DETECTION is supported.
+        if toml_config["MARIADB"].get("CHANGE_DETECTION", "checksum") not in CHANGE_DETECTIONS:
+            msg = "config MARIADB.CHANGE_DETECTION must be one of " + ", ".join(CHANGE_DETECTIONS)
+            logger.error(msg)
+            return {"is_working": False, "msg": msg}
+
+        # Check that tables are dumped one by one.
+        if skip_unchanged and (per_database or toml_config["MARIADB"].get("STREAM", False) or incremental or mode in ["chunked", "physical"]):
+            msg = "config MARIADB.SKIP_UNCHANGED does not support MARIADB.PER_DATABASE, MARIADB.STREAM, MARIADB.INCREMENTAL or MARIADB.MODE chunked and physical"
+            logger.error(msg)
+            return {"is_working": False, "msg": msg}
+
+        # Check that the backups holding unchanged tables are files, the repository deduplicates unchanged tables itself.
+        if skip_unchanged and toml_config.get("REPOSITORY", {}).get("USE", False):
+            msg = "config MARIADB.SKIP_UNCHANGED does not support REPOSITORY.USE"
+            logger.error(msg)
+            return {"is_working": False, "msg": msg}
+
+        # Check if MARIADB.LAYOUT is a supported dump layout.
+        layout = toml_config["MARIADB"].get("LAYOUT", "file")
+        if layout not in DUMP_LAYOUTS:
+            msg = "config MARIADB.LAYOUT must be one of " + ", ".join(DUMP_LAYOUTS)
+            logger.error(msg)
+            return {"is_working": False, "msg": msg}
+
+        # Check that the tables layout is the only layout of the dump.
+        if layout == "tables" and (per_database or toml_config["MARIADB"].get("STREAM", False) or incremental or skip_unchanged or mode in ["chunked", "physical"]):
+            msg = "config MARIADB.LAYOUT tables does not support MARIADB.PER_DATABASE, MARIADB.STREAM, MARIADB.INCREMENTAL, MARIADB.SKIP_UNCHANGED or MARIADB.MODE chunked and physical"
+            logger.error(msg)
+            return {"is_working": False, "msg": msg}
+
+        # Check if MARIADB.DELTA is a boolean.
+        delta = toml_config["MARIADB"].get("DELTA", False)
+        if not isinstance(delta, bool):
+            msg = "config MARIADB.DELTA must be a boolean"
+            logger.error(msg)
+            return {"is_working": False, "msg": msg}
+
+        # Check if MARIADB.DELTA_FULL_EVERY is a positive integer.
+        delta_full_every = toml_config["MARIADB"].get("DELTA_FULL_EVERY", 7)
+        if not isinstance(delta_full_every, int) or isinstance(delta_full_every, bool) or delta_full_every <= 0:
+            msg = "config MARIADB.DELTA_FULL_EVERY must be a positive integer"
+            logger.error(msg)
+            return {"is_working": False, "msg": msg}
+
+        # Check that the delta is encoded from one plain dump file, a compressed dump has no common bytes.
+        if delta and (
+                per_database or toml_config["MARIADB"].get("STREAM", False) or incremental or skip_unchanged or layout == "tables"
+                or mode in ["chunked", "physical"] or toml_config["MARIADB"].get("COMPRESSION", "none") != "none"
+                or toml_config.get("REPOSITORY", {}).get("USE", False)):
+            msg = "config MARIADB.DELTA only supports one uncompressed dump file of MARIADB.MODE lock or consistent without REPOSITORY.USE"
+            logger.error(msg)
+            return {"is_working": False, "msg": msg}
+
+        if per_database or incremental or mode == "chunked" or skip_unchanged or layout == "tables":
+            mariadb_bin = toml_config["MARIADB"].get("MARIADB_BIN", "/usr/bin/mariadb")
+
+            # Check if MARIADB.MARIADB_BIN is a file.
+            if not isinstance(mariadb_bin, str) or not os.path.isfile(mariadb_bin):
+                msg = "config MARIADB.MARIADB_BIN must be a valid path"
+                logger.error(msg)
+                return {"is_working": False, "msg": msg}
+
+            # Check if MARIADB.MARIADB_BIN is executable.
+            if not os.access(mariadb_bin, os.X_OK):
+                msg = "config MARIADB.MARIADB_BIN must be executable"
+                logger.error(msg)
+                return {"is_working": False, "msg": msg}
+
+        # Check if MARIADB.STREAM is a boolean.
+        stream = toml_config["MARIADB"].get("STREAM", False)
+        if not isinstance(stream, bool):
+            msg = "config MARIADB.STREAM must be a boolean"
+            logger.error(msg)
+            return {"is_working": False, "msg": msg}
+
+        # Check that a streamed dump is archived by the python engine, tar only archives files.
+        if stream and toml_config.get("ARCHIVE", {}).get("ENGINE", "tar") != "python":
+            msg = "config MARIADB.STREAM needs ARCHIVE.ENGINE python"
+            logger.error(msg)
+            return {"is_working": False, "msg": msg}
+
+        # Check that a streamed dump is written to one archive.
+        if stream and (toml_config.get("ARCHIVE", {}).get("SHARDED", False) or toml_config.get("REPOSITORY", {}).get("USE", False)):
+            msg = "config MARIADB.STREAM does not support ARCHIVE.SHARDED or REPOSITORY.USE"
+            logger.error(msg)
+            return {"is_working": False, "msg": msg}
+
+        if incremental:
+            # Check that binary log backups follow the backup levels of the data.
+            if not toml_config["DATA"].get("INCREMENTAL", False):
+                msg = "config MARIADB.INCREMENTAL needs DATA.INCREMENTAL"
+                logger.error(msg)
+                return {"is_working": False, "msg": msg}
+
+            # Check that the full dump is one file taken at one binary log position.
+            if per_database or stream:
+                msg = "config MARIADB.INCREMENTAL does not support MARIADB.PER_DATABASE or MARIADB.STREAM"
+                logger.error(msg)
+                return {"is_working": False, "msg": msg}
+
+            # Check if MARIADB.BINLOG_INDEX is a file.
+            binlog_index = toml_config["MARIADB"].get("BINLOG_INDEX")
+            if not isinstance(binlog_index, str) or not os.path.isfile(binlog_index):
+                msg = "config MARIADB.BINLOG_INDEX must be a valid path"
+                logger.error(msg)
+                return {"is_working": False, "msg": msg}
+
+        # Check if MARIADB.COMPRESSION is a supported codec.
+        dump_codec = toml_config["MARIADB"].get("COMPRESSION", "none")
+        if dump_codec not in DUMP_CODECS:
+            msg = "config MARIADB.COMPRESSION must be one of " + ", ".join(DUMP_CODECS)
+            logger.error(msg)
+            return {"is_working": False, "msg": msg}
+
+        # Check if MARIADB.COMPRESSION_LEVEL is valid for the codec, the level is not used without compression.
+        dump_settings = compression_settings(dump_compression_config(toml_config))
+        _, min_level, max_level = CODEC_LEVELS[dump_codec]
+        level = dump_settings["level"]
+        if dump_codec != "none" and (not isinstance(level, int) or isinstance(level, bool) or level < min_level or level > max_level):
+            msg = "config MARIADB.COMPRESSION_LEVEL must be an integer between " + str(min_level) + " and " + str(max_level)
+            logger.error(msg)
+            return {"is_working": False, "msg": msg}
+
+        if dump_codec in BINARY_CODECS:
+            # Check if MARIADB.COMPRESSION_BIN is a file.
+            if not isinstance(dump_settings["bin"], str) or not os.path.isfile(dump_settings["bin"]):
+                msg = "config MARIADB.COMPRESSION_BIN must be a valid path"
+                logger.error(msg)
+                return {"is_working": False, "msg": msg}
+
+            # Check if MARIADB.COMPRESSION_BIN is executable.
+            if not os.access(dump_settings["bin"], os.X_OK):
+                msg = "config MARIADB.COMPRESSION_BIN must be executable"
+                logger.error(msg)
+                return {"is_working": False, "msg": msg}
+
     return {"is_working": True, "msg": "Configurations file MARIADB section variables is valid."}
 
 def check_gpg_vars(logger:logging.Logger,toml_config:dict) -> dict:
@@ -238,6 +754,10 @@ def check_gpg_vars(logger:logging.Logger,toml_config:dict) -> dict:
         {"is_working": False, "msg": "config GPG_ENCRYPTION.PUBKEY_FINGERPRINT must be a string"}: If fingerprint isn't a string
         {"is_working": False, "msg": "config GPG_ENCRYPTION.PUBKEY_FINGERPRINT must be a valid fingerprint"}: If fingerprint format is invalid
         {"is_working": False, "msg": "config GPG_ENCRYPTION.PUBKEY_FINGERPRINT <fingerprint> key is not in keystore"}: If key isn't in keystore
+        {"is_working": False, "msg": "config GPG_ENCRYPTION.ENGINE must be one of <engines>"}: If the encryption engine is unknown
+        {"is_working": False, "msg": "config GPG_ENCRYPTION.THREADS must be a positive integer"}: If the number of encryption threads is invalid
+        {"is_working": False, "msg": "config GPG_ENCRYPTION.CHUNK_SIZE must be an integer between 65536 and 67108864"}: If the chunk size is invalid
+        {"is_working": False, "msg": "config GPG_ENCRYPTION.ENGINE chunked needs the cryptography package"}: If cryptography is not installed
 
     Success Response:
         {"is_working": True, "msg": "Configurations file GPG section variables is valid."}
@@ -275,15 +795,39 @@ def check_gpg_vars(logger:logging.Logger,toml_config:dict) -> dict:
             logger.error(msg)
             return {"is_working": False, "msg": msg}
 
-        # Check if GPG_ENCRYPTION.FINGERPRINT key exist in keystore
-        gpg = gnupg.GPG(gpgbinary=toml_config["GPG_ENCRYPTION"]["GPG_BIN"])
-        gpg.encoding = 'utf-8'
-
-        if not gpg.list_keys(secret=False, keys=toml_config["GPG_ENCRYPTION"]["PUBKEY_FINGERPRINT"]):
+        # Check if GPG_ENCRYPTION.FINGERPRINT key exist in keystore, found keys are cached until the keyring changes.
+        if not gpg_key_in_keystore(toml_config):
             msg = "config GPG_ENCRYPTION.PUBKEY_FINGERPRINT " + toml_config["GPG_ENCRYPTION"]["PUBKEY_FINGERPRINT"] +" key is not in keystore"
             logger.error(msg)
             return {"is_working": False, "msg": msg}
 
+        settings = encryption_settings(toml_config)
+
+        # Check if GPG_ENCRYPTION.ENGINE is a supported encryption engine.
+        if settings["engine"] not in ENCRYPTION_ENGINES:
+            msg = "config GPG_ENCRYPTION.ENGINE must be one of " + ", ".join(ENCRYPTION_ENGINES)
+            logger.error(msg)
+            return {"is_working": False, "msg": msg}
+
+        # Check if GPG_ENCRYPTION.THREADS is a positive int.
+        if not isinstance(settings["threads"], int) or isinstance(settings["threads"], bool) or settings["threads"] <= 0:
+            msg = "config GPG_ENCRYPTION.THREADS must be a positive integer"
+            logger.error(msg)
+            return {"is_working": False, "msg": msg}
+
+        # Check if GPG_ENCRYPTION.CHUNK_SIZE is an int between 64kb and 64mb.
+        chunk_size = settings["chunk_size"]
+        if not isinstance(chunk_size, int) or isinstance(chunk_size, bool) or chunk_size < 65536 or chunk_size > 67108864:
+            msg = "config GPG_ENCRYPTION.CHUNK_SIZE must be an integer between 65536 and 67108864"
+            logger.error(msg)
+            return {"is_working": False, "msg": msg}
+
+        # Check if the cryptography package needed by the chunked engine is installed.
+        if settings["engine"] == "chunked" and importlib.util.find_spec("cryptography") is None:
+            msg = "config GPG_ENCRYPTION.ENGINE chunked needs the cryptography package"
+            logger.error(msg)
+            return {"is_working": False, "msg": msg}
+
     return {"is_working": True, "msg": "Configurations file GPG section variables is valid."}
 
 def check_backup_receiver_vars(logger:logging.Logger,toml_config:dict) -> dict:
@@ -304,6 +848,10 @@ def check_backup_receiver_vars(logger:logging.Logger,toml_config:dict) -> dict:
         {"is_working": False, "msg": "config BACKUP_RECEIVER.URL must be a string"}: If URL isn't a string
         {"is_working": False, "msg": "config BACKUP_RECEIVER.URL must be a valid URL"}: If URL format is invalid
         {"is_working": False, "msg": "config BACKUP_RECEIVER.PASSWORD must be a string"}: If password isn't a string
+        {"is_working": False, "msg": "config BACKUP_RECEIVER.MODE must be one of single, chunked"}: If the upload mode is unknown
+        {"is_working": False, "msg": "config BACKUP_RECEIVER.CHUNK_SIZE must be an integer of at least 65536"}: If the upload chunk size is invalid
+        {"is_working": False, "msg": "config BACKUP_RECEIVER.RETRIES must be an integer of at least 0"}: If the number of retries is invalid
+        {"is_working": False, "msg": "config BACKUP_RECEIVER.CONCURRENCY must be a positive integer"}: If the number of upload streams is invalid
 
     Success Response:
         {"is_working": True, "msg": "Configurations file BACKUP_RECEIVER section variables is valid."}
@@ -328,6 +876,35 @@ def check_backup_receiver_vars(logger:logging.Logger,toml_config:dict) -> dict:
             logger.error(msg)
             return {"is_working": False, "msg": msg}
 
+        settings = upload_settings(toml_config)
+
+        # Check if BACKUP_RECEIVER.MODE is a supported upload mode.
+        if settings["mode"] not in UPLOAD_MODES:
+            msg = "config BACKUP_RECEIVER.MODE must be one of " + ", ".join(UPLOAD_MODES)
+            logger.error(msg)
+            return {"is_working": False, "msg": msg}
+
+        # Check if BACKUP_RECEIVER.CHUNK_SIZE is an int of at least 64kb.
+        chunk_size = settings["chunk_size"]
+        if not isinstance(chunk_size, int) or isinstance(chunk_size, bool) or chunk_size < 65536:
+            msg = "config BACKUP_RECEIVER.CHUNK_SIZE must be an integer of at least 65536"
+            logger.error(msg)
+            return {"is_working": False, "msg": msg}
+
+        # Check if BACKUP_RECEIVER.RETRIES is an int of at least 0.
+        retries = settings["retries"]
+        if not isinstance(retries, int) or isinstance(retries, bool) or retries < 0:
+            msg = "config BACKUP_RECEIVER.RETRIES must be an integer of at least 0"
+            logger.error(msg)
+            return {"is_working": False, "msg": msg}
+
+        # Check if BACKUP_RECEIVER.CONCURRENCY is a positive int.
+        concurrency = settings["concurrency"]
+        if not isinstance(concurrency, int) or isinstance(concurrency, bool) or concurrency <= 0:
+            msg = "config BACKUP_RECEIVER.CONCURRENCY must be a positive integer"
+            logger.error(msg)
+            return {"is_working": False, "msg": msg}
+
     return {"is_working": True, "msg": "Configurations file BACKUP_RECEIVER section variables is valid."}
 
 def check_config(logger:logging.Logger, toml_config:dict) -> dict:
@@ -368,6 +945,24 @@ def check_config(logger:logging.Logger, toml_config:dict) -> dict:
         return results_check_data_vars
 
 
+    # Check ARCHIVE sektion vars in toml_config.
+    results_check_archive_vars = check_archive_vars(logger, toml_config)
+    if not results_check_archive_vars["is_working"]:
+        return results_check_archive_vars
+
+
+    # Check COMPRESSION sektion vars in toml_config.
+    results_check_compression_vars = check_compression_vars(logger, toml_config)
+    if not results_check_compression_vars["is_working"]:
+        return results_check_compression_vars
+
+
+    # Check REPOSITORY sektion vars in toml_config.
+    results_check_repository_vars = check_repository_vars(logger, toml_config)
+    if not results_check_repository_vars["is_working"]:
+        return results_check_repository_vars
+
+
     # Check MARIADB sektion vars in toml_config.
     results_check_mariadb_vars = check_mariadb_vars(logger, toml_config)
     if not results_check_mariadb_vars["is_working"]:
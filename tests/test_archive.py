@@ -0,0 +1,173 @@
+import os
+import io
+import hashlib
+import shutil
+import subprocess
+import tarfile
+import tempfile
+import pytest
+from ddmail_backup_taker.archive import iter_tar, stream_archive, stream_tar_process
+
+def test_iter_tar_readable_by_tarfile(logger):
+    """Test iter_tar() builds a tar stream with all folders, files and file content."""
+    data_dir = tempfile.mkdtemp()
+    os.makedirs(os.path.join(data_dir, "sub"))
+    with open(os.path.join(data_dir, "a.txt"), "wb") as f:
+        f.write(b"first file")
+    with open(os.path.join(data_dir, "sub", "b.bin"), "wb") as f:
+        f.write(os.urandom(3000))
+    os.symlink("a.txt", os.path.join(data_dir, "link"))
+
+    try:
+        archive = b"".join(iter_tar(logger, [data_dir]))
+
+        # Archive size is a multiple of the tar record size.
+        assert len(archive) % tarfile.RECORDSIZE == 0
+
+        with tarfile.open(fileobj=io.BytesIO(archive), mode="r:") as tar:
+            names = tar.getnames()
+            base = data_dir.lstrip("/")
+            assert base in names
+            assert base + "/sub" in names
+            assert tar.getmember(base + "/link").issym()
+            assert tar.extractfile(base + "/a.txt").read() == b"first file"
+            with open(os.path.join(data_dir, "sub", "b.bin"), "rb") as f:
+                assert tar.extractfile(base + "/sub/b.bin").read() == f.read()
+    finally:
+        shutil.rmtree(data_dir)
+
+
+def test_iter_tar_readable_by_tar_bin(logger, toml_config):
+    """Test iter_tar() output can be listed by the tar binary."""
+    data_dir = tempfile.mkdtemp()
+    with open(os.path.join(data_dir, "a.txt"), "w") as f:
+        f.write("test")
+
+    try:
+        archive = b"".join(iter_tar(logger, [data_dir]))
+        output = subprocess.run([toml_config["TAR_BIN"], "-tf", "-"], input=archive, check=True, stdout=subprocess.PIPE)
+
+        assert data_dir.lstrip("/") + "/a.txt" in output.stdout.decode("utf-8").splitlines()
+    finally:
+        shutil.rmtree(data_dir)
+
+
+def test_iter_tar_missing_path(logger):
+    """Test iter_tar() skips paths that does not exist."""
+    archive = b"".join(iter_tar(logger, ["/path/that/does/not/exist"]))
+
+    with tarfile.open(fileobj=io.BytesIO(archive), mode="r:") as tar:
+        assert tar.getnames() == []
+
+
+def test_stream_archive_with_encryption(logger, toml_config, monkeypatch):
+    """Test stream_archive() checksum and size match the encrypted backup file."""
+    data_dir = tempfile.mkdtemp()
+    save_backups_to = tempfile.mkdtemp()
+    with open(os.path.join(data_dir, "a.txt"), "w") as f:
+        f.write("test data for stream_archive")
+
+    config_copy = toml_config.copy()
+    gpg_copy = config_copy["GPG_ENCRYPTION"].copy()
+    gpg_copy["USE"] = True
+    monkeypatch.setitem(config_copy, "GPG_ENCRYPTION", gpg_copy)
+
+    backup_file = os.path.join(save_backups_to, "backup.tar.gz.gpg")
+
+    try:
+        result = stream_archive(logger, config_copy, [data_dir], backup_file)
+
+        assert result["is_working"]
+        assert result["backup_size"] == os.path.getsize(backup_file)
+        with open(backup_file, "rb") as f:
+            assert result["sha256"] == hashlib.sha256(f.read()).hexdigest()
+    finally:
+        shutil.rmtree(data_dir)
+        shutil.rmtree(save_backups_to)
+
+
+def test_stream_archive_gpg_failure(logger, toml_config, monkeypatch):
+    """Test stream_archive() removes the partial backup file when gpg fails."""
+    data_dir = tempfile.mkdtemp()
+    save_backups_to = tempfile.mkdtemp()
+    with open(os.path.join(data_dir, "a.txt"), "w") as f:
+        f.write("test data for stream_archive")
+
+    config_copy = toml_config.copy()
+    gpg_copy = config_copy["GPG_ENCRYPTION"].copy()
+    gpg_copy["USE"] = True
+    gpg_copy["PUBKEY_FINGERPRINT"] = "0" * 40
+    monkeypatch.setitem(config_copy, "GPG_ENCRYPTION", gpg_copy)
+
+    backup_file = os.path.join(save_backups_to, "backup.tar.gz.gpg")
+
+    try:
+        result = stream_archive(logger, config_copy, [data_dir], backup_file)
+
+        assert not result["is_working"]
+        assert "gpg command failed with return code" in result["msg"]
+        assert not os.path.exists(backup_file)
+    finally:
+        shutil.rmtree(data_dir)
+        shutil.rmtree(save_backups_to)
+
+
+def test_stream_tar_process_tar_failure(logger, toml_config, monkeypatch):
+    """Test stream_tar_process() reports a failing tar binary."""
+    save_backups_to = tempfile.mkdtemp()
+
+    config_copy = toml_config.copy()
+    gpg_copy = config_copy["GPG_ENCRYPTION"].copy()
+    gpg_copy["USE"] = False
+    monkeypatch.setitem(config_copy, "GPG_ENCRYPTION", gpg_copy)
+
+    backup_file = os.path.join(save_backups_to, "backup.tar.gz")
+    tar_cmd = [toml_config["TAR_BIN"], "-cf", "-", "/path/that/does/not/exist"]
+
+    try:
+        result = stream_tar_process(logger, config_copy, tar_cmd, backup_file)
+
+        assert not result["is_working"]
+        assert "tar command failed with return code" in result["msg"]
+        assert not os.path.exists(backup_file)
+    finally:
+        shutil.rmtree(save_backups_to)
+
+
+def test_stream_tar_process_zstd_pipeline(logger, toml_config, monkeypatch):
+    """Test stream_tar_process() connects tar and the zstd binary as a pipeline and hashes the backup file."""
+    compressor_bin = shutil.which("zstd")
+    if compressor_bin is None:
+        pytest.skip("zstd binary is not installed")
+
+    data_dir = tempfile.mkdtemp()
+    save_backups_to = tempfile.mkdtemp()
+    with open(os.path.join(data_dir, "a.txt"), "wb") as f:
+        f.write(b"mail text " * 100000)
+
+    config_copy = toml_config.copy()
+    gpg_copy = config_copy["GPG_ENCRYPTION"].copy()
+    gpg_copy["USE"] = False
+    monkeypatch.setitem(config_copy, "GPG_ENCRYPTION", gpg_copy)
+    monkeypatch.setitem(config_copy, "COMPRESSION", {"CODEC": "zstd", "BIN": compressor_bin})
+    monkeypatch.setitem(config_copy, "ARCHIVE", {})
+
+    backup_file = os.path.join(save_backups_to, "backup.tar.zst")
+    tar_cmd = [toml_config["TAR_BIN"], "-cf", "-", "-C", data_dir, "a.txt"]
+
+    try:
+        result = stream_tar_process(logger, config_copy, tar_cmd, backup_file)
+
+        assert result["is_working"]
+        with open(backup_file, "rb") as f:
+            backup = f.read()
+        assert result["sha256"] == hashlib.sha256(backup).hexdigest()
+        assert result["backup_size"] == len(backup)
+
+        archive = subprocess.run([compressor_bin, "-d", "-c"], input=backup, check=True, stdout=subprocess.PIPE).stdout
+        assert result["archive_size"] == len(archive)
+        with tarfile.open(fileobj=io.BytesIO(archive)) as tar:
+            assert tar.extractfile("a.txt").read() == b"mail text " * 100000
+    finally:
+        shutil.rmtree(data_dir)
+        shutil.rmtree(save_backups_to)
@@ -1,5 +1,7 @@
 import pytest
 import os
+import json
+import tarfile
 import tempfile
 import hashlib
 import uuid
@@ -7,7 +9,9 @@ import subprocess
 import shutil
 import datetime
 import time
-from ddmail_backup_taker.backup import sha256_of_file, backup_mariadb, clear_backups, tar_data, secure_delete, create_backup
+from ddmail_backup_taker.backup import sha256_of_file, backup_mariadb, clear_backups, tar_data, secure_delete, create_backup, is_backup_file, backup_stem, SNAPSHOT_FOLDER
+from ddmail_backup_taker.table_changes import load_table_state, TABLE_STATE
+from ddmail_backup_taker.delta import load_delta_state, DELTA_STATE, DELTA_SIGNATURE
 
 def test_sha256_of_file_create_sha256(logger,testfile):
     """Test sha256_of_file() checksum is correct."""
@@ -739,6 +743,416 @@ def test_tar_data_encryption_exception(logger, toml_config, monkeypatch):
         shutil.rmtree(save_backups_to)
 
 
+def test_tar_data_incremental(logger, toml_config, monkeypatch):
+    """Test tar_data takes a full backup first and then only archives changed files."""
+    # Create temporary directories for testing
+    save_backups_to = tempfile.mkdtemp()
+    data_dir = tempfile.mkdtemp()
+
+    # Create sample files to back up
+    unchanged_file = os.path.join(data_dir, "unchanged.txt")
+    changed_file = os.path.join(data_dir, "changed.txt")
+    for path in [unchanged_file, changed_file]:
+        with open(path, "w") as f:
+            f.write("first version")
+
+    # Modify config to use our temporary directories
+    config_copy = toml_config.copy()
+    config_copy["SAVE_BACKUPS_TO"] = save_backups_to
+
+    # Ensure GPG encryption is disabled
+    gpg_copy = config_copy["GPG_ENCRYPTION"].copy()
+    gpg_copy["USE"] = False
+    monkeypatch.setitem(config_copy, "GPG_ENCRYPTION", gpg_copy)
+
+    # Enable incremental backups
+    data_copy = config_copy["DATA"].copy()
+    data_copy["INCREMENTAL"] = True
+    data_copy["INCREMENTAL_MAX_LEVEL"] = 1
+    monkeypatch.setitem(config_copy, "DATA", data_copy)
+
+    def list_archive(path):
+        output = subprocess.run([config_copy["TAR_BIN"], "-tzf", path], check=True, stdout=subprocess.PIPE)
+        return [name for name in output.stdout.decode("utf-8").splitlines() if not name.endswith("/")]
+
+    try:
+        # First run is a full backup.
+        result_full = tar_data(logger, config_copy, [data_dir])
+        assert result_full["is_working"]
+        assert result_full["backup_type"] == "full"
+        assert result_full["backup_level"] == 0
+        assert len(list_archive(result_full["backup_file"])) == 2
+
+        # Change one file, make sure the backup name differs.
+        time.sleep(1.1)
+        with open(changed_file, "w") as f:
+            f.write("second version")
+
+        # Second run only contains the changed file.
+        result_incr = tar_data(logger, config_copy, [data_dir])
+        assert result_incr["is_working"]
+        assert result_incr["backup_type"] == "incremental"
+        assert result_incr["backup_level"] == 1
+        assert ".incr1.tar.gz" in result_incr["backup_filename"]
+        members = list_archive(result_incr["backup_file"])
+        assert len(members) == 1
+        assert members[0].endswith("changed.txt")
+
+        # Max level is reached so the third run is a full backup again.
+        time.sleep(1.1)
+        result_next = tar_data(logger, config_copy, [data_dir])
+        assert result_next["is_working"]
+        assert result_next["backup_type"] == "full"
+        assert len(list_archive(result_next["backup_file"])) == 2
+    finally:
+        # Clean up
+        shutil.rmtree(save_backups_to)
+        shutil.rmtree(data_dir)
+
+
+def test_tar_data_incremental_failure_keeps_snapshot(logger, toml_config, monkeypatch):
+    """Test tar_data does not change the saved snapshot when tar fails."""
+    # Create temporary directory for testing
+    save_backups_to = tempfile.mkdtemp()
+
+    # Modify config to use our temporary directory
+    config_copy = toml_config.copy()
+    config_copy["SAVE_BACKUPS_TO"] = save_backups_to
+
+    # Ensure GPG encryption is disabled
+    gpg_copy = config_copy["GPG_ENCRYPTION"].copy()
+    gpg_copy["USE"] = False
+    monkeypatch.setitem(config_copy, "GPG_ENCRYPTION", gpg_copy)
+
+    # Enable incremental backups
+    data_copy = config_copy["DATA"].copy()
+    data_copy["INCREMENTAL"] = True
+    monkeypatch.setitem(config_copy, "DATA", data_copy)
+
+    # Mock subprocess.run to simulate tar command failure
+    def mock_run(*args, **kwargs):
+        raise subprocess.CalledProcessError(2, "tar", stderr=b"mock tar error")
+
+    monkeypatch.setattr(subprocess, "run", mock_run)
+
+    try:
+        result = tar_data(logger, config_copy, ["/tmp/test.txt"])
+
+        assert not result["is_working"]
+        assert not os.path.exists(os.path.join(save_backups_to, "snapshots", "state.json"))
+    finally:
+        # Clean up
+        shutil.rmtree(save_backups_to)
+
+
+def test_tar_data_python_engine(logger, toml_config, monkeypatch):
+    """Test tar_data with the python archive engine creates a gzip tar file."""
+    # Create temporary directories for testing
+    save_backups_to = tempfile.mkdtemp()
+    data_dir = tempfile.mkdtemp()
+
+    # Create a sample file to back up
+    test_file_path = os.path.join(data_dir, "test_file.txt")
+    with open(test_file_path, "w") as f:
+        f.write("Test data for tar_data function")
+
+    # Modify config to use our temporary directories
+    config_copy = toml_config.copy()
+    config_copy["SAVE_BACKUPS_TO"] = save_backups_to
+    monkeypatch.setitem(config_copy, "ARCHIVE", {"ENGINE": "python"})
+
+    # Ensure GPG encryption is disabled
+    gpg_copy = config_copy["GPG_ENCRYPTION"].copy()
+    gpg_copy["USE"] = False
+    monkeypatch.setitem(config_copy, "GPG_ENCRYPTION", gpg_copy)
+
+    try:
+        result = tar_data(logger, config_copy, [test_file_path])
+
+        assert result["is_working"]
+        assert result["backup_filename"].endswith(".tar.gz")
+        assert result["sha256"] == sha256_of_file(logger, result["backup_file"])["checksum"]
+        assert result["backup_size"] == os.path.getsize(result["backup_file"])
+
+        output = subprocess.run([config_copy["TAR_BIN"], "-tzf", result["backup_file"]], check=True, stdout=subprocess.PIPE)
+        assert test_file_path.lstrip("/") in output.stdout.decode("utf-8").splitlines()
+    finally:
+        # Clean up
+        shutil.rmtree(save_backups_to)
+        shutil.rmtree(data_dir)
+
+
+def test_tar_data_python_engine_stream_mariadb(logger, toml_config, monkeypatch):
+    """Test tar_data with MARIADB.STREAM archives the dump without a file on disk."""
+    save_backups_to = tempfile.mkdtemp()
+
+    config_copy = toml_config.copy()
+    config_copy["SAVE_BACKUPS_TO"] = save_backups_to
+    monkeypatch.setitem(config_copy, "ARCHIVE", {"ENGINE": "python"})
+    mariadb_copy = config_copy["MARIADB"].copy()
+    mariadb_copy["USE"] = True
+    mariadb_copy["STREAM"] = True
+    monkeypatch.setitem(config_copy, "MARIADB", mariadb_copy)
+    gpg_copy = config_copy["GPG_ENCRYPTION"].copy()
+    gpg_copy["USE"] = False
+    monkeypatch.setitem(config_copy, "GPG_ENCRYPTION", gpg_copy)
+
+    try:
+        result = tar_data(logger, config_copy, [])
+
+        assert result["is_working"]
+        with tarfile.open(result["backup_file"], "r:gz") as tar:
+            assert tar.getnames() == [".ddmail_backup_taker/mariadb/full_db_dump.sql.part0001"]
+            assert len(tar.extractfile(".ddmail_backup_taker/mariadb/full_db_dump.sql.part0001").read()) > 0
+    finally:
+        shutil.rmtree(save_backups_to)
+
+
+@pytest.mark.parametrize("use_gpg", [False, True])
+def test_tar_data_compression_threads(logger, toml_config, monkeypatch, use_gpg):
+    """Test tar_data compressing with several threads with and without encryption."""
+    # Create temporary directories for testing
+    save_backups_to = tempfile.mkdtemp()
+    data_dir = tempfile.mkdtemp()
+
+    # Create a sample file to back up
+    test_file_path = os.path.join(data_dir, "test_file.txt")
+    with open(test_file_path, "w") as f:
+        f.write("Test data for tar_data function" * 1000)
+
+    # Modify config to use our temporary directories
+    config_copy = toml_config.copy()
+    config_copy["SAVE_BACKUPS_TO"] = save_backups_to
+    monkeypatch.setitem(config_copy, "COMPRESSION", {"THREADS": 4})
+
+    gpg_copy = config_copy["GPG_ENCRYPTION"].copy()
+    gpg_copy["USE"] = use_gpg
+    monkeypatch.setitem(config_copy, "GPG_ENCRYPTION", gpg_copy)
+
+    try:
+        result = tar_data(logger, config_copy, [test_file_path])
+
+        assert result["is_working"]
+        assert result["backup_size"] == os.path.getsize(result["backup_file"])
+
+        if use_gpg:
+            assert result["backup_filename"].endswith(".tar.gz.gpg")
+            decrypted = subprocess.run([gpg_copy["GPG_BIN"], "--batch", "-d", result["backup_file"]], check=True, stdout=subprocess.PIPE, stderr=subprocess.DEVNULL)
+            archive = decrypted.stdout
+        else:
+            assert result["backup_filename"].endswith(".tar.gz")
+            with open(result["backup_file"], "rb") as f:
+                archive = f.read()
+
+        output = subprocess.run([config_copy["TAR_BIN"], "-tzf", "-"], input=archive, check=True, stdout=subprocess.PIPE)
+        assert test_file_path.lstrip("/") in output.stdout.decode("utf-8").splitlines()
+    finally:
+        # Clean up
+        shutil.rmtree(save_backups_to)
+        shutil.rmtree(data_dir)
+
+
+@pytest.mark.parametrize("codec,extension,tar_flag", [("zstd", ".tar.zst", "--zstd"), ("xz", ".tar.xz", "-J"), ("none", ".tar", None)])
+def test_tar_data_compression_codec(logger, toml_config, monkeypatch, codec, extension, tar_flag):
+    """Test tar_data with the other compression codecs."""
+    compressor_bin = shutil.which(codec)
+    if codec == "zstd" and compressor_bin is None:
+        pytest.skip("zstd binary is not installed")
+
+    # Create temporary directories for testing
+    save_backups_to = tempfile.mkdtemp()
+    data_dir = tempfile.mkdtemp()
+
+    # Create a sample file to back up
+    test_file_path = os.path.join(data_dir, "test_file.txt")
+    with open(test_file_path, "w") as f:
+        f.write("Test data for tar_data function" * 1000)
+
+    # Modify config to use our temporary directories
+    config_copy = toml_config.copy()
+    config_copy["SAVE_BACKUPS_TO"] = save_backups_to
+    monkeypatch.setitem(config_copy, "COMPRESSION", {"CODEC": codec, "BIN": compressor_bin})
+
+    # Ensure GPG encryption is disabled
+    gpg_copy = config_copy["GPG_ENCRYPTION"].copy()
+    gpg_copy["USE"] = False
+    monkeypatch.setitem(config_copy, "GPG_ENCRYPTION", gpg_copy)
+
+    # Make sure tar can find the zstd binary.
+    if compressor_bin:
+        monkeypatch.setenv("PATH", os.path.dirname(compressor_bin) + os.pathsep + os.environ["PATH"])
+
+    try:
+        result = tar_data(logger, config_copy, [test_file_path])
+
+        assert result["is_working"]
+        assert result["backup_filename"].endswith(extension)
+
+        tar_cmd = [config_copy["TAR_BIN"], "-tf", result["backup_file"]]
+        if tar_flag:
+            tar_cmd.insert(1, tar_flag)
+        output = subprocess.run(tar_cmd, check=True, stdout=subprocess.PIPE)
+        assert test_file_path.lstrip("/") in output.stdout.decode("utf-8").splitlines()
+    finally:
+        # Clean up
+        shutil.rmtree(save_backups_to)
+        shutil.rmtree(data_dir)
+
+
+def test_tar_data_python_engine_maildir_incremental(logger, toml_config, monkeypatch):
+    """Test tar_data with the python archive engine records Maildir flag changes as renames."""
+    # Create temporary directories for testing
+    save_backups_to = tempfile.mkdtemp()
+    data_dir = tempfile.mkdtemp()
+    for folder in ["cur", "new", "tmp"]:
+        os.makedirs(os.path.join(data_dir, "Maildir", folder))
+
+    # Create sample messages and a dovecot index file
+    def write_file(name, content):
+        with open(os.path.join(data_dir, "Maildir", name), "w") as f:
+            f.write(content)
+
+    write_file("new/1700000000.M1P1.host", "first message")
+    write_file("cur/1700000001.M2P2.host:2,", "second message")
+    write_file("cur/1700000002.M3P3.host:2,S", "third message")
+    write_file("dovecot.index", "index")
+
+    # Modify config to use our temporary directories
+    config_copy = toml_config.copy()
+    config_copy["SAVE_BACKUPS_TO"] = save_backups_to
+    monkeypatch.setitem(config_copy, "ARCHIVE", {"ENGINE": "python"})
+
+    # Ensure GPG encryption is disabled
+    gpg_copy = config_copy["GPG_ENCRYPTION"].copy()
+    gpg_copy["USE"] = False
+    monkeypatch.setitem(config_copy, "GPG_ENCRYPTION", gpg_copy)
+
+    # Enable incremental Maildir backups
+    data_copy = config_copy["DATA"].copy()
+    data_copy["INCREMENTAL"] = True
+    data_copy["MAILDIR"] = True
+    monkeypatch.setitem(config_copy, "DATA", data_copy)
+
+    def read_archive(path):
+        with tarfile.open(path, mode="r:gz") as tar:
+            files = [member.name for member in tar if member.isreg()]
+            changes = json.load(tar.extractfile(".ddmail_backup_taker/changes.json"))
+        return files, changes
+
+    base = os.path.join(data_dir, "Maildir").lstrip("/")
+
+    try:
+        # First run is a full backup with every message.
+        result_full = tar_data(logger, config_copy, [data_dir])
+        assert result_full["is_working"]
+        assert result_full["backup_type"] == "full"
+        files, changes = read_archive(result_full["backup_file"])
+        assert len(files) == 5
+
+        # Read the first message, mark the second as seen, delete the third, deliver a new one.
+        time.sleep(1.1)
+        maildir = os.path.join(data_dir, "Maildir")
+        os.rename(os.path.join(maildir, "new/1700000000.M1P1.host"), os.path.join(maildir, "cur/1700000000.M1P1.host:2,"))
+        os.rename(os.path.join(maildir, "cur/1700000001.M2P2.host:2,"), os.path.join(maildir, "cur/1700000001.M2P2.host:2,S"))
+        os.remove(os.path.join(maildir, "cur/1700000002.M3P3.host:2,S"))
+        write_file("new/1700000003.M4P4.host", "fourth message")
+
+        # Second run only contains the new message and the changes.
+        result_incr = tar_data(logger, config_copy, [data_dir])
+        assert result_incr["is_working"]
+        assert result_incr["backup_type"] == "incremental"
+        assert ".incr1.tar.gz" in result_incr["backup_filename"]
+        files, changes = read_archive(result_incr["backup_file"])
+        assert files == [base + "/new/1700000003.M4P4.host", ".ddmail_backup_taker/changes.json"]
+        assert sorted(changes["renames"]) == [
+                [base + "/cur/1700000001.M2P2.host:2,", base + "/cur/1700000001.M2P2.host:2,S"],
+                [base + "/new/1700000000.M1P1.host", base + "/cur/1700000000.M1P1.host:2,"],
+                ]
+        assert changes["deletes"] == [base + "/cur/1700000002.M3P3.host:2,S"]
+    finally:
+        # Clean up
+        shutil.rmtree(save_backups_to)
+        shutil.rmtree(data_dir)
+
+
+def test_tar_data_volumes(logger, toml_config, monkeypatch):
+    """Test tar_data splits the backup into volumes described by an index file."""
+    # Create temporary directories for testing
+    save_backups_to = tempfile.mkdtemp()
+    data_dir = tempfile.mkdtemp()
+    with open(os.path.join(data_dir, "random.bin"), "wb") as f:
+        f.write(os.urandom(3000000))
+
+    # Modify config to use our temporary directories and 1mb volumes
+    config_copy = toml_config.copy()
+    config_copy["SAVE_BACKUPS_TO"] = save_backups_to
+    monkeypatch.setitem(config_copy, "ARCHIVE", {"ENGINE": "tar", "VOLUME_SIZE": 1048576})
+
+    # Ensure GPG encryption is disabled
+    gpg_copy = config_copy["GPG_ENCRYPTION"].copy()
+    gpg_copy["USE"] = False
+    monkeypatch.setitem(config_copy, "GPG_ENCRYPTION", gpg_copy)
+
+    try:
+        result = tar_data(logger, config_copy, [data_dir])
+
+        assert result["is_working"]
+        assert result["backup_filename"].endswith(".tar.gz.index")
+        assert result["backup_files"][-1] == result["backup_file"]
+
+        with open(result["backup_file"], "r") as f:
+            index = json.load(f)
+        assert len(index["volumes"]) == len(result["backup_files"]) - 1 == 3
+        assert index["sha256"] == result["sha256"]
+
+        # Joined volumes are the complete archive.
+        joined = b""
+        for volume in index["volumes"]:
+            with open(os.path.join(save_backups_to, volume["filename"]), "rb") as f:
+                joined = joined + f.read()
+        assert hashlib.sha256(joined).hexdigest() == index["sha256"]
+        output = subprocess.run([config_copy["TAR_BIN"], "-tzf", "-"], input=joined, check=True, stdout=subprocess.PIPE)
+        assert data_dir.lstrip("/") + "/random.bin" in output.stdout.decode("utf-8").splitlines()
+    finally:
+        # Clean up
+        shutil.rmtree(save_backups_to)
+        shutil.rmtree(data_dir)
+
+
+def test_tar_data_sharded(logger, toml_config, monkeypatch):
+    """Test tar_data archives every path as an encrypted shard named by a manifest."""
+    # Create temporary directories for testing
+    save_backups_to = tempfile.mkdtemp()
+    data_dirs = [tempfile.mkdtemp(), tempfile.mkdtemp()]
+    for data_dir in data_dirs:
+        with open(os.path.join(data_dir, "a.txt"), "w") as f:
+            f.write("test")
+
+    # Modify config to use our temporary directories and sharded archiving
+    config_copy = toml_config.copy()
+    config_copy["SAVE_BACKUPS_TO"] = save_backups_to
+    monkeypatch.setitem(config_copy, "ARCHIVE", {"ENGINE": "tar", "SHARDED": True, "SHARD_WORKERS": 2})
+
+    # Ensure GPG encryption is enabled
+    gpg_copy = config_copy["GPG_ENCRYPTION"].copy()
+    gpg_copy["USE"] = True
+    monkeypatch.setitem(config_copy, "GPG_ENCRYPTION", gpg_copy)
+
+    try:
+        result = tar_data(logger, config_copy, data_dirs)
+
+        assert result["is_working"]
+        assert result["backup_filename"].endswith(".tar.gz.gpg.manifest")
+        assert len(result["backup_files"]) == 3
+        assert all(is_backup_file(file) for file in result["backup_files"])
+        assert set(backup_stem(file) for file in result["backup_files"]) == {result["backup_file"][:-len(".manifest")]}
+    finally:
+        # Clean up
+        shutil.rmtree(save_backups_to)
+        for data_dir in data_dirs:
+            shutil.rmtree(data_dir)
+
+
 # Test cases for clear_backups function
 
 def test_clear_backups_no_files(logger, toml_config):
@@ -789,38 +1203,260 @@ def test_clear_backups_fewer_than_limit(logger, toml_config):
         assert result["is_working"]
         assert result["msg"] == "too few backups for clearing old backups"
 
-        # Verify all files still exist
-        for file in backup_files:
-            assert os.path.exists(file)
+        # Verify all files still exist
+        for file in backup_files:
+            assert os.path.exists(file)
+    finally:
+        # Clean up
+        shutil.rmtree(save_backups_to)
+
+
+def test_clear_backups_more_than_limit(logger, toml_config, monkeypatch):
+    """Test clear_backups when there are more files than the retention limit."""
+    # Create temporary directory for testing
+    save_backups_to = tempfile.mkdtemp()
+
+    # Modify config to use our temporary directory
+    config_copy = toml_config.copy()
+    config_copy["SAVE_BACKUPS_TO"] = save_backups_to
+    config_copy["BACKUPS_TO_SAVE_LOCAL"] = 2
+
+    # Create five backup files (more than the limit of 2)
+    backup_files = []
+    for i in range(5):
+        backup_path = os.path.join(save_backups_to, f"backup_{i}.tar.gz")
+        with open(backup_path, "w") as f:
+            f.write(f"backup content {i}")
+        # Add delays to ensure different modification times
+        time.sleep(0.1)
+        backup_files.append(backup_path)
+
+    # Save the paths of the files to delete for verification later
+    files_to_delete = backup_files[:-2]
+
+    # Mock secure_delete to avoid actual deletion but track what would be deleted
+    deleted_files = []
+
+    def mock_secure_delete(logger, toml_config, path):
+        deleted_files.append(path)
+        return {"is_working": True, "msg": f"deleted {path} successfully"}
+
+    monkeypatch.setattr("ddmail_backup_taker.backup.secure_delete", mock_secure_delete)
+
+    try:
+        # Call clear_backups
+        result = clear_backups(logger, config_copy)
+
+        # Verify results
+        assert result["is_working"]
+        assert result["msg"] == "finished successfully"
+
+        # Verify the correct files were "deleted"
+        assert set(deleted_files) == set(files_to_delete)
+    finally:
+        # Clean up
+        shutil.rmtree(save_backups_to)
+
+
+def test_clear_backups_keeps_delta_base(logger, toml_config, monkeypatch):
+    """Test clear_backups keeps the backup with the base dump of a kept delta backup."""
+    save_backups_to = tempfile.mkdtemp()
+
+    config_copy = toml_config.copy()
+    config_copy["SAVE_BACKUPS_TO"] = save_backups_to
+    config_copy["BACKUPS_TO_SAVE_LOCAL"] = 2
+
+    # Backup 1 has the base dump of the deltas in backup 2, 3 and 4.
+    backup_files = []
+    for i in range(5):
+        backup_path = os.path.join(save_backups_to, f"backup_{i}.tar.gz")
+        with open(backup_path, "w") as f:
+            f.write(f"backup content {i}")
+        time.sleep(0.1)
+        backup_files.append(backup_path)
+
+    os.makedirs(os.path.join(save_backups_to, SNAPSHOT_FOLDER))
+    with open(os.path.join(save_backups_to, SNAPSHOT_FOLDER, DELTA_STATE), "w") as f:
+        json.dump({"base_backup_filename": "backup_1.tar.gz", "base_digest": "", "base_size": 0, "runs_since_full": 3,
+                   "deltas": {"backup_2.tar.gz": "backup_1.tar.gz", "backup_3.tar.gz": "backup_1.tar.gz", "backup_4.tar.gz": "backup_1.tar.gz"}}, f)
+
+    deleted_files = []
+
+    def mock_secure_delete(logger, toml_config, path):
+        deleted_files.append(path)
+        return {"is_working": True, "msg": f"deleted {path} successfully"}
+
+    monkeypatch.setattr("ddmail_backup_taker.backup.secure_delete", mock_secure_delete)
+
+    try:
+        result = clear_backups(logger, config_copy)
+
+        assert result["is_working"]
+        assert sorted(deleted_files) == [backup_files[0], backup_files[2]]
+    finally:
+        shutil.rmtree(save_backups_to)
+
+
+def test_clear_backups_keeps_unchanged_table_backups(logger, toml_config, monkeypatch):
+    """Test clear_backups keeps the older backups that hold the unchanged tables of a kept backup."""
+    save_backups_to = tempfile.mkdtemp()
+
+    config_copy = toml_config.copy()
+    config_copy["SAVE_BACKUPS_TO"] = save_backups_to
+    config_copy["BACKUPS_TO_SAVE_LOCAL"] = 2
+
+    # Backup 4 references tables in backup 2 split into volumes, backup 2 references tables in backup 0.
+    backup_files = []
+    for i in range(5):
+        backup_path = os.path.join(save_backups_to, f"backup_{i}.tar.gz" + (".001" if i == 2 else ""))
+        with open(backup_path, "w") as f:
+            f.write(f"backup content {i}")
+        time.sleep(0.1)
+        backup_files.append(backup_path)
+
+    os.makedirs(os.path.join(save_backups_to, SNAPSHOT_FOLDER))
+    with open(os.path.join(save_backups_to, SNAPSHOT_FOLDER, TABLE_STATE), "w") as f:
+        json.dump({"tables": [{"database": "mail", "table": "users", "fingerprint": "1", "file": "db_dump_mail.users.sql", "backup_filename": "backup_2.tar.gz"}],
+                   "references": {"backup_2.tar.gz": ["backup_0.tar.gz"], "backup_3.tar.gz": [], "backup_4.tar.gz": ["backup_2.tar.gz"]}}, f)
+
+    deleted_files = []
+
+    def mock_secure_delete(logger, toml_config, path):
+        deleted_files.append(path)
+        return {"is_working": True, "msg": f"deleted {path} successfully"}
+
+    monkeypatch.setattr("ddmail_backup_taker.backup.secure_delete", mock_secure_delete)
+
+    try:
+        result = clear_backups(logger, config_copy)
+
+        assert result["is_working"]
+        assert deleted_files == [backup_files[1]]
+    finally:
+        shutil.rmtree(save_backups_to)
+
+
+def test_clear_backups_secure_delete_failure(logger, toml_config, monkeypatch):
+    """Test clear_backups when secure_delete fails."""
+    # Create temporary directory for testing
+    save_backups_to = tempfile.mkdtemp()
+
+    # Modify config to use our temporary directory
+    config_copy = toml_config.copy()
+    config_copy["SAVE_BACKUPS_TO"] = save_backups_to
+    config_copy["BACKUPS_TO_SAVE_LOCAL"] = 2
+
+    # Create five backup files (more than the limit of 2)
+    for i in range(5):
+        backup_path = os.path.join(save_backups_to, f"backup_{i}.tar.gz")
+        with open(backup_path, "w") as f:
+            f.write(f"backup content {i}")
+        # Add delays to ensure different modification times
+        time.sleep(0.1)
+
+    # Mock secure_delete to fail on the first delete
+    def mock_secure_delete(logger, toml_config, path):
+        return {"is_working": False, "msg": "mock secure delete failure"}
+
+    monkeypatch.setattr("ddmail_backup_taker.backup.secure_delete", mock_secure_delete)
+
+    try:
+        # Call clear_backups
+        result = clear_backups(logger, config_copy)
+
+        # Verify results
+        assert not result["is_working"]
+        assert "Failed to delete file" in result["msg"]
+    finally:
+        # Clean up
+        shutil.rmtree(save_backups_to)
+
+
+def test_clear_backups_glob_pattern(logger, toml_config, monkeypatch):
+    """Test clear_backups uses the correct glob pattern for finding backup files."""
+    # Create temporary directory for testing
+    save_backups_to = tempfile.mkdtemp()
+
+    # Modify config to use our temporary directory
+    config_copy = toml_config.copy()
+    config_copy["SAVE_BACKUPS_TO"] = save_backups_to
+    config_copy["BACKUPS_TO_SAVE_LOCAL"] = 1
+
+    # Create various files with different patterns
+    valid_backup = os.path.join(save_backups_to, "backup_20220101.tar.gz")
+    encrypted_backup = os.path.join(save_backups_to, "backup_20220102.tar.gz.gpg")
+    non_backup_file = os.path.join(save_backups_to, "not_a_backup.txt")
+    wrong_extension = os.path.join(save_backups_to, "backup_20220103.zip")
+
+    # Create all test files
+    for path in [valid_backup, encrypted_backup, non_backup_file, wrong_extension]:
+        with open(path, "w") as f:
+            f.write("test content")
+        # Add a small delay between file creations
+        time.sleep(0.1)
+
+    # Mock secure_delete to track what would be deleted
+    deleted_files = []
+
+    def mock_secure_delete(logger, toml_config, path):
+        deleted_files.append(path)
+        return {"is_working": True, "msg": f"deleted {path} successfully"}
+
+    monkeypatch.setattr("ddmail_backup_taker.backup.secure_delete", mock_secure_delete)
+
+    try:
+        # Call clear_backups
+        result = clear_backups(logger, config_copy)
+
+        # Verify results
+        assert result["is_working"]
+        assert result["msg"] == "finished successfully"
+
+        # Should delete the oldest backup file, which should be the valid one
+        # (since the encrypted one was created later)
+        assert len(deleted_files) == 1
+        assert deleted_files[0] == valid_backup
+
+        # The non-backup files should not be touched
+        assert os.path.exists(non_backup_file)
+        assert os.path.exists(wrong_extension)
     finally:
         # Clean up
         shutil.rmtree(save_backups_to)
 
 
-def test_clear_backups_more_than_limit(logger, toml_config, monkeypatch):
-    """Test clear_backups when there are more files than the retention limit."""
+def test_clear_backups_all_codecs(logger, toml_config, monkeypatch):
+    """Test clear_backups finds backups of every compression codec."""
     # Create temporary directory for testing
     save_backups_to = tempfile.mkdtemp()
 
     # Modify config to use our temporary directory
     config_copy = toml_config.copy()
     config_copy["SAVE_BACKUPS_TO"] = save_backups_to
-    config_copy["BACKUPS_TO_SAVE_LOCAL"] = 2
+    config_copy["BACKUPS_TO_SAVE_LOCAL"] = 1
 
-    # Create five backup files (more than the limit of 2)
+    names = [
+            "backup_20220101.tar",
+            "backup_20220102.tar.zst.gpg",
+            "backup_20220103.tar.lz4",
+            "backup_20220104.tar.xz.gpg",
+            "backup_20220105.tar.gz",
+            ]
     backup_files = []
-    for i in range(5):
-        backup_path = os.path.join(save_backups_to, f"backup_{i}.tar.gz")
+    for name in names:
+        backup_path = os.path.join(save_backups_to, name)
         with open(backup_path, "w") as f:
-            f.write(f"backup content {i}")
+            f.write("backup content")
         # Add delays to ensure different modification times
         time.sleep(0.1)
         backup_files.append(backup_path)
 
-    # Save the paths of the files to delete for verification later
-    files_to_delete = backup_files[:-2]
+    # Files that are not backups
+    other_file = os.path.join(save_backups_to, "backup_20220106.tar.bz2")
+    with open(other_file, "w") as f:
+        f.write("not a backup")
 
-    # Mock secure_delete to avoid actual deletion but track what would be deleted
+    # Mock secure_delete to track what would be deleted
     deleted_files = []
 
     def mock_secure_delete(logger, toml_config, path):
@@ -830,22 +1466,49 @@ def test_clear_backups_more_than_limit(logger, toml_config, monkeypatch):
     monkeypatch.setattr("ddmail_backup_taker.backup.secure_delete", mock_secure_delete)
 
     try:
-        # Call clear_backups
         result = clear_backups(logger, config_copy)
 
-        # Verify results
         assert result["is_working"]
-        assert result["msg"] == "finished successfully"
-
-        # Verify the correct files were "deleted"
-        assert set(deleted_files) == set(files_to_delete)
+        assert set(deleted_files) == set(backup_files[:-1])
+        assert os.path.exists(other_file)
     finally:
         # Clean up
         shutil.rmtree(save_backups_to)
 
 
-def test_clear_backups_secure_delete_failure(logger, toml_config, monkeypatch):
-    """Test clear_backups when secure_delete fails."""
+def test_is_backup_file():
+    """Test is_backup_file() matches the backup archives of every codec."""
+    assert is_backup_file("/root/backups/backup_20220101.tar.gz")
+    assert is_backup_file("backup_20220101.incr2.tar.zst.gpg")
+    assert is_backup_file("backup_20220101.tar")
+    assert is_backup_file("backup_20220101.tar.gz.gpg.001")
+    assert is_backup_file("backup_20220101.tar.gz.gpg.index")
+    assert is_backup_file("backup_20220101.shard002.tar.gz.gpg")
+    assert is_backup_file("backup_20220101.tar.gz.gpg.manifest")
+    assert is_backup_file("backup_20220101.tar.gz.gpg.catalog")
+    assert is_backup_file("backup_20220101.tar.zst.ddenc")
+    assert is_backup_file("backup_20220101.tar.zst.ddenc.catalog")
+
+
+def test_backup_stem():
+    """Test backup_stem() is the same for every file of a backup."""
+    stems = set(backup_stem(name) for name in [
+            "/backups/backup_1.tar.gz.gpg",
+            "/backups/backup_1.tar.gz.gpg.index",
+            "/backups/backup_1.tar.gz.gpg.manifest",
+            "/backups/backup_1.tar.gz.gpg.catalog",
+            "/backups/backup_1.shard001.tar.gz.gpg",
+            "/backups/backup_1.shard012.tar.gz.gpg.003",
+            ])
+
+    assert stems == {"/backups/backup_1.tar.gz.gpg"}
+    assert not is_backup_file("backup_20220101.zip")
+    assert not is_backup_file("backup_20220101.tar.gz.tmp")
+    assert not is_backup_file("not_a_backup.tar.gz")
+
+
+def test_clear_backups_volumes(logger, toml_config, monkeypatch):
+    """Test clear_backups treats the volumes and index of a backup as one backup."""
     # Create temporary directory for testing
     save_backups_to = tempfile.mkdtemp()
 
@@ -854,54 +1517,69 @@ def test_clear_backups_secure_delete_failure(logger, toml_config, monkeypatch):
     config_copy["SAVE_BACKUPS_TO"] = save_backups_to
     config_copy["BACKUPS_TO_SAVE_LOCAL"] = 2
 
-    # Create five backup files (more than the limit of 2)
-    for i in range(5):
-        backup_path = os.path.join(save_backups_to, f"backup_{i}.tar.gz")
+    # Oldest to newest: one backup in volumes, two single file backups.
+    names = [
+            "backup_20220101.tar.gz.gpg.001",
+            "backup_20220101.tar.gz.gpg.002",
+            "backup_20220101.tar.gz.gpg.index",
+            "backup_20220102.tar.gz.gpg",
+            "backup_20220103.tar.gz.gpg.001",
+            "backup_20220103.tar.gz.gpg.index",
+            ]
+    backup_files = []
+    for name in names:
+        backup_path = os.path.join(save_backups_to, name)
         with open(backup_path, "w") as f:
-            f.write(f"backup content {i}")
+            f.write("backup content")
         # Add delays to ensure different modification times
         time.sleep(0.1)
+        backup_files.append(backup_path)
+
+    # Mock secure_delete to track what would be deleted
+    deleted_files = []
 
-    # Mock secure_delete to fail on the first delete
     def mock_secure_delete(logger, toml_config, path):
-        return {"is_working": False, "msg": "mock secure delete failure"}
+        deleted_files.append(path)
+        return {"is_working": True, "msg": f"deleted {path} successfully"}
 
     monkeypatch.setattr("ddmail_backup_taker.backup.secure_delete", mock_secure_delete)
 
     try:
-        # Call clear_backups
         result = clear_backups(logger, config_copy)
 
-        # Verify results
-        assert not result["is_working"]
-        assert "Failed to delete file" in result["msg"]
+        assert result["is_working"]
+        assert deleted_files == backup_files[:3]
     finally:
         # Clean up
         shutil.rmtree(save_backups_to)
 
 
-def test_clear_backups_glob_pattern(logger, toml_config, monkeypatch):
-    """Test clear_backups uses the correct glob pattern for finding backup files."""
+def test_clear_backups_keeps_incremental_chain(logger, toml_config, monkeypatch):
+    """Test clear_backups keeps the older backups a kept incremental backup depends on."""
     # Create temporary directory for testing
     save_backups_to = tempfile.mkdtemp()
 
     # Modify config to use our temporary directory
     config_copy = toml_config.copy()
     config_copy["SAVE_BACKUPS_TO"] = save_backups_to
-    config_copy["BACKUPS_TO_SAVE_LOCAL"] = 1
-
-    # Create various files with different patterns
-    valid_backup = os.path.join(save_backups_to, "backup_20220101.tar.gz")
-    encrypted_backup = os.path.join(save_backups_to, "backup_20220102.tar.gz.gpg")
-    non_backup_file = os.path.join(save_backups_to, "not_a_backup.txt")
-    wrong_extension = os.path.join(save_backups_to, "backup_20220103.zip")
+    config_copy["BACKUPS_TO_SAVE_LOCAL"] = 2
 
-    # Create all test files
-    for path in [valid_backup, encrypted_backup, non_backup_file, wrong_extension]:
-        with open(path, "w") as f:
-            f.write("test content")
-        # Add a small delay between file creations
+    # Oldest to newest: full, incr1, full, incr1, incr2
+    names = [
+            "backup_20220101.tar.gz",
+            "backup_20220102.incr1.tar.gz",
+            "backup_20220103.tar.gz.gpg",
+            "backup_20220104.incr1.tar.gz.gpg",
+            "backup_20220105.incr2.tar.gz.gpg",
+            ]
+    backup_files = []
+    for name in names:
+        backup_path = os.path.join(save_backups_to, name)
+        with open(backup_path, "w") as f:
+            f.write("backup content")
+        # Add delays to ensure different modification times
         time.sleep(0.1)
+        backup_files.append(backup_path)
 
     # Mock secure_delete to track what would be deleted
     deleted_files = []
@@ -913,21 +1591,11 @@ def test_clear_backups_glob_pattern(logger, toml_config, monkeypatch):
     monkeypatch.setattr("ddmail_backup_taker.backup.secure_delete", mock_secure_delete)
 
     try:
-        # Call clear_backups
         result = clear_backups(logger, config_copy)
 
-        # Verify results
         assert result["is_working"]
-        assert result["msg"] == "finished successfully"
-
-        # Should delete the oldest backup file, which should be the valid one
-        # (since the encrypted one was created later)
-        assert len(deleted_files) == 1
-        assert deleted_files[0] == valid_backup
-
-        # The non-backup files should not be touched
-        assert os.path.exists(non_backup_file)
-        assert os.path.exists(wrong_extension)
+        # The full backup of the newest chain is kept, the old chain is removed.
+        assert set(deleted_files) == set(backup_files[:2])
     finally:
         # Clean up
         shutil.rmtree(save_backups_to)
@@ -1018,6 +1686,219 @@ def test_create_backup_success_mariadb_and_data(logger, toml_config, monkeypatch
         shutil.rmtree(data_dir)
 
 
+def test_create_backup_mariadb_per_database(logger, toml_config, monkeypatch):
+    """Test create_backup archives every database dump with MARIADB.PER_DATABASE true."""
+    tmp_folder = tempfile.mkdtemp()
+    save_backups_to = tempfile.mkdtemp()
+
+    config_copy = toml_config.copy()
+    config_copy["TMP_FOLDER"] = tmp_folder
+    config_copy["SAVE_BACKUPS_TO"] = save_backups_to
+
+    mariadb_config = config_copy["MARIADB"].copy()
+    mariadb_config["USE"] = True
+    mariadb_config["PER_DATABASE"] = True
+    monkeypatch.setitem(config_copy, "MARIADB", mariadb_config)
+
+    data_config = config_copy["DATA"].copy()
+    data_config["USE"] = False
+    monkeypatch.setitem(config_copy, "DATA", data_config)
+
+    def mock_backup_mariadb_databases(logger, toml_config, dst_folder):
+        return {"is_working": True, "msg": "done", "db_dump_files": [os.path.join(dst_folder, "db_dump_db1.sql"), os.path.join(dst_folder, "db_dump_db2.sql")]}
+
+    monkeypatch.setattr("ddmail_backup_taker.backup.backup_mariadb_databases", mock_backup_mariadb_databases)
+
+    archived = []
+    backup_file = os.path.join(save_backups_to, "backup_20230115120000.tar.gz")
+
+    def mock_tar_data(logger, toml_config, data_to_backup):
+        archived.extend(data_to_backup)
+        return {"is_working": True, "msg": "finished successfully",
+                "backup_file": backup_file, "backup_filename": "backup_20230115120000.tar.gz"}
+
+    monkeypatch.setattr("ddmail_backup_taker.backup.tar_data", mock_tar_data)
+
+    def mock_secure_delete(logger, toml_config, path):
+        return {"is_working": True, "msg": f"deleted {path} successfully"}
+
+    monkeypatch.setattr("ddmail_backup_taker.backup.secure_delete", mock_secure_delete)
+
+    try:
+        result = create_backup(logger, config_copy)
+
+        assert result["is_working"]
+        assert [os.path.basename(path) for path in archived] == ["db_dump_db1.sql", "db_dump_db2.sql"]
+    finally:
+        shutil.rmtree(tmp_folder)
+        shutil.rmtree(save_backups_to)
+
+
+def test_create_backup_mariadb_chunked(logger, toml_config, monkeypatch):
+    """Test create_backup archives the schema and chunk files with MARIADB.MODE chunked."""
+    tmp_folder = tempfile.mkdtemp()
+    save_backups_to = tempfile.mkdtemp()
+
+    config_copy = toml_config.copy()
+    config_copy["TMP_FOLDER"] = tmp_folder
+    config_copy["SAVE_BACKUPS_TO"] = save_backups_to
+
+    mariadb_config = config_copy["MARIADB"].copy()
+    mariadb_config["USE"] = True
+    mariadb_config["MODE"] = "chunked"
+    mariadb_config["INCREMENTAL"] = False
+    monkeypatch.setitem(config_copy, "MARIADB", mariadb_config)
+
+    data_config = config_copy["DATA"].copy()
+    data_config["USE"] = False
+    monkeypatch.setitem(config_copy, "DATA", data_config)
+
+    def mock_backup_mariadb_chunked(logger, toml_config, dst_folder):
+        return {"is_working": True, "msg": "done", "db_dump_files": [os.path.join(dst_folder, "db_dump_db1.schema.sql"), os.path.join(dst_folder, "db_dump_db1.t1.00001.sql")]}
+
+    monkeypatch.setattr("ddmail_backup_taker.backup.backup_mariadb_chunked", mock_backup_mariadb_chunked)
+
+    archived = []
+    backup_file = os.path.join(save_backups_to, "backup_20230115120000.tar.gz")
+
+    def mock_tar_data(logger, toml_config, data_to_backup):
+        archived.extend(data_to_backup)
+        return {"is_working": True, "msg": "finished successfully",
+                "backup_file": backup_file, "backup_filename": "backup_20230115120000.tar.gz"}
+
+    monkeypatch.setattr("ddmail_backup_taker.backup.tar_data", mock_tar_data)
+
+    def mock_secure_delete(logger, toml_config, path):
+        return {"is_working": True, "msg": f"deleted {path} successfully"}
+
+    monkeypatch.setattr("ddmail_backup_taker.backup.secure_delete", mock_secure_delete)
+
+    try:
+        result = create_backup(logger, config_copy)
+
+        assert result["is_working"]
+        assert [os.path.basename(path) for path in archived] == ["db_dump_db1.schema.sql", "db_dump_db1.t1.00001.sql"]
+    finally:
+        shutil.rmtree(tmp_folder)
+        shutil.rmtree(save_backups_to)
+
+
+def test_create_backup_mariadb_skip_unchanged(logger, toml_config, monkeypatch):
+    """Test create_backup archives the changed tables and saves the backup that holds them with MARIADB.SKIP_UNCHANGED true."""
+    tmp_folder = tempfile.mkdtemp()
+    save_backups_to = tempfile.mkdtemp()
+
+    config_copy = toml_config.copy()
+    config_copy["TMP_FOLDER"] = tmp_folder
+    config_copy["SAVE_BACKUPS_TO"] = save_backups_to
+
+    mariadb_config = config_copy["MARIADB"].copy()
+    mariadb_config["USE"] = True
+    mariadb_config["MODE"] = "lock"
+    mariadb_config["SKIP_UNCHANGED"] = True
+    mariadb_config["INCREMENTAL"] = False
+    monkeypatch.setitem(config_copy, "MARIADB", mariadb_config)
+
+    data_config = config_copy["DATA"].copy()
+    data_config["USE"] = False
+    monkeypatch.setitem(config_copy, "DATA", data_config)
+
+    tables = [{"database": "db1", "table": "t1", "fingerprint": "1", "file": "db_dump_db1.t1.sql", "backup_filename": None}]
+
+    def mock_backup_changed_tables(logger, toml_config, state_file, dst_folder):
+        return {"is_working": True, "msg": "done", "db_dump_files": [os.path.join(dst_folder, "db_dump_db1.schema.sql"), os.path.join(dst_folder, "db_dump_db1.t1.sql")], "tables": tables}
+
+    monkeypatch.setattr("ddmail_backup_taker.backup.backup_changed_tables", mock_backup_changed_tables)
+
+    archived = []
+    backup_file = os.path.join(save_backups_to, "backup_20230115120000.tar.gz")
+
+    def mock_tar_data(logger, toml_config, data_to_backup):
+        archived.extend(data_to_backup)
+        return {"is_working": True, "msg": "finished successfully",
+                "backup_file": backup_file, "backup_filename": "backup_20230115120000.tar.gz"}
+
+    monkeypatch.setattr("ddmail_backup_taker.backup.tar_data", mock_tar_data)
+
+    def mock_secure_delete(logger, toml_config, path):
+        return {"is_working": True, "msg": f"deleted {path} successfully"}
+
+    monkeypatch.setattr("ddmail_backup_taker.backup.secure_delete", mock_secure_delete)
+
+    try:
+        result = create_backup(logger, config_copy)
+
+        assert result["is_working"]
+        assert [os.path.basename(path) for path in archived] == ["db_dump_db1.schema.sql", "db_dump_db1.t1.sql"]
+        state = load_table_state(os.path.join(save_backups_to, SNAPSHOT_FOLDER, TABLE_STATE))
+        assert state[("db1", "t1")]["backup_filename"] == "backup_20230115120000.tar.gz"
+    finally:
+        shutil.rmtree(tmp_folder)
+        shutil.rmtree(save_backups_to)
+
+
+def test_create_backup_mariadb_delta(logger, toml_config, monkeypatch):
+    """Test create_backup archives the delta and saves the backup with its base with MARIADB.DELTA true."""
+    tmp_folder = tempfile.mkdtemp()
+    save_backups_to = tempfile.mkdtemp()
+
+    config_copy = toml_config.copy()
+    config_copy["TMP_FOLDER"] = tmp_folder
+    config_copy["SAVE_BACKUPS_TO"] = save_backups_to
+
+    mariadb_config = config_copy["MARIADB"].copy()
+    mariadb_config["USE"] = True
+    mariadb_config["MODE"] = "lock"
+    mariadb_config["DELTA"] = True
+    mariadb_config["INCREMENTAL"] = False
+    monkeypatch.setitem(config_copy, "MARIADB", mariadb_config)
+
+    data_config = config_copy["DATA"].copy()
+    data_config["USE"] = False
+    monkeypatch.setitem(config_copy, "DATA", data_config)
+
+    dumps = iter([b"INSERT INTO t VALUES " + b"(1)," * 5000 + b"(2);\n", b"INSERT INTO t VALUES " + b"(1)," * 5000 + b"(3);\n"])
+
+    def mock_dump_database(logger, toml_config, database, dst_folder, table=None):
+        db_dump_file = os.path.join(dst_folder, "full_db_dump.sql")
+        with open(db_dump_file, "wb") as f:
+            f.write(next(dumps))
+        return {"is_working": True, "msg": "done", "db_dump_file": db_dump_file}
+
+    monkeypatch.setattr("ddmail_backup_taker.delta.dump_database", mock_dump_database)
+
+    archived = []
+
+    def mock_tar_data(logger, toml_config, data_to_backup):
+        archived.extend(os.path.basename(path) for path in data_to_backup)
+        backup_filename = "backup_" + str(len(archived)) + ".tar.gz"
+        with open(os.path.join(save_backups_to, backup_filename), "w") as f:
+            f.write("backup")
+        return {"is_working": True, "msg": "finished successfully",
+                "backup_file": os.path.join(save_backups_to, backup_filename), "backup_filename": backup_filename}
+
+    monkeypatch.setattr("ddmail_backup_taker.backup.tar_data", mock_tar_data)
+
+    def mock_secure_delete(logger, toml_config, path):
+        shutil.rmtree(path)
+        return {"is_working": True, "msg": f"deleted {path} successfully"}
+
+    monkeypatch.setattr("ddmail_backup_taker.backup.secure_delete", mock_secure_delete)
+
+    try:
+        assert create_backup(logger, config_copy)["is_working"]
+        assert create_backup(logger, config_copy)["is_working"]
+
+        assert archived == ["full_db_dump.sql", "full_db_dump.sql.delta"]
+        state = load_delta_state(os.path.join(save_backups_to, SNAPSHOT_FOLDER, DELTA_STATE))
+        assert state["base_backup_filename"] == "backup_1.tar.gz"
+        assert state["deltas"] == {"backup_2.tar.gz": "backup_1.tar.gz"}
+        assert sorted(os.listdir(os.path.join(save_backups_to, SNAPSHOT_FOLDER))) == [DELTA_STATE, DELTA_SIGNATURE]
+    finally:
+        shutil.rmtree(tmp_folder)
+        shutil.rmtree(save_backups_to)
+
+
 def test_create_backup_mariadb_only(logger, toml_config, monkeypatch):
     """Test create_backup with only MariaDB backup enabled."""
     # Create temporary directories
@@ -1148,6 +2029,8 @@ def test_create_backup_data_only(logger, toml_config, monkeypatch):
         assert result["msg"] == "finished successfully"
         assert result["backup_file"] == backup_file
         assert result["backup_filename"] == "backup_20230115120000.tar.gz"
+        assert result["backup_type"] == "full"
+        assert result["backup_level"] == 0
     finally:
         # Clean up
         shutil.rmtree(tmp_folder)
@@ -1378,3 +2261,38 @@ def test_create_backup_no_backups_configured(logger, toml_config, monkeypatch):
         # Clean up
         shutil.rmtree(tmp_folder)
         shutil.rmtree(save_backups_to)
+
+
+def test_clear_backups_prunes_repository(logger, toml_config, monkeypatch):
+    """Test clear_backups removes the repository packs returned by prune_repository."""
+    # Create temporary directory for testing
+    save_backups_to = tempfile.mkdtemp()
+
+    # Modify config to use our temporary directory and the repository
+    config_copy = toml_config.copy()
+    config_copy["SAVE_BACKUPS_TO"] = save_backups_to
+    monkeypatch.setitem(config_copy, "REPOSITORY", {"USE": True, "PATH": os.path.join(save_backups_to, "repository")})
+
+    unused_pack = os.path.join(save_backups_to, "repository", "packs", "backup_20220101000000.pack.gpg")
+
+    def mock_prune_repository(logger, toml_config):
+        return {"is_working": True, "msg": "done", "unused_packs": [unused_pack]}
+
+    # Mock secure_delete to track what would be deleted
+    deleted_files = []
+
+    def mock_secure_delete(logger, toml_config, path):
+        deleted_files.append(path)
+        return {"is_working": True, "msg": f"deleted {path} successfully"}
+
+    monkeypatch.setattr("ddmail_backup_taker.backup.prune_repository", mock_prune_repository)
+    monkeypatch.setattr("ddmail_backup_taker.backup.secure_delete", mock_secure_delete)
+
+    try:
+        result = clear_backups(logger, config_copy)
+
+        assert result["is_working"]
+        assert deleted_files == [unused_pack]
+    finally:
+        # Clean up
+        shutil.rmtree(save_backups_to)
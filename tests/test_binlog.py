@@ -0,0 +1,205 @@
+import os
+import json
+import shutil
+import tempfile
+import pytest
+from ddmail_backup_taker.backup import create_backup, SNAPSHOT_FOLDER
+from ddmail_backup_taker.binlog import read_binlog_index, load_binlog_state, save_binlog_state, full_dump, copy_binlogs, BINLOG_STATE
+
+def write_script(path, content):
+    """Write an executable shell script."""
+    with open(path, "w") as f:
+        f.write("#!/bin/sh\n" + content)
+    os.chmod(path, 0o755)
+    return str(path)
+
+def rotate_script(binlog_folder):
+    """Shell commands that start the next binary log file like FLUSH BINARY LOGS does."""
+    return (
+            "n=$(wc -l < " + binlog_folder + "/mysql-bin.index)\n"
+            "next=$(printf 'mysql-bin.%06d' $((n+1)))\n"
+            "echo \"events of $next\" > " + binlog_folder + "/$next\n"
+            "echo \"./$next\" >> " + binlog_folder + "/mysql-bin.index\n"
+            )
+
+@pytest.fixture
+def binlog_config(toml_config, monkeypatch, tmp_path):
+    """Config with a stub binary log folder and stand-in mariadb and mariadb-dump binaries that start new binary log files."""
+    binlog_folder = tmp_path / "binlog"
+    binlog_folder.mkdir()
+    (binlog_folder / "mysql-bin.000001").write_text("events of mysql-bin.000001\n")
+    (binlog_folder / "mysql-bin.index").write_text("./mysql-bin.000001\n")
+
+    mariadb_bin = write_script(tmp_path / "mariadb", rotate_script(str(binlog_folder)))
+    mariadbdump_bin = write_script(tmp_path / "mariadb-dump", rotate_script(str(binlog_folder)) + "echo \"-- dump $@\"\n")
+
+    config_copy = toml_config.copy()
+    mariadb_copy = config_copy["MARIADB"].copy()
+    mariadb_copy["USE"] = True
+    mariadb_copy["INCREMENTAL"] = True
+    mariadb_copy["PER_DATABASE"] = False
+    mariadb_copy["STREAM"] = False
+    mariadb_copy["COMPRESSION"] = "none"
+    mariadb_copy["MARIADB_BIN"] = mariadb_bin
+    mariadb_copy["MARIADBDUMP_BIN"] = mariadbdump_bin
+    mariadb_copy["BINLOG_INDEX"] = str(binlog_folder / "mysql-bin.index")
+    monkeypatch.setitem(config_copy, "MARIADB", mariadb_copy)
+    return config_copy
+
+
+def test_read_binlog_index(binlog_config):
+    """Test read_binlog_index() returns the file names in the index."""
+    assert read_binlog_index(binlog_config) == ["mysql-bin.000001"]
+
+
+def test_save_load_binlog_state(logger, tmp_path):
+    """Test the binary log state is saved and loaded, and None without a state file."""
+    state_file = str(tmp_path / "snapshots" / BINLOG_STATE)
+
+    assert load_binlog_state(state_file) is None
+
+    save_binlog_state(logger, state_file, {"binlog_file": "mysql-bin.000002", "binlog_position": 4})
+
+    assert load_binlog_state(state_file) == {"binlog_file": "mysql-bin.000002", "binlog_position": 4}
+
+
+def test_full_dump(logger, binlog_config, tmp_path):
+    """Test full_dump() records the binary log file started by the dump."""
+    dst_folder = tmp_path / "dst"
+    dst_folder.mkdir()
+
+    result = full_dump(logger, binlog_config, str(dst_folder))
+
+    assert result["is_working"]
+    assert result["binlog_file"] == "mysql-bin.000002"
+    assert result["binlog_position"] == 4
+
+    with open(result["db_dump_file"], "r") as f:
+        dump = f.read()
+    assert "--single-transaction --quick --flush-logs --master-data=2 --all-databases" in dump
+
+
+def test_full_dump_binlog_disabled(logger, binlog_config, tmp_path):
+    """Test full_dump() fails when the dump does not start a new binary log file."""
+    binlog_config["MARIADB"]["MARIADBDUMP_BIN"] = write_script(tmp_path / "plain-dump", "echo \"-- dump\"\n")
+
+    result = full_dump(logger, binlog_config, str(tmp_path))
+
+    assert not result["is_working"]
+    assert result["msg"] == "mariadb-dump did not start a new binary log file"
+
+
+def test_copy_binlogs_only_new_files(logger, binlog_config, tmp_path):
+    """Test copy_binlogs() only copies the binary log files written since the last run."""
+    state_file = str(tmp_path / "snapshots" / BINLOG_STATE)
+    dst_folder = tmp_path / "dst"
+    dst_folder.mkdir()
+
+    result = full_dump(logger, binlog_config, str(dst_folder))
+    assert result["is_working"]
+    save_binlog_state(logger, state_file, {"binlog_file": result["binlog_file"], "binlog_position": result["binlog_position"]})
+
+    # First incremental run copies the file started by the full dump.
+    first_dst = tmp_path / "first"
+    first_dst.mkdir()
+    result = copy_binlogs(logger, binlog_config, state_file, str(first_dst))
+
+    assert result["is_working"]
+    assert [os.path.basename(path) for path in result["binlog_files"]] == ["mysql-bin.000002"]
+    assert sorted(os.listdir(first_dst / "binlog")) == ["mysql-bin.000002"]
+    assert (first_dst / "binlog" / "mysql-bin.000002").read_text() == "events of mysql-bin.000002\n"
+    assert result["binlog_file"] == "mysql-bin.000003"
+    save_binlog_state(logger, state_file, {"binlog_file": result["binlog_file"], "binlog_position": result["binlog_position"]})
+
+    # Second incremental run does not copy the files of the first run again.
+    second_dst = tmp_path / "second"
+    second_dst.mkdir()
+    result = copy_binlogs(logger, binlog_config, state_file, str(second_dst))
+
+    assert result["is_working"]
+    assert sorted(os.listdir(second_dst / "binlog")) == ["mysql-bin.000003"]
+    assert result["binlog_file"] == "mysql-bin.000004"
+
+
+def test_copy_binlogs_no_state(logger, binlog_config, tmp_path):
+    """Test copy_binlogs() without a saved binary log state."""
+    state_file = str(tmp_path / BINLOG_STATE)
+
+    result = copy_binlogs(logger, binlog_config, state_file, str(tmp_path))
+
+    assert not result["is_working"]
+    assert result["msg"] == "binary log state file " + state_file + " does not exist"
+
+
+def test_copy_binlogs_purged(logger, binlog_config, tmp_path):
+    """Test copy_binlogs() when the saved binary log file has been purged."""
+    state_file = str(tmp_path / BINLOG_STATE)
+    save_binlog_state(logger, state_file, {"binlog_file": "mysql-bin.000000", "binlog_position": 4})
+
+    result = copy_binlogs(logger, binlog_config, state_file, str(tmp_path))
+
+    assert not result["is_working"]
+    assert result["msg"] == "binary log mysql-bin.000000 is no longer available"
+
+
+def test_create_backup_mariadb_incremental(logger, binlog_config, monkeypatch):
+    """Test create_backup takes a full dump at level 0, then only archives the new binary log files."""
+    tmp_folder = tempfile.mkdtemp()
+    save_backups_to = tempfile.mkdtemp()
+
+    binlog_config["TMP_FOLDER"] = tmp_folder
+    binlog_config["SAVE_BACKUPS_TO"] = save_backups_to
+
+    data_config = binlog_config["DATA"].copy()
+    data_config["USE"] = False
+    data_config["INCREMENTAL"] = True
+    monkeypatch.setitem(binlog_config, "DATA", data_config)
+
+    archive_config = binlog_config.get("ARCHIVE", {}).copy()
+    archive_config["ENGINE"] = "tar"
+    monkeypatch.setitem(binlog_config, "ARCHIVE", archive_config)
+
+    archived = []
+    backup_level = {"level": 0}
+
+    def mock_tar_data(logger, toml_config, data_to_backup):
+        archived.append([os.path.basename(path) for path in data_to_backup])
+
+        # Save the snapshot state like tar_data does for an incremental backup.
+        snapshot_folder = os.path.join(save_backups_to, SNAPSHOT_FOLDER)
+        os.makedirs(snapshot_folder, exist_ok=True)
+        with open(os.path.join(snapshot_folder, "data.snar"), "w") as f:
+            f.write("snapshot")
+        with open(os.path.join(snapshot_folder, "state.json"), "w") as f:
+            json.dump({"level": backup_level["level"], "backup_filename": "backup.tar.gz"}, f)
+        backup_level["level"] += 1
+
+        return {"is_working": True, "msg": "finished successfully",
+                "backup_file": os.path.join(save_backups_to, "backup.tar.gz"), "backup_filename": "backup.tar.gz"}
+
+    monkeypatch.setattr("ddmail_backup_taker.backup.tar_data", mock_tar_data)
+
+    def mock_secure_delete(logger, toml_config, path):
+        return {"is_working": True, "msg": f"deleted {path} successfully"}
+
+    monkeypatch.setattr("ddmail_backup_taker.backup.secure_delete", mock_secure_delete)
+
+    try:
+        result = create_backup(logger, binlog_config)
+
+        assert result["is_working"]
+        assert archived[0] == ["full_db_dump.sql"]
+        assert result["binlog_file"] == "mysql-bin.000002"
+        assert result["binlog_position"] == 4
+
+        result = create_backup(logger, binlog_config)
+
+        assert result["is_working"]
+        assert archived[1] == ["mysql-bin.000002"]
+        assert result["binlog_file"] == "mysql-bin.000003"
+
+        state = load_binlog_state(os.path.join(save_backups_to, SNAPSHOT_FOLDER, BINLOG_STATE))
+        assert state == {"binlog_file": "mysql-bin.000003", "binlog_position": 4}
+    finally:
+        shutil.rmtree(tmp_folder)
+        shutil.rmtree(save_backups_to)
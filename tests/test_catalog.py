@@ -0,0 +1,310 @@
+import os
+import gzip
+import shutil
+import tempfile
+import pytest
+from ddmail_backup_taker.archive import stream_archive
+from ddmail_backup_taker import catalog
+from ddmail_backup_taker.catalog import VolumeReader, read_catalog, read_ranges_from_stream, restore_members
+
+def create_data_folder():
+    """Create a folder with mail in two users folders and one large file."""
+    data_dir = tempfile.mkdtemp()
+    for user in ["alice", "bob"]:
+        os.makedirs(os.path.join(data_dir, user, "cur"))
+        with open(os.path.join(data_dir, user, "cur", "1.host:2,S"), "w") as f:
+            f.write("message of " + user)
+    with open(os.path.join(data_dir, "large.bin"), "wb") as f:
+        f.write(os.urandom(3000000))
+    return data_dir
+
+def catalog_config(toml_config, monkeypatch, codec, use_gpg, volume_size = 0, engine = "gpg"):
+    """Copy of the config with the catalog, codec and encryption set, the chunked engine encrypts 64kb chunks."""
+    config_copy = toml_config.copy()
+    monkeypatch.setitem(config_copy, "ARCHIVE", {"ENGINE": "python", "INDEX": True, "VOLUME_SIZE": volume_size})
+    monkeypatch.setitem(config_copy, "COMPRESSION", {"CODEC": codec, "THREADS": 2})
+    gpg_copy = config_copy["GPG_ENCRYPTION"].copy()
+    gpg_copy["USE"] = use_gpg
+    gpg_copy["ENGINE"] = engine
+    gpg_copy["CHUNK_SIZE"] = 65536
+    monkeypatch.setitem(config_copy, "GPG_ENCRYPTION", gpg_copy)
+    return config_copy
+
+
+def test_read_ranges_from_stream():
+    """Test read_ranges_from_stream() reads ranges across buffers and skips the bytes between them."""
+    chunks = iter([b"0123", b"4567", b"89ab"])
+
+    assert list(read_ranges_from_stream(chunks, [(1, 2), (3, 6), (11, 1)])) == [b"12", b"345678", b"b"]
+
+
+def test_read_ranges_from_stream_too_short():
+    """Test read_ranges_from_stream() fails when the stream ends before a range."""
+    with pytest.raises(ValueError):
+        list(read_ranges_from_stream(iter([b"0123"]), [(2, 4)]))
+
+
+@pytest.mark.parametrize("codec,use_gpg,volume_size", [
+    ("gzip", False, 0),
+    ("xz", False, 0),
+    ("none", False, 0),
+    ("gzip", True, 0),
+    ("gzip", False, 1048576),
+    ])
+def test_restore_members(logger, toml_config, monkeypatch, codec, use_gpg, volume_size):
+    """Test restore_members() restores one user folder from a backup with a catalog."""
+    data_dir = create_data_folder()
+    save_backups_to = tempfile.mkdtemp()
+    dst_folder = tempfile.mkdtemp()
+    config_copy = catalog_config(toml_config, monkeypatch, codec, use_gpg, volume_size)
+
+    backup_file = os.path.join(save_backups_to, "backup_1.tar" + (".gpg" if use_gpg else ""))
+
+    try:
+        result = stream_archive(logger, config_copy, [data_dir], backup_file)
+        assert result["is_working"]
+        assert result["catalog_file"] == backup_file + ".catalog"
+        assert result["backup_files"][-1] == result["catalog_file"]
+
+        catalog = read_catalog(config_copy, result["catalog_file"])
+        assert catalog["codec"] == codec
+        assert len(catalog["frames"]) > 1
+
+        result_restore = restore_members(logger, config_copy, backup_file, [os.path.join(data_dir, "bob")], dst_folder)
+
+        assert result_restore["is_working"]
+        assert result_restore["members"] == 3
+        restored = os.path.join(dst_folder, data_dir.lstrip("/"))
+        assert sorted(os.listdir(restored)) == ["bob"]
+        with open(os.path.join(restored, "bob", "cur", "1.host:2,S"), "r") as f:
+            assert f.read() == "message of bob"
+    finally:
+        shutil.rmtree(data_dir)
+        shutil.rmtree(save_backups_to)
+        shutil.rmtree(dst_folder)
+
+
+@pytest.mark.parametrize("volume_size", [0, 1048576])
+def test_restore_members_chunked_seeks(logger, toml_config, monkeypatch, volume_size):
+    """Test restore_members() reads only the encrypted chunks holding the members from a chunked backup."""
+    data_dir = create_data_folder()
+    save_backups_to = tempfile.mkdtemp()
+    dst_folder = tempfile.mkdtemp()
+    config_copy = catalog_config(toml_config, monkeypatch, "gzip", True, volume_size, "chunked")
+
+    backup_file = os.path.join(save_backups_to, "backup_1.tar.gz.ddenc")
+
+    # A backup of many frames, the members of bob are in at most two of them.
+    with open(os.path.join(data_dir, "large.bin"), "wb") as f:
+        f.write(os.urandom(12000000))
+
+    # Count the bytes read from the backup.
+    read_sizes = []
+    original_read = VolumeReader.read
+    def counting_read(self, size):
+        data = original_read(self, size)
+        read_sizes.append(len(data))
+        return data
+    monkeypatch.setattr(catalog.VolumeReader, "read", counting_read)
+
+    try:
+        result = stream_archive(logger, config_copy, [data_dir], backup_file)
+        assert result["is_working"]
+        parts = catalog.backup_parts(backup_file)
+        assert len(parts) == (12 if volume_size else 1)
+        backup_size = sum(os.path.getsize(path) for path in parts)
+
+        result_restore = restore_members(logger, config_copy, backup_file, [os.path.join(data_dir, "bob")], dst_folder)
+
+        assert result_restore["is_working"]
+        assert result_restore["members"] == 3
+        with open(os.path.join(dst_folder, data_dir.lstrip("/"), "bob", "cur", "1.host:2,S"), "r") as f:
+            assert f.read() == "message of bob"
+        assert sum(read_sizes) < 3 * 1048576 < backup_size // 3
+
+        # A large file spans many chunks and volumes.
+        result_restore = restore_members(logger, config_copy, backup_file, [os.path.join(data_dir, "large.bin")], dst_folder)
+        assert result_restore["is_working"]
+        with open(os.path.join(data_dir, "large.bin"), "rb") as f1, open(os.path.join(dst_folder, data_dir.lstrip("/"), "large.bin"), "rb") as f2:
+            assert f1.read() == f2.read()
+    finally:
+        shutil.rmtree(data_dir)
+        shutil.rmtree(save_backups_to)
+        shutil.rmtree(dst_folder)
+
+
+def test_volume_reader(tmp_path):
+    """Test VolumeReader reads and seeks across volumes."""
+    paths = []
+    for number, data in enumerate([b"0123", b"", b"4567", b"89"]):
+        paths.append(str(tmp_path / ("backup.tar." + str(number + 1).zfill(3))))
+        with open(paths[-1], "wb") as f:
+            f.write(data)
+
+    f = VolumeReader(paths)
+    try:
+        assert f.read(6) == b"012345"
+        assert f.seek(-3, os.SEEK_END) == 7
+        assert f.read(10) == b"789"
+        assert f.read(1) == b""
+        f.seek(3)
+        assert f.read(2) == b"34"
+    finally:
+        f.close()
+
+
+def test_restore_members_readable_by_gzip(logger, toml_config, monkeypatch):
+    """Test a framed gzip backup is still read as one file by gzip."""
+    data_dir = create_data_folder()
+    save_backups_to = tempfile.mkdtemp()
+    dst_folder = tempfile.mkdtemp()
+    config_copy = catalog_config(toml_config, monkeypatch, "gzip", False)
+
+    backup_file = os.path.join(save_backups_to, "backup_1.tar.gz")
+
+    try:
+        result = stream_archive(logger, config_copy, [data_dir], backup_file)
+        assert result["is_working"]
+
+        with open(backup_file, "rb") as f:
+            assert len(gzip.decompress(f.read())) == result["archive_size"]
+
+        # A large file spans many frames.
+        result_restore = restore_members(logger, config_copy, backup_file, [os.path.join(data_dir, "large.bin")], dst_folder)
+        assert result_restore["is_working"]
+        with open(os.path.join(data_dir, "large.bin"), "rb") as f1, open(os.path.join(dst_folder, data_dir.lstrip("/"), "large.bin"), "rb") as f2:
+            assert f1.read() == f2.read()
+    finally:
+        shutil.rmtree(data_dir)
+        shutil.rmtree(save_backups_to)
+        shutil.rmtree(dst_folder)
+
+
+def test_restore_members_corrupt(logger, toml_config, monkeypatch):
+    """Test restore_members() detects data that does not match the catalog checksum."""
+    data_dir = create_data_folder()
+    save_backups_to = tempfile.mkdtemp()
+    dst_folder = tempfile.mkdtemp()
+    config_copy = catalog_config(toml_config, monkeypatch, "none", False)
+
+    backup_file = os.path.join(save_backups_to, "backup_1.tar")
+
+    try:
+        result = stream_archive(logger, config_copy, [data_dir], backup_file)
+        assert result["is_working"]
+
+        # Change one byte in the message of bob.
+        with open(backup_file, "r+b") as f:
+            data = f.read()
+            position = data.index(b"message of bob")
+            f.seek(position)
+            f.write(b"M")
+
+        result_restore = restore_members(logger, config_copy, backup_file, [os.path.join(data_dir, "bob")], dst_folder)
+
+        assert not result_restore["is_working"]
+        assert result_restore["msg"].startswith("checksum of ")
+    finally:
+        shutil.rmtree(data_dir)
+        shutil.rmtree(save_backups_to)
+        shutil.rmtree(dst_folder)
+
+
+def test_restore_members_large_file_streamed(logger, toml_config, monkeypatch):
+    """Test restore_members() writes a large file frame by frame with its mode and mtime."""
+    data_dir = create_data_folder()
+    save_backups_to = tempfile.mkdtemp()
+    dst_folder = tempfile.mkdtemp()
+    config_copy = catalog_config(toml_config, monkeypatch, "gzip", False)
+    large_file = os.path.join(data_dir, "large.bin")
+    os.chmod(large_file, 0o640)
+    os.utime(large_file, (1700000000, 1700000000))
+
+    backup_file = os.path.join(save_backups_to, "backup_1.tar.gz")
+
+    # Record the size of the members extracted in memory.
+    member_sizes = []
+    original_extract_member = catalog.extract_member
+    def recording_extract_member(logger, member, member_data, dst_folder):
+        member_sizes.append(len(member_data))
+        return original_extract_member(logger, member, member_data, dst_folder)
+    monkeypatch.setattr(catalog, "extract_member", recording_extract_member)
+
+    try:
+        assert stream_archive(logger, config_copy, [data_dir], backup_file)["is_working"]
+
+        result_restore = restore_members(logger, config_copy, backup_file, [data_dir], dst_folder)
+
+        assert result_restore["is_working"]
+        assert max(member_sizes) < 1048576
+        restored = os.path.join(dst_folder, data_dir.lstrip("/"), "large.bin")
+        with open(large_file, "rb") as f1, open(restored, "rb") as f2:
+            assert f1.read() == f2.read()
+        assert os.stat(restored).st_mode & 0o777 == 0o640
+        assert os.stat(restored).st_mtime == 1700000000
+        with open(os.path.join(dst_folder, data_dir.lstrip("/"), "bob", "cur", "1.host:2,S"), "r") as f:
+            assert f.read() == "message of bob"
+    finally:
+        shutil.rmtree(data_dir)
+        shutil.rmtree(save_backups_to)
+        shutil.rmtree(dst_folder)
+
+
+def test_restore_members_large_file_corrupt(logger, toml_config, monkeypatch):
+    """Test restore_members() removes a streamed file that does not match the catalog checksum."""
+    data_dir = create_data_folder()
+    save_backups_to = tempfile.mkdtemp()
+    dst_folder = tempfile.mkdtemp()
+    config_copy = catalog_config(toml_config, monkeypatch, "none", False)
+
+    backup_file = os.path.join(save_backups_to, "backup_1.tar")
+
+    try:
+        assert stream_archive(logger, config_copy, [data_dir], backup_file)["is_working"]
+
+        # Change one byte in the middle of the large file.
+        with open(os.path.join(data_dir, "large.bin"), "rb") as f:
+            large = f.read()
+        with open(backup_file, "r+b") as f:
+            position = f.read().index(large[:4096]) + 2000000
+            f.seek(position)
+            byte = f.read(1)
+            f.seek(position)
+            f.write(bytes([byte[0] ^ 1]))
+
+        result_restore = restore_members(logger, config_copy, backup_file, [os.path.join(data_dir, "large.bin")], dst_folder)
+
+        assert not result_restore["is_working"]
+        assert result_restore["msg"] == "checksum of " + os.path.join(data_dir, "large.bin").lstrip("/") + " does not match the catalog"
+        assert not os.path.exists(os.path.join(dst_folder, data_dir.lstrip("/"), "large.bin"))
+    finally:
+        shutil.rmtree(data_dir)
+        shutil.rmtree(save_backups_to)
+        shutil.rmtree(dst_folder)
+
+def test_restore_members_no_match(logger, toml_config, monkeypatch):
+    """Test restore_members() fails when no member matches the paths."""
+    data_dir = create_data_folder()
+    save_backups_to = tempfile.mkdtemp()
+    config_copy = catalog_config(toml_config, monkeypatch, "gzip", False)
+
+    backup_file = os.path.join(save_backups_to, "backup_1.tar.gz")
+
+    try:
+        assert stream_archive(logger, config_copy, [data_dir], backup_file)["is_working"]
+
+        result_restore = restore_members(logger, config_copy, backup_file, ["/does/not/exist"], save_backups_to)
+
+        assert not result_restore["is_working"]
+        assert result_restore["msg"] == "no members in the backup match the paths"
+    finally:
+        shutil.rmtree(data_dir)
+        shutil.rmtree(save_backups_to)
+
+
+def test_restore_members_no_catalog(logger, toml_config):
+    """Test restore_members() fails when the backup has no catalog."""
+    result = restore_members(logger, toml_config, "/does/not/exist.tar.gz", ["/var/mail"], "/tmp")
+
+    assert not result["is_working"]
+    assert result["msg"] == "catalog file /does/not/exist.tar.gz.catalog does not exist"
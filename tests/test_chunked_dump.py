@@ -0,0 +1,215 @@
+import os
+import sys
+import pytest
+from ddmail_backup_taker.chunked_dump import unescape_batch, chunk_ranges, row_expression, chunk_query, iter_insert_statements, chunk_file_of, open_session, close_session, session_query, backup_mariadb_chunked
+from ddmail_backup_taker.mariadb import dump_cmd
+from ddmail_backup_taker import chunked_dump
+
+# Stand-in mariadb client that answers the queries of chunked_dump from a small users table.
+MARIADB_STUB = r'''
+import re
+import sys
+
+users = {1: "alice", 2: "bob", 3: "multi\nline", 4: "tab\there", 5: "back\\slash", 6: "f", 7: "g", 8: "h", 9: "i", 10: "j"}
+
+def escape(value):
+    return value.replace("\\", "\\\\").replace("\n", "\\n").replace("\t", "\\t")
+
+log = open(sys.argv[1], "a")
+for line in sys.stdin:
+    line = line.strip()
+    log.write(line + "\n")
+    log.flush()
+    marker = re.match(r"^SELECT '(-- ddmail_backup_taker end \w+)';$", line)
+    if marker:
+        print(marker.group(1), flush=True)
+    elif line.startswith("SHOW CREATE DATABASE"):
+        print("mail\tCREATE DATABASE IF NOT EXISTS `mail`", flush=True)
+    elif line.startswith("SHOW CREATE TABLE"):
+        table = re.search(r"`mail`\.`(\w+)`", line).group(1)
+        print(table + "\tCREATE TABLE `" + table + "` (\\n  `id` int\\n)", flush=True)
+    elif "TABLE_TYPE = 'VIEW'" in line:
+        print("v_users\nv_aliases", flush=True)
+    elif "information_schema.TABLES" in line:
+        print("mail\tusers\t10\nmail\taliases\t2", flush=True)
+    elif "information_schema.COLUMNS" in line:
+        print("mail\taliases\tsrc\tvarchar\t\t\nmail\taliases\tdst\tvarchar\t\t\nmail\tusers\tid\tint\tPRI\tauto_increment\nmail\tusers\tname\tvarchar\t\t\nmail\tusers\tlower_name\tvarchar\t\tVIRTUAL GENERATED", flush=True)
+    elif "MIN(" in line:
+        print("1\t10", flush=True)
+    elif "FROM `mail`.`users`" in line:
+        low = re.search(r">= (\d+)", line)
+        high = re.search(r"< (\d+)", line)
+        for key, name in users.items():
+            if (low is None or key >= int(low.group(1))) and (high is None or key < int(high.group(1))):
+                print(escape("(" + str(key) + ",'" + name + "')"), flush=True)
+    elif "FROM `mail`.`aliases`" in line:
+        print("('a@example.com','b@example.com')\n('c@example.com',NULL)", flush=True)
+    elif line == "FAIL;":
+        sys.exit(1)
+'''
+
+def write_script(path, content):
+    """Write an executable script."""
+    with open(path, "w") as f:
+        f.write(content)
+    os.chmod(path, 0o755)
+    return str(path)
+
+@pytest.fixture
+def chunked_config(toml_config, monkeypatch, tmp_path):
+    """Config with stand-in mariadb and mariadb-dump binaries for MARIADB.MODE chunked."""
+    stub = tmp_path / "mariadb_stub.py"
+    stub.write_text(MARIADB_STUB)
+    mariadb_bin = write_script(tmp_path / "mariadb", "#!/bin/sh\nexec " + sys.executable + " " + str(stub) + " " + str(tmp_path / "statements.log") + "\n")
+    mariadbdump_bin = write_script(tmp_path / "mariadb-dump", "#!/bin/sh\necho \"-- schema $@\"\n")
+
+    config_copy = toml_config.copy()
+    mariadb_copy = config_copy["MARIADB"].copy()
+    mariadb_copy["USE"] = True
+    mariadb_copy["MODE"] = "chunked"
+    mariadb_copy["CHUNK_ROWS"] = 4
+    mariadb_copy["PARALLELISM"] = 2
+    mariadb_copy["COMPRESSION"] = "none"
+    mariadb_copy["INCREMENTAL"] = False
+    mariadb_copy["MARIADB_BIN"] = mariadb_bin
+    mariadb_copy["MARIADBDUMP_BIN"] = mariadbdump_bin
+    monkeypatch.setitem(config_copy, "MARIADB", mariadb_copy)
+    return config_copy
+
+
+def test_unescape_batch():
+    """Test unescape_batch() undoes the batch mode escaping."""
+    assert unescape_batch(b"a\\nb\\tc\\\\n\\0") == b"a\nb\tc\\n\0"
+
+
+def test_chunk_ranges():
+    """Test chunk_ranges() covers the whole key range with open ends."""
+    assert chunk_ranges(1, 10, 10, 4) == [(None, 5), (5, 9), (9, None)]
+    assert chunk_ranges(1, 10, 3, 4) == [(None, None)]
+    assert chunk_ranges(7, 7, 1000, 4) == [(None, None)]
+
+
+def test_chunk_query():
+    """Test chunk_query() quotes names and dumps binary columns as hex."""
+    table = {"database": "mail", "table": "us`ers", "key": "id", "columns": [("id", "int"), ("data", "blob")]}
+
+    assert row_expression(table["columns"]) == "CONCAT('(', CONCAT_WS(',',QUOTE(`id`),IF(`data` IS NULL, 'NULL', CONCAT('0x', HEX(`data`)))), ')')"
+    assert chunk_query(table, (5, 9)).endswith(" FROM `mail`.`us``ers` WHERE `id` >= 5 AND `id` < 9;")
+    assert chunk_query(table, (None, None)).endswith(" FROM `mail`.`us``ers`;")
+
+
+def test_iter_insert_statements():
+    """Test iter_insert_statements() joins rows into statements of about statement_size bytes."""
+    table = {"table": "users", "columns": [("id", "int"), ("name", "varchar")]}
+
+    statements = list(iter_insert_statements(table, iter([b"(1,'a')", b"(2,'b')", b"(3,'c')"]), statement_size=16))
+
+    assert statements == [
+            b"INSERT INTO `users` (`id`,`name`) VALUES\n(1,'a'),\n(2,'b');\n",
+            b"INSERT INTO `users` (`id`,`name`) VALUES\n(3,'c');\n",
+            ]
+
+
+def test_chunk_file_of():
+    """Test chunk_file_of() for schema and chunk files."""
+    assert chunk_file_of("/tmp", "mail", None) == "/tmp/db_dump_mail.schema.sql"
+    assert chunk_file_of("/tmp", "mail", "a b", 2, ".sql.gz") == "/tmp/db_dump_mail.a%20b.00002.sql.gz"
+
+
+def test_dump_cmd_modes(chunked_config):
+    """Test dump_cmd() reads one snapshot with MARIADB.MODE consistent and for the schema dump."""
+    chunked_config["MARIADB"]["MODE"] = "consistent"
+    assert dump_cmd(chunked_config)[5:] == ["--single-transaction", "--quick", "--all-databases"]
+
+    chunked_config["MARIADB"]["MODE"] = "lock"
+    assert dump_cmd(chunked_config)[5:] == ["--all-databases"]
+    assert dump_cmd(chunked_config, "mail", schema_only=True)[5:] == ["--single-transaction", "--quick", "--no-data", "--databases", "mail"]
+
+
+def test_session_query(chunked_config):
+    """Test session_query() returns the output of each query and keeps the session open."""
+    session = open_session(chunked_config)
+
+    assert list(session_query(session, "SELECT MIN(`id`), MAX(`id`) FROM `mail`.`users`;")) == [b"1\t10"]
+    assert list(session_query(session, "SELECT x FROM `mail`.`users` WHERE `id` >= 3 AND `id` < 5;")) == [b"(3,'multi\nline')", b"(4,'tab\there')"]
+
+    close_session(session)
+
+
+def test_backup_mariadb_chunked(logger, chunked_config, tmp_path):
+    """Test backup_mariadb_chunked() dumps key range chunks of one snapshot with every row once."""
+    dst_folder = tmp_path / "dst"
+    dst_folder.mkdir()
+
+    result = backup_mariadb_chunked(logger, chunked_config, str(dst_folder))
+
+    assert result["is_working"]
+    assert sorted(os.path.basename(path) for path in result["db_dump_files"]) == [
+            "db_dump_mail.aliases.00001.sql",
+            "db_dump_mail.schema.sql",
+            "db_dump_mail.users.00001.sql",
+            "db_dump_mail.users.00002.sql",
+            "db_dump_mail.users.00003.sql",
+            ]
+
+    # The tables are read in the snapshot, the triggers and views with mariadb-dump.
+    with open(dst_folder / "db_dump_mail.schema.sql", "r") as f:
+        schema = f.read()
+    assert schema.startswith("SET NAMES utf8mb4;\nSET FOREIGN_KEY_CHECKS=0;\nCREATE DATABASE IF NOT EXISTS `mail`;\nUSE `mail`;\n")
+    assert "DROP TABLE IF EXISTS `aliases`;\nCREATE TABLE `aliases` (\n  `id` int\n);\n" in schema
+    assert "DROP TABLE IF EXISTS `users`;\nCREATE TABLE `users` (\n  `id` int\n);\n" in schema
+    assert "--no-data --no-create-info --no-create-db --databases mail\n" in schema
+    assert "--no-data mail v_users v_aliases\n" in schema
+
+    users = ""
+    for number in range(1, 4):
+        with open(dst_folder / f"db_dump_mail.users.{number:05d}.sql", "r") as f:
+            chunk = f.read()
+        assert chunk.startswith("SET NAMES utf8mb4;\n")
+        assert "USE `mail`;\nINSERT INTO `users` (`id`,`name`) VALUES\n" in chunk
+        users = users + chunk
+
+    # Every row is in exactly one chunk, the escaped values are restored.
+    for key in range(1, 11):
+        assert users.count("(" + str(key) + ",'") == 1
+    assert "(3,'multi\nline')" in users
+    assert "(5,'back\\slash')" in users
+
+    # Every session started its transaction while the tables were locked.
+    with open(tmp_path / "statements.log", "r") as f:
+        statements = [line.strip() for line in f if not line.startswith("SELECT '-- ddmail_backup_taker end")]
+    assert statements.index("FLUSH TABLES WITH READ LOCK;") < statements.index("UNLOCK TABLES;")
+    assert statements[:statements.index("UNLOCK TABLES;")].count("START TRANSACTION WITH CONSISTENT SNAPSHOT;") == 2
+    assert statements.index("UNLOCK TABLES;") < statements.index("SHOW CREATE TABLE `mail`.`users`;")
+
+
+def test_backup_mariadb_chunked_failure(logger, chunked_config, tmp_path):
+    """Test backup_mariadb_chunked() when the mariadb client fails."""
+    chunked_config["MARIADB"]["MARIADB_BIN"] = write_script(tmp_path / "failing", "#!/bin/sh\nexit 1\n")
+
+    result = backup_mariadb_chunked(logger, chunked_config, str(tmp_path))
+
+    assert not result["is_working"]
+    assert result["msg"] == "returncode of cmd mariadb is none zero"
+
+
+def test_backup_mariadb_chunked_write_error(logger, chunked_config, tmp_path, monkeypatch):
+    """Test backup_mariadb_chunked() kills the snapshot sessions when writing a dump file fails."""
+    def write_stage(chunks, path):
+        raise OSError(28, "No space left on device")
+
+    killed = []
+    def kill_session(session):
+        killed.append(session)
+        session.kill()
+        session.wait()
+
+    monkeypatch.setattr(chunked_dump, "write_stage", write_stage)
+    monkeypatch.setattr(chunked_dump, "kill_session", kill_session)
+
+    result = backup_mariadb_chunked(logger, chunked_config, str(tmp_path))
+
+    assert not result["is_working"]
+    assert result["msg"] == "Error during backup process: [Errno 28] No space left on device"
+    assert len(killed) == 2
+    assert all(session.returncode is not None for session in killed)
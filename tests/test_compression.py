@@ -0,0 +1,202 @@
+import os
+import gzip
+import lzma
+import shutil
+import subprocess
+import pytest
+from ddmail_backup_taker.compression import compress_stage, gzip_stage, parallel_gzip_stage, xz_stage, parallel_xz_stage, iter_blocks, compressor_cmd, compression_settings, archive_extension, is_tar_compression, framed_compress_stage, decompress_frame, is_incompressible
+
+def test_gzip_stage(logger):
+    """Test gzip_stage() output is a valid gzip stream of the input buffers."""
+    chunks = [b"a" * 1000, b"b" * 1000, os.urandom(100)]
+
+    compressed = b"".join(gzip_stage(iter(chunks)))
+
+    assert gzip.decompress(compressed) == b"".join(chunks)
+
+
+
+
+def test_iter_blocks():
+    """Test iter_blocks() joins and splits buffers into blocks."""
+    blocks = list(iter_blocks(iter([b"abc", b"defgh", b"ij"]), 4))
+
+    assert blocks == [b"abcd", b"efgh", b"ij"]
+
+
+def test_parallel_gzip_stage(logger):
+    """Test parallel_gzip_stage() output is a single valid gzip stream with many blocks."""
+    data = (b"some repeated mail text " * 20000) + os.urandom(50000)
+    chunks = [data[i:i + 7000] for i in range(0, len(data), 7000)]
+
+    compressed = b"".join(parallel_gzip_stage(iter(chunks), threads=4, block_size=65536))
+
+    assert gzip.decompress(compressed) == data
+    assert len(compressed) < len(data)
+
+    # The gzip binary agrees that the stream is valid.
+    output = subprocess.run(["gzip", "-dc"], input=compressed, check=True, stdout=subprocess.PIPE)
+    assert output.stdout == data
+
+
+def test_parallel_gzip_stage_empty():
+    """Test parallel_gzip_stage() with no input data."""
+    compressed = b"".join(parallel_gzip_stage(iter([]), threads=2))
+
+    assert gzip.decompress(compressed) == b""
+
+
+def test_compress_stage_threads(logger):
+    """Test compress_stage() uses the configured number of threads."""
+    data = b"x" * 100000
+
+    single = b"".join(compress_stage(iter([data]), {}))
+    multi = b"".join(compress_stage(iter([data]), {"COMPRESSION": {"THREADS": 4}}))
+
+    assert gzip.decompress(single) == data
+    assert gzip.decompress(multi) == data
+
+
+def test_xz_stage():
+    """Test xz_stage() output is a valid xz stream of the input buffers."""
+    chunks = [b"a" * 1000, os.urandom(100)]
+
+    compressed = b"".join(xz_stage(iter(chunks), level=1))
+
+    assert lzma.decompress(compressed) == b"".join(chunks)
+
+
+def test_parallel_xz_stage():
+    """Test parallel_xz_stage() output is readable by xz as one file."""
+    data = (b"some repeated mail text " * 20000) + os.urandom(50000)
+
+    compressed = b"".join(parallel_xz_stage(iter([data]), level=1, threads=4, block_size=65536))
+
+    assert lzma.decompress(compressed) == data
+
+
+def test_parallel_xz_stage_empty():
+    """Test parallel_xz_stage() with no input data."""
+    compressed = b"".join(parallel_xz_stage(iter([]), threads=2))
+
+    assert lzma.decompress(compressed) == b""
+
+
+@pytest.mark.parametrize("codec", ["zstd", "lz4"])
+def test_compress_stage_binary_codec(codec):
+    """Test compress_stage() with the codecs that use a compressor binary."""
+    compressor_bin = shutil.which(codec)
+    if compressor_bin is None:
+        pytest.skip(codec + " binary is not installed")
+
+    data = b"mail text " * 10000
+    toml_config = {"COMPRESSION": {"CODEC": codec, "BIN": compressor_bin}}
+
+    compressed = b"".join(compress_stage(iter([data]), toml_config))
+    output = subprocess.run([compressor_bin, "-d", "-c"], input=compressed, check=True, stdout=subprocess.PIPE)
+
+    assert len(compressed) < len(data)
+    assert output.stdout == data
+
+
+def test_compress_stage_none():
+    """Test compress_stage() with codec none passes buffers through unchanged."""
+    chunks = [b"abc", b"def"]
+
+    assert list(compress_stage(iter(chunks), {"COMPRESSION": {"CODEC": "none"}})) == chunks
+
+
+def test_compressor_cmd_zstd():
+    """Test compressor_cmd() for zstd with threads, ultra level and long-range matching."""
+    settings = compression_settings({"COMPRESSION": {"CODEC": "zstd", "LEVEL": 20, "THREADS": 8, "LONG": True, "BIN": "/usr/bin/zstd"}})
+
+    assert compressor_cmd(settings) == ["/usr/bin/zstd", "-q", "-c", "-20", "--ultra", "-T8", "--long=27"]
+
+
+def test_archive_extension():
+    """Test archive_extension() for the default and the other codecs."""
+    assert archive_extension({}) == ".tar.gz"
+    assert archive_extension({"COMPRESSION": {"CODEC": "zstd"}}) == ".tar.zst"
+    assert archive_extension({"COMPRESSION": {"CODEC": "none"}}) == ".tar"
+
+
+def test_is_tar_compression():
+    """Test is_tar_compression() is only true for what tar -z does."""
+    assert is_tar_compression({})
+    assert is_tar_compression({"COMPRESSION": {"CODEC": "gzip", "LEVEL": 6, "THREADS": 1}})
+    assert not is_tar_compression({"COMPRESSION": {"LEVEL": 9}})
+    assert not is_tar_compression({"COMPRESSION": {"CODEC": "xz"}})
+    assert not is_tar_compression({"COMPRESSION": {"SKIP_INCOMPRESSIBLE": True}})
+    assert not is_tar_compression({"MARIADB": {"USE": True, "COMPRESSION": "zstd"}})
+    assert is_tar_compression({"MARIADB": {"USE": True, "COMPRESSION": "zstd"}, "COMPRESSION": {"SKIP_INCOMPRESSIBLE": False}})
+
+
+@pytest.mark.parametrize("codec", ["gzip", "xz", "none"])
+def test_framed_compress_stage(codec):
+    """Test framed_compress_stage() frames decompress on their own and join into one valid stream."""
+    data = (b"some repeated mail text " * 20000) + os.urandom(50000)
+    frames = []
+
+    compressed = b"".join(framed_compress_stage(iter([data]), {"COMPRESSION": {"CODEC": codec, "THREADS": 2}}, frames, frame_size=65536))
+
+    assert len(frames) == (len(data) + 65535) // 65536
+    for offset, size, compressed_offset, compressed_size in frames:
+        assert decompress_frame(compressed[compressed_offset:compressed_offset + compressed_size], codec) == data[offset:offset + size]
+
+    # The joined frames are one file for the codec.
+    if codec == "gzip":
+        assert gzip.decompress(compressed) == data
+    elif codec == "xz":
+        assert lzma.decompress(compressed) == data
+    else:
+        assert compressed == data
+
+
+def test_is_incompressible():
+    """Test is_incompressible() for text, compressed data and an empty block."""
+    text = b"Subject: some repeated mail text\r\n" * 100000
+
+    assert not is_incompressible(text)
+    assert is_incompressible(os.urandom(1000000))
+    assert not is_incompressible(b"")
+
+
+@pytest.mark.parametrize("threads", [1, 4])
+def test_parallel_gzip_stage_skip_incompressible(threads):
+    """Test parallel_gzip_stage() stores incompressible blocks and still compresses text blocks."""
+    random_data = os.urandom(200000)
+    text = b"some repeated mail text " * 20000
+    data = random_data + text
+
+    compressed = b"".join(parallel_gzip_stage(iter([data]), threads=threads, block_size=200000, skip_incompressible=True))
+
+    # The gzip binary agrees that the stream with stored blocks is valid.
+    output = subprocess.run(["gzip", "-dc"], input=compressed, check=True, stdout=subprocess.PIPE)
+    assert output.stdout == data
+
+    # The text is still compressed, the random data is stored with a small overhead.
+    assert len(compressed) < len(random_data) + len(text) // 10
+
+
+@pytest.mark.parametrize("threads", [1, 4])
+def test_parallel_xz_stage_skip_incompressible(threads):
+    """Test parallel_xz_stage() with incompressible and text blocks."""
+    random_data = os.urandom(200000)
+    text = b"some repeated mail text " * 20000
+    data = random_data + text
+
+    compressed = b"".join(parallel_xz_stage(iter([data]), threads=threads, block_size=200000, skip_incompressible=True))
+
+    assert lzma.decompress(compressed) == data
+
+    # The text is still compressed, the random data is stored with a small overhead.
+    assert len(compressed) < len(random_data) + len(text) // 10
+
+
+def test_compress_stage_skip_incompressible():
+    """Test compress_stage() with single threaded gzip compresses as blocks when skipping incompressible blocks."""
+    data = os.urandom(100000) + b"x" * 100000
+
+    compressed = b"".join(compress_stage(iter([data]), {"COMPRESSION": {"SKIP_INCOMPRESSIBLE": True}}))
+
+    assert gzip.decompress(compressed) == data
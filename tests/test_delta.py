@@ -0,0 +1,244 @@
+import os
+import random
+import hashlib
+import pytest
+from ddmail_backup_taker import delta
+from ddmail_backup_taker.delta import iter_delta, encode_delta, apply_delta, file_digest, write_signature, load_signature, signature_chunk_sizes, backup_mariadb_delta, save_delta_state, load_delta_state, delta_bases, DELTA_STATE, DELTA_SIGNATURE
+
+def write_script(path, content):
+    """Write an executable shell script."""
+    with open(path, "w") as f:
+        f.write("#!/bin/sh\n" + content)
+    os.chmod(path, 0o755)
+    return str(path)
+
+def dump_of(rows):
+    """Make a dump like file with one extended INSERT of rows."""
+    return b"INSERT INTO `users` VALUES " + b",".join(b"(%d,'user%d@example.com','%s')" % (key, key, value) for key, value in rows) + b";\n"
+
+@pytest.fixture
+def delta_config(toml_config, monkeypatch, tmp_path):
+    """Config with a stand-in mariadb-dump binary that dumps the file dump.sql."""
+    (tmp_path / "dump.sql").write_bytes(dump_of((key, b"a") for key in range(5000)))
+    mariadbdump_bin = write_script(tmp_path / "mariadb-dump", "cat " + str(tmp_path / "dump.sql") + "\n")
+
+    save_backups_to = tmp_path / "backups"
+    save_backups_to.mkdir()
+
+    config_copy = toml_config.copy()
+    config_copy["SAVE_BACKUPS_TO"] = str(save_backups_to)
+    mariadb_copy = config_copy["MARIADB"].copy()
+    mariadb_copy["USE"] = True
+    mariadb_copy["DELTA"] = True
+    mariadb_copy["DELTA_FULL_EVERY"] = 3
+    mariadb_copy["MODE"] = "lock"
+    mariadb_copy["COMPRESSION"] = "none"
+    mariadb_copy["MARIADBDUMP_BIN"] = mariadbdump_bin
+    monkeypatch.setitem(config_copy, "MARIADB", mariadb_copy)
+    return config_copy
+
+
+def test_signature_chunk_sizes():
+    """Test signature_chunk_sizes() grows the chunks with the base between the smallest and largest average size."""
+    assert signature_chunk_sizes(0) == (256, 1024, 4096)
+    assert signature_chunk_sizes(64 * 1048576) == (256, 1024, 4096)
+    assert signature_chunk_sizes(1024 * 1048576) == (4096, 16384, 65536)
+    assert signature_chunk_sizes(1024 ** 4) == (16384, 65536, 262144)
+
+
+def test_write_load_signature(tmp_path):
+    """Test load_signature() finds the base offset of every chunk written by write_signature()."""
+    base = random.Random(1).randbytes(100000)
+    (tmp_path / "base.sql").write_bytes(base)
+
+    digest = write_signature(str(tmp_path / "base.sql"), str(tmp_path / "base.sig"))
+    signature = load_signature(str(tmp_path / "base.sig"))
+
+    assert digest == file_digest(str(tmp_path / "base.sql"))
+    assert signature["base_digest"] == digest
+    assert signature["chunk_sizes"] == (256, 1024, 4096)
+    assert len(signature["offsets"]) > 10
+    assert 0 in signature["offsets"].values()
+    assert (tmp_path / "base.sig").stat().st_mode & 0o777 == 0o600
+    assert os.path.getsize(tmp_path / "base.sig") < len(base) // 10
+
+
+def test_load_signature_not_a_signature(tmp_path):
+    """Test load_signature() with a file that is not a signature."""
+    (tmp_path / "base.sig").write_bytes(b"base")
+
+    with pytest.raises(ValueError):
+        load_signature(str(tmp_path / "base.sig"))
+
+
+@pytest.mark.parametrize("change", ["same", "modify", "insert", "delete", "append", "empty"])
+def test_encode_apply_delta(logger, tmp_path, change):
+    """Test a dump restored with apply_delta() is the dump encoded by encode_delta()."""
+    rows = [(key, b"a") for key in range(5000)]
+    base = dump_of(rows)
+
+    if change == "modify":
+        rows[2500] = (2500, b"b")
+    elif change == "insert":
+        rows.insert(2000, (99999, b"new"))
+    elif change == "delete":
+        del rows[10:20]
+    elif change == "append":
+        rows = rows + [(key, b"c") for key in range(5000, 5100)]
+    data = dump_of(rows) if change != "empty" else b""
+
+    (tmp_path / "base.sql").write_bytes(base)
+    (tmp_path / "data.sql").write_bytes(data)
+    write_signature(str(tmp_path / "base.sql"), str(tmp_path / "base.sig"))
+
+    delta_size = encode_delta(str(tmp_path / "base.sig"), str(tmp_path / "data.sql"), str(tmp_path / "data.sql.delta"))
+    result = apply_delta(logger, str(tmp_path / "base.sql"), str(tmp_path / "data.sql.delta"), str(tmp_path / "restored.sql"))
+
+    assert result["is_working"]
+    assert (tmp_path / "restored.sql").read_bytes() == data
+    assert delta_size < 200 + len(data) // 20
+
+
+def test_iter_delta_copies(tmp_path):
+    """Test iter_delta() writes copies of the base around a changed byte and only the chunk with it as a literal."""
+    base = random.Random(2).randbytes(20000)
+    data = base[:10000] + b"X" + base[10001:]
+    (tmp_path / "base.sql").write_bytes(base)
+    write_signature(str(tmp_path / "base.sql"), str(tmp_path / "base.sig"))
+
+    delta = b"".join(iter_delta(load_signature(str(tmp_path / "base.sig")), data))
+
+    assert delta.count(b"C\x00\x00\x00\x00\x00\x00\x00\x00") == 1
+    assert delta.count(b"L") >= 1
+    assert len(delta) < 8192 + 200
+
+
+def test_apply_delta_large_copy(logger, tmp_path, monkeypatch):
+    """Test apply_delta() writes a copy longer than LITERAL_SIZE in slices of at most LITERAL_SIZE bytes."""
+    base = random.Random(3).randbytes(100000)
+    (tmp_path / "base.sql").write_bytes(base)
+    (tmp_path / "data.sql").write_bytes(base)
+    write_signature(str(tmp_path / "base.sql"), str(tmp_path / "base.sig"))
+    encode_delta(str(tmp_path / "base.sig"), str(tmp_path / "data.sql"), str(tmp_path / "data.sql.delta"))
+
+    # An unchanged dump is one copy of the whole base.
+    assert b"C" + (0).to_bytes(8, "big") + len(base).to_bytes(8, "big") in (tmp_path / "data.sql.delta").read_bytes()
+
+    # Record the size of every slice hashed while the dump is restored.
+    sizes = []
+    sha256 = hashlib.sha256
+    class RecordingSha256:
+        def __init__(self, data=b""):
+            self.sha256 = sha256(data)
+        def update(self, data):
+            sizes.append(len(data))
+            self.sha256.update(data)
+        def digest(self):
+            return self.sha256.digest()
+        def hexdigest(self):
+            return self.sha256.hexdigest()
+    monkeypatch.setattr(delta, "LITERAL_SIZE", 4096)
+    monkeypatch.setattr(delta.hashlib, "sha256", RecordingSha256)
+
+    result = apply_delta(logger, str(tmp_path / "base.sql"), str(tmp_path / "data.sql.delta"), str(tmp_path / "restored.sql"))
+
+    assert result["is_working"]
+    assert (tmp_path / "restored.sql").read_bytes() == base
+    assert max(sizes) == 4096
+
+
+def test_apply_delta_copy_past_base(logger, tmp_path):
+    """Test apply_delta() with a copy outside the base."""
+    (tmp_path / "base.sql").write_bytes(b"base")
+    (tmp_path / "data.sql.delta").write_bytes(delta.DELTA_MAGIC + bytes.fromhex(file_digest(str(tmp_path / "base.sql"))) + b"C" + (2).to_bytes(8, "big") + (10).to_bytes(8, "big"))
+
+    result = apply_delta(logger, str(tmp_path / "base.sql"), str(tmp_path / "data.sql.delta"), str(tmp_path / "restored.sql"))
+
+    assert not result["is_working"]
+    assert result["msg"] == "delta file copies past the end of the base"
+
+
+def test_apply_delta_wrong_base(logger, tmp_path):
+    """Test apply_delta() with another base than the delta was encoded against."""
+    (tmp_path / "base.sql").write_bytes(b"base")
+    (tmp_path / "other.sql").write_bytes(b"other")
+    (tmp_path / "data.sql").write_bytes(b"data")
+    write_signature(str(tmp_path / "base.sql"), str(tmp_path / "base.sig"))
+    encode_delta(str(tmp_path / "base.sig"), str(tmp_path / "data.sql"), str(tmp_path / "data.sql.delta"))
+
+    result = apply_delta(logger, str(tmp_path / "other.sql"), str(tmp_path / "data.sql.delta"), str(tmp_path / "restored.sql"))
+
+    assert not result["is_working"]
+    assert result["msg"] == "base dump does not match the delta"
+
+
+def test_apply_delta_truncated(logger, tmp_path):
+    """Test apply_delta() with a delta that ends before its end operation."""
+    (tmp_path / "base.sql").write_bytes(b"base")
+    (tmp_path / "data.sql").write_bytes(b"data")
+    write_signature(str(tmp_path / "base.sql"), str(tmp_path / "base.sig"))
+    encode_delta(str(tmp_path / "base.sig"), str(tmp_path / "data.sql"), str(tmp_path / "data.sql.delta"))
+    (tmp_path / "data.sql.delta").write_bytes((tmp_path / "data.sql.delta").read_bytes()[:-10])
+
+    result = apply_delta(logger, str(tmp_path / "base.sql"), str(tmp_path / "data.sql.delta"), str(tmp_path / "restored.sql"))
+
+    assert not result["is_working"]
+    assert result["msg"] == "delta file is truncated"
+
+
+def test_backup_mariadb_delta(logger, delta_config, tmp_path):
+    """Test backup_mariadb_delta() keeps a full dump every DELTA_FULL_EVERY runs and deltas in between."""
+    state_file = os.path.join(delta_config["SAVE_BACKUPS_TO"], "snapshots", DELTA_STATE)
+    kinds = []
+    base_dump = None
+
+    for run in range(5):
+        (tmp_path / "dump.sql").write_bytes(dump_of((key, b"r%d" % run if key == 100 else b"a") for key in range(5000)))
+        dst_folder = tmp_path / ("run" + str(run))
+        dst_folder.mkdir()
+
+        result = backup_mariadb_delta(logger, delta_config, state_file, str(dst_folder))
+
+        assert result["is_working"]
+        kinds.append(os.path.basename(result["db_dump_file"]))
+
+        backup_filename = "backup_" + str(run) + ".tar.gz"
+        (tmp_path / "backups" / backup_filename).write_text("backup")
+        save_delta_state(logger, delta_config, state_file, result["delta_run"], backup_filename)
+
+        # The delta restores the dump of the run from the base dump in the backup of the last full run.
+        if result["delta_run"]["full"]:
+            base_dump = result["db_dump_file"]
+        else:
+            restored = str(dst_folder / "restored.sql")
+            assert apply_delta(logger, base_dump, result["db_dump_file"], restored)["is_working"]
+            assert file_digest(restored) == file_digest(str(tmp_path / "dump.sql"))
+
+    assert kinds == ["full_db_dump.sql", "full_db_dump.sql.delta", "full_db_dump.sql.delta", "full_db_dump.sql", "full_db_dump.sql.delta"]
+    assert load_delta_state(state_file)["base_backup_filename"] == "backup_3.tar.gz"
+    assert sorted(os.listdir(os.path.dirname(state_file))) == [DELTA_STATE, DELTA_SIGNATURE]
+    assert delta_bases(state_file) == {"backup_1.tar.gz": "backup_0.tar.gz", "backup_2.tar.gz": "backup_0.tar.gz", "backup_4.tar.gz": "backup_3.tar.gz"}
+
+
+def test_backup_mariadb_delta_base_gone(logger, delta_config, tmp_path):
+    """Test backup_mariadb_delta() keeps a full dump when the backup with the base is gone."""
+    state_file = os.path.join(delta_config["SAVE_BACKUPS_TO"], "snapshots", DELTA_STATE)
+
+    result = backup_mariadb_delta(logger, delta_config, state_file, str(tmp_path))
+    assert result["delta_run"]["full"]
+    save_delta_state(logger, delta_config, state_file, result["delta_run"], "backup_0.tar.gz")
+
+    result = backup_mariadb_delta(logger, delta_config, state_file, str(tmp_path))
+
+    assert result["is_working"]
+    assert result["delta_run"]["full"]
+
+
+def test_backup_mariadb_delta_failure(logger, delta_config, tmp_path):
+    """Test backup_mariadb_delta() when mariadb-dump fails."""
+    delta_config["MARIADB"]["MARIADBDUMP_BIN"] = write_script(tmp_path / "failing", "exit 1\n")
+
+    result = backup_mariadb_delta(logger, delta_config, str(tmp_path / DELTA_STATE), str(tmp_path))
+
+    assert not result["is_working"]
+    assert result["msg"] == "returncode of cmd mariadbdump is none zero"
@@ -0,0 +1,138 @@
+import os
+import struct
+import tarfile
+import subprocess
+import pytest
+from ddmail_backup_taker.archive import stream_archive
+from ddmail_backup_taker.catalog import restore_members
+from ddmail_backup_taker.encryption import encrypt_stage, decrypt_stage, decrypt_file, iter_last, CHUNKED_MAGIC
+
+pytest.importorskip("cryptography")
+
+def encryption_config(toml_config, monkeypatch, engine):
+    """Copy of the config with encryption by engine in 64kb chunks on three threads."""
+    config_copy = toml_config.copy()
+    gpg_copy = config_copy["GPG_ENCRYPTION"].copy()
+    gpg_copy["USE"] = True
+    gpg_copy["ENGINE"] = engine
+    gpg_copy["THREADS"] = 3
+    gpg_copy["CHUNK_SIZE"] = 65536
+    monkeypatch.setitem(config_copy, "GPG_ENCRYPTION", gpg_copy)
+    return config_copy
+
+def split_records(data):
+    """Split a chunked stream into its header and records."""
+    wrapped_key_size, = struct.unpack(">I", data[12:16])
+    offset = 16 + wrapped_key_size
+    header = data[:offset]
+    records = []
+    while offset < len(data):
+        size, = struct.unpack(">I", data[offset:offset + 4])
+        records.append(data[offset:offset + 4 + size])
+        offset = offset + 4 + size
+    return header, records
+
+
+def test_iter_last():
+    """Test iter_last() flags only the last block and keeps an empty stream as one block."""
+    assert list(iter_last([b"a", b"b"])) == [(b"a", False), (b"b", True)]
+    assert list(iter_last([])) == [(b"", True)]
+
+
+@pytest.mark.parametrize("engine", ["gpg", "chunked"])
+@pytest.mark.parametrize("size", [0, 1, 65536, 65536 * 5 + 123])
+def test_encrypt_decrypt_stage(toml_config, monkeypatch, engine, size):
+    """Test decrypt_stage() restores what encrypt_stage() encrypted with every engine."""
+    config_copy = encryption_config(toml_config, monkeypatch, engine)
+    data = os.urandom(size)
+
+    encrypted = b"".join(encrypt_stage(iter([data[:1000], data[1000:]]), config_copy))
+
+    assert encrypted.startswith(CHUNKED_MAGIC) == (engine == "chunked")
+    assert b"".join(decrypt_stage(iter([encrypted[:100], encrypted[100:]]), config_copy)) == data
+
+
+def test_chunked_records(toml_config, monkeypatch):
+    """Test the chunked engine writes one record per chunk with the tag."""
+    config_copy = encryption_config(toml_config, monkeypatch, "chunked")
+
+    encrypted = b"".join(encrypt_stage(iter([bytes(65536 * 3 + 10)]), config_copy))
+    _, records = split_records(encrypted)
+
+    assert [len(record) for record in records] == [4 + 65536 + 16] * 3 + [4 + 10 + 16]
+
+
+@pytest.mark.parametrize("damage,msg", [
+    ("flip", "encrypted chunk 1 failed authentication"),
+    ("drop_last", "encrypted chunk 2 failed authentication"),
+    ("swap", "encrypted chunk 0 failed authentication"),
+    ("cut", "encrypted stream is truncated"),
+    ])
+def test_decrypt_file_damaged(logger, toml_config, monkeypatch, tmp_path, damage, msg):
+    """Test decrypt_file() refuses a changed, reordered or truncated chunked stream."""
+    config_copy = encryption_config(toml_config, monkeypatch, "chunked")
+    encrypted = b"".join(encrypt_stage(iter([os.urandom(65536 * 3 + 10)]), config_copy))
+    header, records = split_records(encrypted)
+
+    if damage == "flip":
+        records[1] = records[1][:100] + bytes([records[1][100] ^ 1]) + records[1][101:]
+    elif damage == "drop_last":
+        records = records[:-1]
+    elif damage == "swap":
+        records[0], records[1] = records[1], records[0]
+    elif damage == "cut":
+        records[-1] = records[-1][:-5]
+    (tmp_path / "backup.tar.ddenc").write_bytes(header + b"".join(records))
+
+    result = decrypt_file(logger, config_copy, str(tmp_path / "backup.tar.ddenc"), str(tmp_path / "backup.tar"))
+
+    assert not result["is_working"]
+    assert result["msg"] == msg
+    assert not os.path.exists(tmp_path / "backup.tar")
+
+
+def test_decrypt_file_wrong_key(logger, toml_config, monkeypatch, tmp_path):
+    """Test decrypt_file() when gpg can not decrypt the session key."""
+    config_copy = encryption_config(toml_config, monkeypatch, "chunked")
+    wrapped_key = b"not an openpgp message"
+    (tmp_path / "backup.tar.ddenc").write_bytes(CHUNKED_MAGIC + struct.pack(">II", 65536, len(wrapped_key)) + wrapped_key)
+
+    result = decrypt_file(logger, config_copy, str(tmp_path / "backup.tar.ddenc"), str(tmp_path / "backup.tar"))
+
+    assert not result["is_working"]
+    assert result["msg"] == "gpg command failed with return code 2"
+
+
+def test_stream_archive_chunked(logger, toml_config, monkeypatch, tmp_path):
+    """Test a backup and catalog encrypted by the chunked engine are restored."""
+    config_copy = encryption_config(toml_config, monkeypatch, "chunked")
+    monkeypatch.setitem(config_copy, "ARCHIVE", {"ENGINE": "python", "INDEX": True})
+    monkeypatch.setitem(config_copy, "COMPRESSION", {"CODEC": "gzip", "THREADS": 2})
+
+    data_dir = tmp_path / "data"
+    for user in ["alice", "bob"]:
+        (data_dir / user).mkdir(parents=True)
+        (data_dir / user / "mail").write_bytes(os.urandom(200000))
+    backup_file = str(tmp_path / "backup_1.tar.gz.ddenc")
+
+    result = stream_archive(logger, config_copy, [str(data_dir)], backup_file)
+    assert result["is_working"]
+
+    # The whole backup is decrypted and read by tar.
+    assert decrypt_file(logger, config_copy, backup_file, str(tmp_path / "backup_1.tar.gz"))["is_working"]
+    with tarfile.open(tmp_path / "backup_1.tar.gz", "r:gz") as tar:
+        assert len([member for member in tar.getmembers() if member.isfile()]) == 2
+
+    # One user is restored with the encrypted catalog.
+    result_restore = restore_members(logger, config_copy, backup_file, [str(data_dir / "bob")], str(tmp_path / "restored"))
+    assert result_restore["is_working"]
+    restored = tmp_path / "restored" / str(data_dir).lstrip("/")
+    assert (restored / "bob" / "mail").read_bytes() == (data_dir / "bob" / "mail").read_bytes()
+
+
+def test_decrypt_stage_gpg_failure(toml_config, monkeypatch):
+    """Test decrypt_stage() raises when gpg can not decrypt the stream."""
+    config_copy = encryption_config(toml_config, monkeypatch, "gpg")
+
+    with pytest.raises(subprocess.CalledProcessError):
+        b"".join(decrypt_stage(iter([b"not an openpgp message"]), config_copy))
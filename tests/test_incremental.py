@@ -0,0 +1,62 @@
+import os
+import json
+import shutil
+import tempfile
+from ddmail_backup_taker.incremental import message_key, track_path, deleted_paths, apply_changes
+
+def test_message_key():
+    """Test message_key() ignores the flags and the new/cur folder of a message."""
+    assert message_key("var/mail/user/Maildir/new/1700000000.M1P1.host") == "var/mail/user/Maildir/1700000000.M1P1.host"
+    assert message_key("var/mail/user/Maildir/cur/1700000000.M1P1.host:2,RS") == "var/mail/user/Maildir/1700000000.M1P1.host"
+    assert message_key("var/mail/user/Maildir/.Sent/cur/1700000000.M1P1.host:2,S") == "var/mail/user/Maildir/.Sent/1700000000.M1P1.host"
+
+
+def test_message_key_not_a_message():
+    """Test message_key() returns None for files that are not Maildir messages."""
+    assert message_key("var/mail/user/Maildir/dovecot.index") is None
+    assert message_key("var/mail/user/Maildir/tmp/1700000000.M1P1.host") is None
+
+
+def test_track_path_changed_file():
+    """Test track_path() archives regular files only when they changed."""
+    data_dir = tempfile.mkdtemp()
+    path = os.path.join(data_dir, "a.txt")
+    with open(path, "w") as f:
+        f.write("test")
+
+    try:
+        previous = {"files": {}, "messages": {}}
+        current = {"files": {}, "messages": {}}
+        changes = {"renames": []}
+        assert track_path(previous, current, changes, path, os.lstat(path), True)
+
+        # Same file in the next run is not archived again.
+        previous, current = current, {"files": {}, "messages": {}}
+        assert not track_path(previous, current, changes, path, os.lstat(path), True)
+        assert deleted_paths(previous, current) == []
+    finally:
+        shutil.rmtree(data_dir)
+
+
+def test_apply_changes(logger):
+    """Test apply_changes() renames and deletes files in a restored tree."""
+    dst_folder = tempfile.mkdtemp()
+    os.makedirs(os.path.join(dst_folder, "Maildir", "new"))
+    with open(os.path.join(dst_folder, "Maildir", "new", "1.host"), "w") as f:
+        f.write("message")
+    with open(os.path.join(dst_folder, "Maildir", "old.txt"), "w") as f:
+        f.write("deleted")
+
+    changes_file = os.path.join(dst_folder, "changes.json")
+    with open(changes_file, "w") as f:
+        json.dump({"level": 1, "renames": [["Maildir/new/1.host", "Maildir/cur/1.host:2,S"]], "deletes": ["Maildir/old.txt"]}, f)
+
+    try:
+        result = apply_changes(logger, changes_file, dst_folder)
+
+        assert result["is_working"]
+        assert os.path.isfile(os.path.join(dst_folder, "Maildir", "cur", "1.host:2,S"))
+        assert not os.path.exists(os.path.join(dst_folder, "Maildir", "new", "1.host"))
+        assert not os.path.exists(os.path.join(dst_folder, "Maildir", "old.txt"))
+    finally:
+        shutil.rmtree(dst_folder)
@@ -0,0 +1,239 @@
+import os
+import gzip
+import time
+import shutil
+import tarfile
+import subprocess
+import pytest
+from ddmail_backup_taker.archive import stream_archive
+from ddmail_backup_taker.mariadb import list_databases, db_dump_file_of, dump_database, backup_mariadb_databases, iter_dump_parts, iter_dump_members, dump_extension, DUMP_MEMBER_FOLDER
+
+def write_script(path, content):
+    """Write an executable shell script."""
+    with open(path, "w") as f:
+        f.write("#!/bin/sh\n" + content)
+    os.chmod(path, 0o755)
+    return str(path)
+
+@pytest.fixture
+def mariadb_config(toml_config, monkeypatch, tmp_path):
+    """Config with stand-in mariadb and mariadb-dump binaries, every dump takes 0.5 seconds."""
+    mariadb_bin = write_script(tmp_path / "mariadb", "printf 'db1\\ndb2\\ninformation_schema\\ndb3\\nperformance_schema\\ndb4\\n'\n")
+    mariadbdump_bin = write_script(tmp_path / "mariadb-dump", "sleep 0.5\necho \"-- dump of $6\"\n")
+
+    config_copy = toml_config.copy()
+    mariadb_copy = config_copy["MARIADB"].copy()
+    mariadb_copy["USE"] = True
+    mariadb_copy["PER_DATABASE"] = True
+    mariadb_copy["PARALLELISM"] = 4
+    mariadb_copy["MARIADB_BIN"] = mariadb_bin
+    mariadb_copy["MARIADBDUMP_BIN"] = mariadbdump_bin
+    monkeypatch.setitem(config_copy, "MARIADB", mariadb_copy)
+    return config_copy
+
+
+def test_list_databases(logger, mariadb_config):
+    """Test list_databases() skips the databases mariadb-dump --all-databases skips."""
+    result = list_databases(logger, mariadb_config)
+
+    assert result["is_working"]
+    assert result["databases"] == ["db1", "db2", "db3", "db4"]
+
+
+def test_list_databases_failure(logger, mariadb_config, tmp_path):
+    """Test list_databases() when the mariadb command fails."""
+    mariadb_config["MARIADB"]["MARIADB_BIN"] = write_script(tmp_path / "failing", "exit 1\n")
+
+    result = list_databases(logger, mariadb_config)
+
+    assert not result["is_working"]
+    assert result["msg"] == "returncode of cmd mariadb is none zero"
+
+
+def test_db_dump_file_of():
+    """Test db_dump_file_of() quotes names that are not safe in a file name."""
+    assert db_dump_file_of("/tmp/2023-01-15", "mail") == "/tmp/2023-01-15/db_dump_mail.sql"
+    assert db_dump_file_of("/tmp/2023-01-15", "../a b") == "/tmp/2023-01-15/db_dump_..%2Fa%20b.sql"
+    assert db_dump_file_of("/tmp/2023-01-15", None, ".sql.zst") == "/tmp/2023-01-15/full_db_dump.sql.zst"
+
+
+def test_dump_extension():
+    """Test dump_extension() follows MARIADB.COMPRESSION."""
+    assert dump_extension({"MARIADB": {}}) == ".sql"
+    assert dump_extension({"MARIADB": {"COMPRESSION": "gzip"}}) == ".sql.gz"
+    assert dump_extension({"MARIADB": {"COMPRESSION": "zstd"}}) == ".sql.zst"
+
+
+def test_dump_database(logger, mariadb_config, tmp_path):
+    """Test dump_database() writes the dump of one database."""
+    result = dump_database(logger, mariadb_config, "db1", str(tmp_path))
+
+    assert result["is_working"]
+    with open(result["db_dump_file"], "r") as f:
+        assert f.read() == "-- dump of db1\n"
+
+
+def test_backup_mariadb_databases(logger, mariadb_config, tmp_path):
+    """Test backup_mariadb_databases() dumps the databases concurrently to one file each."""
+    dst_folder = tmp_path / "dst"
+    dst_folder.mkdir()
+
+    start = time.monotonic()
+    result = backup_mariadb_databases(logger, mariadb_config, str(dst_folder))
+    elapsed = time.monotonic() - start
+
+    assert result["is_working"]
+    assert result["db_dump_files"] == [db_dump_file_of(str(dst_folder), database) for database in ["db1", "db2", "db3", "db4"]]
+    for database, db_dump_file in zip(["db1", "db2", "db3", "db4"], result["db_dump_files"]):
+        with open(db_dump_file, "r") as f:
+            assert f.read() == "-- dump of " + database + "\n"
+
+    # Four dumps of 0.5 seconds in parallel take far less than the 2 seconds one after the other.
+    assert elapsed < 1.5
+
+
+def test_backup_mariadb_databases_failure(logger, mariadb_config, tmp_path):
+    """Test backup_mariadb_databases() when one dump fails."""
+    mariadb_config["MARIADB"]["MARIADBDUMP_BIN"] = write_script(tmp_path / "failing-dump", "[ \"$6\" = db3 ] && exit 2\necho ok\n")
+
+    result = backup_mariadb_databases(logger, mariadb_config, str(tmp_path))
+
+    assert not result["is_working"]
+    assert result["msg"] == "dump of database db3 failed: returncode of cmd mariadbdump is none zero"
+
+
+def test_backup_mariadb_databases_invalid_destination(logger, mariadb_config):
+    """Test backup_mariadb_databases() with non-existent destination folder."""
+    result = backup_mariadb_databases(logger, mariadb_config, "/path/that/does/not/exist")
+
+    assert not result["is_working"]
+    assert result["msg"] == "dst_folder do not exist"
+
+
+def test_iter_dump_parts():
+    """Test iter_dump_parts() splits a stream into numbered parts and an empty stream into one empty part."""
+    parts = list(iter_dump_parts("dump.sql", iter([b"abc", b"defgh"]), 3))
+
+    assert parts == [("dump.sql.part0001", b"abc"), ("dump.sql.part0002", b"def"), ("dump.sql.part0003", b"gh")]
+    assert list(iter_dump_parts("dump.sql", iter([]), 3)) == [("dump.sql.part0001", b"")]
+
+
+def test_iter_dump_members(mariadb_config):
+    """Test iter_dump_members() dumps all databases or every database in turn."""
+    assert list(iter_dump_members(mariadb_config)) == [(DUMP_MEMBER_FOLDER + "/full_db_dump.sql.part0001", b"-- dump of \n")]
+    assert list(iter_dump_members(mariadb_config, ["db1", "db2"])) == [
+            (DUMP_MEMBER_FOLDER + "/db_dump_db1.sql.part0001", b"-- dump of db1\n"),
+            (DUMP_MEMBER_FOLDER + "/db_dump_db2.sql.part0001", b"-- dump of db2\n"),
+            ]
+
+
+def test_stream_archive_dump_members(logger, mariadb_config, monkeypatch, tmp_path):
+    """Test stream_archive() archives a streamed dump split into parts that join into the dump."""
+    mariadb_config["MARIADB"]["MARIADBDUMP_BIN"] = write_script(tmp_path / "large-dump", "head -c 2500000 /dev/zero | tr '\\0' 'x'\n")
+    gpg_copy = mariadb_config["GPG_ENCRYPTION"].copy()
+    gpg_copy["USE"] = False
+    monkeypatch.setitem(mariadb_config, "GPG_ENCRYPTION", gpg_copy)
+    backup_file = str(tmp_path / "backup.tar.gz")
+
+    result = stream_archive(logger, mariadb_config, [], backup_file, members=iter_dump_members(mariadb_config, part_size=1048576))
+
+    assert result["is_working"]
+    with tarfile.open(backup_file, "r:gz") as tar:
+        names = tar.getnames()
+        assert names == [DUMP_MEMBER_FOLDER + "/full_db_dump.sql.part000" + str(number) for number in [1, 2, 3]]
+        dump = b"".join(tar.extractfile(name).read() for name in names)
+    assert dump == b"x" * 2500000
+
+
+def test_stream_archive_dump_members_failure(logger, mariadb_config, monkeypatch, tmp_path):
+    """Test stream_archive() removes the backup file when the streamed dump fails."""
+    mariadb_config["MARIADB"]["MARIADBDUMP_BIN"] = write_script(tmp_path / "mariadb-dump", "echo partial\nexit 2\n")
+    gpg_copy = mariadb_config["GPG_ENCRYPTION"].copy()
+    gpg_copy["USE"] = False
+    monkeypatch.setitem(mariadb_config, "GPG_ENCRYPTION", gpg_copy)
+    backup_file = str(tmp_path / "backup.tar.gz")
+
+    result = stream_archive(logger, mariadb_config, [], backup_file, members=iter_dump_members(mariadb_config))
+
+    assert not result["is_working"]
+    assert result["msg"] == "mariadb-dump command failed with return code 2"
+    assert not os.path.exists(backup_file)
+
+
+@pytest.mark.parametrize("codec", ["gzip", "zstd"])
+def test_dump_database_compressed(logger, mariadb_config, tmp_path, codec):
+    """Test dump_database() compresses the dump of all databases while it is written."""
+    if codec == "zstd":
+        compressor_bin = shutil.which("zstd")
+        if compressor_bin is None:
+            pytest.skip("zstd binary is not installed")
+        mariadb_config["MARIADB"]["COMPRESSION_BIN"] = compressor_bin
+    mariadb_config["MARIADB"]["COMPRESSION"] = codec
+
+    result = dump_database(logger, mariadb_config, None, str(tmp_path))
+
+    assert result["is_working"]
+    assert result["db_dump_file"] == db_dump_file_of(str(tmp_path), None, dump_extension(mariadb_config))
+    with open(result["db_dump_file"], "rb") as f:
+        data = f.read()
+    if codec == "gzip":
+        assert gzip.decompress(data) == b"-- dump of \n"
+    else:
+        output = subprocess.run([compressor_bin, "-d", "-c"], input=data, check=True, stdout=subprocess.PIPE)
+        assert output.stdout == b"-- dump of \n"
+
+
+def test_dump_database_compressor_failure(logger, mariadb_config, tmp_path):
+    """Test dump_database() when the compressor fails."""
+    mariadb_config["MARIADB"]["COMPRESSION"] = "zstd"
+    mariadb_config["MARIADB"]["COMPRESSION_BIN"] = write_script(tmp_path / "zstd", "exit 1\n")
+
+    result = dump_database(logger, mariadb_config, "db1", str(tmp_path))
+
+    assert not result["is_working"]
+    assert result["msg"] == "returncode of cmd zstd is none zero"
+
+
+def test_iter_dump_members_compressed(mariadb_config):
+    """Test iter_dump_members() names and compresses the parts with MARIADB.COMPRESSION."""
+    mariadb_config["MARIADB"]["COMPRESSION"] = "gzip"
+
+    members = list(iter_dump_members(mariadb_config, ["db1"]))
+
+    assert [name for name, data in members] == [DUMP_MEMBER_FOLDER + "/db_dump_db1.sql.gz.part0001"]
+    assert gzip.decompress(members[0][1]) == b"-- dump of db1\n"
+
+
+@pytest.fixture
+def physical_config(mariadb_config, tmp_path):
+    """Config with MARIADB.MODE physical and a stand-in mariabackup binary."""
+    mariadb_config["MARIADB"]["MODE"] = "physical"
+    mariadb_config["MARIADB"]["PER_DATABASE"] = False
+    mariadb_config["MARIADB"]["COMPRESSION"] = "none"
+    mariadb_config["MARIADB"]["MARIABACKUP_BIN"] = write_script(tmp_path / "mariabackup", "echo \"xbstream $1 $2\"\n")
+    return mariadb_config
+
+
+def test_dump_database_physical(logger, physical_config, tmp_path):
+    """Test dump_database() writes the xbstream of mariabackup with MARIADB.MODE physical."""
+    result = dump_database(logger, physical_config, None, str(tmp_path))
+
+    assert result["is_working"]
+    assert result["db_dump_file"] == str(tmp_path / "full_db_dump.xbstream")
+    with open(result["db_dump_file"], "r") as f:
+        assert f.read() == "xbstream --backup --stream=xbstream\n"
+
+
+def test_dump_database_physical_failure(logger, physical_config, tmp_path):
+    """Test dump_database() when mariabackup fails."""
+    physical_config["MARIADB"]["MARIABACKUP_BIN"] = write_script(tmp_path / "mariabackup", "exit 1\n")
+
+    result = dump_database(logger, physical_config, None, str(tmp_path))
+
+    assert not result["is_working"]
+    assert result["msg"] == "returncode of cmd mariabackup is none zero"
+
+
+def test_iter_dump_members_physical(physical_config):
+    """Test iter_dump_members() streams the xbstream of mariabackup into the archive."""
+    assert list(iter_dump_members(physical_config)) == [(DUMP_MEMBER_FOLDER + "/full_db_dump.xbstream.part0001", b"xbstream --backup --stream=xbstream\n")]
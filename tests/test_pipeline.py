@@ -0,0 +1,83 @@
+import os
+import hashlib
+import subprocess
+import pytest
+from ddmail_backup_taker.pipeline import enlarge_pipe, relay, run_pipeline, PIPE_SIZE
+
+@pytest.fixture
+def data_file(tmp_path):
+    """A file of a few pipe buffers of data."""
+    path = tmp_path / "data"
+    path.write_bytes(os.urandom(3 * PIPE_SIZE + 12345))
+    return path
+
+
+def test_enlarge_pipe():
+    """Test enlarge_pipe() grows a pipe and returns 0 for a file."""
+    read_fd, write_fd = os.pipe()
+    try:
+        assert enlarge_pipe(write_fd, 262144) >= 262144
+    finally:
+        os.close(read_fd)
+        os.close(write_fd)
+
+    with open(__file__, "rb") as f:
+        assert enlarge_pipe(f.fileno()) == 0
+
+
+@pytest.mark.parametrize("zero_copy", [True, False])
+@pytest.mark.parametrize("hashed", [True, False])
+def test_relay(data_file, tmp_path, zero_copy, hashed):
+    """Test relay() moves a pipe to a file with and without splice and tee."""
+    process = subprocess.Popen(["cat", str(data_file)], stdout=subprocess.PIPE)
+    hasher = hashlib.sha256() if hashed else None
+
+    with open(tmp_path / "out", "wb") as f:
+        size = relay(process.stdout.fileno(), f.fileno(), hasher, zero_copy)
+    process.stdout.close()
+    process.wait()
+
+    data = data_file.read_bytes()
+    assert size == len(data)
+    assert (tmp_path / "out").read_bytes() == data
+    if hashed:
+        assert hasher.hexdigest() == hashlib.sha256(data).hexdigest()
+
+
+def test_relay_append(data_file, tmp_path):
+    """Test relay() copies to a file opened for appending, which can not be spliced to."""
+    (tmp_path / "out").write_bytes(b"head")
+    process = subprocess.Popen(["cat", str(data_file)], stdout=subprocess.PIPE)
+    hasher = hashlib.sha256()
+
+    with open(tmp_path / "out", "ab") as f:
+        relay(process.stdout.fileno(), f.fileno(), hasher)
+    process.stdout.close()
+    process.wait()
+
+    assert (tmp_path / "out").read_bytes() == b"head" + data_file.read_bytes()
+    assert hasher.hexdigest() == hashlib.sha256(data_file.read_bytes()).hexdigest()
+
+
+@pytest.mark.parametrize("zero_copy", [True, False])
+def test_run_pipeline(data_file, tmp_path, zero_copy):
+    """Test run_pipeline() chains subprocesses and counts the bytes of every stage."""
+    hasher = hashlib.sha256()
+
+    counts = run_pipeline([["cat", str(data_file)], ["gzip", "-1", "-c"], ["gzip", "-d", "-c"]], str(tmp_path / "out"), hasher, zero_copy)
+
+    data = data_file.read_bytes()
+    assert (tmp_path / "out").read_bytes() == data
+    assert hasher.hexdigest() == hashlib.sha256(data).hexdigest()
+    assert counts[0] == len(data)
+    assert counts[1] > 0
+    assert counts[2] == len(data)
+
+
+def test_run_pipeline_failure(data_file, tmp_path):
+    """Test run_pipeline() raises for the first failing subprocess."""
+    with pytest.raises(subprocess.CalledProcessError) as e:
+        run_pipeline([["cat", str(data_file)], ["sh", "-c", "head -c 10 > /dev/null; exit 3"], ["cat"]], str(tmp_path / "out"))
+
+    assert e.value.cmd[0] == "sh"
+    assert e.value.returncode == 3
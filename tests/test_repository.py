@@ -0,0 +1,256 @@
+import os
+import io
+import random
+import shutil
+import tempfile
+import time
+from ddmail_backup_taker import repository
+from ddmail_backup_taker.repository import iter_chunks, window_hashes, find_candidates, backup_to_repository, prune_repository, restore_snapshot, WINDOW_TABLE, WINDOW_PERMUTATIONS, HASH_WINDOW_SIZE
+
+def repository_config(toml_config, monkeypatch, repository_path, use_gpg):
+    """Copy the config with the repository enabled and a small chunk size."""
+    config_copy = toml_config.copy()
+
+    gpg_copy = config_copy["GPG_ENCRYPTION"].copy()
+    gpg_copy["USE"] = use_gpg
+    monkeypatch.setitem(config_copy, "GPG_ENCRYPTION", gpg_copy)
+
+    monkeypatch.setitem(config_copy, "REPOSITORY", {"USE": True, "PATH": repository_path, "AVG_CHUNK_SIZE": 65536})
+    return config_copy
+
+
+def test_window_hashes():
+    """Test window_hashes() hashes every window like one hash per window step by step."""
+    data = random.Random(5).randbytes(300)
+
+    def window_hash(window):
+        hashes = list(window.translate(WINDOW_TABLE))
+        for level, permutation in enumerate(WINDOW_PERMUTATIONS):
+            hashes = [hashes[i] ^ permutation[hashes[i + (1 << level)]] for i in range(len(hashes) - (1 << level))]
+        return hashes[0]
+
+    hashes = window_hashes(data)
+
+    assert len(hashes) == len(data)
+    assert all(hashes[i] == window_hash(data[i:i + HASH_WINDOW_SIZE]) for i in range(len(data) - HASH_WINDOW_SIZE + 1))
+
+
+def test_find_candidates_runs_of_one_byte():
+    """Test find_candidates() never finds a candidate in a run of one byte, so runs are not checked byte by byte."""
+    assert all(find_candidates(bytes([byte]) * 4096, 1024) == [] for byte in range(256))
+
+
+def test_find_candidates_across_blocks(monkeypatch):
+    """Test find_candidates() finds the same positions when the data is hashed in several blocks."""
+    data = random.Random(6).randbytes(200000)
+    candidates = find_candidates(data, 1024)
+
+    monkeypatch.setattr(repository, "WINDOW_BLOCK_SIZE", 4099)
+
+    assert find_candidates(data, 1024) == candidates
+    assert 100 < len(candidates) < 300
+
+
+def test_iter_chunks_sizes_and_content():
+    """Test iter_chunks() splits data within the chunk size limits without losing bytes."""
+    data = random.Random(1).randbytes(2000000)
+
+    chunks = list(iter_chunks(io.BytesIO(data), 16384, 65536, 262144))
+
+    assert b"".join(chunks) == data
+    assert all(16384 < len(chunk) <= 262144 for chunk in chunks[:-1])
+
+
+def test_iter_chunks_boundaries_follow_content():
+    """Test iter_chunks() finds the same boundaries after data is inserted at the start."""
+    data = random.Random(2).randbytes(2000000)
+
+    chunks = set(iter_chunks(io.BytesIO(data), 16384, 65536, 262144))
+    shifted_chunks = set(iter_chunks(io.BytesIO(b"new data" + data), 16384, 65536, 262144))
+
+    # Only the first chunk differs.
+    assert len(shifted_chunks - chunks) == 1
+
+
+def test_iter_chunks_empty_file():
+    """Test iter_chunks() yields no chunks for an empty file."""
+    assert list(iter_chunks(io.BytesIO(b""), 16384, 65536, 262144)) == []
+
+
+def test_backup_to_repository_dedup_and_restore(logger, toml_config, monkeypatch):
+    """Test backup_to_repository() only stores new chunks and a snapshot can be restored."""
+    repository_path = tempfile.mkdtemp()
+    data_dir = tempfile.mkdtemp()
+    restore_dir = tempfile.mkdtemp()
+    os.makedirs(os.path.join(data_dir, "sub"))
+    big_data = random.Random(3).randbytes(1000000)
+    with open(os.path.join(data_dir, "big.bin"), "wb") as f:
+        f.write(big_data)
+    with open(os.path.join(data_dir, "sub", "small.txt"), "w") as f:
+        f.write("small file")
+    os.symlink("big.bin", os.path.join(data_dir, "link"))
+
+    config_copy = repository_config(toml_config, monkeypatch, repository_path, True)
+
+    try:
+        result_first = backup_to_repository(logger, config_copy, [data_dir])
+        assert result_first["is_working"]
+        assert result_first["backup_type"] == "snapshot"
+        assert result_first["backup_filename"].endswith(".pack.gpg")
+        assert os.path.isfile(result_first["backup_file"])
+        assert result_first["new_chunks"] == result_first["chunks"]
+
+        # Change the start of the big file and make sure the snapshot name differs.
+        time.sleep(1.1)
+        with open(os.path.join(data_dir, "big.bin"), "wb") as f:
+            f.write(b"changed" + big_data)
+
+        result_second = backup_to_repository(logger, config_copy, [data_dir])
+        assert result_second["is_working"]
+        assert result_second["new_chunks"] < result_second["chunks"]
+        assert os.path.getsize(result_second["backup_file"]) < os.path.getsize(result_first["backup_file"])
+
+        name = result_second["backup_filename"].split(".")[0]
+        result_restore = restore_snapshot(logger, config_copy, name, restore_dir)
+        assert result_restore["is_working"]
+
+        restored = os.path.join(restore_dir, data_dir.lstrip("/"))
+        with open(os.path.join(restored, "big.bin"), "rb") as f:
+            assert f.read() == b"changed" + big_data
+        with open(os.path.join(restored, "sub", "small.txt"), "r") as f:
+            assert f.read() == "small file"
+        assert os.readlink(os.path.join(restored, "link")) == "big.bin"
+    finally:
+        shutil.rmtree(repository_path)
+        shutil.rmtree(data_dir)
+        shutil.rmtree(restore_dir)
+
+
+def test_backup_to_repository_skips_unchanged_files(logger, toml_config, monkeypatch):
+    """Test backup_to_repository() reuses the chunks of files that did not change since the last snapshot without reading them."""
+    repository_path = tempfile.mkdtemp()
+    data_dir = tempfile.mkdtemp()
+    restore_dir = tempfile.mkdtemp()
+    files = {name: random.Random(index).randbytes(150000) for index, name in enumerate(["a.bin", "b.bin", "c.bin"])}
+    for name, data in files.items():
+        with open(os.path.join(data_dir, name), "wb") as f:
+            f.write(data)
+        # Files changed within the last second are always read.
+        os.utime(os.path.join(data_dir, name), (time.time() - 60, time.time() - 60))
+
+    config_copy = repository_config(toml_config, monkeypatch, repository_path, False)
+
+    read_files = []
+    real_iter_chunks = repository.iter_chunks
+
+    def counting_iter_chunks(f, *sizes):
+        read_files.append(os.path.basename(f.name))
+        return real_iter_chunks(f, *sizes)
+
+    monkeypatch.setattr(repository, "iter_chunks", counting_iter_chunks)
+
+    try:
+        assert backup_to_repository(logger, config_copy, [data_dir])["is_working"]
+        assert sorted(read_files) == ["a.bin", "b.bin", "c.bin"]
+
+        # Only the changed file is read again.
+        time.sleep(1.1)
+        files["b.bin"] = b"changed" + files["b.bin"]
+        with open(os.path.join(data_dir, "b.bin"), "wb") as f:
+            f.write(files["b.bin"])
+        read_files.clear()
+
+        result = backup_to_repository(logger, config_copy, [data_dir])
+
+        assert result["is_working"]
+        assert read_files == ["b.bin"]
+
+        name = result["backup_filename"].split(".")[0]
+        assert restore_snapshot(logger, config_copy, name, restore_dir)["is_working"]
+        for file_name, data in files.items():
+            with open(os.path.join(restore_dir, data_dir.lstrip("/"), file_name), "rb") as f:
+                assert f.read() == data
+    finally:
+        shutil.rmtree(repository_path)
+        shutil.rmtree(data_dir)
+        shutil.rmtree(restore_dir)
+
+
+def test_restore_snapshot_does_not_exist(logger, toml_config, monkeypatch):
+    """Test restore_snapshot() with a snapshot that is not in the repository."""
+    repository_path = tempfile.mkdtemp()
+    config_copy = repository_config(toml_config, monkeypatch, repository_path, False)
+
+    try:
+        result = restore_snapshot(logger, config_copy, "backup_20000101000000", repository_path)
+
+        assert not result["is_working"]
+        assert result["msg"] == "snapshot backup_20000101000000 does not exist"
+    finally:
+        shutil.rmtree(repository_path)
+
+
+def test_backup_to_repository_gpg_failure(logger, toml_config, monkeypatch):
+    """Test backup_to_repository() removes the pack and indexes nothing when gpg fails."""
+    repository_path = tempfile.mkdtemp()
+    data_dir = tempfile.mkdtemp()
+    with open(os.path.join(data_dir, "a.txt"), "w") as f:
+        f.write("test")
+
+    config_copy = repository_config(toml_config, monkeypatch, repository_path, True)
+    config_copy["GPG_ENCRYPTION"]["PUBKEY_FINGERPRINT"] = "0000000000000000000000000000000000000000"
+
+    try:
+        result = backup_to_repository(logger, config_copy, [data_dir])
+
+        assert not result["is_working"]
+        assert result["msg"].startswith("gpg command failed with return code")
+        assert os.listdir(os.path.join(repository_path, "packs")) == []
+
+        result_prune = prune_repository(logger, config_copy)
+        assert result_prune["unused_packs"] == []
+    finally:
+        shutil.rmtree(repository_path)
+        shutil.rmtree(data_dir)
+
+
+def test_prune_repository(logger, toml_config, monkeypatch):
+    """Test prune_repository() keeps the packs used by the kept snapshots."""
+    repository_path = tempfile.mkdtemp()
+    data_dir = tempfile.mkdtemp()
+    kept_data = random.Random(4).randbytes(200000)
+    with open(os.path.join(data_dir, "kept.bin"), "wb") as f:
+        f.write(kept_data)
+
+    config_copy = repository_config(toml_config, monkeypatch, repository_path, False)
+    config_copy["BACKUPS_TO_SAVE_LOCAL"] = 1
+
+    try:
+        # First pack holds kept.bin, second pack holds removed.bin.
+        result_first = backup_to_repository(logger, config_copy, [data_dir])
+        time.sleep(1.1)
+        with open(os.path.join(data_dir, "removed.bin"), "wb") as f:
+            f.write(b"removed data")
+        result_second = backup_to_repository(logger, config_copy, [data_dir])
+
+        # Third snapshot uses chunks from the first pack only.
+        time.sleep(1.1)
+        os.remove(os.path.join(data_dir, "removed.bin"))
+        result_third = backup_to_repository(logger, config_copy, [data_dir])
+        assert result_third["new_chunks"] == 0
+
+        result = prune_repository(logger, config_copy)
+        assert result["is_working"]
+        assert result["unused_packs"] == [result_second["backup_file"]]
+
+        # The kept snapshot can still be restored after the unused pack is removed.
+        os.remove(result_second["backup_file"])
+        restore_dir = os.path.join(repository_path, "restore")
+        name = result_third["backup_filename"].split(".")[0]
+        assert restore_snapshot(logger, config_copy, name, restore_dir)["is_working"]
+        with open(os.path.join(restore_dir, data_dir.lstrip("/"), "kept.bin"), "rb") as f:
+            assert f.read() == kept_data
+        assert os.path.isfile(result_first["backup_file"])
+    finally:
+        shutil.rmtree(repository_path)
+        shutil.rmtree(data_dir)
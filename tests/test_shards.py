@@ -0,0 +1,156 @@
+import os
+import json
+import shutil
+import subprocess
+import tempfile
+import pytest
+from ddmail_backup_taker.shards import plan_shards, shard_file, archive_shards
+
+def create_mail_folder():
+    """Create a folder with two user folders in two domains and a file at the top."""
+    data_dir = tempfile.mkdtemp()
+    for user in ["example.com/alice", "example.com/bob", "example.org/carol"]:
+        os.makedirs(os.path.join(data_dir, user, "cur"))
+        with open(os.path.join(data_dir, user, "cur", "1.host:2,S"), "w") as f:
+            f.write("message of " + user)
+    with open(os.path.join(data_dir, "top.txt"), "w") as f:
+        f.write("top")
+    return data_dir
+
+
+def test_plan_shards_depth_0(logger):
+    """Test plan_shards() makes every path a shard with depth 0."""
+    data_dir = create_mail_folder()
+
+    try:
+        shards = plan_shards(logger, [data_dir, os.path.join(data_dir, "top.txt")], 0)
+
+        assert shards == [
+                {"paths": [data_dir], "recursive": True},
+                {"paths": [os.path.join(data_dir, "top.txt")], "recursive": True},
+                ]
+    finally:
+        shutil.rmtree(data_dir)
+
+
+def test_plan_shards_depth_2(logger):
+    """Test plan_shards() makes every user folder a shard with depth 2."""
+    data_dir = create_mail_folder()
+
+    try:
+        shards = plan_shards(logger, [data_dir], 2)
+
+        assert shards[0] == {
+                "paths": [data_dir, os.path.join(data_dir, "example.com"), os.path.join(data_dir, "example.org"), os.path.join(data_dir, "top.txt")],
+                "recursive": False
+                }
+        assert [shard["paths"] for shard in shards[1:]] == [
+                [os.path.join(data_dir, "example.com", "alice")],
+                [os.path.join(data_dir, "example.com", "bob")],
+                [os.path.join(data_dir, "example.org", "carol")],
+                ]
+    finally:
+        shutil.rmtree(data_dir)
+
+
+def test_plan_shards_unreadable_folder(logger, monkeypatch):
+    """Test plan_shards() archives a folder that can not be listed without its content."""
+    data_dir = create_mail_folder()
+    unreadable = os.path.join(data_dir, "example.com")
+
+    original_listdir = os.listdir
+    def listdir(path):
+        if path == unreadable:
+            raise PermissionError(13, "Permission denied", path)
+        return original_listdir(path)
+    monkeypatch.setattr(os, "listdir", listdir)
+
+    try:
+        shards = plan_shards(logger, [data_dir], 2)
+
+        assert shards[0]["paths"] == [data_dir, unreadable, os.path.join(data_dir, "example.org"), os.path.join(data_dir, "top.txt")]
+        assert [shard["paths"] for shard in shards[1:]] == [[os.path.join(data_dir, "example.org", "carol")]]
+    finally:
+        shutil.rmtree(data_dir)
+
+def test_shard_file():
+    """Test shard_file() puts the shard number before the archive extension."""
+    assert shard_file("/backups/backup_1.tar.gz.gpg", ".tar.gz.gpg", 2) == "/backups/backup_1.shard002.tar.gz.gpg"
+
+
+@pytest.mark.parametrize("engine", ["tar", "python"])
+def test_archive_shards(logger, toml_config, monkeypatch, engine):
+    """Test archive_shards() archives every file once across the shards listed in the manifest."""
+    data_dir = create_mail_folder()
+    save_backups_to = tempfile.mkdtemp()
+
+    config_copy = toml_config.copy()
+    monkeypatch.setitem(config_copy, "ARCHIVE", {"ENGINE": engine, "SHARDED": True, "SHARD_WORKERS": 2, "SHARD_DEPTH": 1})
+    gpg_copy = config_copy["GPG_ENCRYPTION"].copy()
+    gpg_copy["USE"] = False
+    monkeypatch.setitem(config_copy, "GPG_ENCRYPTION", gpg_copy)
+
+    backup_file = os.path.join(save_backups_to, "backup_1.tar.gz")
+
+    try:
+        result = archive_shards(logger, config_copy, [data_dir], backup_file, ".tar.gz")
+
+        assert result["is_working"]
+        assert result["manifest_file"] == backup_file + ".manifest"
+        with open(result["manifest_file"], "r") as f:
+            manifest = json.load(f)
+        assert len(manifest["shards"]) == 3
+
+        members = []
+        for shard in manifest["shards"]:
+            output = subprocess.run(
+                    [config_copy["TAR_BIN"], "-tzf", os.path.join(save_backups_to, shard["filename"])],
+                    check=True,
+                    stdout=subprocess.PIPE
+                    )
+            members.extend(name.rstrip("/") for name in output.stdout.decode("utf-8").splitlines())
+
+        # Every folder and file is in exactly one shard.
+        base = data_dir.lstrip("/")
+        assert sorted(members) == sorted([
+                base,
+                base + "/top.txt",
+                base + "/example.com",
+                base + "/example.org",
+                base + "/example.com/alice",
+                base + "/example.com/alice/cur",
+                base + "/example.com/alice/cur/1.host:2,S",
+                base + "/example.com/bob",
+                base + "/example.com/bob/cur",
+                base + "/example.com/bob/cur/1.host:2,S",
+                base + "/example.org/carol",
+                base + "/example.org/carol/cur",
+                base + "/example.org/carol/cur/1.host:2,S",
+                ])
+    finally:
+        shutil.rmtree(data_dir)
+        shutil.rmtree(save_backups_to)
+
+
+def test_archive_shards_failure(logger, toml_config, monkeypatch):
+    """Test archive_shards() removes every shard when one shard fails."""
+    data_dir = create_mail_folder()
+    save_backups_to = tempfile.mkdtemp()
+
+    config_copy = toml_config.copy()
+    monkeypatch.setitem(config_copy, "ARCHIVE", {"ENGINE": "tar", "SHARDED": True, "SHARD_DEPTH": 1})
+    gpg_copy = config_copy["GPG_ENCRYPTION"].copy()
+    gpg_copy["USE"] = False
+    monkeypatch.setitem(config_copy, "GPG_ENCRYPTION", gpg_copy)
+
+    monkeypatch.setitem(config_copy, "TAR_BIN", "/bin/false")
+
+    try:
+        result = archive_shards(logger, config_copy, [data_dir], os.path.join(save_backups_to, "backup_1.tar.gz"), ".tar.gz")
+
+        assert not result["is_working"]
+        assert result["msg"].startswith("shard 1 failed: false command failed with return code 1")
+        assert os.listdir(save_backups_to) == []
+    finally:
+        shutil.rmtree(data_dir)
+        shutil.rmtree(save_backups_to)
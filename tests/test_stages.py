@@ -0,0 +1,87 @@
+import os
+import hashlib
+import subprocess
+import tempfile
+import shutil
+import pytest
+from ddmail_backup_taker.stages import hash_stage, count_stage, process_source, process_stage, write_stage, write_volumes_stage
+
+def test_hash_and_count_stage():
+    """Test hash_stage() and count_stage() pass buffers through unchanged."""
+    chunks = [b"abc", b"def"]
+    sha256 = hashlib.sha256()
+    stats = {"bytes": 0}
+
+    output = list(count_stage(hash_stage(iter(chunks), sha256), stats))
+
+    assert output == chunks
+    assert stats["bytes"] == 6
+    assert sha256.hexdigest() == hashlib.sha256(b"abcdef").hexdigest()
+
+
+def test_process_stage():
+    """Test process_stage() passes buffers through a subprocess."""
+    chunks = [b"x" * 2000000, b"y" * 10]
+
+    output = b"".join(process_stage(iter(chunks), ["cat"]))
+
+    assert output == b"".join(chunks)
+
+
+def test_process_stage_failure():
+    """Test process_stage() raises CalledProcessError when the subprocess fails."""
+    with pytest.raises(subprocess.CalledProcessError):
+        b"".join(process_stage(iter([b"data"]), ["false"]))
+
+
+def test_write_stage():
+    """Test write_stage() writes all buffers to the file."""
+    with tempfile.NamedTemporaryFile(delete=False) as temp_file:
+        temp_path = temp_file.name
+
+    try:
+        written = write_stage(iter([b"abc", b"def"]), temp_path)
+
+        assert written == 6
+        with open(temp_path, "rb") as f:
+            assert f.read() == b"abcdef"
+    finally:
+        os.unlink(temp_path)
+
+
+@pytest.mark.parametrize("data_size,volume_count", [(25, 3), (20, 2), (0, 1)])
+def test_write_volumes_stage(data_size, volume_count):
+    """Test write_volumes_stage() splits the stream into volumes that join to the stream."""
+    temp_dir = tempfile.mkdtemp()
+    data = os.urandom(data_size)
+    chunks = [data[i:i + 7] for i in range(0, len(data), 7)]
+
+    try:
+        volumes = write_volumes_stage(iter(chunks), os.path.join(temp_dir, "backup.tar.gz"), 10)
+
+        assert len(volumes) == volume_count
+        assert [os.path.basename(volume["file"]) for volume in volumes] == ["backup.tar.gz.%03d" % (i + 1) for i in range(volume_count)]
+
+        joined = b""
+        for volume in volumes:
+            with open(volume["file"], "rb") as f:
+                content = f.read()
+            assert len(content) == volume["size"] <= 10
+            assert hashlib.sha256(content).hexdigest() == volume["sha256"]
+            joined = joined + content
+        assert joined == data
+    finally:
+        shutil.rmtree(temp_dir)
+
+
+def test_process_source():
+    """Test process_source() yields the stdout of a subprocess."""
+    output = b"".join(process_source(["echo", "hello"]))
+
+    assert output == b"hello\n"
+
+
+def test_process_source_failure():
+    """Test process_source() raises CalledProcessError when the subprocess fails."""
+    with pytest.raises(subprocess.CalledProcessError):
+        b"".join(process_source(["false"]))
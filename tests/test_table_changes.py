@@ -0,0 +1,152 @@
+import os
+import json
+import pytest
+from ddmail_backup_taker.table_changes import list_table_fingerprints, load_table_state, save_table_state, table_backups, backup_changed_tables, TABLE_MANIFEST, TABLE_STATE
+
+def write_script(path, content):
+    """Write an executable shell script."""
+    with open(path, "w") as f:
+        f.write("#!/bin/sh\n" + content)
+    os.chmod(path, 0o755)
+    return str(path)
+
+@pytest.fixture
+def tables_config(toml_config, monkeypatch, tmp_path):
+    """Config with stand-in mariadb and mariadb-dump binaries, the checksums are read from the checksums file."""
+    checksums = tmp_path / "checksums"
+    checksums.write_text("mail.aliases\t100\nmail.domains\t200\nmail.users\t300\n")
+    mariadb_bin = write_script(tmp_path / "mariadb", (
+            "case \"$8\" in\n"
+            "*information_schema*) printf 'mail\\taliases\\t2024-01-01 10:00:00\\t2\\t16384\\nmail\\tdomains\\t\\t1\\t16384\\nmail\\tusers\\t2024-01-02 10:00:00\\t10\\t16384\\n' ;;\n"
+            "*CHECKSUM*) cat " + str(checksums) + " ;;\n"
+            "esac\n"))
+    mariadbdump_bin = write_script(tmp_path / "mariadb-dump", "echo \"-- dump $@\"\n")
+
+    save_backups_to = tmp_path / "backups"
+    save_backups_to.mkdir()
+
+    config_copy = toml_config.copy()
+    config_copy["SAVE_BACKUPS_TO"] = str(save_backups_to)
+    mariadb_copy = config_copy["MARIADB"].copy()
+    mariadb_copy["USE"] = True
+    mariadb_copy["SKIP_UNCHANGED"] = True
+    mariadb_copy["MODE"] = "lock"
+    mariadb_copy["COMPRESSION"] = "none"
+    mariadb_copy["MARIADB_BIN"] = mariadb_bin
+    mariadb_copy["MARIADBDUMP_BIN"] = mariadbdump_bin
+    monkeypatch.setitem(config_copy, "MARIADB", mariadb_copy)
+    return config_copy
+
+
+def test_list_table_fingerprints(logger, tables_config):
+    """Test list_table_fingerprints() with CHECKSUM TABLE and with information_schema metadata."""
+    result = list_table_fingerprints(logger, tables_config)
+
+    assert result["is_working"]
+    assert result["tables"] == [
+            {"database": "mail", "table": "aliases", "fingerprint": "100"},
+            {"database": "mail", "table": "domains", "fingerprint": "200"},
+            {"database": "mail", "table": "users", "fingerprint": "300"},
+            ]
+
+    tables_config["MARIADB"]["CHANGE_DETECTION"] = "update_time"
+    result = list_table_fingerprints(logger, tables_config)
+
+    assert result["is_working"]
+    assert [table["fingerprint"] for table in result["tables"]] == ["2024-01-01 10:00:00|2|16384", None, "2024-01-02 10:00:00|10|16384"]
+
+
+def test_save_load_table_state(logger, toml_config, tmp_path):
+    """Test save_table_state() fills in the backup of the dumped tables and lists the backups every backup references."""
+    state_file = str(tmp_path / "snapshots" / TABLE_STATE)
+    config_copy = dict(toml_config, SAVE_BACKUPS_TO=str(tmp_path))
+    tables = [
+            {"database": "mail", "table": "aliases", "fingerprint": "100", "file": "a.sql", "backup_filename": "backup_1.tar.gz"},
+            {"database": "mail", "table": "users", "fingerprint": "300", "file": "u.sql", "backup_filename": None},
+            ]
+
+    assert load_table_state(state_file) == {}
+    assert table_backups(state_file) == {}
+
+    (tmp_path / "backup_2.tar.gz.001").write_text("volume")
+    save_table_state(logger, config_copy, state_file, tables, "backup_2.tar.gz")
+    state = load_table_state(state_file)
+
+    assert state[("mail", "aliases")]["backup_filename"] == "backup_1.tar.gz"
+    assert state[("mail", "users")]["backup_filename"] == "backup_2.tar.gz"
+    assert table_backups(state_file) == {"backup_2.tar.gz": ["backup_1.tar.gz"]}
+
+    # Backups that are gone are no longer listed.
+    save_table_state(logger, config_copy, state_file, [dict(tables[0], backup_filename="backup_2.tar.gz")], "backup_3.tar.gz")
+
+    assert table_backups(state_file) == {"backup_2.tar.gz": ["backup_1.tar.gz"], "backup_3.tar.gz": ["backup_2.tar.gz"]}
+
+    os.remove(tmp_path / "backup_2.tar.gz.001")
+    save_table_state(logger, config_copy, state_file, [], "backup_4.tar.gz")
+
+    assert table_backups(state_file) == {"backup_4.tar.gz": []}
+
+
+def test_backup_changed_tables(logger, tables_config, tmp_path):
+    """Test backup_changed_tables() only dumps the tables with a new checksum on the second run."""
+    state_file = os.path.join(tables_config["SAVE_BACKUPS_TO"], "snapshots", TABLE_STATE)
+    first_dst = tmp_path / "first"
+    first_dst.mkdir()
+
+    result = backup_changed_tables(logger, tables_config, state_file, str(first_dst))
+
+    assert result["is_working"]
+    assert sorted(os.listdir(first_dst)) == ["db_dump_mail.aliases.sql", "db_dump_mail.domains.sql", "db_dump_mail.schema.sql", "db_dump_mail.users.sql", TABLE_MANIFEST]
+    with open(first_dst / "db_dump_mail.users.sql", "r") as f:
+        assert f.read().endswith(" mail users\n")
+
+    # The first backup has been written.
+    (tmp_path / "backups" / "backup_1.tar.gz").write_text("backup")
+    save_table_state(logger, tables_config, state_file, result["tables"], "backup_1.tar.gz")
+
+    # Only the users table changed.
+    (tmp_path / "checksums").write_text("mail.aliases\t100\nmail.domains\t200\nmail.users\t301\n")
+    second_dst = tmp_path / "second"
+    second_dst.mkdir()
+
+    result = backup_changed_tables(logger, tables_config, state_file, str(second_dst))
+
+    assert result["is_working"]
+    assert sorted(os.listdir(second_dst)) == ["db_dump_mail.schema.sql", "db_dump_mail.users.sql", TABLE_MANIFEST]
+    with open(second_dst / TABLE_MANIFEST, "r") as f:
+        manifest = json.load(f)
+    assert [(table["table"], table["file"], table["backup_filename"]) for table in manifest["tables"]] == [
+            ("aliases", "db_dump_mail.aliases.sql", "backup_1.tar.gz"),
+            ("domains", "db_dump_mail.domains.sql", "backup_1.tar.gz"),
+            ("users", "db_dump_mail.users.sql", None),
+            ]
+
+    # A backup split into volumes still holds the tables.
+    os.rename(tmp_path / "backups" / "backup_1.tar.gz", tmp_path / "backups" / "backup_1.tar.gz.001")
+    (tmp_path / "backups" / "backup_1.tar.gz.index").write_text("index")
+
+    result = backup_changed_tables(logger, tables_config, state_file, str(tmp_path / "second"))
+
+    assert result["is_working"]
+    assert [table["backup_filename"] for table in result["tables"]] == ["backup_1.tar.gz", "backup_1.tar.gz", None]
+
+    # Tables are dumped again when the backup that holds them is gone.
+    os.remove(tmp_path / "backups" / "backup_1.tar.gz.001")
+    os.remove(tmp_path / "backups" / "backup_1.tar.gz.index")
+    third_dst = tmp_path / "third"
+    third_dst.mkdir()
+
+    result = backup_changed_tables(logger, tables_config, state_file, str(third_dst))
+
+    assert result["is_working"]
+    assert all(table["backup_filename"] is None for table in result["tables"])
+
+
+def test_backup_changed_tables_failure(logger, tables_config, tmp_path):
+    """Test backup_changed_tables() when the mariadb command fails."""
+    tables_config["MARIADB"]["MARIADB_BIN"] = write_script(tmp_path / "failing", "exit 1\n")
+
+    result = backup_changed_tables(logger, tables_config, str(tmp_path / TABLE_STATE), str(tmp_path))
+
+    assert not result["is_working"]
+    assert result["msg"] == "returncode of cmd mariadb is none zero"
@@ -0,0 +1,235 @@
+import os
+import sys
+import json
+import pytest
+from ddmail_backup_taker import table_layout
+from ddmail_backup_taker.table_layout import layout_file_of, backup_mariadb_table_layout, restore_table_layout, LAYOUT_MANIFEST
+
+# Stand-in mariadb client session that answers the queries of the tables layout, every statement is logged.
+MARIADB_STUB = r'''
+import re
+import sys
+
+log = open(sys.argv[1], "a")
+for line in sys.stdin:
+    line = line.strip()
+    log.write(line + "\n")
+    log.flush()
+    marker = re.match(r"^SELECT '(-- ddmail_backup_taker end \w+)';$", line)
+    if marker:
+        print(marker.group(1), flush=True)
+    elif "SCHEMATA" in line:
+        print("mail", flush=True)
+    elif "TABLE_TYPE, IFNULL(DATA_LENGTH" in line:
+        print("mail\taliases\tBASE TABLE\t5000\nmail\tusers\tBASE TABLE\t90000\nmail\tv_users\tVIEW\t0", flush=True)
+    elif "information_schema.TABLES" in line:
+        print("mail\taliases\t2\nmail\tusers\t2", flush=True)
+    elif "information_schema.COLUMNS" in line:
+        print("mail\taliases\tsrc\tvarchar\t\t\nmail\tusers\tid\tint\tPRI\t\nmail\tusers\tname\tvarchar\t\t", flush=True)
+    elif "FROM `mail`.`users`" in line:
+        print("(1,'alice')\n(2,'bob')", flush=True)
+    elif "FROM `mail`.`aliases`" in line:
+        print("('a@example.com')", flush=True)
+'''
+
+def write_script(path, content):
+    """Write an executable shell script."""
+    with open(path, "w") as f:
+        f.write("#!/bin/sh\n" + content)
+    os.chmod(path, 0o755)
+    return str(path)
+
+@pytest.fixture
+def layout_config(toml_config, monkeypatch, tmp_path):
+    """Config with stand-in mariadb and mariadb-dump binaries, the mariadb client logs every restored file on one line."""
+    restore_log = tmp_path / "restore.log"
+    stub = tmp_path / "mariadb_stub.py"
+    stub.write_text(MARIADB_STUB)
+    mariadb_bin = write_script(tmp_path / "mariadb", (
+            "case \"$5\" in\n"
+            "-N) exec " + sys.executable + " " + str(stub) + " " + str(tmp_path / "statements.log") + " ;;\n"
+            "*) echo \"$5 $(tr '\\n' ' ')\" >> " + str(restore_log) + " ;;\n"
+            "esac\n"))
+    mariadbdump_bin = write_script(tmp_path / "mariadb-dump", "shift 4\necho \"$@\"\n")
+
+    config_copy = toml_config.copy()
+    mariadb_copy = config_copy["MARIADB"].copy()
+    mariadb_copy["USE"] = True
+    mariadb_copy["LAYOUT"] = "tables"
+    mariadb_copy["MODE"] = "lock"
+    mariadb_copy["COMPRESSION"] = "none"
+    mariadb_copy["MARIADB_BIN"] = mariadb_bin
+    mariadb_copy["MARIADBDUMP_BIN"] = mariadbdump_bin
+    monkeypatch.setitem(config_copy, "MARIADB", mariadb_copy)
+    return config_copy
+
+
+def test_layout_file_of():
+    """Test layout_file_of() quotes names that are not safe in a file name."""
+    assert layout_file_of("mail", None, "database") == "mail/database.sql"
+    assert layout_file_of("my db", "a/b", "data", ".sql.gz") == "my%20db/a%2Fb.data.sql.gz"
+
+
+def test_backup_mariadb_table_layout(logger, layout_config, tmp_path):
+    """Test backup_mariadb_table_layout() dumps a schema, data and triggers file for every table and a manifest."""
+    dst_folder = tmp_path / "dst"
+    dst_folder.mkdir()
+
+    result = backup_mariadb_table_layout(logger, layout_config, str(dst_folder))
+
+    assert result["is_working"]
+    assert result["db_dump_folder"] == str(tmp_path / "dst" / "mariadb")
+    assert sorted(os.listdir(tmp_path / "dst" / "mariadb" / "mail")) == [
+            "aliases.data.sql", "aliases.schema.sql", "aliases.triggers.sql",
+            "database.sql",
+            "users.data.sql", "users.schema.sql", "users.triggers.sql",
+            "v_users.schema.sql",
+            ]
+
+    # The data is read in the snapshot sessions, the schemas are dumped with mariadb-dump.
+    with open(tmp_path / "dst" / "mariadb" / "mail" / "users.data.sql", "r") as f:
+        assert f.read() == "SET NAMES utf8mb4;\nSET FOREIGN_KEY_CHECKS=0;\nSET UNIQUE_CHECKS=0;\nUSE `mail`;\nINSERT INTO `users` (`id`,`name`) VALUES\n(1,'alice'),\n(2,'bob');\n"
+    with open(tmp_path / "dst" / "mariadb" / "mail" / "users.schema.sql", "r") as f:
+        assert f.read() == "--single-transaction --quick --no-data --skip-triggers mail users\n"
+    with open(tmp_path / "dst" / "mariadb" / "mail" / "database.sql", "r") as f:
+        assert f.read() == "--single-transaction --quick --no-data --no-create-info --routines --events --skip-triggers --databases mail\n"
+
+    with open(tmp_path / "dst" / "mariadb" / LAYOUT_MANIFEST, "r") as f:
+        manifest = json.load(f)
+    assert [table["table"] for table in manifest["databases"][0]["tables"]] == ["aliases", "users"]
+    assert manifest["databases"][0]["views"] == [{"view": "v_users", "schema": "mail/v_users.schema.sql"}]
+
+    # Every session started its transaction while the tables were locked, the tables were read after.
+    with open(tmp_path / "statements.log", "r") as f:
+        statements = [line.strip() for line in f if not line.startswith("SELECT '-- ddmail_backup_taker end")]
+    unlock = statements.index("UNLOCK TABLES;")
+    assert statements.index("FLUSH TABLES WITH READ LOCK;") < unlock
+    assert statements[:unlock].count("START TRANSACTION WITH CONSISTENT SNAPSHOT;") == layout_config["MARIADB"].get("PARALLELISM", 4)
+    assert all(statements.index(statement) > unlock for statement in statements if "FROM `mail`.`" in statement)
+
+
+def test_backup_mariadb_table_layout_failure(logger, layout_config, tmp_path):
+    """Test backup_mariadb_table_layout() when the mariadb client fails."""
+    layout_config["MARIADB"]["MARIADB_BIN"] = write_script(tmp_path / "failing", "exit 1\n")
+
+    result = backup_mariadb_table_layout(logger, layout_config, str(tmp_path))
+
+    assert not result["is_working"]
+    assert result["msg"] == "returncode of cmd mariadb is none zero"
+
+
+
+def test_backup_mariadb_table_layout_write_error(logger, layout_config, tmp_path, monkeypatch):
+    """Test backup_mariadb_table_layout() kills the snapshot sessions when writing a dump file fails."""
+    def write_stage(chunks, path):
+        raise OSError(28, "No space left on device")
+
+    killed = []
+    def kill_session(session):
+        killed.append(session)
+        session.kill()
+        session.wait()
+
+    monkeypatch.setattr(table_layout, "write_stage", write_stage)
+    monkeypatch.setattr(table_layout, "kill_session", kill_session)
+    dst_folder = tmp_path / "dst"
+    dst_folder.mkdir()
+
+    result = backup_mariadb_table_layout(logger, layout_config, str(dst_folder))
+
+    assert not result["is_working"]
+    assert result["msg"].endswith(" failed: [Errno 28] No space left on device")
+    assert len(killed) == layout_config["MARIADB"].get("PARALLELISM", 4)
+    assert all(session.returncode is not None for session in killed)
+
+@pytest.mark.parametrize("codec", ["none", "gzip"])
+def test_restore_table_layout(logger, layout_config, tmp_path, codec):
+    """Test restore_table_layout() restores the database first, the data after the schemas and the views last."""
+    layout_config["MARIADB"]["COMPRESSION"] = codec
+    dst_folder = tmp_path / "dst"
+    dst_folder.mkdir()
+    result = backup_mariadb_table_layout(logger, layout_config, str(dst_folder))
+    assert result["is_working"]
+
+    result = restore_table_layout(logger, layout_config, result["db_dump_folder"], workers=3)
+
+    assert result["is_working"]
+    assert result["tables"] == 2
+
+    with open(tmp_path / "restore.log", "r") as f:
+        restored = [line.strip() for line in f]
+
+    # The database file runs without a database, every other file in its database.
+    assert restored[0] == "--single-transaction --quick --no-data --no-create-info --routines --events --skip-triggers --databases mail"
+    assert all(line.startswith("mail ") for line in restored[1:])
+
+    kinds = ["schema" if "--no-data --skip-triggers" in line else "data" if "INSERT INTO" in line else "triggers" if "--no-data --no-create-info mail" in line else "view" for line in restored[1:]]
+    assert kinds == ["schema", "schema", "data", "data", "triggers", "triggers", "view"]
+
+
+def test_restore_table_layout_view_of_view(logger, layout_config, tmp_path):
+    """Test restore_table_layout() restores a view that uses a view later in the manifest."""
+    dump_folder = tmp_path / "dump"
+    (dump_folder / "mail").mkdir(parents=True)
+    (dump_folder / "mail" / "database.sql").write_text("CREATE DATABASE mail;\n")
+    (dump_folder / "mail" / "a_view.schema.sql").write_text("CREATE VIEW a_view AS SELECT * FROM b_view;\n")
+    (dump_folder / "mail" / "b_view.schema.sql").write_text("CREATE VIEW b_view AS SELECT 1;\n")
+    manifest = {"databases": [{
+            "database": "mail",
+            "file": "mail/database.sql",
+            "tables": [],
+            "views": [{"view": "a_view", "schema": "mail/a_view.schema.sql"}, {"view": "b_view", "schema": "mail/b_view.schema.sql"}],
+            }]}
+    (dump_folder / LAYOUT_MANIFEST).write_text(json.dumps(manifest))
+
+    # The stand-in client fails on a view that uses b_view until b_view exists.
+    created = tmp_path / "created"
+    layout_config["MARIADB"]["MARIADB_BIN"] = write_script(tmp_path / "mariadb_views", (
+            "sql=$(cat)\n"
+            "case \"$sql\" in\n"
+            "*\"FROM b_view\"*) grep -qx b_view " + str(created) + " 2>/dev/null || exit 1 ;;\n"
+            "esac\n"
+            "echo \"$sql\" | sed -n 's/^CREATE VIEW \\([a-z_]*\\) .*/\\1/p' >> " + str(created) + "\n"))
+
+    result = restore_table_layout(logger, layout_config, str(dump_folder))
+
+    assert result["is_working"]
+    assert created.read_text().split() == ["b_view", "a_view"]
+
+
+def test_restore_table_layout_view_failure(logger, layout_config, tmp_path):
+    """Test restore_table_layout() fails when a view can never be restored."""
+    dump_folder = tmp_path / "dump"
+    (dump_folder / "mail").mkdir(parents=True)
+    (dump_folder / "mail" / "database.sql").write_text("CREATE DATABASE mail;\n")
+    (dump_folder / "mail" / "a_view.schema.sql").write_text("CREATE VIEW a_view AS SELECT * FROM missing;\n")
+    manifest = {"databases": [{"database": "mail", "file": "mail/database.sql", "tables": [], "views": [{"view": "a_view", "schema": "mail/a_view.schema.sql"}]}]}
+    (dump_folder / LAYOUT_MANIFEST).write_text(json.dumps(manifest))
+    layout_config["MARIADB"]["MARIADB_BIN"] = write_script(tmp_path / "mariadb_views", "grep -q missing && exit 1\nexit 0\n")
+
+    result = restore_table_layout(logger, layout_config, str(dump_folder))
+
+    assert not result["is_working"]
+    assert result["msg"] == "restore of mail/a_view.schema.sql failed: returncode of cmd mariadb_views is none zero"
+
+
+def test_restore_table_layout_no_manifest(logger, layout_config, tmp_path):
+    """Test restore_table_layout() with a folder without a manifest."""
+    result = restore_table_layout(logger, layout_config, str(tmp_path))
+
+    assert not result["is_working"]
+    assert result["msg"] == "manifest " + str(tmp_path / LAYOUT_MANIFEST) + " does not exist"
+
+
+def test_restore_table_layout_failure(logger, layout_config, tmp_path):
+    """Test restore_table_layout() stops when a file can not be restored."""
+    dst_folder = tmp_path / "dst"
+    dst_folder.mkdir()
+    result = backup_mariadb_table_layout(logger, layout_config, str(dst_folder))
+    assert result["is_working"]
+    layout_config["MARIADB"]["MARIADB_BIN"] = write_script(tmp_path / "failing", "cat > /dev/null\nexit 1\n")
+
+    result = restore_table_layout(logger, layout_config, result["db_dump_folder"])
+
+    assert not result["is_working"]
+    assert result["msg"] == "restore of mail/database.sql failed: returncode of cmd failing is none zero"
@@ -0,0 +1,264 @@
+import os
+import threading
+import tracemalloc
+import http.server
+import email.parser
+import pytest
+from ddmail_backup_taker.backup import send_to_backup_receiver
+from ddmail_backup_taker import upload
+from ddmail_backup_taker.local_receiver import LocalReceiver
+from ddmail_backup_taker.upload import MultipartFileBody, load_upload_progress, progress_file_of
+
+class ReceiverHandler(http.server.BaseHTTPRequestHandler):
+    """Stand-in backup receiver saving every request body to a file in 64kb reads."""
+
+    def do_POST(self):
+        size = int(self.headers["Content-Length"])
+        with open(self.server.body_file, "wb") as f:
+            while size > 0:
+                data = self.rfile.read(min(65536, size))
+                if not data:
+                    break
+                f.write(data)
+                size = size - len(data)
+        self.server.content_type = self.headers["Content-Type"]
+
+        reply = self.server.reply.encode("utf-8")
+        self.send_response(self.server.status)
+        self.send_header("Content-Length", str(len(reply)))
+        self.end_headers()
+        self.wfile.write(reply)
+
+    def log_message(self, *args):
+        pass
+
+@pytest.fixture
+def receiver(toml_config, monkeypatch, tmp_path):
+    """Config sending to a stand-in receiver on localhost, the server is returned to read what it got."""
+    server = http.server.ThreadingHTTPServer(("127.0.0.1", 0), ReceiverHandler)
+    server.body_file = str(tmp_path / "body")
+    server.status = 200
+    server.reply = "done"
+    thread = threading.Thread(target=server.serve_forever, daemon=True)
+    thread.start()
+
+    config_copy = toml_config.copy()
+    monkeypatch.setitem(config_copy, "BACKUP_RECEIVER", {"USE": True, "URL": "http://127.0.0.1:" + str(server.server_port) + "/receive_backup", "PASSWORD": "secret"})
+
+    yield config_copy, server
+
+    server.shutdown()
+    server.server_close()
+
+def parse_body(server):
+    """Parse the multipart body the receiver got into {name: (filename, payload)}."""
+    with open(server.body_file, "rb") as f:
+        message = email.parser.BytesParser().parsebytes(b"Content-Type: " + server.content_type.encode("ascii") + b"\r\n\r\n" + f.read())
+    return {part.get_param("name", header="content-disposition"): (part.get_filename(), part.get_payload(decode=True)) for part in message.get_payload()}
+
+
+def test_multipart_file_body_read(tmp_path):
+    """Test MultipartFileBody reads the same body in any buffer size and has its length."""
+    (tmp_path / "backup.tar.gz").write_bytes(os.urandom(100000))
+
+    with MultipartFileBody({"a": "1"}, "file", str(tmp_path / "backup.tar.gz")) as body:
+        whole = body.read()
+        assert len(whole) == len(body)
+        whole = whole.replace(body.boundary.encode("ascii"), b"boundary")
+
+    with MultipartFileBody({"a": "1"}, "file", str(tmp_path / "backup.tar.gz")) as body:
+        pieces = []
+        while True:
+            data = body.read(7)
+            if not data:
+                break
+            pieces.append(data)
+        assert b"".join(pieces).replace(body.boundary.encode("ascii"), b"boundary") == whole
+
+
+def test_send_to_backup_receiver(logger, receiver, tmp_path):
+    """Test the receiver gets the fields and the file as multipart form data."""
+    config_copy, server = receiver
+    content = os.urandom(300000)
+    (tmp_path / "backup_1.tar.gz").write_bytes(content)
+
+    result = send_to_backup_receiver(logger, config_copy, str(tmp_path / "backup_1.tar.gz"), "backup_1.tar.gz")
+
+    assert result["is_working"]
+    assert result["msg"] == "successfully sent backup to backup_receiver"
+    parts = parse_body(server)
+    assert parts["filename"][1] == b"backup_1.tar.gz"
+    assert parts["password"][1] == b"secret"
+    assert len(parts["sha256"][1]) == 64
+    assert parts["file"] == ("backup_1.tar.gz", content)
+
+
+def test_send_to_backup_receiver_constant_memory(logger, receiver, tmp_path):
+    """Test sending a large backup allocates a small part of its size."""
+    config_copy, server = receiver
+    size = 64 * 1048576
+    with open(tmp_path / "backup_1.tar.gz", "wb") as f:
+        for _ in range(size // 1048576):
+            f.write(os.urandom(1048576))
+
+    tracemalloc.start()
+    try:
+        result = send_to_backup_receiver(logger, config_copy, str(tmp_path / "backup_1.tar.gz"), "backup_1.tar.gz")
+        _, peak = tracemalloc.get_traced_memory()
+    finally:
+        tracemalloc.stop()
+
+    assert result["is_working"]
+    assert peak < 4 * 1048576
+    assert os.path.getsize(server.body_file) > size
+
+
+def test_send_to_backup_receiver_error(logger, receiver, tmp_path):
+    """Test the status code and reply of a failing receiver are returned."""
+    config_copy, server = receiver
+    server.status = 500
+    server.reply = "wrong password"
+    (tmp_path / "backup_1.tar.gz").write_bytes(b"backup")
+
+    result = send_to_backup_receiver(logger, config_copy, str(tmp_path / "backup_1.tar.gz"), "backup_1.tar.gz")
+
+    assert not result["is_working"]
+    assert result["msg"] == "failed to sent backup to backup_receiver got http status code: 500 and message: wrong password"
+
+
+@pytest.fixture
+def local_receiver(tmp_path):
+    """Stand-in receiver implementing the chunked upload protocol."""
+    folder = tmp_path / "received"
+    folder.mkdir()
+    with LocalReceiver(str(folder), "secret") as receiver:
+        yield receiver
+
+def chunked_config(toml_config, monkeypatch, tmp_path, receiver, retries = 3, concurrency = 1):
+    """Copy of the config sending to receiver in 64kb chunks on concurrency streams."""
+    config_copy = toml_config.copy()
+    save_backups_to = tmp_path / "backups"
+    save_backups_to.mkdir(exist_ok=True)
+    config_copy["SAVE_BACKUPS_TO"] = str(save_backups_to)
+    monkeypatch.setitem(config_copy, "BACKUP_RECEIVER", {"USE": True, "URL": receiver.url, "PASSWORD": "secret", "MODE": "chunked", "CHUNK_SIZE": 65536, "RETRIES": retries, "CONCURRENCY": concurrency})
+    return config_copy
+
+
+@pytest.mark.parametrize("size", [0, 65536, 65536 * 3 + 100])
+def test_send_chunked(logger, toml_config, monkeypatch, tmp_path, local_receiver, size):
+    """Test send_to_backup_receiver() sends every chunk once and the receiver joins them."""
+    config_copy = chunked_config(toml_config, monkeypatch, tmp_path, local_receiver)
+    content = os.urandom(size)
+    (tmp_path / "backup_1.tar.gz").write_bytes(content)
+
+    result = send_to_backup_receiver(logger, config_copy, str(tmp_path / "backup_1.tar.gz"), "backup_1.tar.gz")
+
+    assert result["is_working"]
+    assert result["msg"] == "successfully sent backup to backup_receiver"
+    assert (tmp_path / "received" / "backup_1.tar.gz").read_bytes() == content
+    chunks = max(1, -(-size // 65536))
+    assert local_receiver.requests == [("status", None)] + [("chunk", number) for number in range(chunks)] + [("finish", None)]
+    assert not os.path.exists(progress_file_of(config_copy, "backup_1.tar.gz"))
+
+
+def test_send_chunked_interrupted(logger, toml_config, monkeypatch, tmp_path, local_receiver):
+    """Test an interrupted upload asks for the received chunks and only sends the missing ones."""
+    config_copy = chunked_config(toml_config, monkeypatch, tmp_path, local_receiver)
+    local_receiver.drop_chunks = {2}
+    content = os.urandom(65536 * 4)
+    (tmp_path / "backup_1.tar.gz").write_bytes(content)
+
+    result = send_to_backup_receiver(logger, config_copy, str(tmp_path / "backup_1.tar.gz"), "backup_1.tar.gz")
+
+    assert result["is_working"]
+    assert (tmp_path / "received" / "backup_1.tar.gz").read_bytes() == content
+    assert local_receiver.requests == [("status", None), ("chunk", 0), ("chunk", 1), ("chunk", 2), ("status", None), ("chunk", 2), ("chunk", 3), ("finish", None)]
+
+
+def test_send_chunked_resumed_by_later_run(logger, toml_config, monkeypatch, tmp_path, local_receiver):
+    """Test a failed upload leaves its progress and a later run sends the missing chunks without hashing the file again."""
+    config_copy = chunked_config(toml_config, monkeypatch, tmp_path, local_receiver, retries=0)
+    local_receiver.drop_chunks = {2}
+    content = os.urandom(65536 * 4)
+    (tmp_path / "backup_1.tar.gz").write_bytes(content)
+
+    result = send_to_backup_receiver(logger, config_copy, str(tmp_path / "backup_1.tar.gz"), "backup_1.tar.gz")
+
+    assert not result["is_working"]
+    assert result["msg"] == "failed to sent backup to backup_receiver request exception ConnectionError"
+    progress = load_upload_progress(progress_file_of(config_copy, "backup_1.tar.gz"))
+    assert progress["sent"] == [0, 1]
+    assert len(progress["chunks"]) == 4
+
+    # The checksums are read from the progress.
+    monkeypatch.setattr(upload, "hashlib", None)
+    local_receiver.requests.clear()
+    result = send_to_backup_receiver(logger, config_copy, str(tmp_path / "backup_1.tar.gz"), "backup_1.tar.gz")
+
+    assert result["is_working"]
+    assert local_receiver.requests == [("status", None), ("chunk", 2), ("chunk", 3), ("finish", None)]
+
+
+def test_send_chunked_wrong_password(logger, toml_config, monkeypatch, tmp_path, local_receiver):
+    """Test the reply of the receiver is returned when it refuses the upload."""
+    config_copy = chunked_config(toml_config, monkeypatch, tmp_path, local_receiver)
+    config_copy["BACKUP_RECEIVER"]["PASSWORD"] = "wrong"
+    (tmp_path / "backup_1.tar.gz").write_bytes(b"backup")
+
+    result = send_to_backup_receiver(logger, config_copy, str(tmp_path / "backup_1.tar.gz"), "backup_1.tar.gz")
+
+    assert not result["is_working"]
+    assert result["msg"] == "failed to sent backup to backup_receiver got http status code: 403 and message: wrong password"
+
+
+def test_send_chunked_concurrent(logger, toml_config, monkeypatch, tmp_path, local_receiver):
+    """Test chunks are sent at the same time over a pool of kept open connections and the whole file is verified."""
+    config_copy = chunked_config(toml_config, monkeypatch, tmp_path, local_receiver, concurrency=4)
+    local_receiver.latency = 0.2
+    content = os.urandom(65536 * 12)
+    (tmp_path / "backup_1.tar.gz").write_bytes(content)
+
+    result = send_to_backup_receiver(logger, config_copy, str(tmp_path / "backup_1.tar.gz"), "backup_1.tar.gz")
+
+    assert result["is_working"]
+    assert (tmp_path / "received" / "backup_1.tar.gz").read_bytes() == content
+    assert sorted(number for endpoint, number in local_receiver.requests if endpoint == "chunk") == list(range(12))
+    assert local_receiver.requests[-1] == ("finish", None)
+    assert local_receiver.max_active == 4
+    assert len(local_receiver.client_ports) <= 4
+
+
+def test_send_chunked_concurrent_interrupted(logger, toml_config, monkeypatch, tmp_path, local_receiver):
+    """Test a concurrent upload with cut connections resumes and sends every chunk."""
+    config_copy = chunked_config(toml_config, monkeypatch, tmp_path, local_receiver, concurrency=3)
+    local_receiver.drop_chunks = {1, 5, 9}
+    content = os.urandom(65536 * 10 + 1)
+    (tmp_path / "backup_1.tar.gz").write_bytes(content)
+
+    result = send_to_backup_receiver(logger, config_copy, str(tmp_path / "backup_1.tar.gz"), "backup_1.tar.gz")
+
+    assert result["is_working"]
+    assert (tmp_path / "received" / "backup_1.tar.gz").read_bytes() == content
+    assert not os.path.exists(progress_file_of(config_copy, "backup_1.tar.gz"))
+
+
+def test_send_chunked_changed_file(logger, toml_config, monkeypatch, tmp_path, local_receiver):
+    """Test a backup changed after its checksums were calculated is refused."""
+    config_copy = chunked_config(toml_config, monkeypatch, tmp_path, local_receiver, concurrency=2)
+    (tmp_path / "backup_1.tar.gz").write_bytes(os.urandom(65536 * 4))
+
+    # Change the file after hashing without changing its size or mtime.
+    real_upload_progress = upload.upload_progress
+    def changing_upload_progress(backup_path, *args):
+        progress = real_upload_progress(backup_path, *args)
+        st = os.stat(backup_path)
+        with open(backup_path, "r+b") as f:
+            f.write(b"changed")
+        os.utime(backup_path, ns=(st.st_atime_ns, st.st_mtime_ns))
+        return progress
+    monkeypatch.setattr(upload, "upload_progress", changing_upload_progress)
+
+    result = send_to_backup_receiver(logger, config_copy, str(tmp_path / "backup_1.tar.gz"), "backup_1.tar.gz")
+
+    assert not result["is_working"]
+    assert result["msg"] == "failed to sent backup to backup_receiver got http status code: 400 and message: chunk checksum mismatch"
@@ -2,7 +2,8 @@ import os
 import pytest
 import uuid
 import gnupg
-from ddmail_backup_taker.validate_config import check_main_vars, check_data_vars, check_mariadb_vars, check_gpg_vars, check_backup_receiver_vars, check_config
+from ddmail_backup_taker import encryption
+from ddmail_backup_taker.validate_config import check_main_vars, check_data_vars, check_archive_vars, check_compression_vars, check_repository_vars, check_mariadb_vars, check_gpg_vars, check_backup_receiver_vars, check_config
 
 def test_check_main_vars(logger,toml_config):
     """Test the check_main_vars function with valid configuration."""
@@ -458,6 +459,324 @@ def test_check_data_vars_with_file(logger, toml_config, monkeypatch, tmp_path):
     assert result["msg"] == "Configurations file DATA section variables is valid."
 
 
+def test_check_data_vars_incremental_not_bool(logger, toml_config, monkeypatch):
+    """Test check_data_vars with DATA.INCREMENTAL not a boolean."""
+    config_copy = toml_config.copy()
+    data_copy = config_copy["DATA"].copy()
+    data_copy["INCREMENTAL"] = "yes"
+    monkeypatch.setitem(config_copy, "DATA", data_copy)
+
+    result = check_data_vars(logger, config_copy)
+
+    assert not result["is_working"]
+    assert result["msg"] == "config DATA.INCREMENTAL must be a boolean"
+
+
+def test_check_data_vars_incremental_max_level_zero(logger, toml_config, monkeypatch):
+    """Test check_data_vars with DATA.INCREMENTAL_MAX_LEVEL set to zero."""
+    config_copy = toml_config.copy()
+    data_copy = config_copy["DATA"].copy()
+    data_copy["INCREMENTAL"] = True
+    data_copy["INCREMENTAL_MAX_LEVEL"] = 0
+    monkeypatch.setitem(config_copy, "DATA", data_copy)
+
+    result = check_data_vars(logger, config_copy)
+
+    assert not result["is_working"]
+    assert result["msg"] == "config DATA.INCREMENTAL_MAX_LEVEL must be a positive integer"
+
+
+# Test cases for check_archive_vars function
+
+def test_check_archive_vars_default(logger, toml_config, monkeypatch):
+    """Test check_archive_vars without an ARCHIVE section."""
+    config_copy = toml_config.copy()
+    config_copy.pop("ARCHIVE", None)
+
+    result = check_archive_vars(logger, config_copy)
+
+    assert result["is_working"]
+    assert result["msg"] == "Configurations file ARCHIVE section variables is valid."
+
+
+def test_check_archive_vars_python_engine(logger, toml_config, monkeypatch):
+    """Test check_archive_vars with the python archive engine."""
+    config_copy = toml_config.copy()
+    monkeypatch.setitem(config_copy, "ARCHIVE", {"ENGINE": "python"})
+
+    result = check_archive_vars(logger, config_copy)
+
+    assert result["is_working"]
+
+
+def test_check_archive_vars_unknown_engine(logger, toml_config, monkeypatch):
+    """Test check_archive_vars with an unknown archive engine."""
+    config_copy = toml_config.copy()
+    monkeypatch.setitem(config_copy, "ARCHIVE", {"ENGINE": "zip"})
+
+    result = check_archive_vars(logger, config_copy)
+
+    assert not result["is_working"]
+    assert result["msg"] == "config ARCHIVE.ENGINE must be tar or python"
+
+
+def test_check_archive_vars_python_engine_incremental(logger, toml_config, monkeypatch):
+    """Test check_archive_vars with the python archive engine and incremental Maildir backups."""
+    config_copy = toml_config.copy()
+    monkeypatch.setitem(config_copy, "ARCHIVE", {"ENGINE": "python"})
+    data_copy = config_copy["DATA"].copy()
+    data_copy["INCREMENTAL"] = True
+    data_copy["MAILDIR"] = True
+    monkeypatch.setitem(config_copy, "DATA", data_copy)
+
+    result = check_archive_vars(logger, config_copy)
+
+    assert result["is_working"]
+
+
+def test_check_archive_vars_tar_engine_maildir(logger, toml_config, monkeypatch):
+    """Test check_archive_vars with the tar archive engine and Maildir change detection."""
+    config_copy = toml_config.copy()
+    monkeypatch.setitem(config_copy, "ARCHIVE", {"ENGINE": "tar"})
+    data_copy = config_copy["DATA"].copy()
+    data_copy["MAILDIR"] = True
+    monkeypatch.setitem(config_copy, "DATA", data_copy)
+
+    result = check_archive_vars(logger, config_copy)
+
+    assert not result["is_working"]
+    assert result["msg"] == "config DATA.MAILDIR needs ARCHIVE.ENGINE python"
+
+
+@pytest.mark.parametrize("volume_size", [1000, -1, "1G"])
+def test_check_archive_vars_invalid_volume_size(logger, toml_config, monkeypatch, volume_size):
+    """Test check_archive_vars with a volume size that is not valid."""
+    config_copy = toml_config.copy()
+    monkeypatch.setitem(config_copy, "ARCHIVE", {"ENGINE": "tar", "VOLUME_SIZE": volume_size})
+
+    result = check_archive_vars(logger, config_copy)
+
+    assert not result["is_working"]
+    assert result["msg"] == "config ARCHIVE.VOLUME_SIZE must be 0 or at least 1048576"
+
+
+def test_check_archive_vars_volume_size_repository(logger, toml_config, monkeypatch):
+    """Test check_archive_vars with volumes and the chunk repository."""
+    config_copy = toml_config.copy()
+    monkeypatch.setitem(config_copy, "ARCHIVE", {"ENGINE": "tar", "VOLUME_SIZE": 1048576})
+    monkeypatch.setitem(config_copy, "REPOSITORY", {"USE": True, "PATH": "/tmp/repository"})
+
+    result = check_archive_vars(logger, config_copy)
+
+    assert not result["is_working"]
+    assert result["msg"] == "config ARCHIVE.VOLUME_SIZE is not supported with REPOSITORY.USE"
+
+
+@pytest.mark.parametrize("archive_config,msg", [
+    ({"SHARDED": "yes"}, "config ARCHIVE.SHARDED must be a boolean"),
+    ({"SHARDED": True, "SHARD_WORKERS": 0}, "config ARCHIVE.SHARD_WORKERS must be a positive integer"),
+    ({"SHARDED": True, "SHARD_DEPTH": -1}, "config ARCHIVE.SHARD_DEPTH must be 0 or a positive integer"),
+    ])
+def test_check_archive_vars_invalid_shards(logger, toml_config, monkeypatch, archive_config, msg):
+    """Test check_archive_vars with shard settings that are not valid."""
+    config_copy = toml_config.copy()
+    monkeypatch.setitem(config_copy, "ARCHIVE", archive_config)
+
+    result = check_archive_vars(logger, config_copy)
+
+    assert not result["is_working"]
+    assert result["msg"] == msg
+
+
+def test_check_archive_vars_sharded_incremental(logger, toml_config, monkeypatch):
+    """Test check_archive_vars with sharded and incremental backups."""
+    config_copy = toml_config.copy()
+    monkeypatch.setitem(config_copy, "ARCHIVE", {"SHARDED": True})
+    data_copy = config_copy["DATA"].copy()
+    data_copy["INCREMENTAL"] = True
+    monkeypatch.setitem(config_copy, "DATA", data_copy)
+
+    result = check_archive_vars(logger, config_copy)
+
+    assert not result["is_working"]
+    assert result["msg"] == "config ARCHIVE.SHARDED does not support DATA.INCREMENTAL"
+
+
+@pytest.mark.parametrize("archive_config,compression_config,msg", [
+    ({"ENGINE": "python", "INDEX": "yes"}, {}, "config ARCHIVE.INDEX must be a boolean"),
+    ({"ENGINE": "tar", "INDEX": True}, {}, "config ARCHIVE.INDEX needs ARCHIVE.ENGINE python"),
+    ({"ENGINE": "python", "INDEX": True}, {"CODEC": "zstd"}, "config ARCHIVE.INDEX needs COMPRESSION.CODEC gzip, xz or none"),
+    ])
+def test_check_archive_vars_invalid_index(logger, toml_config, monkeypatch, archive_config, compression_config, msg):
+    """Test check_archive_vars with catalog settings that are not valid."""
+    config_copy = toml_config.copy()
+    monkeypatch.setitem(config_copy, "ARCHIVE", archive_config)
+    monkeypatch.setitem(config_copy, "COMPRESSION", compression_config)
+
+    result = check_archive_vars(logger, config_copy)
+
+    assert not result["is_working"]
+    assert result["msg"] == msg
+
+
+# Test cases for check_compression_vars function
+
+def test_check_compression_vars_valid(logger, toml_config, monkeypatch):
+    """Test check_compression_vars with several threads."""
+    config_copy = toml_config.copy()
+    monkeypatch.setitem(config_copy, "COMPRESSION", {"THREADS": 8})
+
+    result = check_compression_vars(logger, config_copy)
+
+    assert result["is_working"]
+    assert result["msg"] == "Configurations file COMPRESSION section variables is valid."
+
+
+def test_check_compression_vars_threads_zero(logger, toml_config, monkeypatch):
+    """Test check_compression_vars with COMPRESSION.THREADS set to zero."""
+    config_copy = toml_config.copy()
+    monkeypatch.setitem(config_copy, "COMPRESSION", {"THREADS": 0})
+
+    result = check_compression_vars(logger, config_copy)
+
+    assert not result["is_working"]
+    assert result["msg"] == "config COMPRESSION.THREADS must be a positive integer"
+
+
+def test_check_compression_vars_unknown_codec(logger, toml_config, monkeypatch):
+    """Test check_compression_vars with an unknown codec."""
+    config_copy = toml_config.copy()
+    monkeypatch.setitem(config_copy, "COMPRESSION", {"CODEC": "brotli"})
+
+    result = check_compression_vars(logger, config_copy)
+
+    assert not result["is_working"]
+    assert result["msg"] == "config COMPRESSION.CODEC must be one of gzip, zstd, lz4, xz, none"
+
+
+def test_check_compression_vars_level_out_of_range(logger, toml_config, monkeypatch):
+    """Test check_compression_vars with a level the codec does not support."""
+    config_copy = toml_config.copy()
+    monkeypatch.setitem(config_copy, "COMPRESSION", {"CODEC": "gzip", "LEVEL": 19})
+
+    result = check_compression_vars(logger, config_copy)
+
+    assert not result["is_working"]
+    assert result["msg"] == "config COMPRESSION.LEVEL must be an integer between 1 and 9"
+
+
+def test_check_compression_vars_long_not_zstd(logger, toml_config, monkeypatch):
+    """Test check_compression_vars with long-range matching and codec gzip."""
+    config_copy = toml_config.copy()
+    monkeypatch.setitem(config_copy, "COMPRESSION", {"CODEC": "gzip", "LONG": True})
+
+    result = check_compression_vars(logger, config_copy)
+
+    assert not result["is_working"]
+    assert result["msg"] == "config COMPRESSION.LONG is only supported by codec zstd"
+
+
+@pytest.mark.parametrize("compression_config,msg", [
+    ({"CODEC": "gzip", "SKIP_INCOMPRESSIBLE": "yes"}, "config COMPRESSION.SKIP_INCOMPRESSIBLE must be a boolean"),
+    ({"CODEC": "none", "SKIP_INCOMPRESSIBLE": True}, "config COMPRESSION.SKIP_INCOMPRESSIBLE is only supported by codec gzip and xz"),
+    ])
+def test_check_compression_vars_invalid_skip_incompressible(logger, toml_config, monkeypatch, compression_config, msg):
+    """Test check_compression_vars with skip incompressible settings that are not valid."""
+    config_copy = toml_config.copy()
+    monkeypatch.setitem(config_copy, "COMPRESSION", compression_config)
+
+    result = check_compression_vars(logger, config_copy)
+
+    assert not result["is_working"]
+    assert result["msg"] == msg
+
+
+def test_check_compression_vars_bin_not_file(logger, toml_config, monkeypatch):
+    """Test check_compression_vars with codec zstd and a compressor binary that does not exist."""
+    config_copy = toml_config.copy()
+    monkeypatch.setitem(config_copy, "COMPRESSION", {"CODEC": "zstd", "BIN": "/path/to/nonexistent/zstd" + str(uuid.uuid4())})
+
+    result = check_compression_vars(logger, config_copy)
+
+    assert not result["is_working"]
+    assert result["msg"] == "config COMPRESSION.BIN must be a valid path"
+
+
+def test_check_compression_vars_bin_not_executable(logger, toml_config, monkeypatch, tmp_path):
+    """Test check_compression_vars with codec lz4 and a compressor binary that is not executable."""
+    compressor_bin = tmp_path / "lz4"
+    compressor_bin.write_text("not executable")
+    compressor_bin.chmod(0o644)
+
+    config_copy = toml_config.copy()
+    monkeypatch.setitem(config_copy, "COMPRESSION", {"CODEC": "lz4", "BIN": str(compressor_bin)})
+
+    result = check_compression_vars(logger, config_copy)
+
+    assert not result["is_working"]
+    assert result["msg"] == "config COMPRESSION.BIN must be executable"
+
+
+# Test cases for check_repository_vars function
+
+def test_check_repository_vars_default(logger, toml_config, monkeypatch):
+    """Test check_repository_vars without a REPOSITORY section."""
+    config_copy = toml_config.copy()
+    config_copy.pop("REPOSITORY", None)
+
+    result = check_repository_vars(logger, config_copy)
+
+    assert result["is_working"]
+    assert result["msg"] == "Configurations file REPOSITORY section variables is valid."
+
+
+def test_check_repository_vars_valid(logger, toml_config, monkeypatch):
+    """Test check_repository_vars with the repository enabled."""
+    config_copy = toml_config.copy()
+    monkeypatch.setitem(config_copy, "REPOSITORY", {"USE": True, "PATH": "/tmp/repository", "AVG_CHUNK_SIZE": 65536})
+
+    result = check_repository_vars(logger, config_copy)
+
+    assert result["is_working"]
+
+
+def test_check_repository_vars_no_path(logger, toml_config, monkeypatch):
+    """Test check_repository_vars with the repository enabled and no path."""
+    config_copy = toml_config.copy()
+    monkeypatch.setitem(config_copy, "REPOSITORY", {"USE": True})
+
+    result = check_repository_vars(logger, config_copy)
+
+    assert not result["is_working"]
+    assert result["msg"] == "config REPOSITORY.PATH is None"
+
+
+@pytest.mark.parametrize("avg_chunk_size", [1000000, 4096, True])
+def test_check_repository_vars_invalid_chunk_size(logger, toml_config, monkeypatch, avg_chunk_size):
+    """Test check_repository_vars with an average chunk size that is not valid."""
+    config_copy = toml_config.copy()
+    monkeypatch.setitem(config_copy, "REPOSITORY", {"USE": True, "PATH": "/tmp/repository", "AVG_CHUNK_SIZE": avg_chunk_size})
+
+    result = check_repository_vars(logger, config_copy)
+
+    assert not result["is_working"]
+    assert result["msg"] == "config REPOSITORY.AVG_CHUNK_SIZE must be a power of two of at least 65536"
+
+
+def test_check_repository_vars_incremental(logger, toml_config, monkeypatch):
+    """Test check_repository_vars with the repository and incremental backups."""
+    config_copy = toml_config.copy()
+    monkeypatch.setitem(config_copy, "REPOSITORY", {"USE": True, "PATH": "/tmp/repository"})
+    data_copy = config_copy["DATA"].copy()
+    data_copy["INCREMENTAL"] = True
+    monkeypatch.setitem(config_copy, "DATA", data_copy)
+
+    result = check_repository_vars(logger, config_copy)
+
+    assert not result["is_working"]
+    assert result["msg"] == "config REPOSITORY.USE does not support DATA.INCREMENTAL"
+
+
 # Test cases for check_mariadb_vars function
 
 def test_check_mariadb_vars_valid(logger, toml_config):
@@ -592,6 +911,158 @@ def test_check_mariadb_vars_root_password_empty(logger, toml_config, monkeypatch
     assert result["msg"] == "config MARIADB.ROOT_PASSWORD must be a string"
 
 
+def test_check_mariadb_vars_stream_sharded(logger, toml_config, monkeypatch, tmp_path):
+    """Test check_mariadb_vars with a streamed dump and sharded backups."""
+    # Create an executable file for mariadbdump
+    test_file = tmp_path / "fake_mariadbdump"
+    test_file.write_text("#!/bin/sh\necho 'fake mariadbdump'")
+    test_file.chmod(0o700)  # rwx------
+
+    config_copy = toml_config.copy()
+    mariadb_copy = config_copy["MARIADB"].copy()
+    mariadb_copy["USE"] = True
+    mariadb_copy["MARIADBDUMP_BIN"] = str(test_file)
+    mariadb_copy["ROOT_PASSWORD"] = "password"
+    mariadb_copy["STREAM"] = True
+    monkeypatch.setitem(config_copy, "MARIADB", mariadb_copy)
+    monkeypatch.setitem(config_copy, "ARCHIVE", {"ENGINE": "python", "SHARDED": True})
+
+    result = check_mariadb_vars(logger, config_copy)
+
+    assert not result["is_working"]
+    assert result["msg"] == "config MARIADB.STREAM does not support ARCHIVE.SHARDED or REPOSITORY.USE"
+
+
+def test_check_mariadb_vars_skip_unchanged_repository(logger, toml_config, monkeypatch, tmp_path):
+    """Test check_mariadb_vars with unchanged tables skipped and the chunk repository."""
+    # Create an executable file for mariadbdump
+    test_file = tmp_path / "fake_mariadbdump"
+    test_file.write_text("#!/bin/sh\necho 'fake mariadbdump'")
+    test_file.chmod(0o700)  # rwx------
+
+    config_copy = toml_config.copy()
+    mariadb_copy = config_copy["MARIADB"].copy()
+    mariadb_copy["USE"] = True
+    mariadb_copy["MARIADBDUMP_BIN"] = str(test_file)
+    mariadb_copy["MARIADB_BIN"] = str(test_file)
+    mariadb_copy["ROOT_PASSWORD"] = "password"
+    mariadb_copy["SKIP_UNCHANGED"] = True
+    monkeypatch.setitem(config_copy, "MARIADB", mariadb_copy)
+    monkeypatch.setitem(config_copy, "REPOSITORY", {"USE": True, "PATH": "/tmp/repository"})
+
+    result = check_mariadb_vars(logger, config_copy)
+
+    assert not result["is_working"]
+    assert result["msg"] == "config MARIADB.SKIP_UNCHANGED does not support REPOSITORY.USE"
+
+
+@pytest.mark.parametrize("mariadb_config,msg", [
+    ({"PER_DATABASE": "yes"}, "config MARIADB.PER_DATABASE must be a boolean"),
+    ({"PER_DATABASE": True, "PARALLELISM": 0}, "config MARIADB.PARALLELISM must be a positive integer"),
+    ({"PER_DATABASE": True, "MARIADB_BIN": "/path/that/does/not/exist"}, "config MARIADB.MARIADB_BIN must be a valid path"),
+    ({"STREAM": "yes"}, "config MARIADB.STREAM must be a boolean"),
+    ({"STREAM": True}, "config MARIADB.STREAM needs ARCHIVE.ENGINE python"),
+    ({"COMPRESSION": "xz"}, "config MARIADB.COMPRESSION must be one of none, gzip, zstd"),
+    ({"MODE": "fast"}, "config MARIADB.MODE must be one of lock, consistent, chunked, physical"),
+    ({"MODE": "chunked", "CHUNK_ROWS": 0}, "config MARIADB.CHUNK_ROWS must be a positive integer"),
+    ({"MODE": "chunked", "PER_DATABASE": True}, "config MARIADB.MODE chunked does not support MARIADB.PER_DATABASE, MARIADB.STREAM or MARIADB.INCREMENTAL"),
+    ({"MODE": "chunked", "MARIADB_BIN": "/path/that/does/not/exist"}, "config MARIADB.MARIADB_BIN must be a valid path"),
+    ({"SKIP_UNCHANGED": "yes"}, "config MARIADB.SKIP_UNCHANGED must be a boolean"),
+    ({"CHANGE_DETECTION": "mtime"}, "config MARIADB.CHANGE_DETECTION must be one of checksum, update_time"),
+    ({"SKIP_UNCHANGED": True, "MODE": "chunked"}, "config MARIADB.SKIP_UNCHANGED does not support MARIADB.PER_DATABASE, MARIADB.STREAM, MARIADB.INCREMENTAL or MARIADB.MODE chunked and physical"),
+    ({"SKIP_UNCHANGED": True, "MARIADB_BIN": "/path/that/does/not/exist"}, "config MARIADB.MARIADB_BIN must be a valid path"),
+    ({"LAYOUT": "folder"}, "config MARIADB.LAYOUT must be one of file, tables"),
+    ({"LAYOUT": "tables", "SKIP_UNCHANGED": True}, "config MARIADB.LAYOUT tables does not support MARIADB.PER_DATABASE, MARIADB.STREAM, MARIADB.INCREMENTAL, MARIADB.SKIP_UNCHANGED or MARIADB.MODE chunked and physical"),
+    ({"LAYOUT": "tables", "MARIADB_BIN": "/path/that/does/not/exist"}, "config MARIADB.MARIADB_BIN must be a valid path"),
+    ({"DELTA": "yes"}, "config MARIADB.DELTA must be a boolean"),
+    ({"DELTA": True, "DELTA_FULL_EVERY": 0}, "config MARIADB.DELTA_FULL_EVERY must be a positive integer"),
+    ({"DELTA": True, "COMPRESSION": "gzip"}, "config MARIADB.DELTA only supports one uncompressed dump file of MARIADB.MODE lock or consistent without REPOSITORY.USE"),
+    ({"DELTA": True, "PER_DATABASE": True}, "config MARIADB.DELTA only supports one uncompressed dump file of MARIADB.MODE lock or consistent without REPOSITORY.USE"),
+    ({"MODE": "physical", "PER_DATABASE": True}, "config MARIADB.MODE physical does not support MARIADB.PER_DATABASE or MARIADB.INCREMENTAL"),
+    ({"MODE": "physical", "MARIABACKUP_BIN": "/path/that/does/not/exist"}, "config MARIADB.MARIABACKUP_BIN must be a valid path"),
+    ({"COMPRESSION": "gzip", "COMPRESSION_LEVEL": 10}, "config MARIADB.COMPRESSION_LEVEL must be an integer between 1 and 9"),
+    ({"COMPRESSION": "zstd", "COMPRESSION_BIN": "/path/that/does/not/exist"}, "config MARIADB.COMPRESSION_BIN must be a valid path"),
+    ])
+def test_check_mariadb_vars_invalid_dump_options(logger, toml_config, monkeypatch, tmp_path, mariadb_config, msg):
+    """Test check_mariadb_vars with dump settings that are not valid."""
+    # Create an executable file for mariadbdump
+    test_file = tmp_path / "fake_mariadbdump"
+    test_file.write_text("#!/bin/sh\necho 'fake mariadbdump'")
+    test_file.chmod(0o700)  # rwx------
+
+    config_copy = toml_config.copy()
+    mariadb_copy = config_copy["MARIADB"].copy()
+    mariadb_copy["USE"] = True
+    mariadb_copy["MARIADBDUMP_BIN"] = str(test_file)
+    mariadb_copy["ROOT_PASSWORD"] = "password"
+    mariadb_copy.update(mariadb_config)
+    monkeypatch.setitem(config_copy, "MARIADB", mariadb_copy)
+    monkeypatch.setitem(config_copy, "ARCHIVE", {"ENGINE": "tar"})
+
+    result = check_mariadb_vars(logger, config_copy)
+
+    assert not result["is_working"]
+    assert result["msg"] == msg
+
+
+def test_check_mariadb_vars_level_without_compression(logger, toml_config, monkeypatch, tmp_path):
+    """Test check_mariadb_vars ignores MARIADB.COMPRESSION_LEVEL when the dump is not compressed."""
+    # Create an executable file for mariadbdump
+    test_file = tmp_path / "fake_mariadbdump"
+    test_file.write_text("#!/bin/sh\necho 'fake mariadbdump'")
+    test_file.chmod(0o700)  # rwx------
+
+    config_copy = toml_config.copy()
+    mariadb_copy = config_copy["MARIADB"].copy()
+    mariadb_copy["USE"] = True
+    mariadb_copy["MARIADBDUMP_BIN"] = str(test_file)
+    mariadb_copy["ROOT_PASSWORD"] = "password"
+    mariadb_copy["COMPRESSION"] = "none"
+    mariadb_copy["COMPRESSION_LEVEL"] = 1
+    monkeypatch.setitem(config_copy, "MARIADB", mariadb_copy)
+    monkeypatch.setitem(config_copy, "ARCHIVE", {"ENGINE": "tar"})
+
+    result = check_mariadb_vars(logger, config_copy)
+
+    assert result["is_working"]
+
+
+@pytest.mark.parametrize("data_incremental,mariadb_config,msg", [
+    (True, {"INCREMENTAL": "yes"}, "config MARIADB.INCREMENTAL must be a boolean"),
+    (False, {"INCREMENTAL": True}, "config MARIADB.INCREMENTAL needs DATA.INCREMENTAL"),
+    (True, {"INCREMENTAL": True, "PER_DATABASE": True}, "config MARIADB.INCREMENTAL does not support MARIADB.PER_DATABASE or MARIADB.STREAM"),
+    (True, {"INCREMENTAL": True, "BINLOG_INDEX": "/path/that/does/not/exist"}, "config MARIADB.BINLOG_INDEX must be a valid path"),
+    (True, {"INCREMENTAL": True, "MARIADB_BIN": "/path/that/does/not/exist"}, "config MARIADB.MARIADB_BIN must be a valid path"),
+    ])
+def test_check_mariadb_vars_invalid_incremental(logger, toml_config, monkeypatch, tmp_path, data_incremental, mariadb_config, msg):
+    """Test check_mariadb_vars with binary log incremental settings that are not valid."""
+    # Create an executable file for mariadbdump and mariadb
+    test_file = tmp_path / "fake_mariadbdump"
+    test_file.write_text("#!/bin/sh\necho 'fake mariadbdump'")
+    test_file.chmod(0o700)  # rwx------
+    binlog_index = tmp_path / "mysql-bin.index"
+    binlog_index.write_text("./mysql-bin.000001\n")
+
+    config_copy = toml_config.copy()
+    mariadb_copy = config_copy["MARIADB"].copy()
+    mariadb_copy["USE"] = True
+    mariadb_copy["MARIADBDUMP_BIN"] = str(test_file)
+    mariadb_copy["MARIADB_BIN"] = str(test_file)
+    mariadb_copy["ROOT_PASSWORD"] = "password"
+    mariadb_copy["BINLOG_INDEX"] = str(binlog_index)
+    mariadb_copy.update(mariadb_config)
+    monkeypatch.setitem(config_copy, "MARIADB", mariadb_copy)
+    data_copy = config_copy["DATA"].copy()
+    data_copy["INCREMENTAL"] = data_incremental
+    monkeypatch.setitem(config_copy, "DATA", data_copy)
+    monkeypatch.setitem(config_copy, "ARCHIVE", {"ENGINE": "tar"})
+
+    result = check_mariadb_vars(logger, config_copy)
+
+    assert not result["is_working"]
+    assert result["msg"] == msg
+
+
 # Test cases for check_gpg_vars function
 
 def test_check_gpg_vars_valid(logger, toml_config):
@@ -617,6 +1088,28 @@ def test_check_gpg_vars_use_false(logger, toml_config, monkeypatch):
     assert result["msg"] == "Configurations file GPG section variables is valid."
 
 
+@pytest.mark.parametrize("key,value,msg", [
+    ("ENGINE", "aes", "config GPG_ENCRYPTION.ENGINE must be one of gpg, chunked"),
+    ("THREADS", 0, "config GPG_ENCRYPTION.THREADS must be a positive integer"),
+    ("THREADS", True, "config GPG_ENCRYPTION.THREADS must be a positive integer"),
+    ("CHUNK_SIZE", 1024, "config GPG_ENCRYPTION.CHUNK_SIZE must be an integer between 65536 and 67108864"),
+    ("CHUNK_SIZE", "4mb", "config GPG_ENCRYPTION.CHUNK_SIZE must be an integer between 65536 and 67108864"),
+    ])
+def test_check_gpg_vars_chunked_engine(logger, toml_config, monkeypatch, key, value, msg):
+    """Test check_gpg_vars with invalid chunked encryption settings."""
+    config_copy = toml_config.copy()
+    gpg_copy = config_copy["GPG_ENCRYPTION"].copy()
+    gpg_copy["USE"] = True
+    gpg_copy["ENGINE"] = "chunked"
+    gpg_copy[key] = value
+    monkeypatch.setitem(config_copy, "GPG_ENCRYPTION", gpg_copy)
+
+    result = check_gpg_vars(logger, config_copy)
+
+    assert not result["is_working"]
+    assert result["msg"] == msg
+
+
 def test_check_gpg_vars_gpg_bin_not_string(logger, toml_config, monkeypatch):
     """Test check_gpg_vars with GPG_BIN not a string."""
     config_copy = toml_config.copy()
@@ -748,6 +1241,54 @@ def test_check_gpg_vars_pubkey_fingerprint_not_in_keystore(logger, toml_config,
     assert result["msg"] == f"config GPG_ENCRYPTION.PUBKEY_FINGERPRINT {valid_fingerprint} key is not in keystore"
 
 
+@pytest.mark.parametrize("found", [True, False])
+def test_check_gpg_vars_keystore_cache(logger, toml_config, monkeypatch, tmp_path, found):
+    """Test check_gpg_vars only lists the keys again when the keyring changed and never caches a missing key."""
+    gnupg_home = tmp_path / "gnupg"
+    gnupg_home.mkdir()
+    (gnupg_home / "pubring.kbx").write_bytes(b"keyring")
+    monkeypatch.setenv("GNUPGHOME", str(gnupg_home))
+    monkeypatch.setattr(encryption, "key_cache", {})
+
+    valid_fingerprint = "ABCDEF0123456789ABCDEF0123456789ABCDEF02"
+    config_copy = toml_config.copy()
+    config_copy["SAVE_BACKUPS_TO"] = str(tmp_path)
+    gpg_copy = config_copy["GPG_ENCRYPTION"].copy()
+    gpg_copy["PUBKEY_FINGERPRINT"] = valid_fingerprint
+    monkeypatch.setitem(config_copy, "GPG_ENCRYPTION", gpg_copy)
+
+    # Mock gnupg.GPG to count the key listings.
+    calls = []
+    class MockGPG:
+        def __init__(self, gpgbinary=None):
+            self.encoding = None
+
+        def list_keys(self, secret=False, keys=None):
+            calls.append(keys)
+            return [{"fingerprint": keys}] if found else []
+
+    monkeypatch.setattr(gnupg, "GPG", MockGPG)
+
+    results = [check_gpg_vars(logger, config_copy)]
+    results.append(check_gpg_vars(logger, config_copy))
+
+    # A new process reads the cache file.
+    monkeypatch.setattr(encryption, "key_cache", {})
+    results.append(check_gpg_vars(logger, config_copy))
+
+    # A changed keyring is listed again.
+    (gnupg_home / "pubring.kbx").write_bytes(b"changed keyring")
+    results.append(check_gpg_vars(logger, config_copy))
+
+    if found:
+        assert all(result["is_working"] for result in results)
+        assert len(calls) == 2
+    else:
+        assert all(result["msg"] == f"config GPG_ENCRYPTION.PUBKEY_FINGERPRINT {valid_fingerprint} key is not in keystore" for result in results)
+        assert len(calls) == 4
+        assert not os.path.exists(tmp_path / "snapshots" / encryption.GPG_KEY_CACHE)
+
+
 # Test cases for check_backup_receiver_vars function
 
 def test_check_backup_receiver_vars_valid(logger, toml_config):
@@ -823,6 +1364,30 @@ def test_check_backup_receiver_vars_password_not_string(logger, toml_config, mon
     assert result["msg"] == "config BACKUP_RECEIVER.PASSWORD must be a string"
 
 
+@pytest.mark.parametrize("key,value,msg", [
+    ("MODE", "parallel", "config BACKUP_RECEIVER.MODE must be one of single, chunked"),
+    ("CHUNK_SIZE", 1024, "config BACKUP_RECEIVER.CHUNK_SIZE must be an integer of at least 65536"),
+    ("CHUNK_SIZE", "16mb", "config BACKUP_RECEIVER.CHUNK_SIZE must be an integer of at least 65536"),
+    ("RETRIES", -1, "config BACKUP_RECEIVER.RETRIES must be an integer of at least 0"),
+    ("RETRIES", False, "config BACKUP_RECEIVER.RETRIES must be an integer of at least 0"),
+    ("CONCURRENCY", 0, "config BACKUP_RECEIVER.CONCURRENCY must be a positive integer"),
+    ("CONCURRENCY", "4", "config BACKUP_RECEIVER.CONCURRENCY must be a positive integer"),
+    ])
+def test_check_backup_receiver_vars_chunked_upload(logger, toml_config, monkeypatch, key, value, msg):
+    """Test check_backup_receiver_vars with invalid chunked upload settings."""
+    config_copy = toml_config.copy()
+    backup_receiver_copy = config_copy["BACKUP_RECEIVER"].copy()
+    backup_receiver_copy["USE"] = True
+    backup_receiver_copy["MODE"] = "chunked"
+    backup_receiver_copy[key] = value
+    monkeypatch.setitem(config_copy, "BACKUP_RECEIVER", backup_receiver_copy)
+
+    result = check_backup_receiver_vars(logger, config_copy)
+
+    assert not result["is_working"]
+    assert result["msg"] == msg
+
+
 def test_check_backup_receiver_vars_complex_url(logger, toml_config, monkeypatch):
     """Test check_backup_receiver_vars with a complex URL including credentials, port, and path."""
     config_copy = toml_config.copy()